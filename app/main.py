@@ -9,6 +9,7 @@ from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, Redirect
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from projects.modulo2.api import router as modulo2_router
+from projects.modulo2.executores import get_pool, PoolSaturado, RETRY_AFTER_SEGUNDOS
 from auth.logger import log_info, log_success, log_error, log_warning
 
 
@@ -90,6 +91,15 @@ def create_logger(prefix: str, run_id: str):
     return logger
 
 
+def resposta_pool_saturado(e: PoolSaturado) -> JSONResponse:
+    """429 quando o pool de tarefas pesadas está cheio (não trava o resto da aplicação)"""
+    return JSONResponse(
+        {"success": False, "error": str(e)},
+        status_code=429,
+        headers={"Retry-After": str(RETRY_AFTER_SEGUNDOS)}
+    )
+
+
 # ============================================================
 # IMPORTS PROTEGIDOS (NUNCA QUEBRA)
 # ============================================================
@@ -422,21 +432,27 @@ async def modulo1_process(
                 f.write(upload.file.read())
             return dest
 
-        output_file, logs = process_modulo1(
-            ops_path=save(OPS, "OPS.xlsx"),
-            hk_avulso_path=save(hk_avulso, "hk_avulso.xlsx"),
-            demitidos_path=save(demitidos, "demitidos.xls"),
-            aviso_previo_path=save(AVISO_PREVIO, "AVISO_PREVIO.xls"),
-            situacao_path=save(situacao, "situacao.xlsx"),
-            fp_path=save(fp, "fp.xlsx"),
-            output_dir=OUTPUT_DIR
-        )
+        def processar():
+            return process_modulo1(
+                ops_path=save(OPS, "OPS.xlsx"),
+                hk_avulso_path=save(hk_avulso, "hk_avulso.xlsx"),
+                demitidos_path=save(demitidos, "demitidos.xls"),
+                aviso_previo_path=save(AVISO_PREVIO, "AVISO_PREVIO.xls"),
+                situacao_path=save(situacao, "situacao.xlsx"),
+                fp_path=save(fp, "fp.xlsx"),
+                output_dir=OUTPUT_DIR
+            )
+
+        # Pool de tarefas pesadas: não bloqueia o event loop nem o threadpool padrão
+        output_file, logs = await get_pool("pesado").executar(processar)
 
         return JSONResponse({
             "success": True,
             "download_url": f"/download/{output_file.name}"
         })
 
+    except PoolSaturado as e:
+        return resposta_pool_saturado(e)
     except Exception as e:
         logger(traceback.format_exc())
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
@@ -453,25 +469,32 @@ async def ficha_processar(file: UploadFile = File(...)):
 
     try:
         input_path = UPLOAD_DIR / "FP_INPUT.xlsx"
-        with open(input_path, "wb") as f:
-            f.write(file.file.read())
+        output_path = OUTPUT_DIR / "FP_resultado_clientes.xlsx"
 
-        try:
-            import projects.LocalizaSituacao as loc
-            importlib.reload(loc)
-        except Exception:
-            import projects.LocalizaSituacao as loc
+        def processar():
+            with open(input_path, "wb") as f:
+                f.write(file.file.read())
 
-        from projects.LocalizaSituacao import processar_ficha_presenca
+            try:
+                import projects.LocalizaSituacao as loc
+                importlib.reload(loc)
+            except Exception:
+                import projects.LocalizaSituacao as loc
 
-        output_path = OUTPUT_DIR / "FP_resultado_clientes.xlsx"
-        processar_ficha_presenca(input_path, output_path)
+            from projects.LocalizaSituacao import processar_ficha_presenca
+
+            processar_ficha_presenca(input_path, output_path)
+
+        # Pool de tarefas pesadas: não bloqueia o event loop nem o threadpool padrão
+        await get_pool("pesado").executar(processar)
 
         return JSONResponse({
             "success": True,
             "download_url": f"/download/{output_path.name}"
         })
 
+    except PoolSaturado as e:
+        return resposta_pool_saturado(e)
     except Exception as e:
         logger(traceback.format_exc())
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
@@ -492,7 +515,8 @@ async def modulo2_process(xmls: list[UploadFile] = File(...)):
 
         xml_payload = [(f.filename, await f.read()) for f in xmls]
 
-        output_file, logs = process_suprimentos_xml(
+        output_file, logs = await get_pool("pesado").executar(
+            process_suprimentos_xml,
             xml_files=xml_payload,
             output_dir=MODULO2_DIR
         )
@@ -503,6 +527,8 @@ async def modulo2_process(xmls: list[UploadFile] = File(...)):
             "download_url": f"/download/{output_file.name}"
         })
 
+    except PoolSaturado as e:
+        return resposta_pool_saturado(e)
     except Exception as e:
         logger(traceback.format_exc())
         return JSONResponse({"success": False, "error": str(e)}, status_code=500)
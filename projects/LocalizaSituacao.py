@@ -2,10 +2,11 @@ import os
 from pathlib import Path
 
 import pandas as pd
-import unidecode
 from openpyxl.styles import Font, PatternFill, Alignment, Border
 from openpyxl.utils import get_column_letter
 
+from projects.modulo2.normalizacao import normalizar_leve, normalizar_leve_serie
+
 
 # =========================================================
 # UTILIDADES
@@ -13,7 +14,7 @@ from openpyxl.utils import get_column_letter
 
 def norm(s):
     """Normaliza texto para comparações (sem acento, maiúsculo, sem espaços extras)."""
-    return unidecode.unidecode(str(s)).upper().strip()
+    return normalizar_leve(s)
 
 
 # =========================================================
@@ -165,8 +166,8 @@ def processar_ficha_presenca_v1(input_path, output_path):
     # 7. Normalizar SITUACAO e SITHOJE para contar INSS, Férias, etc.
     # -----------------------------------------
 
-    df["situacao_norm"] = df["situacao"].apply(norm)
-    df["sithoje_norm"]  = df["sithoje"].apply(norm)
+    df["situacao_norm"] = normalizar_leve_serie(df["situacao"])
+    df["sithoje_norm"]  = normalizar_leve_serie(df["sithoje"])
 
     # Versão bruta em maiúsculas, preservando caracteres estranhos (F╔RIAS, SUSPENS├O)
     situ_up = df["situacao"].astype(str).str.upper()
@@ -455,8 +456,8 @@ def processar_ficha_presenca_v2(input_path, output_path):
 
     cargo_por_re = top_cargo_por_re.set_index("re")["desc_cargo"].to_dict()
 
-    df["situacao_norm"] = df["situacao"].apply(norm)
-    df["sithoje_norm"]  = df["sithoje"].apply(norm)
+    df["situacao_norm"] = normalizar_leve_serie(df["situacao"])
+    df["sithoje_norm"]  = normalizar_leve_serie(df["sithoje"])
     situ_up = df["situacao"].astype(str).str.upper()
 
     df["flag_inss"] = situ_up.str.contains("INSS", na=False, regex=False)
@@ -1,6 +1,12 @@
 # projects/modulo2/api.py
 
-from fastapi import APIRouter, Query, HTTPException, Body
+import os
+import json
+import time
+import asyncio
+
+from fastapi import APIRouter, Query, HTTPException, Body, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from datetime import date
 from typing import Optional
 from pydantic import BaseModel
@@ -20,6 +26,9 @@ from .service import (
 from .preview import preview_importacao, preview_importacao_inicial
 from .utils import obter_periodo_mes_atual
 from .scheduler import get_scheduler
+from .cache_respostas import resposta_com_cache
+from .executores import em_pool
+from .progresso_importacao import get_progresso_importacao, PROGRESSO_POLL_SEGUNDOS
 
 router = APIRouter(prefix="/api/modulo2", tags=["Modulo 2"])
 
@@ -39,6 +48,7 @@ class IdentificarPendenciaRequest(BaseModel):
 # Nota: Rota raiz removida para evitar conflito com rota HTML /modulo2
 
 @router.get("/status")
+@em_pool("interativo")
 def get_status():
     """
     Retorna o status do módulo 2, incluindo se está em modo desenvolvimento.
@@ -52,6 +62,7 @@ def get_status():
 
 
 @router.get("/sefaz/consultar")
+@em_pool("interativo")
 def consultar_sefaz(
     data_ini: date = Query(..., description="Data inicial do intervalo"),
     data_fim: date = Query(..., description="Data final do intervalo")
@@ -68,6 +79,7 @@ def consultar_sefaz(
 
 
 @router.get("/sefaz/preview")
+@em_pool("pesado")
 def preview_importacao_endpoint():
     """
     Preview da importação: mostra o que será importado sem importar de fato.
@@ -82,6 +94,7 @@ def preview_importacao_endpoint():
 
 
 @router.post("/sefaz/importar")
+@em_pool("pesado")
 def importar_xmls():
     """
     Importa XMLs do SEFAZ para o banco de dados.
@@ -98,6 +111,7 @@ def importar_xmls():
 
 
 @router.get("/sefaz/preview-inicial")
+@em_pool("pesado")
 def preview_importacao_inicial_endpoint():
     """
     Preview da importação inicial: mostra o que será importado sem importar de fato.
@@ -119,6 +133,7 @@ def preview_importacao_inicial_endpoint():
 
 
 @router.post("/sefaz/importacao-inicial")
+@em_pool("pesado")
 def importacao_inicial():
     """
     Importação inicial (Dia 0): Importa todos os XMLs desde início do ano até hoje.
@@ -133,6 +148,7 @@ def importacao_inicial():
 
 
 @router.get("/pendencias")
+@em_pool("interativo")
 def pendencias(
     limit: int = Query(500, description="Limite de resultados"),
     data_ini: Optional[date] = Query(None, description="Data inicial do filtro (opcional)"),
@@ -169,32 +185,85 @@ def identificar_pendencia_endpoint(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/pendencias/reidentificar")
+@em_pool("pesado")
+def reidentificar_pendencias(
+    aplicar: bool = Query(True, description="False = apenas relatório do que mudaria"),
+    incluir_alteracoes: bool = Query(True, description="Incluir a lista NF-e -> posto na resposta")
+):
+    """
+    Reavalia todas as NF-es pendentes com o cadastro de postos atual
+    e resolve as que passaram a ser identificadas.
+    """
+    try:
+        from .reidentificacao import reidentificar_pendentes
+        
+        resultado = reidentificar_pendentes(aplicar=aplicar, salvar_relatorio=aplicar)
+        if not incluir_alteracoes:
+            resultado.pop("alteracoes", None)
+        return resultado
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/postos")
-def postos():
+@em_pool("interativo")
+def postos(request: Request):
     """
     Lista todos os postos de trabalho cadastrados.
     """
     try:
-        result = listar_postos()
-        return result
+        return resposta_com_cache(request, ("postos",), listar_postos)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/postos/sugestoes")
+@em_pool("interativo")
+def postos_sugestoes(
+    texto: str = Query(..., min_length=3, description="Nome do posto (como aparece na NF-e)"),
+    limite: int = Query(5, ge=1, le=50)
+):
+    """
+    Sugere postos com nome parecido (erros de digitação, abreviações, palavras fora de ordem).
+    """
+    try:
+        from .matcher import get_posto_matcher
+        
+        similares = get_posto_matcher().buscar_similares(texto, limite=limite)
+        return [
+            {
+                "id": posto["id"],
+                "codigo": posto.get("codigo"),
+                "nomecli": posto.get("nomecli"),
+                "nomepos": posto.get("nomepos"),
+                "cep": posto.get("cep"),
+                "similaridade": similaridade
+            }
+            for posto, similaridade in similares
+        ]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/clientes")
-def clientes():
+@em_pool("interativo")
+def clientes(request: Request):
     """
     Lista todos os clientes únicos cadastrados.
     """
     try:
-        result = listar_clientes()
-        return result
+        # listar_clientes do service: o nome é sobrescrito pela rota /dashboard/clientes abaixo
+        from .service import listar_clientes as listar_clientes_service
+        return resposta_com_cache(request, ("clientes",), listar_clientes_service)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/gastos-por-posto")
+@em_pool("interativo")
 def gastos_por_posto(
+    request: Request,
     data_ini: Optional[date] = Query(None, description="Data inicial do filtro (opcional)"),
     data_fim: Optional[date] = Query(None, description="Data final do filtro (opcional)"),
     cliente: Optional[str] = Query(None, description="Filtrar por cliente específico (opcional)")
@@ -206,14 +275,18 @@ def gastos_por_posto(
     """
     try:
         from .service import listar_gastos_por_posto
-        result = listar_gastos_por_posto(data_ini=data_ini, data_fim=data_fim, cliente_filtro=cliente)
-        return result
+        return resposta_com_cache(
+            request, ("gastos-por-posto", data_ini, data_fim, cliente),
+            lambda: listar_gastos_por_posto(data_ini=data_ini, data_fim=data_fim, cliente_filtro=cliente)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/totais-gerais")
+@em_pool("interativo")
 def totais_gerais(
+    request: Request,
     data_ini: Optional[str] = Query(None, description="Data inicial do filtro (opcional)"),
     data_fim: Optional[str] = Query(None, description="Data final do filtro (opcional)"),
     cliente: Optional[str] = Query(None, description="Filtrar por cliente"),
@@ -223,6 +296,15 @@ def totais_gerais(
     Retorna totais gerais para o dashboard: orçado total e realizado total.
     Suporta filtros por data, cliente e posto.
     """
+    return resposta_com_cache(
+        request, ("totais-gerais", data_ini, data_fim, cliente, posto),
+        lambda: _calcular_totais_gerais(data_ini, data_fim, cliente, posto)
+    )
+
+
+def _calcular_totais_gerais(data_ini: Optional[str], data_fim: Optional[str],
+                            cliente: Optional[str], posto: Optional[int]) -> dict:
+    """Totais de /totais-gerais (sem cache)"""
     try:
         from .db import get_conn
         
@@ -297,6 +379,7 @@ def totais_gerais(
 
 
 @router.get("/scheduler/status")
+@em_pool("interativo")
 def scheduler_status():
     """
     Retorna status do agendador de importação automática.
@@ -309,19 +392,21 @@ def scheduler_status():
 
 
 @router.get("/scheduler/reset-xmls")
+@em_pool("interativo")
 def resetar_xmls_disponiveis():
     """
     Reseta o contador de XMLs disponíveis (após importação).
     """
     try:
         scheduler = get_scheduler()
-        scheduler.xmls_disponiveis = 0
+        scheduler.resetar_xmls_disponiveis()
         return {"success": True, "mensagem": "Contador resetado"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/importacoes/log")
+@em_pool("interativo")
 def importacoes_log(
     limit: int = Query(10, description="Limite de resultados"),
     tipo: Optional[str] = Query(None, description="Filtrar por tipo: 'inicial', 'diaria', 'manual'")
@@ -329,85 +414,91 @@ def importacoes_log(
     """
     Lista histórico de importações realizadas.
     """
+    conn = None
     try:
-        from .db import get_conn, _row_to_dict
+        from .db import get_conn, consultar_importacoes_log
         
         conn = get_conn()
         cur = conn.cursor()
-        
-        if tipo:
-            query = """
-                SELECT id, tipo, data_inicio, data_fim, total_xmls, xmls_processados,
-                       xmls_identificados, xmls_pendentes, status, mensagem,
-                       tempo_execucao_segundos, iniciado_em, concluido_em
-                FROM modulo2_importacoes_log
-                WHERE tipo = ?
-                ORDER BY iniciado_em DESC
-                LIMIT ?
-            """
-            cur.execute(query, (tipo, limit))
-        else:
-            query = """
-                SELECT id, tipo, data_inicio, data_fim, total_xmls, xmls_processados,
-                       xmls_identificados, xmls_pendentes, status, mensagem,
-                       tempo_execucao_segundos, iniciado_em, concluido_em
-                FROM modulo2_importacoes_log
-                ORDER BY iniciado_em DESC
-                LIMIT ?
-            """
-            cur.execute(query, (limit,))
-        
-        rows = cur.fetchall()
-        result = []
-        
-        for row in rows:
-            r = _row_to_dict(row)
-            result.append({
-                "id": r.get("id"),
-                "tipo": r.get("tipo"),
-                "data_inicio": r.get("data_inicio"),
-                "data_fim": r.get("data_fim"),
-                "total_xmls": r.get("total_xmls", 0),
-                "xmls_processados": r.get("xmls_processados", 0),
-                "xmls_identificados": r.get("xmls_identificados", 0),
-                "xmls_pendentes": r.get("xmls_pendentes", 0),
-                "status": r.get("status"),
-                "mensagem": r.get("mensagem"),
-                "tempo_segundos": r.get("tempo_execucao_segundos"),
-                "iniciado_em": r.get("iniciado_em"),
-                "concluido_em": r.get("concluido_em")
-            })
-        
+        result = consultar_importacoes_log(cur, limit=limit, tipo=tipo)
         cur.close()
-        conn.close()
         
         return result
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if conn:
+            conn.close()
 
 
 # ============================================
 # PROGRESSO E ESTADO DA IMPORTAÇÃO
 # ============================================
 
-# Variável global para rastrear progresso (em memória)
-import_progress = {
-    "em_andamento": False,
-    "processados": 0,
-    "total": 0,
-    "mensagem": ""
-}
-
 @router.get("/importacao/progresso")
+@em_pool("interativo")
 def obter_progresso_importacao():
-    """Retorna progresso da importação em andamento"""
-    return import_progress
+    """Retorna progresso da importação em andamento (para acompanhar ao vivo use /importacao/eventos)"""
+    return get_progresso_importacao().estado()
+
+
+# Intervalo do comentário de keep-alive no stream (proxies derrubam conexões ociosas)
+SSE_KEEPALIVE_SEGUNDOS = 15
+
+
+@router.get("/importacao/eventos")
+async def eventos_importacao(request: Request):
+    """
+    Server-Sent Events com o progresso da importação: um evento por lote
+    (NSU, buscados, salvos, identificados, docs_por_segundo, eta_segundos).
+    O primeiro evento é o estado atual, então reconectar já ressincroniza a página.
+    Importações rodando em outro worker chegam pela linha gravada no banco
+    (ProgressoImportacao.sincronizar, a cada PROGRESSO_POLL_SEGUNDOS).
+    """
+    progresso = get_progresso_importacao()
+    fila, atual = progresso.assinar()
+
+    def formatar(evento: dict) -> str:
+        dados = json.dumps(evento["dados"], ensure_ascii=False)
+        return f"id: {evento['id']}\nevent: {evento['evento']}\ndata: {dados}\n\n"
+
+    async def stream():
+        try:
+            yield formatar(atual)
+            ultimo_envio = time.monotonic()
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    evento = await asyncio.wait_for(fila.get(), timeout=PROGRESSO_POLL_SEGUNDOS)
+                except asyncio.TimeoutError:
+                    progresso.sincronizar()
+                    if time.monotonic() - ultimo_envio >= SSE_KEEPALIVE_SEGUNDOS:
+                        ultimo_envio = time.monotonic()
+                        yield ": keep-alive\n\n"
+                    continue
+                ultimo_envio = time.monotonic()
+                yield formatar(evento)
+        finally:
+            progresso.cancelar(fila)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @router.get("/importacao/estado")
-def verificar_estado_importacao():
+@em_pool("interativo")
+def verificar_estado_importacao(request: Request):
     """Verifica se já houve importação (para ocultar botão)"""
+    return resposta_com_cache(request, ("importacao/estado",), _calcular_estado_importacao)
+
+
+def _calcular_estado_importacao() -> dict:
+    """Estado de /importacao/estado (sem cache)"""
     try:
         from .db import get_conn
         conn = get_conn()
@@ -440,8 +531,14 @@ def verificar_estado_importacao():
 
 
 @router.get("/estatisticas/resumo")
-def obter_estatisticas_resumo():
+@em_pool("interativo")
+def obter_estatisticas_resumo(request: Request):
     """Retorna estatísticas para o popup final"""
+    return resposta_com_cache(request, ("estatisticas/resumo",), _calcular_estatisticas_resumo)
+
+
+def _calcular_estatisticas_resumo() -> dict:
+    """Estatísticas de /estatisticas/resumo (sem cache)"""
     try:
         from .db import get_conn
         conn = get_conn()
@@ -483,11 +580,18 @@ def obter_estatisticas_resumo():
 # ============================================
 
 @router.get("/status/resumo")
-def obter_status_resumo():
+@em_pool("interativo")
+def obter_status_resumo(request: Request):
     """
     Retorna resumo do status para o tooltip de informação.
     Inclui última atualização, total importado, próxima importação.
     """
+    # A próxima importação depende do dia: a data entra na chave do cache
+    return resposta_com_cache(request, ("status/resumo", date.today()), _calcular_status_resumo)
+
+
+def _calcular_status_resumo() -> dict:
+    """Resumo de /status/resumo (sem cache)"""
     try:
         from .db import get_conn, _row_to_dict
         from datetime import datetime
@@ -605,6 +709,7 @@ def resetar_para_importacao_inicial():
 
 
 @router.get("/sefaz/verificar-bloqueio")
+@em_pool("interativo")
 def verificar_bloqueio_sefaz():
     """
     Verifica se há risco de bloqueio antes de iniciar importação.
@@ -708,14 +813,44 @@ def verificar_bloqueio_sefaz():
 # EXPORTAÇÃO EXCEL
 # ============================================
 
+def _job_exportacao(formato: str, data_inicio: Optional[date], data_fim: Optional[date], apenas_pendentes: bool) -> dict:
+    """Solicita o job de exportação (pronto ou em andamento) já no formato de resposta da API"""
+    from .exportacao import parquet_disponivel
+    from .executores import PoolSaturado, RETRY_AFTER_SEGUNDOS
+    from .jobs_exportacao import get_jobs_exportacao
+    
+    if formato == "parquet" and not parquet_disponivel():
+        raise HTTPException(status_code=501, detail="pyarrow é necessário para Parquet. Instale com: pip install pyarrow")
+    
+    try:
+        job = get_jobs_exportacao().solicitar(formato, data_inicio, data_fim, apenas_pendentes)
+    except PoolSaturado as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(RETRY_AFTER_SEGUNDOS)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return _resposta_job(job)
+
+
+def _resposta_job(job: dict) -> dict:
+    job["status_url"] = f"/api/modulo2/exportar/jobs/{job['id']}"
+    if job["status"] == "ok":
+        job["download_url"] = f"/api/modulo2/exportar/jobs/{job['id']}/download"
+        job["mensagem"] = "Arquivo reaproveitado (mesmos filtros, dados sem alteração)" if job.get("reaproveitado") \
+            else "Arquivo gerado com sucesso"
+    elif job["status"] == "em_andamento":
+        job["mensagem"] = "Exportação em andamento"
+    return job
+
+
 @router.get("/exportar/excel")
+@em_pool("interativo")
 def exportar_nfes_excel_endpoint(
     data_inicio: Optional[date] = Query(None, description="Data inicial (padrão: 01/01/2026)"),
     data_fim: Optional[date] = Query(None, description="Data final (padrão: hoje)"),
     apenas_pendentes: bool = Query(False, description="Exportar apenas NFes pendentes")
 ):
     """
-    Exporta todas as NFes para um arquivo Excel.
+    Exporta todas as NFes para um arquivo Excel (job em segundo plano).
     
     Campos incluídos:
     - Chave da NF, Número da NF, NSU vinculado, Data da NF
@@ -723,34 +858,100 @@ def exportar_nfes_excel_endpoint(
     - Informações de destinatário, Informações complementares
     - Status (identificada ou não), Motivo (se não identificada)
     
-    Retorna o caminho do arquivo gerado.
+    Mesmos filtros sem alteração nos dados: status "ok" na hora, com o arquivo já gerado.
+    Senão: status "em_andamento" e o id do job (acompanhar em status_url).
     """
-    try:
-        from .service import exportar_nfes_excel
-        
-        caminho = exportar_nfes_excel(
-            data_inicio=data_inicio,
-            data_fim=data_fim,
-            apenas_pendentes=apenas_pendentes
-        )
-        
-        return {
-            "status": "ok",
-            "arquivo": caminho,
-            "mensagem": "Arquivo Excel gerado com sucesso"
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    return _job_exportacao("xlsx", data_inicio, data_fim, apenas_pendentes)
+
+
+@router.post("/exportar/jobs")
+@em_pool("interativo")
+def criar_job_exportacao(
+    formato: str = Query("xlsx", pattern="^(csv|parquet|xlsx)$", description="csv, parquet ou xlsx"),
+    data_inicio: Optional[date] = Query(None, description="Data inicial (padrão: 01/01/2026)"),
+    data_fim: Optional[date] = Query(None, description="Data final (padrão: hoje)"),
+    apenas_pendentes: bool = Query(False, description="Exportar apenas NFes pendentes")
+):
+    """Cria (ou reaproveita) o job de exportação no formato pedido"""
+    return _job_exportacao(formato, data_inicio, data_fim, apenas_pendentes)
+
+
+@router.get("/exportar/jobs")
+@em_pool("interativo")
+def listar_jobs_exportacao():
+    """Jobs de exportação recentes (mais recente primeiro)"""
+    from .jobs_exportacao import get_jobs_exportacao
+    return {"jobs": [_resposta_job(j) for j in get_jobs_exportacao().listar()]}
+
+
+@router.get("/exportar/jobs/{job_id}")
+@em_pool("interativo")
+def status_job_exportacao(job_id: str):
+    """Status do job de exportação"""
+    from .jobs_exportacao import get_jobs_exportacao
+    job = get_jobs_exportacao().obter(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return _resposta_job(job)
+
+
+@router.get("/exportar/jobs/{job_id}/download")
+@em_pool("interativo")
+def download_job_exportacao(job_id: str):
+    """Baixa o arquivo do job concluído"""
+    from fastapi.responses import FileResponse
+    from .exportacao import TIPOS_MIDIA, nome_arquivo_exportacao
+    from .jobs_exportacao import get_jobs_exportacao
+    
+    job = get_jobs_exportacao().obter(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if job["status"] != "ok" or not os.path.exists(job["arquivo"]):
+        raise HTTPException(status_code=409, detail=f"Exportação ainda não disponível (status: {job['status']})")
+    
+    return FileResponse(
+        path=job["arquivo"],
+        filename=nome_arquivo_exportacao(job["formato"]),
+        media_type=TIPOS_MIDIA[job["formato"]]
+    )
+
+
+@router.get("/exportar/nfes")
+@em_pool("interativo")
+def exportar_nfes_arquivo(
+    formato: str = Query("csv", pattern="^(csv|parquet|xlsx)$", description="csv, parquet ou xlsx"),
+    data_inicio: Optional[date] = Query(None, description="Data inicial (padrão: 01/01/2026)"),
+    data_fim: Optional[date] = Query(None, description="Data final (padrão: hoje)"),
+    apenas_pendentes: bool = Query(False, description="Exportar apenas NFes pendentes")
+):
+    """
+    Baixa a exportação das NFes no formato pedido (mesmas colunas de /exportar/excel).
+    
+    O arquivo é gerado por um job no pool "pesado" (leitura do SQLite inteira em uma
+    thread) e servido do disco: arquivo pronto sai na hora (reaproveitado enquanto os
+    dados não mudam); senão, 202 com o id do job para acompanhar em status_url.
+    Com o pool pesado saturado, 429. Este endpoint só solicita o job e serve o
+    arquivo, por isso roda no pool interativo. Parquet requer pyarrow.
+    """
+    from fastapi.responses import FileResponse
+    from .exportacao import TIPOS_MIDIA, nome_arquivo_exportacao
+    
+    job = _job_exportacao(formato, data_inicio, data_fim, apenas_pendentes)
+    if job["status"] != "ok":
+        return JSONResponse(status_code=202, content=job)
+    return FileResponse(path=job["arquivo"], filename=nome_arquivo_exportacao(formato),
+                        media_type=TIPOS_MIDIA[formato])
 
 
 @router.get("/exportar/download/{filename}")
+@em_pool("interativo")
 def download_excel(filename: str):
     """
     Faz download do arquivo Excel gerado.
     """
     from fastapi.responses import FileResponse
     from pathlib import Path
+    from .exportacao import TIPOS_MIDIA
     
     output_dir = Path(__file__).parent / "output"
     file_path = output_dir / filename
@@ -761,14 +962,15 @@ def download_excel(filename: str):
     return FileResponse(
         path=str(file_path),
         filename=filename,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        media_type=TIPOS_MIDIA.get(file_path.suffix.lstrip("."), TIPOS_MIDIA["xlsx"])
     )
 
 
 @router.get("/exportar/lista")
+@em_pool("interativo")
 def listar_arquivos_exportados():
     """
-    Lista arquivos Excel exportados disponíveis para download.
+    Lista arquivos exportados (Excel, CSV e Parquet) disponíveis para download.
     """
     from pathlib import Path
     import os
@@ -779,7 +981,7 @@ def listar_arquivos_exportados():
         return {"arquivos": []}
     
     arquivos = []
-    for f in output_dir.glob("*.xlsx"):
+    for f in sorted(output_dir.glob("*.xlsx")) + sorted(output_dir.glob("*.csv")) + sorted(output_dir.glob("*.parquet")):
         stat = f.stat()
         arquivos.append({
             "nome": f.name,
@@ -800,7 +1002,9 @@ def listar_arquivos_exportados():
 # ============================================
 
 @router.get("/dashboard/total-nfes")
+@em_pool("interativo")
 def total_nfes(
+    request: Request,
     cliente: Optional[str] = Query(None, description="Filtrar por cliente"),
     posto: Optional[str] = Query(None, description="Filtrar por posto (requer cliente)")
 ):
@@ -809,26 +1013,34 @@ def total_nfes(
     """
     try:
         from .db import obter_total_nfes
-        return obter_total_nfes(cliente_filtro=cliente, posto_filtro=posto)
+        return resposta_com_cache(
+            request, ("dashboard/total-nfes", cliente, posto),
+            lambda: obter_total_nfes(cliente_filtro=cliente, posto_filtro=posto)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/dashboard/clientes")
-def listar_clientes():
+@em_pool("interativo")
+def listar_clientes(request: Request):
     """
     Lista todos os clientes distintos disponíveis para filtro.
     """
     try:
         from .db import listar_clientes_distintos
-        clientes = listar_clientes_distintos()
-        return {"clientes": clientes}
+        return resposta_com_cache(
+            request, ("dashboard/clientes",),
+            lambda: {"clientes": listar_clientes_distintos()}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/dashboard/postos")
+@em_pool("interativo")
 def listar_postos_por_cliente_endpoint(
+    request: Request,
     cliente: str = Query(..., description="Cliente para listar postos")
 ):
     """
@@ -836,14 +1048,18 @@ def listar_postos_por_cliente_endpoint(
     """
     try:
         from .db import listar_postos_por_cliente
-        postos = listar_postos_por_cliente(cliente)
-        return {"postos": postos}
+        return resposta_com_cache(
+            request, ("dashboard/postos", cliente),
+            lambda: {"postos": listar_postos_por_cliente(cliente)}
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.get("/dashboard/grafico-clientes")
+@em_pool("interativo")
 def grafico_clientes(
+    request: Request,
     cliente_filtro: Optional[str] = Query(None, description="Filtrar por cliente específico")
 ):
     """
@@ -851,14 +1067,90 @@ def grafico_clientes(
     """
     try:
         from .db import listar_gastos_por_cliente_agregado
-        dados = listar_gastos_por_cliente_agregado(cliente_filtro=cliente_filtro)
-        return dados
+        return resposta_com_cache(
+            request, ("dashboard/grafico-clientes", cliente_filtro),
+            lambda: listar_gastos_por_cliente_agregado(cliente_filtro=cliente_filtro)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/dashboard/serie-gastos")
+@em_pool("interativo")
+def serie_gastos_endpoint(
+    request: Request,
+    granularidade: str = Query("mes", pattern="^(dia|semana|mes)$", description="dia, semana ou mes"),
+    data_ini: Optional[date] = Query(None, description="Data inicial (padrão: 12 meses atrás)"),
+    data_fim: Optional[date] = Query(None, description="Data final (padrão: hoje)"),
+    cliente: Optional[str] = Query(None, description="Filtrar por cliente"),
+    posto: Optional[str] = Query(None, description="Filtrar por posto"),
+    agrupar_por: Optional[str] = Query(None, pattern="^(cliente|posto)$", description="Uma série por cliente ou posto")
+):
+    """
+    Série temporal do realizado (por dia, semana ou mês) com o orçado por ano_mes.
+    Servida dos agregados diários (modulo2_gastos_diarios), sem varrer as NFes.
+    """
+    try:
+        from .service import serie_gastos
+        return resposta_com_cache(
+            request, ("dashboard/serie-gastos", granularidade, data_ini, data_fim, cliente, posto, agrupar_por,
+                      date.today()),
+            lambda: serie_gastos(granularidade, data_ini, data_fim, cliente, posto, agrupar_por)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/fornecedores/ranking")
+@em_pool("interativo")
+def ranking_fornecedores(
+    request: Request,
+    ordem: str = Query("valor", pattern="^(valor|nfes|pendentes|identificacao)$",
+                       description="valor, nfes, pendentes ou identificacao (pior taxa primeiro)"),
+    limit: int = Query(50, ge=1, le=1000, description="Limite de fornecedores"),
+    mes_ini: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="Mês inicial (YYYY-MM)"),
+    mes_fim: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="Mês final (YYYY-MM)")
+):
+    """
+    Ranking de fornecedores (emitentes) por gasto, NFes, pendentes ou taxa de identificação.
+    Servido dos contadores de modulo2_fornecedores (por mês quando há período), sem varrer as NFes.
+    """
+    try:
+        from .db import listar_ranking_fornecedores
+        return resposta_com_cache(
+            request, ("fornecedores/ranking", ordem, limit, mes_ini, mes_fim),
+            lambda: listar_ranking_fornecedores(ordem, limit, mes_ini, mes_fim)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/fornecedores/{chave:path}")
+@em_pool("interativo")
+def detalhe_fornecedor(
+    chave: str,
+    mes_ini: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="Mês inicial (YYYY-MM)"),
+    mes_fim: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$", description="Mês final (YYYY-MM)")
+):
+    """
+    Totais e evolução mensal de um fornecedor. `chave` é o CNPJ do emitente
+    (ou NOME:<nome> para NFes sem CNPJ, como devolvido no ranking).
+    Leitura pela chave primária dos contadores, sem cache de resposta.
+    """
+    from .db import obter_fornecedor
+    try:
+        fornecedor = obter_fornecedor(chave, mes_ini, mes_fim)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if fornecedor is None:
+        raise HTTPException(status_code=404, detail="Fornecedor não encontrado")
+    return fornecedor
 
 
 @router.get("/dashboard/grafico-produtos")
+@em_pool("interativo")
 def grafico_produtos(
+    request: Request,
     cliente: Optional[str] = Query(None, description="Filtrar por cliente"),
     posto: Optional[str] = Query(None, description="Filtrar por posto (requer cliente)"),
     limit: int = Query(50, description="Limite de produtos")
@@ -868,11 +1160,75 @@ def grafico_produtos(
     """
     try:
         from .db import listar_produtos_agregados
-        produtos = listar_produtos_agregados(
-            cliente_filtro=cliente,
-            posto_filtro=posto,
-            limit=limit
+        return resposta_com_cache(
+            request, ("dashboard/grafico-produtos", cliente, posto, limit),
+            lambda: listar_produtos_agregados(cliente_filtro=cliente, posto_filtro=posto, limit=limit)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/dashboard/bundle")
+@em_pool("interativo")
+def dashboard_bundle(
+    request: Request,
+    data_ini: Optional[date] = Query(None, description="Data inicial (pendências, gastos por posto, totais)"),
+    data_fim: Optional[date] = Query(None, description="Data final (pendências, gastos por posto, totais)"),
+    cliente: Optional[str] = Query(None, description="Filtrar por cliente"),
+    posto: Optional[str] = Query(None, description="Filtrar por posto (requer cliente)"),
+    limit_produtos: int = Query(20, description="Limite de produtos no gráfico"),
+    limit_pendencias: int = Query(500, description="Limite de pendências")
+):
+    """
+    Todos os widgets do dashboard em uma requisição: total de NFes, totais gerais,
+    gráficos de clientes/produtos, gastos por posto, pendências, clientes e postos
+    para os filtros, estatísticas, estado da importação, resumo de status e log.
+    Calculado em uma transação, com as NFes do JSON selecionadas uma única vez.
+    """
+    try:
+        from .dashboard_bundle import montar_bundle_dashboard
+        # O resumo de status traz a próxima importação (depende do dia): o dia vai na
+        # chave do cache e é o mesmo usado no cálculo
+        hoje = date.today()
+        chave = ("dashboard/bundle", data_ini, data_fim, cliente, posto, limit_produtos, limit_pendencias, hoje)
+        return resposta_com_cache(
+            request, chave,
+            lambda: montar_bundle_dashboard(
+                data_ini=data_ini,
+                data_fim=data_fim,
+                cliente=cliente,
+                posto=posto,
+                limite_produtos=limit_produtos,
+                limite_pendencias=limit_pendencias,
+                hoje=hoje
+            )
         )
-        return produtos
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/cache/estatisticas")
+@em_pool("interativo")
+def cache_estatisticas():
+    """
+    Métricas do cache de respostas (hits, misses, 304) e da coalescência de
+    chamadas idênticas (execuções, chamadas coalescidas, em andamento).
+    """
+    from .cache_respostas import get_cache_respostas
+    from .single_flight import get_single_flight
+    return {
+        "respostas": get_cache_respostas().estatisticas(),
+        "single_flight": get_single_flight().estatisticas()
+    }
+
+
+@router.get("/executores/estatisticas")
+@em_pool("interativo")
+def executores_estatisticas():
+    """
+    Utilização dos pools por classe de carga ("pesado": importação/exportação,
+    "interativo": leituras do dashboard): workers, ativos, fila, rejeitados (429),
+    tempo médio de execução e de espera.
+    """
+    from .executores import estatisticas_pools
+    return estatisticas_pools()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# projects/modulo2/benchmark_identificacao.py
+
+"""
+Benchmark de acurácia e desempenho de identificar_posto().
+
+Monta um corpus rotulado a partir de produtos_com_posto.json (postos = pares
+codpos/cliente/posto_trabalho dos produtos OK) e gera variações sintéticas de
+infCpl e enderDest para cada regra da cascata. Para cada documento roda
+identificar_posto_com_regra() e compara o posto retornado com o rótulo.
+
+Relatório:
+  - documentos por segundo
+  - recall por cenário (qual regra o documento deveria acionar)
+  - precisão e tempo médio por regra que de fato identificou
+  - falsos positivos nas NF-es pendentes do JSON (sem posto esperado)
+
+Tudo é determinístico (--seed), então serve como gate de CI:
+
+    python -m projects.modulo2.benchmark_identificacao --min-precisao 0.95 --min-docs-por-segundo 2000
+
+Sai com código 1 se algum limite não for atingido.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import contextlib
+from collections import defaultdict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from projects.modulo2.matcher import PostoMatcher
+
+
+CAMINHO_JSON_PADRAO = BASE_DIR / "produtos_com_posto.json"
+
+# Cenários sintéticos (por regra) + documentos reais do JSON
+CENARIOS = (
+    "local_entrega",          # LOCAL DE ENTREGA: <posto>
+    "local_entrega_cliente",  # LOCAL DE ENTREGA: <cliente> - <posto>
+    "local_entrega_erro",     # LOCAL DE ENTREGA com erro de digitação no nome
+    "sme",                    # SME ... POSTO <n> - <posto>
+    "cep_exato",              # CEP do destino igual ao do posto
+    "cep_proximo",            # CEP a até 50 do posto
+    "cep_prefixo",            # mesmo prefixo de 5 dígitos, nome do posto no infCpl
+    "endereco",               # sem CEP, logradouro e número do posto
+    "json_identificado",      # NF-es do JSON com posto identificado (infCpl = end_cliente)
+    "json_pendente",          # NF-es pendentes do JSON (nenhum posto esperado)
+)
+
+LOGRADOUROS = ("RUA", "AVENIDA", "ALAMEDA", "TRAVESSA", "ESTRADA")
+NOMES_RUA = ("DAS FLORES", "SAO JOAO", "BOM JESUS", "DOS ANDRADAS", "SETE DE SETEMBRO",
+             "CAMPOS SALES", "JOSE BONIFACIO", "TIRADENTES", "BARAO DE JAGUARA")
+BAIRROS = ("CENTRO", "VILA NOVA", "JARDIM AMERICA", "MOOCA", "CAMBUI", None)
+# Postos por prefixo de CEP (sufixos distantes entre si mais que 2x o raio de ±50)
+SUFIXOS_CEP = (100, 400, 700)
+
+
+# ================================
+# CORPUS
+# ================================
+
+def carregar_produtos(caminho_json: Path) -> List[dict]:
+    """Produtos do produtos_com_posto.json"""
+    with open(caminho_json, "r", encoding="utf-8") as f:
+        dados = json.load(f)
+    return dados.get("produtos", []) if isinstance(dados, dict) else dados
+
+
+def montar_postos_json(produtos: List[dict], rnd: random.Random, distratores: int = 0) -> List[dict]:
+    """
+    Postos (id sequencial) a partir dos produtos OK, com CEP e endereço sintéticos:
+    três postos por prefixo de CEP e logradouros únicos. Distratores são postos extras
+    (sem documentos) para simular um cadastro maior.
+    """
+    vistos = set()
+    postos = []
+    for p in produtos:
+        if p.get("_status") != "OK" or not p.get("posto_trabalho"):
+            continue
+        chave = (p.get("codpos") or "", p.get("cliente") or "", p["posto_trabalho"])
+        if chave in vistos:
+            continue
+        vistos.add(chave)
+        postos.append({"codigo": chave[0], "nomecli": chave[1], "nomepos": chave[2]})
+
+    for i in range(distratores):
+        postos.append({"codigo": f"D{i}", "nomecli": f"CLIENTE SINTETICO {i % 50}",
+                       "nomepos": f"POSTO SINTETICO {i:05d}", "_distrator": True})
+
+    prefixos = rnd.sample(range(1000, 99999), (len(postos) + len(SUFIXOS_CEP) - 1) // len(SUFIXOS_CEP))
+    for i, posto in enumerate(postos):
+        posto["id"] = i + 1
+        prefixo = prefixos[i // len(SUFIXOS_CEP)]
+        posto["cep"] = f"{prefixo:05d}{SUFIXOS_CEP[i % len(SUFIXOS_CEP)]:03d}"
+        logradouro = f"{rnd.choice(LOGRADOUROS)} {rnd.choice(NOMES_RUA)} {i + 1:05d}"
+        posto["_logradouro"] = logradouro
+        posto["_numero"] = str(rnd.randint(1, 999))
+        posto["end"] = f"{logradouro}, {posto['_numero']}"
+        posto["bairro"] = rnd.choice(BAIRROS)
+    return postos
+
+
+def _com_erro_digitacao(texto: str, rnd: random.Random) -> str:
+    """Troca duas letras vizinhas de uma palavra com 5+ letras (se houver)"""
+    palavras = texto.split()
+    longas = [i for i, p in enumerate(palavras) if len(p) >= 5 and p.isalpha()]
+    if not longas:
+        return texto
+    i = rnd.choice(longas)
+    palavra = palavras[i]
+    j = rnd.randint(1, len(palavra) - 3)
+    palavras[i] = palavra[:j] + palavra[j + 1] + palavra[j] + palavra[j + 2:]
+    return " ".join(palavras)
+
+
+def _cep_deslocado(cep: str, deslocamento: int) -> str:
+    return str(int(cep) + deslocamento).zfill(8)
+
+
+def gerar_documento(cenario: str, posto: dict, rnd: random.Random) -> Tuple[str, dict]:
+    """(infCpl, enderDest) sintéticos que deveriam identificar `posto` pela regra do cenário"""
+    pedido = rnd.randint(100000, 999999)
+    if cenario == "local_entrega":
+        return f"LOCAL DE ENTREGA: {posto['nomepos']}; PEDIDO {pedido}", {}
+    if cenario == "local_entrega_cliente":
+        return f"LOCAL DE ENTREGA: {posto['nomecli']} - {posto['nomepos']}; PEDIDO {pedido}", {}
+    if cenario == "local_entrega_erro":
+        return f"LOCAL DE ENTREGA: {_com_erro_digitacao(posto['nomepos'], rnd)}; PEDIDO {pedido}", {}
+    if cenario == "sme":
+        return f"SME PEDIDO {pedido} POSTO {rnd.randint(1, 999)} - {posto['nomepos']}; ENTREGA AGENDADA", {}
+    if cenario == "cep_exato":
+        return "", {"CEP": posto["cep"], "xLgr": "", "nro": ""}
+    if cenario == "cep_proximo":
+        deslocamento = rnd.choice((-1, 1)) * rnd.randint(1, 50)
+        return "", {"CEP": _cep_deslocado(posto["cep"], deslocamento), "xLgr": "", "nro": ""}
+    if cenario == "cep_prefixo":
+        # Fora do raio de ±50, mais perto deste posto que dos vizinhos de prefixo
+        sinal = 1 if posto["cep"].endswith("100") else rnd.choice((-1, 1))
+        deslocamento = sinal * rnd.randint(80, 140)
+        return f"A/C {posto['nomepos']} PEDIDO {pedido}", {
+            "CEP": _cep_deslocado(posto["cep"], deslocamento), "xLgr": "", "nro": ""
+        }
+    if cenario == "endereco":
+        return "", {"CEP": "", "xLgr": posto["_logradouro"], "nro": posto["_numero"],
+                    "xBairro": posto.get("bairro") or ""}
+    raise ValueError(f"Cenário sintético desconhecido: {cenario}")
+
+
+def montar_corpus(produtos: List[dict], postos: List[dict], amostra: int, rnd: random.Random) -> List[dict]:
+    """Documentos rotulados: {"cenario", "infcpl", "ender", "esperado" (id do posto ou None)}"""
+    rotulados = [p for p in postos if not p.get("_distrator")]
+    corpus = []
+    for cenario in CENARIOS:
+        if cenario.startswith("json_"):
+            continue
+        for _ in range(amostra):
+            posto = rnd.choice(rotulados)
+            infcpl, ender = gerar_documento(cenario, posto, rnd)
+            corpus.append({"cenario": cenario, "infcpl": infcpl, "ender": ender, "esperado": posto["id"]})
+
+    # Documentos reais: uma NF-e por chave, rótulo pelo produto OK
+    por_nome = {(p["codigo"], p["nomecli"], p["nomepos"]): p["id"] for p in postos}
+    chaves_ok = {}
+    chaves_pendentes = {}
+    for p in produtos:
+        chave = p.get("chave_nf")
+        if not chave:
+            continue
+        if p.get("_status") == "OK" and p.get("posto_trabalho"):
+            rotulo = por_nome.get((p.get("codpos") or "", p.get("cliente") or "", p["posto_trabalho"]))
+            chaves_ok.setdefault(chave, (p.get("end_cliente") or "", rotulo))
+        elif p.get("_status") == "PENDENTE":
+            chaves_pendentes.setdefault(chave, p.get("end_cliente") or "")
+
+    for chave in sorted(chaves_ok):
+        infcpl, rotulo = chaves_ok[chave]
+        corpus.append({"cenario": "json_identificado", "infcpl": infcpl, "ender": None, "esperado": rotulo})
+    for chave in sorted(set(chaves_pendentes) - set(chaves_ok)):
+        corpus.append({"cenario": "json_pendente", "infcpl": chaves_pendentes[chave], "ender": None, "esperado": None})
+    return corpus
+
+
+# ================================
+# EXECUÇÃO
+# ================================
+
+def executar(postos: List[dict], corpus: List[dict]) -> dict:
+    """Roda a cascata sobre o corpus e calcula as métricas"""
+    from projects.modulo2.service import identificar_posto_com_regra
+
+    inicio = time.perf_counter()
+    matcher = PostoMatcher(postos)
+    tempo_indice = time.perf_counter() - inicio
+
+    por_cenario = defaultdict(lambda: {"documentos": 0, "identificados": 0, "corretos": 0})
+    por_regra = defaultdict(lambda: {"identificados": 0, "corretos": 0, "tempo": 0.0})
+
+    # Os logs da cascata ([IDENTIFICACAO] ...) distorceriam o tempo no terminal
+    with open(os.devnull, "w") as nulo, contextlib.redirect_stdout(nulo):
+        identificar_posto_com_regra("", {}, matcher=matcher)  # aquecimento
+        inicio_total = time.perf_counter()
+        for doc in corpus:
+            inicio = time.perf_counter()
+            posto, regra = identificar_posto_com_regra(doc["infcpl"], doc["ender"], matcher=matcher)
+            duracao = time.perf_counter() - inicio
+
+            correto = (posto["id"] if posto else None) == doc["esperado"]
+            c = por_cenario[doc["cenario"]]
+            c["documentos"] += 1
+            c["identificados"] += 1 if posto else 0
+            c["corretos"] += 1 if (posto and correto) else 0
+
+            r = por_regra[regra or "nao_identificado"]
+            r["identificados"] += 1
+            r["corretos"] += 1 if correto else 0
+            r["tempo"] += duracao
+        tempo_total = time.perf_counter() - inicio_total
+
+    cenarios = {}
+    for cenario in CENARIOS:
+        if cenario not in por_cenario:
+            continue
+        c = por_cenario[cenario]
+        if cenario == "json_pendente":
+            # Sem posto esperado: tudo que foi identificado é falso positivo
+            c["falsos_positivos"] = c["identificados"]
+            c["recall"] = None
+        else:
+            c["recall"] = round(c["corretos"] / c["documentos"], 4) if c["documentos"] else None
+        cenarios[cenario] = c
+
+    regras = {}
+    for regra, r in sorted(por_regra.items()):
+        regras[regra] = {
+            "documentos": r["identificados"],
+            "corretos": r["corretos"] if regra != "nao_identificado" else None,
+            "precisao": round(r["corretos"] / r["identificados"], 4) if regra != "nao_identificado" else None,
+            "tempo_medio_ms": round(r["tempo"] / r["identificados"] * 1000, 4),
+            "tempo_total_s": round(r["tempo"], 4)
+        }
+
+    identificados = sum(r["identificados"] for k, r in por_regra.items() if k != "nao_identificado")
+    corretos = sum(r["corretos"] for k, r in por_regra.items() if k != "nao_identificado")
+    rotulados = sum(1 for doc in corpus if doc["esperado"] is not None)
+    corretos_rotulados = sum(c["corretos"] for k, c in por_cenario.items() if k != "json_pendente")
+
+    return {
+        "postos": len(postos),
+        "documentos": len(corpus),
+        "tempo_indice_s": round(tempo_indice, 4),
+        "tempo_total_s": round(tempo_total, 4),
+        "docs_por_segundo": round(len(corpus) / tempo_total, 1) if tempo_total else None,
+        "precisao": round(corretos / identificados, 4) if identificados else None,
+        "recall": round(corretos_rotulados / rotulados, 4) if rotulados else None,
+        "cenarios": cenarios,
+        "regras": regras
+    }
+
+
+def verificar_limites(r: dict, min_precisao: float = None, min_recall: float = None,
+                      min_docs_por_segundo: float = None) -> List[str]:
+    """Mensagens dos limites (gate de CI) que não foram atingidos"""
+    falhas = []
+    if min_precisao is not None and (r["precisao"] or 0) < min_precisao:
+        falhas.append(f"precisão {r['precisao']} < {min_precisao}")
+    if min_recall is not None and (r["recall"] or 0) < min_recall:
+        falhas.append(f"recall {r['recall']} < {min_recall}")
+    if min_docs_por_segundo is not None and (r["docs_por_segundo"] or 0) < min_docs_por_segundo:
+        falhas.append(f"docs/s {r['docs_por_segundo']} < {min_docs_por_segundo}")
+    return falhas
+
+
+def _fmt(valor: Optional[float]) -> str:
+    return "—" if valor is None else f"{valor * 100:.1f}%"
+
+
+def imprimir_relatorio(r: dict):
+    print("=" * 70)
+    print("BENCHMARK - IDENTIFICAÇÃO DE POSTOS")
+    print("=" * 70)
+    print(f"  Postos: {r['postos']} (índice montado em {r['tempo_indice_s'] * 1000:.1f} ms)")
+    print(f"  Documentos: {r['documentos']} em {r['tempo_total_s']:.3f}s ({r['docs_por_segundo']} docs/s)")
+    print(f"  Precisão geral: {_fmt(r['precisao'])}   Recall geral: {_fmt(r['recall'])}")
+    print()
+    print(f"  {'CENÁRIO':<24}{'DOCS':>7}{'IDENT.':>8}{'CORRETOS':>10}{'RECALL':>9}")
+    for cenario, c in r["cenarios"].items():
+        extra = f"   (falsos positivos: {c['falsos_positivos']})" if "falsos_positivos" in c else ""
+        print(f"  {cenario:<24}{c['documentos']:>7}{c['identificados']:>8}{c['corretos']:>10}{_fmt(c['recall']):>9}{extra}")
+    print()
+    print(f"  {'REGRA':<24}{'DOCS':>7}{'CORRETOS':>10}{'PRECISÃO':>10}{'MS/DOC':>10}")
+    for regra, g in r["regras"].items():
+        corretos = "—" if g["corretos"] is None else g["corretos"]
+        print(f"  {regra:<24}{g['documentos']:>7}{corretos:>10}{_fmt(g['precisao']):>10}{g['tempo_medio_ms']:>10.3f}")
+    print()
+
+
+def main():
+    """Função principal para execução via linha de comando"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark de acurácia e desempenho da identificação de postos")
+    parser.add_argument("--json", default=str(CAMINHO_JSON_PADRAO), help="Caminho do produtos_com_posto.json")
+    parser.add_argument("--amostra", type=int, default=300, help="Documentos sintéticos por cenário")
+    parser.add_argument("--distratores", type=int, default=0, help="Postos sintéticos extras no cadastro")
+    parser.add_argument("--seed", type=int, default=42, help="Semente dos dados sintéticos")
+    parser.add_argument("--saida", help="Grava o resultado em JSON neste caminho")
+    parser.add_argument("--min-precisao", type=float, help="Falha se a precisão geral ficar abaixo (0-1)")
+    parser.add_argument("--min-recall", type=float, help="Falha se o recall geral ficar abaixo (0-1)")
+    parser.add_argument("--min-docs-por-segundo", type=float, help="Falha se a vazão ficar abaixo")
+
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    produtos = carregar_produtos(Path(args.json))
+    postos = montar_postos_json(produtos, rnd, args.distratores)
+    corpus = montar_corpus(produtos, postos, args.amostra, rnd)
+
+    resultado = executar(postos, corpus)
+    imprimir_relatorio(resultado)
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"  Resultado salvo em: {args.saida}")
+
+    falhas = verificar_limites(resultado, args.min_precisao, args.min_recall, args.min_docs_por_segundo)
+    if falhas:
+        for falha in falhas:
+            print(f"ERRO: {falha}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# projects/modulo2/benchmark_indice_cep.py
+
+"""
+Benchmark do índice ordenado de CEPs do PostoMatcher contra os laços antigos
+de identificar_posto (estratégias 2 e 3: CEP ±50 e prefixo de 5 dígitos).
+
+Também valida que os dois caminhos retornam exatamente os mesmos postos, na mesma ordem.
+
+Uso:
+    python -m projects.modulo2.benchmark_indice_cep [num_postos] [num_consultas]
+
+    Sem argumentos usa 5000 postos sintéticos e 20000 consultas.
+    Com "db" como num_postos usa os postos cadastrados no banco.
+"""
+
+import sys
+import time
+import random
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from projects.modulo2.matcher import PostoMatcher
+
+
+# ================================
+# IMPLEMENTAÇÃO ANTIGA (referência)
+# ================================
+
+def _proximo_legado(idx_cep: dict, cep_num: int):
+    """Laço original da estratégia 2 (CEP ±50)"""
+    candidatos = []
+    for cep_cadastrado, postos_lista in idx_cep.items():
+        try:
+            diferenca = abs(cep_num - int(cep_cadastrado))
+            if diferenca <= 50:
+                for posto in postos_lista:
+                    candidatos.append((posto, diferenca))
+        except:
+            pass
+
+    if not candidatos:
+        return None, []
+    candidatos.sort(key=lambda x: x[1])
+    menor_diferenca = candidatos[0][1]
+    return menor_diferenca, [p for p, d in candidatos if d == menor_diferenca]
+
+
+def _prefixo_legado(idx_cep: dict, cep5: str):
+    """Laço original da estratégia 3 (prefixo de 5 dígitos)"""
+    candidatos = []
+    for c, lst in idx_cep.items():
+        if c.startswith(cep5):
+            candidatos.extend(lst)
+    return candidatos
+
+
+# ================================
+# DADOS
+# ================================
+
+def gerar_postos_sinteticos(n: int, seed: int = 42) -> list:
+    """Postos com CEPs agrupados (vários postos por CEP) e alguns CEPs fora do padrão"""
+    rnd = random.Random(seed)
+    bases = [rnd.randint(1000, 99999) for _ in range(max(1, n // 50))]
+    postos = []
+    for i in range(n):
+        sorteio = rnd.random()
+        if sorteio < 0.05:
+            cep = None
+        elif sorteio < 0.07:
+            cep = f"{rnd.randint(1000, 99999):05d}-{rnd.randint(0, 999):03d}"  # com hífen
+        else:
+            cep = str(rnd.choice(bases) * 1000 + rnd.randint(0, 999))  # sem zero à esquerda
+        postos.append({
+            "id": i + 1,
+            "nomecli": f"CLIENTE {i % 97}",
+            "nomepos": f"POSTO {i}",
+            "end": None,
+            "bairro": None,
+            "cep": cep
+        })
+    return postos
+
+
+def gerar_consultas(postos: list, n: int, seed: int = 7) -> list:
+    """CEPs de consulta: existentes, vizinhos (±80) e aleatórios"""
+    rnd = random.Random(seed)
+    ceps = [str(p["cep"]).zfill(8) for p in postos if p.get("cep")]
+    consultas = []
+    for _ in range(n):
+        sorteio = rnd.random()
+        if sorteio < 0.4 and ceps:
+            consultas.append(rnd.choice(ceps))
+        elif sorteio < 0.8 and ceps:
+            base = rnd.choice(ceps)
+            try:
+                consultas.append(str(int(base) + rnd.randint(-80, 80)).zfill(8))
+            except ValueError:
+                consultas.append(base)
+        else:
+            consultas.append(str(rnd.randint(0, 99999999)).zfill(8))
+    return consultas
+
+
+# ================================
+# EXECUÇÃO
+# ================================
+
+def _cep_num(cep: str):
+    """int(cep) ou None (identificar_posto pula a estratégia 2 nesse caso)"""
+    try:
+        return int(cep)
+    except ValueError:
+        return None
+
+
+def executar(postos: list, consultas: list) -> dict:
+    consultas = [(cep, _cep_num(cep)) for cep in consultas]
+
+    inicio = time.perf_counter()
+    matcher = PostoMatcher(postos)
+    tempo_indice = time.perf_counter() - inicio
+
+    divergencias = 0
+    for cep, cep_num in consultas:
+        if cep_num is not None:
+            d1, c1 = _proximo_legado(matcher.idx_cep, cep_num)
+            d2, c2 = matcher.candidatos_cep_proximo(cep_num, 50)
+            if d1 != d2 or [p["id"] for p in c1] != [p["id"] for p in c2]:
+                divergencias += 1
+        if [p["id"] for p in _prefixo_legado(matcher.idx_cep, cep[:5])] != \
+                [p["id"] for p in matcher.candidatos_prefixo_cep(cep[:5])]:
+            divergencias += 1
+
+    inicio = time.perf_counter()
+    for cep, cep_num in consultas:
+        if cep_num is not None:
+            _proximo_legado(matcher.idx_cep, cep_num)
+        _prefixo_legado(matcher.idx_cep, cep[:5])
+    tempo_legado = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for cep, cep_num in consultas:
+        if cep_num is not None:
+            matcher.candidatos_cep_proximo(cep_num, 50)
+        matcher.candidatos_prefixo_cep(cep[:5])
+    tempo_novo = time.perf_counter() - inicio
+
+    return {
+        "postos": len(postos),
+        "ceps_distintos": len(matcher.idx_cep),
+        "consultas": len(consultas),
+        "divergencias": divergencias,
+        "tempo_indice": tempo_indice,
+        "tempo_legado": tempo_legado,
+        "tempo_novo": tempo_novo
+    }
+
+
+def main():
+    """Função principal para execução via linha de comando"""
+    arg_postos = sys.argv[1] if len(sys.argv) > 1 else "5000"
+    num_consultas = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+    if arg_postos == "db":
+        from projects.modulo2.db import init_db, listar_postos_db
+        init_db()
+        postos = listar_postos_db()
+    else:
+        postos = gerar_postos_sinteticos(int(arg_postos))
+
+    r = executar(postos, gerar_consultas(postos, num_consultas))
+
+    print("=" * 70)
+    print("BENCHMARK - ÍNDICE ORDENADO DE CEPs")
+    print("=" * 70)
+    print(f"  Postos: {r['postos']} ({r['ceps_distintos']} CEPs distintos)")
+    print(f"  Consultas: {r['consultas']} (CEP ±50 + prefixo)")
+    print(f"  Montagem do índice: {r['tempo_indice'] * 1000:.1f} ms")
+    print(f"  Laços antigos: {r['tempo_legado']:.3f}s ({r['tempo_legado'] / r['consultas'] * 1e6:.1f} us/consulta)")
+    print(f"  Índice ordenado: {r['tempo_novo']:.3f}s ({r['tempo_novo'] / r['consultas'] * 1e6:.1f} us/consulta)")
+    if r["tempo_novo"] > 0:
+        print(f"  Ganho: {r['tempo_legado'] / r['tempo_novo']:.1f}x")
+    print(f"  Divergências: {r['divergencias']}")
+    print()
+
+    if r["divergencias"]:
+        print("ERRO: resultados diferentes da implementação antiga")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
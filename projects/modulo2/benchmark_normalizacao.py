@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# projects/modulo2/benchmark_normalizacao.py
+
+"""
+Benchmark das normalizações de normalizacao.py (tabelas de str.translate + cache LRU)
+contra as implementações antigas (NFKD + gerador + regex a cada chamada).
+
+Também valida que os resultados são idênticos, incluindo a variante para pandas.
+
+Uso:
+    python -m projects.modulo2.benchmark_normalizacao [repeticoes]
+
+    Textos de produtos_com_posto.json (clientes, postos, endereços, produtos) mais
+    textos sintéticos com acentos, símbolos e caracteres fora do Latin-1.
+    Sem argumentos repete o corpus 20 vezes (valores repetidos, como nos laços reais).
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import unicodedata
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from projects.modulo2.normalizacao import (
+    STOPWORDS_POSTO,
+    normalizar_leve,
+    normalizar_forte,
+    limpar_posto,
+    normalizar_serie,
+    limpar_cache_normalizacao
+)
+
+
+# ================================
+# IMPLEMENTAÇÃO ANTIGA (referência)
+# ================================
+
+def _leve_legado(txt) -> str:
+    if txt is None:
+        return ""
+    txt = str(txt)
+    txt = unicodedata.normalize("NFKD", txt)
+    txt = "".join(c for c in txt if not unicodedata.combining(c))
+    return txt.upper().strip()
+
+
+def _forte_legado(txt) -> str:
+    if txt is None:
+        return ""
+    txt = str(txt)
+    txt = unicodedata.normalize("NFKD", txt)
+    txt = "".join(c for c in txt if not unicodedata.combining(c))
+    txt = re.sub(r"[^A-Z0-9]", "", txt.upper())
+    return txt
+
+
+def _limpar_posto_legado(txt: str) -> str:
+    txt = _leve_legado(txt)
+    palavras = txt.split()
+    palavras = [p for p in palavras if p not in STOPWORDS_POSTO]
+    return " ".join(palavras)
+
+
+# ================================
+# DADOS
+# ================================
+
+def carregar_textos() -> list:
+    """Textos distintos do JSON de produtos + sintéticos (acentos, símbolos, outros alfabetos)"""
+    textos = []
+    caminho = BASE_DIR / "produtos_com_posto.json"
+    if caminho.exists():
+        with open(caminho, "r", encoding="utf-8") as f:
+            dados = json.load(f)
+        for p in dados.get("produtos", []):
+            for campo in ("cliente", "posto_trabalho", "end_cliente", "nome_entrega", "produto", "empresa"):
+                if p.get(campo):
+                    textos.append(p[campo])
+
+    rnd = random.Random(42)
+    alfabeto = "abcçdeéêfghiíjklmnoóôõpqrstuúüvwxyzÁÀÃÂÉÊÍÓÔÕÚÇ0123456789 -/.,;:ºª°ßæøﬁ½²Ω™–—“”ΑβЖ中"
+    for _ in range(2000):
+        textos.append("".join(rnd.choice(alfabeto) for _ in range(rnd.randint(0, 60))))
+    textos.extend([None, "", "   ", 123, 4.5, float("nan"), "é", "DIRETORIA ADM UNIDADE CENTRO"])
+    return list(dict.fromkeys(textos))
+
+
+# ================================
+# EXECUÇÃO
+# ================================
+
+def _medir(funcao, textos, repeticoes: int) -> float:
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        for t in textos:
+            funcao(t)
+    return time.perf_counter() - inicio
+
+
+def executar(textos: list, repeticoes: int) -> dict:
+    pares = (
+        ("normalizar_leve", _leve_legado, normalizar_leve),
+        ("normalizar_forte", _forte_legado, normalizar_forte),
+        ("limpar_posto", _limpar_posto_legado, limpar_posto),
+    )
+
+    divergencias = 0
+    for _, legado, novo in pares:
+        for t in textos:
+            if legado(t) != novo(t):
+                divergencias += 1
+                print(f"  DIVERGÊNCIA {novo.__name__}({t!r}): {legado(t)!r} != {novo(t)!r}")
+
+    tempos = {}
+    for nome, legado, novo in pares:
+        limpar_cache_normalizacao()
+        tempo_sem_cache = _medir(novo, textos, 1)
+        tempos[nome] = {
+            "legado": _medir(legado, textos, repeticoes),
+            "novo": tempo_sem_cache + _medir(novo, textos, repeticoes - 1),
+            "novo_sem_cache": tempo_sem_cache,
+            "legado_uma_vez": _medir(legado, textos, 1)
+        }
+
+    resultado = {"textos": len(textos), "repeticoes": repeticoes, "divergencias": divergencias, "tempos": tempos}
+
+    try:
+        import pandas as pd
+    except ImportError:
+        return resultado
+
+    serie = pd.Series(textos * repeticoes, dtype=object)
+    inicio = time.perf_counter()
+    esperado = serie.apply(_leve_legado)
+    tempo_apply = time.perf_counter() - inicio
+    limpar_cache_normalizacao()
+    inicio = time.perf_counter()
+    obtido = normalizar_serie(serie)
+    tempo_serie = time.perf_counter() - inicio
+    if not esperado.equals(obtido):
+        divergencias += 1
+        print("  DIVERGÊNCIA normalizar_serie != Series.apply")
+    resultado["divergencias"] = divergencias
+    resultado["pandas"] = {"linhas": len(serie), "apply_legado": tempo_apply, "serie": tempo_serie}
+    return resultado
+
+
+def main():
+    """Função principal para execução via linha de comando"""
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    textos = carregar_textos()
+    r = executar(textos, max(1, repeticoes))
+    chamadas = r["textos"] * r["repeticoes"]
+
+    print("=" * 70)
+    print("BENCHMARK - NORMALIZAÇÃO DE TEXTOS")
+    print("=" * 70)
+    print(f"  Textos distintos: {r['textos']} x {r['repeticoes']} repetições ({chamadas} chamadas)")
+    for nome, t in r["tempos"].items():
+        print(f"  {nome}:")
+        print(f"    antigo: {t['legado']:.3f}s ({t['legado'] / chamadas * 1e6:.2f} us/chamada)")
+        print(f"    novo:   {t['novo']:.3f}s ({t['novo'] / chamadas * 1e6:.2f} us/chamada)"
+              f"  ganho {t['legado'] / t['novo']:.1f}x")
+        print(f"    sem repetição (cache vazio): {t['legado_uma_vez'] / t['novo_sem_cache']:.1f}x")
+    if "pandas" in r:
+        p = r["pandas"]
+        print(f"  pandas ({p['linhas']} linhas):")
+        print(f"    Series.apply (antigo): {p['apply_legado']:.3f}s")
+        print(f"    normalizar_serie:      {p['serie']:.3f}s  ganho {p['apply_legado'] / p['serie']:.1f}x")
+    print(f"  Divergências: {r['divergencias']}")
+    print()
+
+    if r["divergencias"]:
+        print("ERRO: resultados diferentes da implementação antiga")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# projects/modulo2/cache_respostas.py
+"""
+Cache de respostas dos endpoints do dashboard.
+
+Cada resposta fica guardada (já serializada em JSON) por endpoint + filtros e vale
+enquanto a versão "dados" não mudar. A versão é incrementada por gatilhos do SQLite
+em toda escrita nas tabelas de TABELAS_VERSAO_DADOS (db.py), de qualquer processo.
+
+Para não consultar a tabela de versões a cada requisição, cada thread mantém uma
+conexão aberta e olha o PRAGMA data_version: ele só muda quando outra conexão grava
+no banco, e ler custa microssegundos. A resposta leva ETag com a versão; o navegador
+reenvia em If-None-Match e recebe 304 sem corpo enquanto nada mudou.
+
+No miss, requisições concorrentes da mesma chave e versão esperam um único cálculo
+(single_flight.py) em vez de repetir a mesma consulta em paralelo.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from . import db
+from .single_flight import get_single_flight
+
+
+CACHE_RESPOSTAS_TAMANHO = int(os.getenv("MODULO2_CACHE_RESPOSTAS", "512"))
+CACHE_RESPOSTAS_HABILITADO = os.getenv("MODULO2_CACHE_RESPOSTAS_HABILITADO", "true").lower() in ("true", "1", "yes")
+
+
+# ================================
+# VERSÃO DOS DADOS
+# ================================
+
+_local = threading.local()
+
+
+def versao_dados() -> int:
+    """
+    Versão "dados" atual. Só consulta modulo2_versoes quando o PRAGMA data_version
+    da conexão desta thread indica que alguém gravou no banco desde a última vez.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "db_path", None) != db.DB_PATH:
+        conn = db.get_conn()
+        _local.conn = conn
+        _local.db_path = db.DB_PATH
+        _local.data_version = None
+
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if data_version != _local.data_version:
+        row = conn.execute("SELECT versao FROM modulo2_versoes WHERE chave = 'dados'").fetchone()
+        _local.versao = row[0] if row else 0
+        _local.data_version = data_version
+    return _local.versao
+
+
+# ================================
+# CACHE
+# ================================
+
+class CacheRespostas:
+    """LRU thread-safe: chave (endpoint + filtros) -> (versão, etag, corpo JSON)"""
+
+    def __init__(self, tamanho: int = CACHE_RESPOSTAS_TAMANHO):
+        self._tamanho = tamanho
+        self._itens: "OrderedDict[tuple, Tuple[int, str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metricas = {"hits": 0, "misses": 0, "nao_modificado": 0}
+
+    def get(self, chave: tuple, versao: int) -> Optional[Tuple[str, bytes]]:
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is None or item[0] != versao:
+                self.metricas["misses"] += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.metricas["hits"] += 1
+            return item[1], item[2]
+
+    def set(self, chave: tuple, versao: int, etag: str, corpo: bytes):
+        with self._lock:
+            self._itens[chave] = (versao, etag, corpo)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self._tamanho:
+                self._itens.popitem(last=False)
+
+    def contar(self, metrica: str):
+        with self._lock:
+            self.metricas[metrica] += 1
+
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+
+    def estatisticas(self) -> Dict:
+        with self._lock:
+            return dict(self.metricas, itens=len(self._itens))
+
+
+# Instância global do cache
+_cache_respostas = CacheRespostas()
+
+
+def get_cache_respostas() -> CacheRespostas:
+    """Retorna instância global do cache de respostas"""
+    return _cache_respostas
+
+
+def _etag(chave: tuple, versao: int) -> str:
+    resumo = hashlib.sha1(repr(chave).encode("utf-8")).hexdigest()[:16]
+    return f'"{versao}-{resumo}"'
+
+
+def resposta_com_cache(request: Request, chave: tuple, calcular: Callable[[], object]) -> Response:
+    """
+    Resposta JSON de `calcular()` guardada por `chave` (endpoint + filtros) até a
+    versão dos dados mudar. Responde 304 quando o If-None-Match do cliente é o ETag atual.
+    Misses concorrentes da mesma chave compartilham um cálculo.
+    Resultados com "erro" (endpoints que devolvem o erro no corpo) ou "erros" não vazio
+    (bundle com widget que falhou) não são guardados.
+    """
+    if not CACHE_RESPOSTAS_HABILITADO:
+        return Response(content=_serializar(calcular()), media_type="application/json")
+
+    versao = versao_dados()
+    etag = _etag(chave, versao)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if request is not None and request.headers.get("if-none-match") == etag:
+        _cache_respostas.contar("nao_modificado")
+        return Response(status_code=304, headers=headers)
+
+    guardado = _cache_respostas.get(chave, versao)
+    if guardado:
+        return Response(content=guardado[1], media_type="application/json", headers=headers)
+
+    def calcular_corpo() -> bytes:
+        resultado = calcular()
+        corpo = _serializar(resultado)
+        if not (isinstance(resultado, dict) and ("erro" in resultado or resultado.get("erros"))):
+            _cache_respostas.set(chave, versao, etag, corpo)
+        return corpo
+
+    corpo = get_single_flight().executar(("resposta", chave, versao), calcular_corpo)
+    return Response(content=corpo, media_type="application/json", headers=headers)
+
+
+def _serializar(resultado) -> bytes:
+    return json.dumps(jsonable_encoder(resultado), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# projects/modulo2/ceps_referencia.py
+
+"""
+Base de referência de CEPs local (sem rede).
+
+Carrega um arquivo CSV de CEPs (ex: base dos Correios/ViaCEP exportada) na tabela
+modulo2_ceps_referencia (chave primária = CEP, sem rowid, com índice por cidade +
+logradouro normalizados). consultar_viacep() e prefetch_ceps() consultam essa base
+antes do cache e da API; a identificação de postos a usa para descobrir o CEP de
+um enderDest que veio sem CEP.
+
+Uso:
+    python -m projects.modulo2.ceps_referencia <arquivo.csv> [--limpar]
+
+    O separador (; , tab ou |) e as colunas são detectados automaticamente:
+    - cep: "cep", "cod_cep"
+    - logradouro: "logradouro", "endereco", "rua"
+    - complemento, bairro, ddd, ibge
+    - localidade: "localidade", "cidade", "municipio"
+    - uf: "uf", "estado"
+"""
+
+import os
+import re
+import sys
+import csv
+import time
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from projects.modulo2 import db
+from projects.modulo2.normalizacao import normalizar_forte
+
+
+# Mapeamento de nomes de colunas possíveis (case-insensitive)
+COLUMN_MAPPING = {
+    "cep": ["cep", "cod_cep", "codigo_cep", "zip"],
+    "logradouro": ["logradouro", "endereco", "endereço", "rua", "nome_logradouro"],
+    "complemento": ["complemento"],
+    "bairro": ["bairro", "distrito"],
+    "localidade": ["localidade", "cidade", "municipio", "município", "nomecid"],
+    "uf": ["uf", "estado", "sigla_uf"],
+    "ddd": ["ddd"],
+    "ibge": ["ibge", "cod_ibge", "codigo_ibge"],
+}
+
+CAMPOS_CEP = ["logradouro", "complemento", "bairro", "localidade", "uf", "ddd", "ibge"]
+
+TAMANHO_LOTE = 5000
+
+# Intervalo para rechecar se a tabela tem dados (carga feita por outro processo)
+REFERENCIA_CHECAGEM_TTL = float(os.getenv("MODULO2_CEPS_REFERENCIA_TTL", "30"))
+
+
+# ================================
+# CONSULTA
+# ================================
+
+# Conexão de leitura por thread (abrir conexão custa mais que a própria consulta)
+_local = threading.local()
+_disponivel = {"valor": None, "checado_em": 0.0, "db_path": None}
+_disponivel_lock = threading.Lock()
+
+
+def _conn_leitura():
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "db_path", None) != db.DB_PATH:
+        if conn is not None:
+            try:
+                conn.close()
+            except:
+                pass
+        conn = db.get_conn()
+        _local.conn = conn
+        _local.db_path = db.DB_PATH
+    return conn
+
+
+def referencia_disponivel(forcar: bool = False) -> bool:
+    """True se a base de referência tem algum CEP (resultado guardado por alguns segundos)"""
+    with _disponivel_lock:
+        agora = time.monotonic()
+        if (not forcar and _disponivel["valor"] is not None and _disponivel["db_path"] == db.DB_PATH
+                and agora - _disponivel["checado_em"] < REFERENCIA_CHECAGEM_TTL):
+            return _disponivel["valor"]
+        try:
+            cur = _conn_leitura().execute("SELECT 1 FROM modulo2_ceps_referencia LIMIT 1")
+            valor = cur.fetchone() is not None
+        except Exception:
+            valor = False
+        _disponivel.update(valor=valor, checado_em=agora, db_path=db.DB_PATH)
+        return valor
+
+
+def _linha_para_dados(row) -> Dict:
+    dados = {"cep": row["cep"]}
+    for campo in CAMPOS_CEP:
+        dados[campo] = row[campo]
+    return dados
+
+
+def consultar_cep_referencia(cep: str) -> Optional[Dict]:
+    """Dados do CEP (8 dígitos) na base local, ou None se não estiver nela"""
+    if not referencia_disponivel():
+        return None
+    try:
+        cur = _conn_leitura().execute(f"""
+            SELECT cep, {', '.join(CAMPOS_CEP)} FROM modulo2_ceps_referencia WHERE cep = ?
+        """, (cep,))
+        row = cur.fetchone()
+        return _linha_para_dados(row) if row else None
+    except Exception as e:
+        print(f"[CEPS] ERRO ao consultar base de referência: {e}")
+        return None
+
+
+def consultar_ceps_referencia_lote(ceps: List[str]) -> Dict[str, Dict]:
+    """{cep: dados} dos CEPs (8 dígitos) encontrados na base local (consulta em blocos)"""
+    encontrados = {}
+    if not ceps or not referencia_disponivel():
+        return encontrados
+    try:
+        conn = _conn_leitura()
+        for i in range(0, len(ceps), 500):
+            bloco = ceps[i:i + 500]
+            cur = conn.execute(f"""
+                SELECT cep, {', '.join(CAMPOS_CEP)} FROM modulo2_ceps_referencia
+                WHERE cep IN ({','.join('?' * len(bloco))})
+            """, bloco)
+            for row in cur.fetchall():
+                encontrados[row["cep"]] = _linha_para_dados(row)
+    except Exception as e:
+        print(f"[CEPS] ERRO ao consultar base de referência: {e}")
+    return encontrados
+
+
+def cep_por_endereco(logradouro: str, cidade: str, uf: str = None) -> Optional[str]:
+    """
+    CEP de um logradouro na cidade (comparação normalizada). Só retorna quando o
+    logradouro tem um único CEP: ruas longas têm um CEP por faixa de numeração.
+    """
+    logradouro_norm = normalizar_forte(logradouro)
+    cidade_norm = normalizar_forte(cidade)
+    if not logradouro_norm or not cidade_norm or not referencia_disponivel():
+        return None
+    try:
+        sql = """
+            SELECT DISTINCT cep FROM modulo2_ceps_referencia
+            WHERE localidade_norm = ? AND logradouro_norm = ?
+        """
+        params = [cidade_norm, logradouro_norm]
+        if uf:
+            sql += " AND uf = ?"
+            params.append(uf.strip().upper())
+        ceps = [row[0] for row in _conn_leitura().execute(sql + " LIMIT 2", params).fetchall()]
+        return ceps[0] if len(ceps) == 1 else None
+    except Exception as e:
+        print(f"[CEPS] ERRO ao consultar base de referência: {e}")
+        return None
+
+
+# ================================
+# CARGA DO ARQUIVO
+# ================================
+
+def _mapear_colunas(cabecalho: List[str]) -> Dict[str, Optional[str]]:
+    """Mapeia cada campo para a coluna do arquivo (case-insensitive)"""
+    colunas = {c.strip().lower(): c for c in cabecalho if c}
+    mapeamento = {}
+    for campo, nomes in COLUMN_MAPPING.items():
+        mapeamento[campo] = next((colunas[n] for n in nomes if n in colunas), None)
+    return mapeamento
+
+
+def _detectar_encoding(caminho: Path) -> str:
+    """UTF-8 se o arquivo todo decodifica como UTF-8; senão Latin-1 (comum em bases exportadas)"""
+    try:
+        with open(caminho, "r", encoding="utf-8-sig") as f:
+            while f.read(1024 * 1024):
+                pass
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+
+def _abrir_csv(caminho: Path):
+    """Abre o CSV detectando encoding e separador"""
+    f = open(caminho, "r", encoding=_detectar_encoding(caminho), newline="")
+    amostra = f.read(64 * 1024)
+    f.seek(0)
+    try:
+        dialeto = csv.Sniffer().sniff(amostra, delimiters=";,\t|")
+    except csv.Error:
+        dialeto = csv.excel
+    return f, csv.DictReader(f, dialect=dialeto)
+
+
+def carregar_ceps_referencia(caminho: str, limpar_antes: bool = False, tamanho_lote: int = TAMANHO_LOTE) -> Dict:
+    """
+    Carrega (ou atualiza) a base de referência a partir de um CSV.
+
+    Args:
+        caminho: arquivo CSV com ao menos a coluna de CEP
+        limpar_antes: apaga a base atual antes de carregar
+        tamanho_lote: linhas por executemany
+
+    Returns:
+        Dict com totais da carga
+    """
+    inicio = time.time()
+    caminho = Path(caminho)
+    if not caminho.exists():
+        return {"success": False, "error": f"Arquivo não encontrado: {caminho}"}
+
+    f, leitor = _abrir_csv(caminho)
+    mapeamento = _mapear_colunas(leitor.fieldnames or [])
+    if not mapeamento["cep"]:
+        f.close()
+        return {"success": False, "error": f"Coluna de CEP não encontrada. Colunas: {leitor.fieldnames}"}
+
+    print(f"[CEPS] Mapeamento de colunas: { {k: v for k, v in mapeamento.items() if v} }")
+
+    total = 0
+    carregados = 0
+    invalidos = 0
+    conn = None
+    try:
+        conn = db.get_conn()
+        cur = conn.cursor()
+        if limpar_antes:
+            cur.execute("DELETE FROM modulo2_ceps_referencia")
+
+        lote = []
+
+        def gravar():
+            cur.executemany("""
+                INSERT INTO modulo2_ceps_referencia (
+                    cep, logradouro, complemento, bairro, localidade, uf, ddd, ibge,
+                    logradouro_norm, localidade_norm
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cep) DO UPDATE SET
+                    logradouro = excluded.logradouro,
+                    complemento = excluded.complemento,
+                    bairro = excluded.bairro,
+                    localidade = excluded.localidade,
+                    uf = excluded.uf,
+                    ddd = excluded.ddd,
+                    ibge = excluded.ibge,
+                    logradouro_norm = excluded.logradouro_norm,
+                    localidade_norm = excluded.localidade_norm
+            """, lote)
+            lote.clear()
+
+        for linha in leitor:
+            total += 1
+            cep = re.sub(r"\D", "", linha.get(mapeamento["cep"]) or "")
+            if not cep or len(cep) > 8:
+                invalidos += 1
+                continue
+            cep = cep.zfill(8)
+
+            valores = {
+                campo: ((linha.get(coluna) or "").strip() or None) if coluna else None
+                for campo, coluna in mapeamento.items() if campo != "cep"
+            }
+            if valores["uf"]:
+                valores["uf"] = valores["uf"].upper()
+            lote.append((
+                cep, *(valores[campo] for campo in CAMPOS_CEP),
+                normalizar_forte(valores["logradouro"]), normalizar_forte(valores["localidade"])
+            ))
+            carregados += 1
+
+            if len(lote) >= tamanho_lote:
+                gravar()
+
+        if lote:
+            gravar()
+
+        # "Não identificado" memorizado pode mudar agora que há CEP para mais endereços
+        cur.execute("DELETE FROM modulo2_memo_identificacao WHERE posto_id IS NULL AND manual = 0")
+
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"[CEPS] ERRO ao carregar base de referência: {e}")
+        if conn:
+            conn.rollback()
+        return {"success": False, "error": str(e)}
+    finally:
+        f.close()
+        if conn:
+            conn.close()
+
+    referencia_disponivel(forcar=True)
+
+    resultado = {
+        "success": True,
+        "arquivo": str(caminho),
+        "linhas": total,
+        "carregados": carregados,
+        "invalidos": invalidos,
+        "tempo_segundos": round(time.time() - inicio, 2)
+    }
+    print(f"[CEPS] Base de referência: {carregados} CEPs carregados, {invalidos} inválidos "
+          f"({resultado['tempo_segundos']}s)")
+    return resultado
+
+
+def main():
+    """Função principal para execução via linha de comando"""
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    db.init_db()
+    resultado = carregar_ceps_referencia(sys.argv[1], limpar_antes="--limpar" in sys.argv)
+
+    if not resultado["success"]:
+        print(f"ERRO: {resultado['error']}")
+        sys.exit(1)
+
+    print()
+    print("=" * 70)
+    print("BASE DE REFERÊNCIA DE CEPs")
+    print("=" * 70)
+    print(f"  Arquivo: {resultado['arquivo']}")
+    print(f"  Linhas lidas: {resultado['linhas']}")
+    print(f"  CEPs carregados: {resultado['carregados']}")
+    print(f"  Linhas inválidas: {resultado['invalidos']}")
+    print(f"  Tempo: {resultado['tempo_segundos']}s")
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# projects/modulo2/dashboard_bundle.py
+"""
+Bundle do dashboard: todos os widgets em uma requisição.
+
+O modulo2_dashboard.html carregava total de NFes, clientes, pendências, gráficos de
+clientes/produtos, gastos por posto, estatísticas e log de importações em chamadas
+separadas, cada uma com sua conexão e cada uma varrendo o XML das NFes atrás de
+"<origem>JSON</origem>". Aqui tudo roda em uma conexão e em uma transação de leitura
+(mesmo snapshot para todos os widgets): as NFes do JSON são selecionadas uma vez para
+uma tabela temporária e as consultas do dashboard (db.consultar_*) leem dela.
+
+Cada widget devolve o mesmo formato do endpoint individual com os mesmos filtros;
+erro em um widget não derruba os outros (vai o valor padrão + "erros" no bundle).
+O status do scheduler continua em /scheduler/status: é estado em memória/lease,
+consultado periodicamente pela página e fora da versão dos dados.
+"""
+
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from .db import (
+    get_conn,
+    consultar_total_nfes,
+    consultar_produtos_agregados,
+    consultar_gastos_por_cliente_agregado,
+    consultar_pendencias,
+    consultar_importacoes_log
+)
+
+
+# Tabela temporária (por conexão) com as NFes do JSON - mesmas colunas de db.NFES_JSON
+TABELA_NFES = "temp.bundle_nfes"
+
+
+def _criar_tabela_nfes(cur):
+    """Seleciona as NFes do JSON uma única vez (a varredura do XML é o custo dominante)"""
+    cur.execute("""
+        CREATE TEMP TABLE bundle_nfes AS
+        SELECT id, chave_acesso, status, valor_total, posto_id, data_emissao, nome_emitente
+        FROM modulo2_nfe
+        WHERE xml LIKE '%<origem>JSON</origem>%'
+    """)
+    cur.execute("CREATE INDEX temp.idx_bundle_nfes_id ON bundle_nfes(id)")
+    cur.execute("CREATE INDEX temp.idx_bundle_nfes_posto ON bundle_nfes(posto_id)")
+    cur.execute("CREATE INDEX temp.idx_bundle_nfes_chave ON bundle_nfes(chave_acesso)")
+
+
+# ================================
+# WIDGETS
+# ================================
+
+def _totais_gerais(cur, data_ini: Optional[date], data_fim: Optional[date],
+                   cliente: Optional[str], posto: Optional[str]) -> dict:
+    """Orçado x realizado (formato de /totais-gerais); cliente/posto pelos nomes, como nos filtros da página"""
+    condicoes = ["1=1"]
+    params = []
+    if data_ini:
+        condicoes.append("date(n.data_emissao) >= ?")
+        params.append(str(data_ini))
+    if data_fim:
+        condicoes.append("date(n.data_emissao) <= ?")
+        params.append(str(data_fim))
+    if cliente:
+        condicoes.append("pt.nomecli = ?")
+        params.append(cliente)
+    if posto:
+        condicoes.append("pt.nomepos = ?")
+        params.append(posto)
+
+    cur.execute(f"""
+        SELECT COALESCE(SUM(n.valor_total), 0)
+        FROM {TABELA_NFES} n
+        LEFT JOIN modulo2_postos_trabalho pt ON pt.id = n.posto_id
+        WHERE {" AND ".join(condicoes)}
+    """, params)
+    total_realizado = float(cur.fetchone()[0] or 0)
+
+    # Orçado = 2x realizado (mesma regra de /totais-gerais)
+    total_orcado = total_realizado * 2.0
+    return {
+        "total_orcado": total_orcado,
+        "total_realizado": total_realizado,
+        "status": total_orcado - total_realizado,
+        "percentual": (total_realizado / total_orcado * 100) if total_orcado > 0 else 0
+    }
+
+
+def _clientes(cur) -> list:
+    cur.execute("""
+        SELECT DISTINCT nomecli
+        FROM modulo2_postos_trabalho
+        WHERE nomecli IS NOT NULL AND nomecli != ''
+        ORDER BY nomecli
+    """)
+    return [r[0] for r in cur.fetchall() if r[0]]
+
+
+def _postos_do_cliente(cur, cliente: str) -> list:
+    cur.execute("""
+        SELECT id, codigo, nomecli, nomepos
+        FROM modulo2_postos_trabalho
+        WHERE nomecli = ?
+        ORDER BY nomepos
+    """, (cliente,))
+    return [
+        {"id": r["id"], "codigo": r["codigo"] or "", "nomecli": r["nomecli"] or "", "nomepos": r["nomepos"] or ""}
+        for r in cur.fetchall()
+    ]
+
+
+def _contadores(cur) -> dict:
+    """Contagens compartilhadas por estatísticas, estado da importação e resumo de status"""
+    cur.execute("""
+        SELECT COUNT(*) AS total,
+               COALESCE(SUM(CASE WHEN status = 'identificado' THEN 1 ELSE 0 END), 0) AS identificadas,
+               MAX(data_importacao) AS ultima_importacao
+        FROM modulo2_nfe
+    """)
+    nfes = cur.fetchone()
+
+    xmls_ultima_importacao = 0
+    if nfes["ultima_importacao"]:
+        cur.execute("SELECT COUNT(*) FROM modulo2_nfe WHERE date(data_importacao) = date(?)",
+                    (nfes["ultima_importacao"],))
+        xmls_ultima_importacao = cur.fetchone()[0] or 0
+
+    cur.execute("""
+        SELECT COUNT(*) AS total,
+               COALESCE(SUM(CASE WHEN status = 'pendente' THEN 1 ELSE 0 END), 0) AS abertas
+        FROM modulo2_pendencias
+    """)
+    pendencias = cur.fetchone()
+
+    cur.execute("SELECT SUM(ultimo_nsu) FROM modulo2_nsu_checkpoint")
+    soma_nsus = cur.fetchone()[0] or 0
+
+    return {
+        "total_nfes": nfes["total"] or 0,
+        "identificadas": nfes["identificadas"],
+        "ultima_importacao": nfes["ultima_importacao"],
+        "xmls_ultima_importacao": xmls_ultima_importacao,
+        "pendencias_total": pendencias["total"] or 0,
+        "pendencias_abertas": pendencias["abertas"],
+        "soma_nsus": soma_nsus
+    }
+
+
+def _estatisticas(c: dict) -> dict:
+    """Formato de /estatisticas/resumo"""
+    total = c["total_nfes"]
+    return {
+        "total": total,
+        "identificadas": c["identificadas"],
+        "pendentes": c["pendencias_total"],
+        "percentual_identificacao": round((c["identificadas"] / total * 100) if total > 0 else 0, 1)
+    }
+
+
+def _estado_importacao(c: dict) -> dict:
+    """Formato de /importacao/estado"""
+    return {
+        "mostrar_botao_inicial": c["total_nfes"] == 0,
+        "total_nfes": c["total_nfes"],
+        "soma_nsus": c["soma_nsus"]
+    }
+
+
+def _status_resumo(c: dict, hoje: date) -> dict:
+    """Formato de /status/resumo; a próxima importação sai de `hoje`, não do relógio"""
+    ultima = c["ultima_importacao"]
+    ultima_formatada = ""
+    if ultima:
+        try:
+            ultima_formatada = datetime.fromisoformat(ultima.replace("Z", "")).strftime("%d/%m/%Y %H:%M")
+        except ValueError:
+            ultima_formatada = ultima[:16]
+
+    # Próxima importação: sempre 00:01 do dia seguinte
+    amanha = hoje + timedelta(days=1)
+    proxima = datetime(amanha.year, amanha.month, amanha.day, 0, 1)
+    return {
+        "total_nfes": c["total_nfes"],
+        "ultima_importacao": ultima_formatada,
+        "xmls_ultima_importacao": c["xmls_ultima_importacao"],
+        "proxima_importacao": proxima.strftime("%d/%m/%Y - %H:%M"),
+        "pendencias": c["pendencias_abertas"],
+        "identificadas": c["identificadas"],
+        "banco_vazio": c["total_nfes"] == 0
+    }
+
+
+# ================================
+# BUNDLE
+# ================================
+
+def montar_bundle_dashboard(
+    data_ini: date = None,
+    data_fim: date = None,
+    cliente: str = None,
+    posto: str = None,
+    limite_produtos: int = 20,
+    limite_pendencias: int = 500,
+    limite_log: int = 20,
+    hoje: date = None
+) -> Dict:
+    """
+    Dados de todos os widgets do dashboard em uma transação.
+
+    Args:
+        data_ini, data_fim: período de emissão (pendências, gastos por posto e totais gerais,
+            os widgets cujos endpoints aceitam datas)
+        cliente: nomecli selecionado no filtro
+        posto: nomepos selecionado no filtro (só vale junto com cliente, como na página)
+        limite_produtos: produtos no gráfico de produtos
+        limite_pendencias: linhas da tabela de pendências
+        limite_log: entradas do log de importações
+        hoje: dia de referência da próxima importação no resumo de status (padrão: hoje).
+            Quem guarda o bundle em cache passa o mesmo dia que pôs na chave, para o
+            corpo guardado não depender do relógio de quando foi calculado.
+
+    Returns:
+        Dict com uma chave por widget, "erros" (widgets que falharam) e "tempo_ms"
+    """
+    from .service import calcular_gastos_por_cliente
+
+    inicio = time.perf_counter()
+    posto_filtro = posto if cliente else None
+    bundle: Dict = {
+        "filtros": {
+            "data_ini": str(data_ini) if data_ini else None,
+            "data_fim": str(data_fim) if data_fim else None,
+            "cliente": cliente,
+            "posto": posto_filtro
+        },
+        "erros": {}
+    }
+
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        # Transação de leitura: todos os widgets veem o mesmo snapshot (WAL não bloqueia escritores)
+        cur.execute("BEGIN")
+        _criar_tabela_nfes(cur)
+
+        def secao(nome: str, padrao, calcular: Callable[[], object]):
+            try:
+                bundle[nome] = calcular()
+            except Exception as e:
+                print(f"[DASHBOARD] ERRO no widget {nome}: {e}")
+                bundle[nome] = padrao
+                bundle["erros"][nome] = str(e)
+
+        secao("total_nfes", {}, lambda: consultar_total_nfes(cur, cliente, posto_filtro, nfes=TABELA_NFES))
+        secao("totais_gerais", {}, lambda: _totais_gerais(cur, data_ini, data_fim, cliente, posto_filtro))
+        secao("grafico_clientes", [], lambda: consultar_gastos_por_cliente_agregado(cur, cliente, nfes=TABELA_NFES))
+        secao("grafico_produtos", [], lambda: consultar_produtos_agregados(
+            cur, cliente, posto_filtro, limite_produtos, nfes=TABELA_NFES
+        ))
+        secao("gastos_por_posto", [], lambda: calcular_gastos_por_cliente(cur, data_ini, data_fim, cliente))
+        secao("pendencias", [], lambda: consultar_pendencias(
+            conn, limite_pendencias, data_ini, data_fim, nfes=TABELA_NFES
+        ))
+        secao("clientes", [], lambda: _clientes(cur))
+        secao("postos", [], lambda: _postos_do_cliente(cur, cliente) if cliente else [])
+        secao("importacoes_log", [], lambda: consultar_importacoes_log(cur, limite_log))
+
+        # Contagens calculadas uma vez para os três widgets de status
+        secao("contadores", {}, lambda: _contadores(cur))
+        contadores = bundle.pop("contadores")
+        if contadores:
+            bundle["estatisticas"] = _estatisticas(contadores)
+            bundle["estado_importacao"] = _estado_importacao(contadores)
+            bundle["status_resumo"] = _status_resumo(contadores, hoje or date.today())
+
+        cur.close()
+    finally:
+        if conn:
+            try:
+                # Só leitura: rollback encerra a transação e descarta a tabela temporária
+                conn.rollback()
+                conn.close()
+            except:
+                pass
+
+    bundle["tempo_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+    return bundle
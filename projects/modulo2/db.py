@@ -8,6 +8,8 @@ from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 from datetime import date, datetime
 
+from .normalizacao import normalizar_forte, limpar_posto
+
 # ================================
 # CONFIGURAÇÃO DO BANCO (SQLite)
 # ================================
@@ -214,6 +216,159 @@ def init_db():
                 else:
                     print("[DB] Tabela modulo2_importacoes_log já existe")
                 
+                # Lease do agendador: garante um único líder entre vários workers
+                _criar_tabela_migracao(cur_migration, "modulo2_scheduler_lease", SQL_TABELA_SCHEDULER_LEASE)
+
+                # Progresso da importação visível para todos os workers (SSE)
+                _criar_tabela_migracao(cur_migration, "modulo2_progresso_importacao", SQL_TABELA_PROGRESSO_IMPORTACAO)
+                
+                # Versões dos dados: invalidação de caches em memória (ex: índice de postos)
+                _criar_tabela_migracao(cur_migration, "modulo2_versoes", """
+                    CREATE TABLE modulo2_versoes (
+                        chave TEXT PRIMARY KEY,
+                        versao INTEGER NOT NULL DEFAULT 0,
+                        atualizado_em TEXT DEFAULT (datetime('now'))
+                    )
+                """)
+                
+                # Memória de identificações (infCpl + destino -> posto)
+                _criar_tabela_migracao(cur_migration, "modulo2_memo_identificacao", """
+                    CREATE TABLE modulo2_memo_identificacao (
+                        chave TEXT PRIMARY KEY,
+                        posto_id INTEGER,
+                        regra TEXT,
+                        versao_postos INTEGER NOT NULL DEFAULT 0,
+                        manual INTEGER NOT NULL DEFAULT 0,
+                        atualizado_em TEXT DEFAULT (datetime('now'))
+                    )
+                """)
+                
+                # Postos sugeridos para cada pendência (calculados na criação da pendência)
+                _criar_tabela_migracao(cur_migration, "modulo2_pendencias_sugestoes", """
+                    CREATE TABLE modulo2_pendencias_sugestoes (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        pendencia_id INTEGER NOT NULL,
+                        posto_id INTEGER NOT NULL,
+                        ordem INTEGER NOT NULL,
+                        score REAL,
+                        motivo TEXT,
+                        FOREIGN KEY (pendencia_id) REFERENCES modulo2_pendencias(id),
+                        FOREIGN KEY (posto_id) REFERENCES modulo2_postos_trabalho(id)
+                    )
+                """, [
+                    "CREATE INDEX IF NOT EXISTS idx_mod2_pend_sugestoes_pendencia ON modulo2_pendencias_sugestoes(pendencia_id, ordem)"
+                ])
+                
+                # Cache de CEPs consultados no ViaCEP (schema_enriquecimento.sql)
+                _criar_tabela_migracao(cur_migration, "modulo2_cache_ceps", """
+                    CREATE TABLE modulo2_cache_ceps (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        cep TEXT UNIQUE NOT NULL,
+                        logradouro TEXT,
+                        complemento TEXT,
+                        bairro TEXT,
+                        localidade TEXT,
+                        uf TEXT,
+                        ddd TEXT,
+                        ibge TEXT,
+                        valido INTEGER DEFAULT 1,
+                        consultado_em TEXT DEFAULT (datetime('now')),
+                        fonte TEXT DEFAULT 'viacep'
+                    )
+                """)
+                
+                # Postos sugeridos e log do enriquecimento de CEPs (schema_enriquecimento.sql)
+                _criar_tabela_migracao(cur_migration, "modulo2_postos_sugeridos", """
+                    CREATE TABLE modulo2_postos_sugeridos (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        nome_sugerido TEXT,
+                        logradouro TEXT,
+                        numero TEXT,
+                        complemento TEXT,
+                        bairro TEXT,
+                        cidade TEXT,
+                        uf TEXT,
+                        cep TEXT,
+                        fonte_xml TEXT,
+                        nfe_id INTEGER,
+                        status TEXT DEFAULT 'pendente',
+                        criado_em TEXT DEFAULT (datetime('now')),
+                        FOREIGN KEY (nfe_id) REFERENCES modulo2_nfe(id)
+                    )
+                """, [
+                    "CREATE INDEX IF NOT EXISTS idx_postos_sugeridos_status ON modulo2_postos_sugeridos(status)",
+                    "CREATE INDEX IF NOT EXISTS idx_postos_sugeridos_cep ON modulo2_postos_sugeridos(cep)"
+                ])
+                _criar_tabela_migracao(cur_migration, "modulo2_log_enriquecimento", """
+                    CREATE TABLE modulo2_log_enriquecimento (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        posto_id INTEGER,
+                        campo_atualizado TEXT,
+                        valor_antigo TEXT,
+                        valor_novo TEXT,
+                        fonte TEXT,
+                        nfe_id INTEGER,
+                        atualizado_em TEXT DEFAULT (datetime('now')),
+                        FOREIGN KEY (posto_id) REFERENCES modulo2_postos_trabalho(id),
+                        FOREIGN KEY (nfe_id) REFERENCES modulo2_nfe(id)
+                    )
+                """, [
+                    "CREATE INDEX IF NOT EXISTS idx_log_enriquecimento_posto ON modulo2_log_enriquecimento(posto_id)",
+                    "CREATE INDEX IF NOT EXISTS idx_log_enriquecimento_data ON modulo2_log_enriquecimento(atualizado_em)"
+                ])
+                
+                # Base de referência de CEPs local (ceps_referencia.py), consultada antes do ViaCEP
+                _criar_tabela_migracao(cur_migration, "modulo2_ceps_referencia", """
+                    CREATE TABLE modulo2_ceps_referencia (
+                        cep TEXT PRIMARY KEY,
+                        logradouro TEXT,
+                        complemento TEXT,
+                        bairro TEXT,
+                        localidade TEXT,
+                        uf TEXT,
+                        ddd TEXT,
+                        ibge TEXT,
+                        logradouro_norm TEXT,
+                        localidade_norm TEXT
+                    ) WITHOUT ROWID
+                """, [
+                    "CREATE INDEX IF NOT EXISTS idx_mod2_ceps_ref_endereco ON modulo2_ceps_referencia(localidade_norm, logradouro_norm)"
+                ])
+                
+                # Colunas normalizadas dos postos (buscas por CEP/nome via índice, sem carregar todos)
+                _adicionar_colunas_migracao(cur_migration, "modulo2_postos_trabalho", COLUNAS_BUSCA_POSTO)
+                for indice_sql in INDICES_BUSCA_POSTO:
+                    cur_migration.execute(indice_sql)
+                _preencher_colunas_busca_postos(cur_migration)
+                
+                # Dimensão de produtos: itens referenciam o produto por id
+                _criar_tabela_migracao(cur_migration, "modulo2_produtos", SQL_TABELA_PRODUTOS, INDICES_PRODUTOS)
+                cur_migration.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'modulo2_nfe_itens'")
+                if cur_migration.fetchone():
+                    _adicionar_colunas_migracao(cur_migration, "modulo2_nfe_itens", COLUNAS_PRODUTO_ITEM)
+                    for indice_sql in INDICES_PRODUTO_ITEM:
+                        cur_migration.execute(indice_sql)
+                    preencher_dimensao_produtos(cur_migration)
+                
+                # Gastos por dia e posto (série temporal do dashboard), mantidos por gatilhos
+                _criar_tabela_migracao(cur_migration, "modulo2_gastos_diarios", SQL_TABELA_GASTOS_DIARIOS,
+                                       INDICES_GASTOS_DIARIOS)
+                if _criar_gatilhos_gastos_diarios(cur_migration):
+                    # Gatilhos novos: NFes gravadas antes deles ainda não estão nos baldes
+                    reconstruir_gastos_diarios(cur_migration)
+                
+                # Fornecedores (emitentes) com contadores totais e por mês, mantidos por gatilhos
+                _criar_tabela_migracao(cur_migration, "modulo2_fornecedores", SQL_TABELA_FORNECEDORES,
+                                       INDICES_FORNECEDORES)
+                _criar_tabela_migracao(cur_migration, "modulo2_fornecedores_mensal", SQL_TABELA_FORNECEDORES_MENSAL,
+                                       INDICES_FORNECEDORES_MENSAL)
+                if _criar_gatilhos_fornecedores(cur_migration):
+                    reconstruir_fornecedores(cur_migration)
+                
+                # Versão "dados" (cache de respostas do dashboard) mantida por gatilhos
+                _criar_gatilhos_versao(cur_migration, "dados", TABELAS_VERSAO_DADOS)
+                conn_migration.commit()
+                
                 cur_migration.close()
                 conn_migration.close()
             except Exception as e:
@@ -245,6 +400,36 @@ def init_db():
                 pass
 
 
+def _adicionar_colunas_migracao(cur, tabela: str, colunas: List[Tuple[str, str]]) -> List[str]:
+    """Adiciona (ALTER TABLE) as colunas que ainda não existem. Retorna os nomes adicionados."""
+    cur.execute(f"PRAGMA table_info({tabela})")
+    existentes = {row[1] for row in cur.fetchall()}
+    
+    adicionadas = []
+    for nome, tipo in colunas:
+        if nome not in existentes:
+            cur.execute(f"ALTER TABLE {tabela} ADD COLUMN {nome} {tipo}")
+            adicionadas.append(nome)
+    if adicionadas:
+        print(f"[DB] Colunas adicionadas em {tabela}: {', '.join(adicionadas)}")
+    return adicionadas
+
+
+def _criar_tabela_migracao(cur, nome: str, create_sql: str, indices: List[str] = None) -> bool:
+    """Cria uma tabela nova (migração) se ainda não existir. Retorna True se criou."""
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name = ?", (nome,))
+    if cur.fetchone():
+        print(f"[DB] Tabela {nome} já existe")
+        return False
+    
+    print(f"[DB] Criando tabela {nome}...")
+    cur.execute(create_sql)
+    for indice_sql in indices or []:
+        cur.execute(indice_sql)
+    print(f"[DB] Tabela {nome} criada com sucesso")
+    return True
+
+
 def _create_tables_fallback():
     """Cria tabelas básicas se o schema SQL não estiver disponível"""
     conn = None
@@ -830,6 +1015,7 @@ def salvar_xmls_e_nsu(
         # Salvar cada XML
         salvos = 0
         rejeitados_mock = 0
+        cache_produtos = {}  # chave do produto -> produto_id (itens repetidos no lote)
         
         for nsu_str, xml_str in xmls:
             try:
@@ -925,21 +1111,25 @@ def salvar_xmls_e_nsu(
                     try:
                         itens = extrair_itens_xml(root)
                         for item in itens:
+                            produto_id = resolver_produto_id(
+                                cur, item["descricao_produto"], item["ncm"], item["codigo_produto"],
+                                item["unidade"], cache_produtos
+                            )
                             cur.execute("""
                                 INSERT INTO modulo2_nfe_itens (
                                     nfe_id, numero_item, codigo_produto, descricao_produto,
                                     ncm, cfop, unidade, quantidade, valor_unitario, valor_total,
                                     icms_base, icms_valor, icms_aliquota,
-                                    ipi_valor, pis_valor, cofins_valor
+                                    ipi_valor, pis_valor, cofins_valor, produto_id
                                 )
-                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                             """, (
                                 nfe_id, item["numero_item"], item["codigo_produto"],
                                 item["descricao_produto"], item["ncm"], item["cfop"],
                                 item["unidade"], item["quantidade"], item["valor_unitario"],
                                 item["valor_total"], item["icms_base"], item["icms_valor"],
                                 item["icms_aliquota"], item["ipi_valor"], item["pis_valor"],
-                                item["cofins_valor"]
+                                item["cofins_valor"], produto_id
                             ))
                     except Exception as e:
                         # Se falhar ao salvar itens, não impede o salvamento da NFe
@@ -1067,11 +1257,14 @@ def salvar_posto(posto_data: dict) -> Optional[int]:
         conn = get_conn()
         cur = conn.cursor()
         
+        busca = colunas_busca_posto(posto_data)
         cur.execute("""
             INSERT INTO modulo2_postos_trabalho (
-                codigo, nomecli, nomepos, end, bairro, cep, nomecid, estado
+                codigo, nomecli, nomepos, end, bairro, cep, nomecid, estado,
+                cep_digitos, cep_num, cep5, nomepos_chave, nomepos_norm, nomecli_norm,
+                end_norm, bairro_norm, nomecid_norm
             )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(codigo) DO UPDATE SET
                 nomecli = excluded.nomecli,
                 nomepos = excluded.nomepos,
@@ -1080,6 +1273,15 @@ def salvar_posto(posto_data: dict) -> Optional[int]:
                 cep = excluded.cep,
                 nomecid = excluded.nomecid,
                 estado = excluded.estado,
+                cep_digitos = excluded.cep_digitos,
+                cep_num = excluded.cep_num,
+                cep5 = excluded.cep5,
+                nomepos_chave = excluded.nomepos_chave,
+                nomepos_norm = excluded.nomepos_norm,
+                nomecli_norm = excluded.nomecli_norm,
+                end_norm = excluded.end_norm,
+                bairro_norm = excluded.bairro_norm,
+                nomecid_norm = excluded.nomecid_norm,
                 updated_at = datetime('now')
         """, (
             posto_data.get("codigo"),
@@ -1089,7 +1291,8 @@ def salvar_posto(posto_data: dict) -> Optional[int]:
             posto_data.get("bairro"),
             posto_data.get("cep"),
             posto_data.get("nomecid"),
-            posto_data.get("estado")
+            posto_data.get("estado"),
+            *(busca[nome] for nome, _ in COLUNAS_BUSCA_POSTO)
         ))
         
         # Buscar ID
@@ -1098,6 +1301,7 @@ def salvar_posto(posto_data: dict) -> Optional[int]:
                        (posto_data.get("codigo"),))
         else:
             posto_id = cur.lastrowid
+            incrementar_versao(cur, "postos")
             conn.commit()
             cur.close()
             return posto_id
@@ -1105,6 +1309,7 @@ def salvar_posto(posto_data: dict) -> Optional[int]:
         row = cur.fetchone()
         posto_id = row[0] if row else None
         
+        incrementar_versao(cur, "postos")
         conn.commit()
         cur.close()
         
@@ -1120,6 +1325,115 @@ def salvar_posto(posto_data: dict) -> Optional[int]:
             conn.close()
 
 
+# ================================
+# COLUNAS NORMALIZADAS DOS POSTOS
+# ================================
+# Mesmas chaves do PostoMatcher, gravadas na tabela e indexadas. buscar_posto_similar
+# (enriquecimento) busca os candidatos pelo CEP em SQL, sem carregar todos os postos;
+# a cascata de identificação usa o índice em memória (matcher.py), montado uma vez por
+# versão dos postos, e não consulta o banco por NF-e.
+
+COLUNAS_BUSCA_POSTO = [
+    ("cep_digitos", "TEXT"),     # só os dígitos do CEP cadastrado (sem completar zeros)
+    ("cep_num", "INTEGER"),      # CEP com 8 dígitos como número (busca por faixa ±N)
+    ("cep5", "TEXT"),            # prefixo de 5 dígitos do CEP com 8 dígitos
+    ("nomepos_chave", "TEXT"),   # normalizar_forte(limpar_posto(nomepos)): regra LOCAL DE ENTREGA
+    ("nomepos_norm", "TEXT"),    # normalizar_forte(nomepos)
+    ("nomecli_norm", "TEXT"),
+    ("end_norm", "TEXT"),
+    ("bairro_norm", "TEXT"),
+    ("nomecid_norm", "TEXT"),
+]
+
+INDICES_BUSCA_POSTO = [
+    "CREATE INDEX IF NOT EXISTS idx_mod2_postos_cep_digitos ON modulo2_postos_trabalho(cep_digitos)",
+    "CREATE INDEX IF NOT EXISTS idx_mod2_postos_cep_num ON modulo2_postos_trabalho(cep_num)",
+    "CREATE INDEX IF NOT EXISTS idx_mod2_postos_cep5 ON modulo2_postos_trabalho(cep5)",
+    "CREATE INDEX IF NOT EXISTS idx_mod2_postos_nomepos_chave ON modulo2_postos_trabalho(nomepos_chave)",
+]
+
+_CAMPOS_POSTO_SQL = "id, codigo, nomecli, nomepos, end, bairro, cep, nomecid, estado, " + \
+    ", ".join(nome for nome, _ in COLUNAS_BUSCA_POSTO)
+
+
+def colunas_busca_cep(cep) -> Dict[str, object]:
+    """Colunas derivadas do CEP (mesmo critério do idx_cep do PostoMatcher)"""
+    if not cep:
+        return {"cep_digitos": None, "cep_num": None, "cep5": None}
+    
+    chave = str(cep).zfill(8)
+    digitos = "".join(c for c in str(cep) if c.isdigit())
+    if chave == "00000000":
+        return {"cep_digitos": digitos, "cep_num": None, "cep5": None}
+    
+    cep_num = int(chave) if len(chave) == 8 and chave.isdigit() else None
+    return {
+        "cep_digitos": digitos,
+        "cep_num": cep_num,
+        "cep5": chave[:5] if cep_num is not None else None
+    }
+
+
+def colunas_busca_posto(posto: dict) -> Dict[str, object]:
+    """Valores das COLUNAS_BUSCA_POSTO para um posto (dict com nomepos, nomecli, end, ...)"""
+    colunas = colunas_busca_cep(posto.get("cep"))
+    colunas.update({
+        "nomepos_chave": normalizar_forte(limpar_posto(posto.get("nomepos") or "")),
+        "nomepos_norm": normalizar_forte(posto.get("nomepos") or ""),
+        "nomecli_norm": normalizar_forte(posto.get("nomecli") or ""),
+        "end_norm": normalizar_forte(posto.get("end") or ""),
+        "bairro_norm": normalizar_forte(posto.get("bairro") or ""),
+        "nomecid_norm": normalizar_forte(posto.get("nomecid") or ""),
+    })
+    return colunas
+
+
+def _preencher_colunas_busca_postos(cur) -> int:
+    """Calcula as colunas normalizadas dos postos que ainda não têm (migração)"""
+    cur.execute("""
+        SELECT id, nomecli, nomepos, end, bairro, cep, nomecid
+        FROM modulo2_postos_trabalho
+        WHERE nomepos_chave IS NULL
+    """)
+    postos = [_row_to_dict(row) for row in cur.fetchall()]
+    if not postos:
+        return 0
+    
+    nomes = [nome for nome, _ in COLUNAS_BUSCA_POSTO]
+    cur.executemany(
+        f"UPDATE modulo2_postos_trabalho SET {', '.join(f'{n} = ?' for n in nomes)} WHERE id = ?",
+        [tuple(colunas_busca_posto(p)[n] for n in nomes) + (p["id"],) for p in postos]
+    )
+    print(f"[DB] Colunas normalizadas preenchidas em {len(postos)} postos")
+    return len(postos)
+
+
+def _consultar_postos(where: str, params: tuple) -> List[dict]:
+    """Postos (campos do cadastro + colunas normalizadas) que atendem ao filtro, em ordem de id"""
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute(f"SELECT {_CAMPOS_POSTO_SQL} FROM modulo2_postos_trabalho WHERE {where} ORDER BY id", params)
+        result = [_row_to_dict(row) for row in cur.fetchall()]
+        cur.close()
+        return result
+    except Exception as e:
+        print(f"[DB] ERRO ao buscar postos: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def buscar_postos_por_cep(cep: str) -> List[dict]:
+    """Postos com o mesmo CEP (comparando só os dígitos)"""
+    digitos = "".join(c for c in str(cep or "") if c.isdigit())
+    if not digitos:
+        return []
+    return _consultar_postos("cep_digitos = ?", (digitos,))
+
+
 # ================================
 # ORÇADO POR POSTO
 # ================================
@@ -1295,68 +1609,21 @@ def listar_orcado_por_posto(posto_id: int = None, ano_mes: str = None) -> List[d
 # PENDÊNCIAS
 # ================================
 
+# NFes consideradas pelo dashboard: apenas dados do JSON (XML contém "<origem>JSON</origem>").
+# As consultar_*() aceitam outra fonte com as mesmas colunas (ex: tabela temporária do bundle).
+NFES_JSON = """(
+    SELECT id, chave_acesso, status, valor_total, posto_id, data_emissao, nome_emitente
+    FROM modulo2_nfe
+    WHERE xml LIKE '%<origem>JSON</origem>%'
+)"""
+
+
 def listar_pendencias_db(limit: int = 500, data_ini: date = None, data_fim: date = None) -> List[dict]:
     """Lista pendências de identificação de posto com filtro opcional por data - APENAS DADOS DO JSON"""
     conn = None
     try:
         conn = get_conn()
-        cur = conn.cursor()
-        
-        query = """
-            SELECT 
-                p.id,
-                p.chave_nfe,
-                p.valor,
-                p.fornecedor,
-                p.cliente,
-                p.posto_trabalho,
-                p.motivo,
-                p.status,
-                p.created_at,
-                n.data_emissao,
-                n.nome_emitente
-            FROM modulo2_pendencias p
-            LEFT JOIN modulo2_nfe n ON n.chave_acesso = p.chave_nfe
-            WHERE p.status = 'pendente'
-            AND n.xml LIKE '%<origem>JSON</origem>%'
-        """
-        
-        params = []
-        
-        # Adicionar filtro de data se fornecido
-        if data_ini:
-            query += " AND (n.data_emissao >= ? OR n.data_emissao IS NULL)"
-            params.append(str(data_ini))
-        
-        if data_fim:
-            query += " AND (n.data_emissao <= ? OR n.data_emissao IS NULL)"
-            params.append(str(data_fim))
-        
-        query += " ORDER BY p.created_at DESC LIMIT ?"
-        params.append(limit)
-        
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        cur.close()
-        
-        # Converter para formato esperado pelo frontend
-        result = []
-        for row in rows:
-            # Converter Row para dict para acesso seguro
-            r = _row_to_dict(row)
-            result.append({
-                "id": r["id"],
-                "chave_nfe": r.get("chave_nfe", ""),
-                "valor": float(r.get("valor", 0)) if r.get("valor") else 0,
-                "fornecedor": r.get("nome_emitente") or r.get("fornecedor", ""),
-                "cliente": r.get("cliente", ""),
-                "posto_trabalho": r.get("posto_trabalho", ""),
-                "motivo": r.get("motivo", ""),
-                "status": r.get("status", "pendente"),
-                "data_emissao": str(r.get("data_emissao", "")) if r.get("data_emissao") else ""
-            })
-        
-        return result
+        return consultar_pendencias(conn, limit, data_ini, data_fim)
         
     except Exception as e:
         print(f"[DB] ERRO ao listar pendências: {e}")
@@ -1369,27 +1636,123 @@ def listar_pendencias_db(limit: int = 500, data_ini: date = None, data_fim: date
                 pass
 
 
-def criar_pendencia(nfe_id: int, chave_nfe: str, valor: float, fornecedor: str, motivo: str):
-    """Cria uma pendência para uma NFe não identificada"""
+def consultar_pendencias(conn, limit: int = 500, data_ini: date = None, data_fim: date = None,
+                         nfes: str = NFES_JSON) -> List[dict]:
+    """Pendências abertas das NFes de `nfes` (padrão: NFes do JSON), com os postos sugeridos"""
+    cur = conn.cursor()
+    
+    query = f"""
+        SELECT 
+            p.id,
+            p.chave_nfe,
+            p.valor,
+            p.fornecedor,
+            p.cliente,
+            p.posto_trabalho,
+            p.motivo,
+            p.status,
+            p.created_at,
+            n.data_emissao,
+            n.nome_emitente
+        FROM modulo2_pendencias p
+        JOIN {nfes} n ON n.chave_acesso = p.chave_nfe
+        WHERE p.status = 'pendente'
+    """
+    
+    params = []
+    
+    # Adicionar filtro de data se fornecido
+    if data_ini:
+        query += " AND (n.data_emissao >= ? OR n.data_emissao IS NULL)"
+        params.append(str(data_ini))
+    
+    if data_fim:
+        query += " AND (n.data_emissao <= ? OR n.data_emissao IS NULL)"
+        params.append(str(data_fim))
+    
+    query += " ORDER BY p.created_at DESC LIMIT ?"
+    params.append(limit)
+    
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    cur.close()
+    
+    # Postos sugeridos (pré-calculados na criação de cada pendência)
+    sugestoes = _listar_sugestoes_pendencias(conn, [row["id"] for row in rows])
+    
+    # Converter para formato esperado pelo frontend
+    return [_pendencia_para_dict(row, sugestoes) for row in rows]
+
+
+def _pendencia_para_dict(row, sugestoes: Dict[int, List[dict]]) -> dict:
+    """Linha de pendência (com data_emissao/nome_emitente da NFe) no formato esperado pelo frontend"""
+    # Converter Row para dict para acesso seguro
+    r = _row_to_dict(row)
+    return {
+        "id": r["id"],
+        "chave_nfe": r.get("chave_nfe", ""),
+        "valor": float(r.get("valor", 0)) if r.get("valor") else 0,
+        "fornecedor": r.get("nome_emitente") or r.get("fornecedor", ""),
+        "cliente": r.get("cliente", ""),
+        "posto_trabalho": r.get("posto_trabalho", ""),
+        "motivo": r.get("motivo", ""),
+        "status": r.get("status", "pendente"),
+        "data_emissao": str(r.get("data_emissao", "")) if r.get("data_emissao") else "",
+        "sugestoes": sugestoes.get(r["id"], [])
+    }
+
+
+def _listar_sugestoes_pendencias(conn, pendencia_ids: List[int]) -> Dict[int, List[dict]]:
+    """Sugestões de postos por pendência, com os dados do posto, na ordem gravada"""
+    resultado: Dict[int, List[dict]] = {}
+    cur = conn.cursor()
+    # Limite de parâmetros do SQLite: consultar em blocos
+    for i in range(0, len(pendencia_ids), 500):
+        bloco = pendencia_ids[i:i + 500]
+        cur.execute(f"""
+            SELECT s.pendencia_id, s.posto_id, s.score, s.motivo,
+                   pt.codigo, pt.nomecli, pt.nomepos
+            FROM modulo2_pendencias_sugestoes s
+            JOIN modulo2_postos_trabalho pt ON pt.id = s.posto_id
+            WHERE s.pendencia_id IN ({",".join("?" * len(bloco))})
+            ORDER BY s.pendencia_id, s.ordem
+        """, bloco)
+        for row in cur.fetchall():
+            r = _row_to_dict(row)
+            resultado.setdefault(r.pop("pendencia_id"), []).append(r)
+    cur.close()
+    return resultado
+
+
+def inserir_sugestoes_pendencia(cur, pendencia_id: int, sugestoes: List[dict]):
+    """
+    Grava os postos sugeridos de uma pendência (na transação do chamador).
+    sugestoes: [{"posto_id", "score", "motivo"}] já em ordem de preferência.
+    """
+    cur.executemany("""
+        INSERT INTO modulo2_pendencias_sugestoes (pendencia_id, posto_id, ordem, score, motivo)
+        VALUES (?, ?, ?, ?, ?)
+    """, [
+        (pendencia_id, s["posto_id"], ordem, s.get("score"), s.get("motivo"))
+        for ordem, s in enumerate(sugestoes or [], start=1)
+    ])
+
+
+def criar_pendencia(nfe_id: int, chave_nfe: str, valor: float, fornecedor: str, motivo: str,
+                    sugestoes: List[dict] = None, cur=None):
+    """
+    Cria uma pendência para uma NFe não identificada (com os postos sugeridos, se houver).
+    Com cursor, grava na transação do chamador (o commit fica com ele).
+    """
+    if cur is not None:
+        _inserir_pendencia(cur, nfe_id, chave_nfe, valor, fornecedor, motivo, sugestoes)
+        return
+    
     conn = None
     try:
         conn = get_conn()
         cur = conn.cursor()
-        
-        # Verificar se já existe
-        cur.execute("SELECT id FROM modulo2_pendencias WHERE chave_nfe = ? AND status = 'pendente'", 
-                   (chave_nfe,))
-        if cur.fetchone():
-            cur.close()
-            return  # Já existe pendência ativa
-        
-        cur.execute("""
-            INSERT INTO modulo2_pendencias (
-                nfe_id, chave_nfe, valor, fornecedor, motivo, status
-            )
-            VALUES (?, ?, ?, ?, ?, 'pendente')
-        """, (nfe_id, chave_nfe, valor, fornecedor, motivo))
-        
+        _inserir_pendencia(cur, nfe_id, chave_nfe, valor, fornecedor, motivo, sugestoes)
         conn.commit()
         cur.close()
         
@@ -1405,6 +1768,25 @@ def criar_pendencia(nfe_id: int, chave_nfe: str, valor: float, fornecedor: str,
                 pass
 
 
+def _inserir_pendencia(cur, nfe_id: int, chave_nfe: str, valor: float, fornecedor: str, motivo: str,
+                       sugestoes: List[dict] = None):
+    # Verificar se já existe
+    cur.execute("SELECT id FROM modulo2_pendencias WHERE chave_nfe = ? AND status = 'pendente'", 
+               (chave_nfe,))
+    if cur.fetchone():
+        return  # Já existe pendência ativa
+    
+    cur.execute("""
+        INSERT INTO modulo2_pendencias (
+            nfe_id, chave_nfe, valor, fornecedor, motivo, status
+        )
+        VALUES (?, ?, ?, ?, ?, 'pendente')
+    """, (nfe_id, chave_nfe, valor, fornecedor, motivo))
+    
+    if sugestoes:
+        inserir_sugestoes_pendencia(cur, cur.lastrowid, sugestoes)
+
+
 def atualizar_pendencia_com_posto(pendencia_id: int, posto_id: int, cliente_nome: str):
     """Atualiza uma pendência identificando o posto"""
     conn = None
@@ -1436,6 +1818,20 @@ def atualizar_pendencia_com_posto(pendencia_id: int, posto_id: int, cliente_nome
             WHERE id = ?
         """, (cliente_nome, pendencia_id))
         
+        # Memorizar a resolução manual: próximas NF-es com o mesmo infCpl/destino saem identificadas
+        try:
+            from .service import dados_identificacao_nfe
+            from .matcher import chave_memo_identificacao
+            
+            cur.execute("SELECT xml, endereco_entrega FROM modulo2_nfe WHERE id = ?", (nfe_id,))
+            nfe = _row_to_dict(cur.fetchone())
+            if nfe:
+                infcpl, ender_dest = dados_identificacao_nfe(nfe.get("xml"), nfe.get("endereco_entrega"))
+                chave = chave_memo_identificacao(infcpl, ender_dest)
+                _gravar_memos_identificacao(cur, [(chave, posto_id, "manual", 0, 1)])
+        except Exception as e:
+            print(f"[DB] AVISO: resolução não memorizada: {e}")
+        
         conn.commit()
         cur.close()
         
@@ -1451,6 +1847,83 @@ def atualizar_pendencia_com_posto(pendencia_id: int, posto_id: int, cliente_nome
             conn.close()
 
 
+def iterar_nfes_pendentes(tamanho_lote: int = 500):
+    """
+    Percorre as NF-es pendentes (sem posto) em lotes, por id crescente.
+    Cada lote usa uma consulta curta (paginação por id), sem manter leitura aberta durante as escritas.
+    """
+    ultimo_id = 0
+    while True:
+        conn = None
+        try:
+            conn = get_conn()
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT id, chave_acesso, xml, endereco_entrega
+                FROM modulo2_nfe
+                WHERE status = 'pendente' AND posto_id IS NULL AND id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (ultimo_id, tamanho_lote))
+            lote = [_row_to_dict(row) for row in cur.fetchall()]
+            cur.close()
+        finally:
+            if conn:
+                conn.close()
+        
+        if not lote:
+            return
+        
+        yield lote
+        ultimo_id = lote[-1]["id"]
+
+
+def resolver_nfes_em_lote(identificacoes: List[Tuple[int, dict]], resolvido_por: str = "reidentificacao") -> int:
+    """
+    Grava em uma única transação as NF-es identificadas: posto na NF-e e pendências resolvidas.
+    identificacoes: lista de (nfe_id, posto). Só altera NF-es que ainda estão pendentes.
+    Retorna quantas NF-es foram atualizadas.
+    """
+    if not identificacoes:
+        return 0
+    
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        
+        atualizadas = 0
+        for nfe_id, posto in identificacoes:
+            cur.execute("""
+                UPDATE modulo2_nfe
+                SET posto_id = ?, status = 'identificado', updated_at = datetime('now')
+                WHERE id = ? AND status = 'pendente' AND posto_id IS NULL
+            """, (posto["id"], nfe_id))
+            if cur.rowcount == 0:
+                continue
+            atualizadas += 1
+            
+            cur.execute("""
+                UPDATE modulo2_pendencias
+                SET status = 'resolvida', cliente = ?, posto_trabalho = ?, resolvido_por = ?,
+                    resolvido_em = datetime('now'), updated_at = datetime('now')
+                WHERE nfe_id = ? AND status = 'pendente'
+            """, (posto.get("nomecli", ""), posto.get("nomepos", ""), resolvido_por, nfe_id))
+        
+        conn.commit()
+        cur.close()
+        return atualizadas
+        
+    except Exception as e:
+        print(f"[DB] ERRO ao resolver NF-es em lote: {e}")
+        if conn:
+            conn.rollback()
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
 # ================================
 # CONSULTAS PARA DASHBOARD (JSON)
 # ================================
@@ -1465,44 +1938,9 @@ def obter_total_nfes(cliente_filtro: str = None, posto_filtro: int = None) -> di
     try:
         conn = get_conn()
         cur = conn.cursor()
-        
-        # Query base - FILTRAR APENAS DADOS DO JSON (XML contém "<origem>JSON</origem>")
-        query = """
-            SELECT 
-                COUNT(DISTINCT n.id) as total_nfes,
-                COUNT(DISTINCT CASE WHEN n.status = 'identificado' THEN n.id END) as nfes_identificadas,
-                COUNT(DISTINCT CASE WHEN n.status = 'pendente' THEN n.id END) as nfes_pendentes,
-                COALESCE(SUM(n.valor_total), 0) as valor_total,
-                (SELECT COUNT(*) FROM modulo2_nfe_itens i WHERE i.nfe_id IN (SELECT id FROM modulo2_nfe WHERE xml LIKE '%<origem>JSON</origem>%')) as total_produtos
-            FROM modulo2_nfe n
-            LEFT JOIN modulo2_postos_trabalho pt ON pt.id = n.posto_id
-            WHERE n.xml LIKE '%<origem>JSON</origem>%'
-        """
-        
-        params = []
-        
-        if cliente_filtro:
-            query += " AND pt.nomecli = ?"
-            params.append(cliente_filtro)
-            
-            if posto_filtro:
-                query += " AND pt.nomepos = ?"
-                params.append(posto_filtro)
-        
-        cur.execute(query, params)
-        row = cur.fetchone()
-        r = _row_to_dict(row)
-        
+        result = consultar_total_nfes(cur, cliente_filtro, posto_filtro)
         cur.close()
-        
-        return {
-            "total_nfes": r.get("total_nfes", 0) or 0,
-            "nfes_identificadas": r.get("nfes_identificadas", 0) or 0,
-            "nfes_pendentes": r.get("nfes_pendentes", 0) or 0,
-            "valor_total": float(r.get("valor_total", 0) or 0),
-            "total_realizado": float(r.get("valor_total", 0) or 0),  # Mesmo valor, mantém consistência
-            "total_produtos": r.get("total_produtos", 0) or 0
-        }
+        return result
         
     except Exception as e:
         print(f"[DB] ERRO ao obter total de NFes: {e}")
@@ -1521,6 +1959,43 @@ def obter_total_nfes(cliente_filtro: str = None, posto_filtro: int = None) -> di
                 pass
 
 
+def consultar_total_nfes(cur, cliente_filtro: str = None, posto_filtro: str = None, nfes: str = NFES_JSON) -> dict:
+    """Totais de obter_total_nfes() sobre as NFes de `nfes` (padrão: NFes do JSON)"""
+    query = f"""
+        SELECT 
+            COUNT(DISTINCT n.id) as total_nfes,
+            COUNT(DISTINCT CASE WHEN n.status = 'identificado' THEN n.id END) as nfes_identificadas,
+            COUNT(DISTINCT CASE WHEN n.status = 'pendente' THEN n.id END) as nfes_pendentes,
+            COALESCE(SUM(n.valor_total), 0) as valor_total,
+            (SELECT COUNT(*) FROM modulo2_nfe_itens i WHERE i.nfe_id IN (SELECT id FROM {nfes})) as total_produtos
+        FROM {nfes} n
+        LEFT JOIN modulo2_postos_trabalho pt ON pt.id = n.posto_id
+        WHERE 1=1
+    """
+    
+    params = []
+    
+    if cliente_filtro:
+        query += " AND pt.nomecli = ?"
+        params.append(cliente_filtro)
+        
+        if posto_filtro:
+            query += " AND pt.nomepos = ?"
+            params.append(posto_filtro)
+    
+    cur.execute(query, params)
+    r = _row_to_dict(cur.fetchone())
+    
+    return {
+        "total_nfes": r.get("total_nfes", 0) or 0,
+        "nfes_identificadas": r.get("nfes_identificadas", 0) or 0,
+        "nfes_pendentes": r.get("nfes_pendentes", 0) or 0,
+        "valor_total": float(r.get("valor_total", 0) or 0),
+        "total_realizado": float(r.get("valor_total", 0) or 0),  # Mesmo valor, mantém consistência
+        "total_produtos": r.get("total_produtos", 0) or 0
+    }
+
+
 def listar_clientes_distintos() -> List[str]:
     """Lista todos os clientes distintos (nomecli) do banco."""
     conn = None
@@ -1600,52 +2075,7 @@ def listar_produtos_agregados(cliente_filtro: str = None, posto_filtro: str = No
     try:
         conn = get_conn()
         cur = conn.cursor()
-        
-        query = """
-            SELECT 
-                i.descricao_produto as produto,
-                i.ncm,
-                SUM(i.quantidade) as quantidade_total,
-                SUM(i.valor_total) as valor_total,
-                COUNT(DISTINCT i.nfe_id) as total_nfes
-            FROM modulo2_nfe_itens i
-            INNER JOIN modulo2_nfe n ON n.id = i.nfe_id
-            LEFT JOIN modulo2_postos_trabalho pt ON pt.id = n.posto_id
-            WHERE i.descricao_produto IS NOT NULL AND i.descricao_produto != ''
-            AND n.xml LIKE '%<origem>JSON</origem>%'
-        """
-        
-        params = []
-        
-        if cliente_filtro:
-            query += " AND pt.nomecli = ?"
-            params.append(cliente_filtro)
-            
-            if posto_filtro:
-                query += " AND pt.nomepos = ?"
-                params.append(posto_filtro)
-        
-        query += """
-            GROUP BY i.descricao_produto, i.ncm
-            ORDER BY valor_total DESC
-            LIMIT ?
-        """
-        params.append(limit)
-        
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        
-        result = []
-        for row in rows:
-            r = _row_to_dict(row)
-            result.append({
-                "produto": r.get("produto", ""),
-                "ncm": r.get("ncm", ""),
-                "quantidade_total": float(r.get("quantidade_total", 0) or 0),
-                "valor_total": float(r.get("valor_total", 0) or 0),
-                "total_nfes": r.get("total_nfes", 0) or 0
-            })
-        
+        result = consultar_produtos_agregados(cur, cliente_filtro, posto_filtro, limit)
         cur.close()
         return result
         
@@ -1660,6 +2090,64 @@ def listar_produtos_agregados(cliente_filtro: str = None, posto_filtro: str = No
                 pass
 
 
+def consultar_produtos_agregados(cur, cliente_filtro: str = None, posto_filtro: str = None, limit: int = 50,
+                                 nfes: str = NFES_JSON) -> List[dict]:
+    """
+    Produtos agregados de listar_produtos_agregados() sobre as NFes de `nfes` (padrão: NFes do JSON).
+    Agrupa pelo produto_id da dimensão (variações de grafia do mesmo produto somam juntas)
+    e só busca descrição/NCM dos `limit` produtos do topo.
+    """
+    query = f"""
+        SELECT 
+            i.produto_id,
+            SUM(i.quantidade) as quantidade_total,
+            SUM(i.valor_total) as valor_total,
+            COUNT(DISTINCT i.nfe_id) as total_nfes
+        FROM {nfes} n
+        CROSS JOIN modulo2_nfe_itens i ON i.nfe_id = n.id
+        LEFT JOIN modulo2_postos_trabalho pt ON pt.id = n.posto_id
+        WHERE i.produto_id IS NOT NULL
+    """
+    
+    params = []
+    
+    if cliente_filtro:
+        query += " AND pt.nomecli = ?"
+        params.append(cliente_filtro)
+        
+        if posto_filtro:
+            query += " AND pt.nomepos = ?"
+            params.append(posto_filtro)
+    
+    query += """
+        GROUP BY i.produto_id
+        ORDER BY valor_total DESC
+        LIMIT ?
+    """
+    params.append(limit)
+    
+    query = f"""
+        SELECT p.descricao as produto, p.ncm, a.quantidade_total, a.valor_total, a.total_nfes
+        FROM ({query}) a
+        INNER JOIN modulo2_produtos p ON p.id = a.produto_id
+        ORDER BY a.valor_total DESC
+    """
+    
+    cur.execute(query, params)
+    
+    result = []
+    for row in cur.fetchall():
+        r = _row_to_dict(row)
+        result.append({
+            "produto": r.get("produto", ""),
+            "ncm": r.get("ncm", ""),
+            "quantidade_total": float(r.get("quantidade_total", 0) or 0),
+            "valor_total": float(r.get("valor_total", 0) or 0),
+            "total_nfes": r.get("total_nfes", 0) or 0
+        })
+    return result
+
+
 def listar_gastos_por_cliente_agregado(cliente_filtro: str = None) -> List[dict]:
     """
     Lista gastos agregados por cliente (para gráfico de clientes).
@@ -1669,51 +2157,7 @@ def listar_gastos_por_cliente_agregado(cliente_filtro: str = None) -> List[dict]
     try:
         conn = get_conn()
         cur = conn.cursor()
-        
-        query = """
-            SELECT 
-                pt.nomecli as cliente,
-                COALESCE(SUM(n.valor_total), 0) as realizado,
-                COUNT(DISTINCT n.id) as total_nfes,
-                COUNT(DISTINCT pt.id) as total_postos
-            FROM modulo2_postos_trabalho pt
-            LEFT JOIN modulo2_nfe n ON n.posto_id = pt.id AND n.xml LIKE '%<origem>JSON</origem>%'
-            WHERE pt.nomecli IS NOT NULL AND pt.nomecli != ''
-        """
-        
-        params = []
-        
-        if cliente_filtro:
-            query += " AND pt.nomecli = ?"
-            params.append(cliente_filtro)
-        
-        query += """
-            GROUP BY pt.nomecli
-            ORDER BY realizado DESC
-        """
-        
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        
-        result = []
-        for row in rows:
-            r = _row_to_dict(row)
-            cliente = r.get("cliente", "")
-            realizado = float(r.get("realizado", 0) or 0)
-            # Orçado = 2x realizado (conforme solicitado)
-            orcado = realizado * 2.0
-            status = orcado - realizado
-            
-            result.append({
-                "nomecli": cliente,
-                "nome": cliente,  # Compatibilidade
-                "orcado": orcado,
-                "realizado": realizado,
-                "status": status,
-                "total_nfes": r.get("total_nfes", 0) or 0,
-                "total_postos": r.get("total_postos", 0) or 0
-            })
-        
+        result = consultar_gastos_por_cliente_agregado(cur, cliente_filtro)
         cur.close()
         return result
         
@@ -1728,6 +2172,53 @@ def listar_gastos_por_cliente_agregado(cliente_filtro: str = None) -> List[dict]
                 pass
 
 
+def consultar_gastos_por_cliente_agregado(cur, cliente_filtro: str = None, nfes: str = NFES_JSON) -> List[dict]:
+    """Gastos por cliente de listar_gastos_por_cliente_agregado() sobre as NFes de `nfes` (padrão: NFes do JSON)"""
+    query = f"""
+        SELECT 
+            pt.nomecli as cliente,
+            COALESCE(SUM(n.valor_total), 0) as realizado,
+            COUNT(DISTINCT n.id) as total_nfes,
+            COUNT(DISTINCT pt.id) as total_postos
+        FROM modulo2_postos_trabalho pt
+        LEFT JOIN {nfes} n ON n.posto_id = pt.id
+        WHERE pt.nomecli IS NOT NULL AND pt.nomecli != ''
+    """
+    
+    params = []
+    
+    if cliente_filtro:
+        query += " AND pt.nomecli = ?"
+        params.append(cliente_filtro)
+    
+    query += """
+        GROUP BY pt.nomecli
+        ORDER BY realizado DESC
+    """
+    
+    cur.execute(query, params)
+    
+    result = []
+    for row in cur.fetchall():
+        r = _row_to_dict(row)
+        cliente = r.get("cliente", "")
+        realizado = float(r.get("realizado", 0) or 0)
+        # Orçado = 2x realizado (conforme solicitado)
+        orcado = realizado * 2.0
+        status = orcado - realizado
+        
+        result.append({
+            "nomecli": cliente,
+            "nome": cliente,  # Compatibilidade
+            "orcado": orcado,
+            "realizado": realizado,
+            "status": status,
+            "total_nfes": r.get("total_nfes", 0) or 0,
+            "total_postos": r.get("total_postos", 0) or 0
+        })
+    return result
+
+
 # ================================
 # CONSULTA POR INTERVALO DE DATAS
 # ================================
@@ -1769,3 +2260,1162 @@ def consultar_nfes_por_data(data_ini: date, data_fim: date) -> List[dict]:
     finally:
         if conn:
             conn.close()
+
+
+# ================================
+# LOG DE IMPORTAÇÕES
+# ================================
+
+def consultar_importacoes_log(cur, limit: int = 10, tipo: str = None) -> List[dict]:
+    """Últimas importações (mais recentes primeiro), opcionalmente de um tipo: 'inicial', 'diaria', 'manual'"""
+    query = """
+        SELECT id, tipo, data_inicio, data_fim, total_xmls, xmls_processados,
+               xmls_identificados, xmls_pendentes, status, mensagem,
+               tempo_execucao_segundos, iniciado_em, concluido_em
+        FROM modulo2_importacoes_log
+    """
+    params = []
+    if tipo:
+        query += " WHERE tipo = ?"
+        params.append(tipo)
+    query += " ORDER BY iniciado_em DESC LIMIT ?"
+    params.append(limit)
+    cur.execute(query, params)
+
+    result = []
+    for row in cur.fetchall():
+        r = _row_to_dict(row)
+        result.append({
+            "id": r.get("id"),
+            "tipo": r.get("tipo"),
+            "data_inicio": r.get("data_inicio"),
+            "data_fim": r.get("data_fim"),
+            "total_xmls": r.get("total_xmls", 0),
+            "xmls_processados": r.get("xmls_processados", 0),
+            "xmls_identificados": r.get("xmls_identificados", 0),
+            "xmls_pendentes": r.get("xmls_pendentes", 0),
+            "status": r.get("status"),
+            "mensagem": r.get("mensagem"),
+            "tempo_segundos": r.get("tempo_execucao_segundos"),
+            "iniciado_em": r.get("iniciado_em"),
+            "concluido_em": r.get("concluido_em")
+        })
+    return result
+
+
+# ================================
+# SCHEDULER (LEASE ENTRE WORKERS)
+# ================================
+# Única definição da tabela (criada pela migração do init_db)
+
+SQL_TABELA_SCHEDULER_LEASE = """
+    CREATE TABLE modulo2_scheduler_lease (
+        nome TEXT PRIMARY KEY,
+        dono TEXT NOT NULL,          -- hostname:pid:uuid do processo líder
+        hostname TEXT,
+        pid INTEGER,
+        adquirido_em REAL,
+        renovado_em REAL,
+        expira_em REAL NOT NULL,     -- epoch: lease expirado pode ser assumido por outro worker
+        proxima_execucao TEXT,
+        xmls_disponiveis INTEGER DEFAULT 0,
+        ultima_verificacao TEXT
+    )
+"""
+
+
+def adquirir_lease_scheduler(nome: str, dono: str, ttl_segundos: float, hostname: str = None,
+                             pid: int = None, proxima_execucao: str = None) -> bool:
+    """
+    Tenta adquirir (ou renovar) o lease do agendador.
+    Só um processo é dono do lease por vez; outro processo só assume quando o lease expira.
+    Retorna True se este processo é o dono após a chamada.
+    """
+    conn = None
+    agora = time.time()
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        
+        # BEGIN IMMEDIATE garante que a leitura + escrita do lease seja atômica entre processos
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+            INSERT INTO modulo2_scheduler_lease (
+                nome, dono, hostname, pid, adquirido_em, renovado_em, expira_em, proxima_execucao
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(nome) DO UPDATE SET
+                adquirido_em = CASE WHEN modulo2_scheduler_lease.dono = excluded.dono
+                                    THEN modulo2_scheduler_lease.adquirido_em
+                                    ELSE excluded.adquirido_em END,
+                dono = excluded.dono,
+                hostname = excluded.hostname,
+                pid = excluded.pid,
+                renovado_em = excluded.renovado_em,
+                expira_em = excluded.expira_em,
+                proxima_execucao = excluded.proxima_execucao
+            WHERE modulo2_scheduler_lease.dono = excluded.dono
+               OR modulo2_scheduler_lease.expira_em < ?
+        """, (nome, dono, hostname, pid, agora, agora, agora + ttl_segundos, proxima_execucao, agora))
+        
+        cur.execute("SELECT dono FROM modulo2_scheduler_lease WHERE nome = ?", (nome,))
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+        
+        return bool(row and row[0] == dono)
+        
+    except Exception as e:
+        print(f"[DB] ERRO ao adquirir lease do scheduler: {e}")
+        if conn:
+            try:
+                conn.rollback()
+            except:
+                pass
+        return False
+    finally:
+        if conn:
+            try:
+                conn.close()
+            except:
+                pass
+
+
+def liberar_lease_scheduler(nome: str, dono: str):
+    """Libera o lease (se este processo for o dono) para que outro worker assuma imediatamente"""
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE modulo2_scheduler_lease
+            SET expira_em = 0, proxima_execucao = NULL
+            WHERE nome = ? AND dono = ?
+        """, (nome, dono))
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"[DB] ERRO ao liberar lease do scheduler: {e}")
+    finally:
+        if conn:
+            try:
+                conn.close()
+            except:
+                pass
+
+
+def atualizar_estado_scheduler(nome: str, xmls_disponiveis: int, ultima_verificacao: str = None):
+    """Grava o resultado do último job no lease (visível para todos os workers)"""
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE modulo2_scheduler_lease
+            SET xmls_disponiveis = ?, ultima_verificacao = COALESCE(?, ultima_verificacao)
+            WHERE nome = ?
+        """, (xmls_disponiveis, ultima_verificacao, nome))
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"[DB] ERRO ao atualizar estado do scheduler: {e}")
+    finally:
+        if conn:
+            try:
+                conn.close()
+            except:
+                pass
+
+
+def obter_lease_scheduler(nome: str) -> dict:
+    """Retorna o registro do lease do agendador (dict vazio se não existir)"""
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT nome, dono, hostname, pid, adquirido_em, renovado_em, expira_em,
+                   proxima_execucao, xmls_disponiveis, ultima_verificacao
+            FROM modulo2_scheduler_lease
+            WHERE nome = ?
+        """, (nome,))
+        row = cur.fetchone()
+        cur.close()
+        return _row_to_dict(row)
+    except Exception as e:
+        print(f"[DB] ERRO ao consultar lease do scheduler: {e}")
+        return {}
+    finally:
+        if conn:
+            try:
+                conn.close()
+            except:
+                pass
+
+
+# ================================
+# PROGRESSO DA IMPORTAÇÃO (ENTRE WORKERS)
+# ================================
+# Uma linha com o último evento de progresso publicado por qualquer processo:
+# os outros workers leem essa linha para repassar o evento aos seus assinantes SSE.
+
+SQL_TABELA_PROGRESSO_IMPORTACAO = """
+    CREATE TABLE modulo2_progresso_importacao (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        seq INTEGER NOT NULL DEFAULT 0,   -- número do evento, crescente entre processos
+        evento TEXT,
+        dados TEXT,                       -- estado da importação em JSON
+        pid INTEGER,
+        atualizado_em REAL                -- epoch
+    )
+"""
+
+
+def gravar_progresso_importacao(evento: str, dados: str, pid: int = None) -> Optional[int]:
+    """
+    Grava o último evento de progresso e retorna o seq atribuído a ele (None em erro).
+    Espera no máximo 2s pelo lock de escrita: progresso perdido não pode travar a importação.
+    """
+    conn = None
+    try:
+        conn = get_conn()
+        conn.execute("PRAGMA busy_timeout = 2000")
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        cur.execute("""
+            INSERT INTO modulo2_progresso_importacao (id, seq, evento, dados, pid, atualizado_em)
+            VALUES (1, 1, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET
+                seq = modulo2_progresso_importacao.seq + 1,
+                evento = excluded.evento,
+                dados = excluded.dados,
+                pid = excluded.pid,
+                atualizado_em = excluded.atualizado_em
+        """, (evento, dados, pid, time.time()))
+        cur.execute("SELECT seq FROM modulo2_progresso_importacao WHERE id = 1")
+        seq = cur.fetchone()[0]
+        conn.commit()
+        cur.close()
+        return seq
+    except Exception as e:
+        print(f"[DB] AVISO: progresso da importação não gravado: {e}")
+        if conn:
+            try:
+                conn.rollback()
+            except:
+                pass
+        return None
+    finally:
+        if conn:
+            try:
+                conn.close()
+            except:
+                pass
+
+
+def obter_progresso_importacao(conn) -> dict:
+    """Último evento de progresso gravado (dict vazio se não houver). Usa a conexão do chamador."""
+    try:
+        row = conn.execute("""
+            SELECT seq, evento, dados, pid, atualizado_em
+            FROM modulo2_progresso_importacao
+            WHERE id = 1
+        """).fetchone()
+        return _row_to_dict(row)
+    except Exception as e:
+        print(f"[DB] ERRO ao consultar progresso da importação: {e}")
+        return {}
+
+
+# ================================
+# DIMENSÃO DE PRODUTOS
+# ================================
+# Cada item de NFe aponta (produto_id) para uma linha de modulo2_produtos, deduplicada
+# pela chave normalizar_forte(descrição) + dígitos do NCM: "Luva Látex P" e "LUVA LATEX-P"
+# com o mesmo NCM são o mesmo produto. O código do produto fica como atributo, fora da
+# chave: é o código interno de cada fornecedor e separaria o mesmo produto por emitente.
+# Os textos originais continuam no item (fiéis ao XML/JSON); agrupamentos por produto
+# usam o produto_id (inteiro) em vez do texto livre.
+
+SQL_TABELA_PRODUTOS = """
+    CREATE TABLE modulo2_produtos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chave TEXT NOT NULL UNIQUE,
+        descricao TEXT NOT NULL,
+        descricao_norm TEXT NOT NULL,
+        ncm TEXT,
+        codigo_produto TEXT,
+        unidade TEXT,
+        criado_em TEXT DEFAULT (datetime('now'))
+    )
+"""
+
+INDICES_PRODUTOS = [
+    "CREATE INDEX IF NOT EXISTS idx_mod2_produtos_ncm ON modulo2_produtos(ncm)"
+]
+
+COLUNAS_PRODUTO_ITEM = [
+    ("produto_id", "INTEGER REFERENCES modulo2_produtos(id)"),
+]
+
+INDICES_PRODUTO_ITEM = [
+    "CREATE INDEX IF NOT EXISTS idx_mod2_nfe_itens_produto ON modulo2_nfe_itens(produto_id, nfe_id)"
+]
+
+
+def _ncm_produto(ncm) -> str:
+    return "".join(c for c in str(ncm or "") if c.isdigit())
+
+
+def chave_produto(descricao, ncm) -> Optional[str]:
+    """Chave de deduplicação do produto; None quando a descrição não tem conteúdo"""
+    descricao_norm = normalizar_forte(descricao)
+    if not descricao_norm:
+        return None
+    return f"{descricao_norm}|{_ncm_produto(ncm)}"
+
+
+def resolver_produto_id(cur, descricao, ncm=None, codigo_produto=None, unidade=None,
+                        cache: Dict[str, int] = None) -> Optional[int]:
+    """
+    Id do produto na dimensão, criando a linha na primeira ocorrência (na transação do
+    chamador). `cache` (dict) evita repetir a consulta dentro de um mesmo lote.
+    """
+    chave = chave_produto(descricao, ncm)
+    if chave is None:
+        return None
+    if cache is not None and chave in cache:
+        return cache[chave]
+    
+    cur.execute("""
+        INSERT INTO modulo2_produtos (chave, descricao, descricao_norm, ncm, codigo_produto, unidade)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(chave) DO NOTHING
+    """, (chave, str(descricao).strip(), chave.split("|", 1)[0], _ncm_produto(ncm),
+          codigo_produto or None, unidade or None))
+    if cur.rowcount > 0:
+        produto_id = cur.lastrowid
+    else:
+        cur.execute("SELECT id FROM modulo2_produtos WHERE chave = ?", (chave,))
+        produto_id = cur.fetchone()[0]
+    
+    if cache is not None:
+        cache[chave] = produto_id
+    return produto_id
+
+
+def preencher_dimensao_produtos(cur=None) -> int:
+    """
+    Liga à dimensão os itens ainda sem produto_id (carga da migração, itens gravados
+    por código antigo). Com cursor, roda na transação do chamador. Retorna os itens ligados.
+    """
+    conn = None
+    try:
+        if cur is None:
+            conn = get_conn()
+            cursor = conn.cursor()
+        else:
+            cursor = cur
+        
+        # Uma resolução por combinação distinta de texto, não por item
+        cursor.execute("""
+            SELECT descricao_produto, COALESCE(ncm, '') as ncm,
+                   MIN(codigo_produto) as codigo_produto, MIN(unidade) as unidade
+            FROM modulo2_nfe_itens
+            WHERE produto_id IS NULL AND descricao_produto IS NOT NULL AND descricao_produto != ''
+            GROUP BY descricao_produto, COALESCE(ncm, '')
+        """)
+        combinacoes = [_row_to_dict(row) for row in cursor.fetchall()]
+        if not combinacoes:
+            return 0
+        
+        cache = {}
+        mapa = []
+        for c in combinacoes:
+            produto_id = resolver_produto_id(cursor, c["descricao_produto"], c["ncm"], c["codigo_produto"],
+                                             c["unidade"], cache)
+            if produto_id is not None:
+                mapa.append((c["descricao_produto"], c["ncm"], produto_id))
+        
+        # Tabela temporária com chave primária: o UPDATE faz uma busca por item, sem varrer o mapa
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS _mapa_produtos (
+                descricao TEXT, ncm TEXT, produto_id INTEGER,
+                PRIMARY KEY (descricao, ncm)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("DELETE FROM _mapa_produtos")
+        cursor.executemany("INSERT INTO _mapa_produtos (descricao, ncm, produto_id) VALUES (?, ?, ?)", mapa)
+        cursor.execute("""
+            UPDATE modulo2_nfe_itens
+            SET produto_id = (
+                SELECT m.produto_id FROM _mapa_produtos m
+                WHERE m.descricao = modulo2_nfe_itens.descricao_produto
+                  AND m.ncm = COALESCE(modulo2_nfe_itens.ncm, '')
+            )
+            WHERE produto_id IS NULL
+              AND (descricao_produto, COALESCE(ncm, '')) IN (SELECT descricao, ncm FROM _mapa_produtos)
+        """)
+        ligados = cursor.rowcount
+        cursor.execute("DROP TABLE _mapa_produtos")
+        
+        if conn:
+            conn.commit()
+        print(f"[DB] Dimensão de produtos: {ligados} itens ligados a {len(set(cache.values()))} produtos")
+        return ligados
+    finally:
+        if conn:
+            conn.close()
+
+
+# ================================
+# GASTOS DIÁRIOS (SÉRIE TEMPORAL)
+# ================================
+# Realizado por dia (date(data_emissao)) e posto, mantido por gatilhos em modulo2_nfe:
+# toda importação/identificação/exclusão ajusta o balde na mesma transação. A série
+# do dashboard (dia/semana/mês, por cliente ou posto) lê só daqui, sem varrer as NFes.
+# NFes sem posto ficam em posto_id = 0; sem data_emissao não entram na série.
+
+SQL_TABELA_GASTOS_DIARIOS = """
+    CREATE TABLE modulo2_gastos_diarios (
+        dia TEXT NOT NULL,
+        posto_id INTEGER NOT NULL,
+        valor REAL NOT NULL DEFAULT 0,
+        qtd_nfes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dia, posto_id)
+    ) WITHOUT ROWID
+"""
+
+INDICES_GASTOS_DIARIOS = [
+    "CREATE INDEX IF NOT EXISTS idx_mod2_gastos_diarios_posto ON modulo2_gastos_diarios(posto_id, dia)"
+]
+
+# Trechos dos gatilhos: soma a NFe nova no balde / retira a NFe antiga do balde
+_GASTOS_SOMAR_NEW = """
+    INSERT INTO modulo2_gastos_diarios (dia, posto_id, valor, qtd_nfes)
+    SELECT date(NEW.data_emissao), COALESCE(NEW.posto_id, 0), COALESCE(NEW.valor_total, 0), 1
+    WHERE date(NEW.data_emissao) IS NOT NULL
+    ON CONFLICT(dia, posto_id) DO UPDATE SET
+        valor = valor + excluded.valor,
+        qtd_nfes = qtd_nfes + 1;
+"""
+_GASTOS_RETIRAR_OLD = """
+    UPDATE modulo2_gastos_diarios
+    SET valor = valor - COALESCE(OLD.valor_total, 0),
+        qtd_nfes = qtd_nfes - 1
+    WHERE dia = date(OLD.data_emissao) AND posto_id = COALESCE(OLD.posto_id, 0);
+    DELETE FROM modulo2_gastos_diarios
+    WHERE dia = date(OLD.data_emissao) AND posto_id = COALESCE(OLD.posto_id, 0) AND qtd_nfes <= 0;
+"""
+
+GATILHOS_GASTOS_DIARIOS = {
+    "trg_gastos_diarios_insert": f"AFTER INSERT ON modulo2_nfe BEGIN {_GASTOS_SOMAR_NEW} END",
+    "trg_gastos_diarios_delete": f"AFTER DELETE ON modulo2_nfe BEGIN {_GASTOS_RETIRAR_OLD} END",
+    # Só quando muda algo que a série usa (não a cada UPDATE de status/xml)
+    "trg_gastos_diarios_update": f"""
+        AFTER UPDATE OF data_emissao, valor_total, posto_id ON modulo2_nfe
+        WHEN OLD.data_emissao IS NOT NEW.data_emissao
+          OR OLD.valor_total IS NOT NEW.valor_total
+          OR OLD.posto_id IS NOT NEW.posto_id
+        BEGIN {_GASTOS_RETIRAR_OLD} {_GASTOS_SOMAR_NEW} END
+    """,
+}
+
+
+def _criar_gatilhos_gastos_diarios(cur) -> bool:
+    """Cria os gatilhos que faltam. Retorna True se criou algum (baldes precisam de carga)."""
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_gastos_diarios_%'")
+    existentes = {row[0] for row in cur.fetchall()}
+    for nome, corpo in GATILHOS_GASTOS_DIARIOS.items():
+        if nome not in existentes:
+            cur.execute(f"CREATE TRIGGER {nome} {corpo}")
+    return set(GATILHOS_GASTOS_DIARIOS) != existentes
+
+
+def reconstruir_gastos_diarios(cur=None) -> int:
+    """
+    Recalcula a tabela inteira a partir de modulo2_nfe (carga inicial da migração ou
+    correção manual). Com cursor, roda na transação do chamador. Retorna os baldes gravados.
+    """
+    conn = None
+    try:
+        if cur is None:
+            conn = get_conn()
+            cursor = conn.cursor()
+        else:
+            cursor = cur
+        cursor.execute("DELETE FROM modulo2_gastos_diarios")
+        cursor.execute("""
+            INSERT INTO modulo2_gastos_diarios (dia, posto_id, valor, qtd_nfes)
+            SELECT date(data_emissao), COALESCE(posto_id, 0), COALESCE(SUM(valor_total), 0), COUNT(*)
+            FROM modulo2_nfe
+            WHERE date(data_emissao) IS NOT NULL
+            GROUP BY date(data_emissao), COALESCE(posto_id, 0)
+        """)
+        baldes = cursor.rowcount
+        if conn:
+            conn.commit()
+        print(f"[DB] Gastos diários reconstruídos: {baldes} baldes (dia x posto)")
+        return baldes
+    finally:
+        if conn:
+            conn.close()
+
+
+# Expressão do período de cada granularidade a partir do dia (semana começa na segunda)
+PERIODOS_SERIE = {
+    "dia": "dia",
+    "semana": "date(dia, 'weekday 0', '-6 days')",
+    "mes": "substr(dia, 1, 7)",
+}
+
+GRUPOS_SERIE = {
+    "cliente": "COALESCE(pt.nomecli, 'Não identificado')",
+    "posto": "COALESCE(pt.nomepos, 'Não identificado')",
+}
+
+
+def consultar_serie_gastos(
+    cur,
+    granularidade: str = "mes",
+    data_ini: date = None,
+    data_fim: date = None,
+    cliente: str = None,
+    posto: str = None,
+    agrupar_por: str = None
+) -> List[dict]:
+    """
+    Realizado por período (dia, semana ou mês) lido de modulo2_gastos_diarios.
+    
+    Args:
+        cliente / posto: filtros por nomecli / nomepos (como no dashboard)
+        agrupar_por: None (uma série), "cliente" ou "posto" (uma linha por período e grupo)
+    
+    Returns:
+        [{"periodo", "grupo"?, "realizado", "qtd_nfes"}] ordenado por período
+    """
+    periodo_sql = PERIODOS_SERIE[granularidade]
+    grupo_sql = GRUPOS_SERIE.get(agrupar_por)
+    
+    condicoes = ["1=1"]
+    params = []
+    if data_ini:
+        condicoes.append("g.dia >= ?")
+        params.append(str(data_ini))
+    if data_fim:
+        condicoes.append("g.dia <= ?")
+        params.append(str(data_fim))
+    if cliente:
+        condicoes.append("pt.nomecli = ?")
+        params.append(cliente)
+    if posto:
+        condicoes.append("pt.nomepos = ?")
+        params.append(posto)
+    
+    # Join com os postos só quando filtra ou agrupa por cliente/posto
+    join = "LEFT JOIN modulo2_postos_trabalho pt ON pt.id = g.posto_id" if (grupo_sql or cliente or posto) else ""
+    colunas_grupo = f", {grupo_sql} AS grupo" if grupo_sql else ""
+    
+    # Soma por dia primeiro (segue a chave primária); o período é calculado sobre esses totais
+    cur.execute(f"""
+        SELECT {periodo_sql} AS periodo{", grupo" if grupo_sql else ""},
+               SUM(valor) AS realizado,
+               SUM(qtd_nfes) AS qtd_nfes
+        FROM (
+            SELECT g.dia AS dia{colunas_grupo},
+                   SUM(g.valor) AS valor,
+                   SUM(g.qtd_nfes) AS qtd_nfes
+            FROM modulo2_gastos_diarios g
+            {join}
+            WHERE {" AND ".join(condicoes)}
+            GROUP BY g.dia{", grupo" if grupo_sql else ""}
+        )
+        GROUP BY periodo{", grupo" if grupo_sql else ""}
+        ORDER BY periodo{", realizado DESC" if grupo_sql else ""}
+    """, params)
+    
+    serie = []
+    for row in cur.fetchall():
+        item = {"periodo": row["periodo"]}
+        if grupo_sql:
+            item["grupo"] = row["grupo"]
+        item["realizado"] = round(float(row["realizado"] or 0), 2)
+        item["qtd_nfes"] = row["qtd_nfes"]
+        serie.append(item)
+    return serie
+
+
+def consultar_orcado_mensal(cur, meses: List[str], cliente: str = None, posto: str = None,
+                            agrupar_por: str = None) -> List[dict]:
+    """
+    valor_orcado de modulo2_orcado_posto por ano_mes (somado nos postos do filtro).
+    Linha com ano_mes NULL vale para todos os meses do posto sem valor específico,
+    como em listar_orcado_por_posto.
+    """
+    if not meses:
+        return []
+    grupo_sql = GRUPOS_SERIE.get(agrupar_por)
+    
+    condicoes = ["(op.ano_mes IS NULL OR op.ano_mes IN (" + ",".join("?" * len(meses)) + "))"]
+    params = list(meses)
+    if cliente:
+        condicoes.append("pt.nomecli = ?")
+        params.append(cliente)
+    if posto:
+        condicoes.append("pt.nomepos = ?")
+        params.append(posto)
+    
+    cur.execute(f"""
+        SELECT op.posto_id, op.ano_mes, op.valor_orcado{f", {grupo_sql} AS grupo" if grupo_sql else ""}
+        FROM modulo2_orcado_posto op
+        INNER JOIN modulo2_postos_trabalho pt ON pt.id = op.posto_id
+        WHERE {" AND ".join(condicoes)}
+    """, params)
+    
+    especificos: Dict[Tuple, float] = {}
+    padrao: Dict[int, float] = {}
+    grupos: Dict[int, str] = {}
+    for row in cur.fetchall():
+        if grupo_sql:
+            grupos[row["posto_id"]] = row["grupo"]
+        if row["ano_mes"] is None:
+            padrao[row["posto_id"]] = float(row["valor_orcado"] or 0)
+        else:
+            especificos[(row["posto_id"], row["ano_mes"])] = float(row["valor_orcado"] or 0)
+    
+    totais: Dict[Tuple, float] = {}
+    postos = set(padrao) | {posto_id for posto_id, _ in especificos}
+    for ano_mes in meses:
+        for posto_id in postos:
+            valor = especificos.get((posto_id, ano_mes), padrao.get(posto_id))
+            if valor is None:
+                continue
+            chave = (ano_mes, grupos.get(posto_id))
+            totais[chave] = totais.get(chave, 0.0) + valor
+    
+    resultado = []
+    for (ano_mes, grupo), valor in sorted(totais.items(), key=lambda t: (t[0][0], t[0][1] or "")):
+        item = {"ano_mes": ano_mes}
+        if grupo_sql:
+            item["grupo"] = grupo
+        item["orcado"] = round(valor, 2)
+        resultado.append(item)
+    return resultado
+
+
+# ================================
+# FORNECEDORES (DIMENSÃO COM CONTADORES)
+# ================================
+# Um registro por emitente com contadores (NFes, valor, identificadas) e o mesmo por
+# mês, mantidos por gatilhos em modulo2_nfe: importação, identificação e exclusão
+# ajustam os contadores na mesma transação. Ranking e detalhe do fornecedor leem só
+# daqui, sem varrer as NFes. A chave é o CNPJ do emitente; NFes sem CNPJ (ex.: JSON)
+# ficam em "NOME:" + nome do emitente em maiúsculas.
+# O nome é o último não vazio gravado; primeira/ultima_emissao só se estendem
+# (exclusões não as recuam até reconstruir_fornecedores).
+
+SQL_TABELA_FORNECEDORES = """
+    CREATE TABLE modulo2_fornecedores (
+        chave TEXT PRIMARY KEY,
+        cnpj TEXT,
+        nome TEXT,
+        qtd_nfes INTEGER NOT NULL DEFAULT 0,
+        valor_total REAL NOT NULL DEFAULT 0,
+        qtd_identificadas INTEGER NOT NULL DEFAULT 0,
+        valor_identificado REAL NOT NULL DEFAULT 0,
+        primeira_emissao TEXT,
+        ultima_emissao TEXT
+    ) WITHOUT ROWID
+"""
+
+INDICES_FORNECEDORES = [
+    "CREATE INDEX IF NOT EXISTS idx_mod2_fornecedores_valor ON modulo2_fornecedores(valor_total)",
+    "CREATE INDEX IF NOT EXISTS idx_mod2_fornecedores_qtd ON modulo2_fornecedores(qtd_nfes)"
+]
+
+SQL_TABELA_FORNECEDORES_MENSAL = """
+    CREATE TABLE modulo2_fornecedores_mensal (
+        chave TEXT NOT NULL,
+        ano_mes TEXT NOT NULL,
+        qtd_nfes INTEGER NOT NULL DEFAULT 0,
+        valor_total REAL NOT NULL DEFAULT 0,
+        qtd_identificadas INTEGER NOT NULL DEFAULT 0,
+        valor_identificado REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (chave, ano_mes)
+    ) WITHOUT ROWID
+"""
+
+INDICES_FORNECEDORES_MENSAL = [
+    "CREATE INDEX IF NOT EXISTS idx_mod2_fornecedores_mensal_mes ON modulo2_fornecedores_mensal(ano_mes)"
+]
+
+
+def _sql_chave_fornecedor(r: str) -> str:
+    """Chave do fornecedor da linha `r` (NEW/OLD ou alias): CNPJ ou NOME:<nome>"""
+    return (f"COALESCE(NULLIF(TRIM({r}.cnpj_emitente), ''), "
+            f"'NOME:' || UPPER(TRIM(COALESCE({r}.nome_emitente, ''))))")
+
+
+def _sql_somar_fornecedor(r: str, sinal: str) -> str:
+    """Trecho de gatilho: soma (sinal "+") ou retira (sinal "-") a NFe `r` dos contadores"""
+    chave = _sql_chave_fornecedor(r)
+    identificada = f"COALESCE({r}.status = 'identificado', 0)"
+    valor = f"COALESCE({r}.valor_total, 0)"
+    if sinal == "+":
+        return f"""
+            INSERT INTO modulo2_fornecedores (chave, cnpj, nome, qtd_nfes, valor_total, qtd_identificadas,
+                                              valor_identificado, primeira_emissao, ultima_emissao)
+            VALUES ({chave}, NULLIF(TRIM({r}.cnpj_emitente), ''), {r}.nome_emitente, 1, {valor},
+                    {identificada}, {identificada} * {valor}, date({r}.data_emissao), date({r}.data_emissao))
+            ON CONFLICT(chave) DO UPDATE SET
+                nome = COALESCE(NULLIF(excluded.nome, ''), nome),
+                qtd_nfes = qtd_nfes + 1,
+                valor_total = valor_total + excluded.valor_total,
+                qtd_identificadas = qtd_identificadas + excluded.qtd_identificadas,
+                valor_identificado = valor_identificado + excluded.valor_identificado,
+                primeira_emissao = MIN(COALESCE(primeira_emissao, excluded.primeira_emissao),
+                                       COALESCE(excluded.primeira_emissao, primeira_emissao)),
+                ultima_emissao = MAX(COALESCE(ultima_emissao, excluded.ultima_emissao),
+                                     COALESCE(excluded.ultima_emissao, ultima_emissao));
+            INSERT INTO modulo2_fornecedores_mensal (chave, ano_mes, qtd_nfes, valor_total,
+                                                     qtd_identificadas, valor_identificado)
+            SELECT {chave}, substr(date({r}.data_emissao), 1, 7), 1, {valor}, {identificada},
+                   {identificada} * {valor}
+            WHERE date({r}.data_emissao) IS NOT NULL
+            ON CONFLICT(chave, ano_mes) DO UPDATE SET
+                qtd_nfes = qtd_nfes + 1,
+                valor_total = valor_total + excluded.valor_total,
+                qtd_identificadas = qtd_identificadas + excluded.qtd_identificadas,
+                valor_identificado = valor_identificado + excluded.valor_identificado;
+        """
+    return f"""
+        UPDATE modulo2_fornecedores
+        SET qtd_nfes = qtd_nfes - 1,
+            valor_total = valor_total - {valor},
+            qtd_identificadas = qtd_identificadas - {identificada},
+            valor_identificado = valor_identificado - {identificada} * {valor}
+        WHERE chave = {chave};
+        DELETE FROM modulo2_fornecedores WHERE chave = {chave} AND qtd_nfes <= 0;
+        UPDATE modulo2_fornecedores_mensal
+        SET qtd_nfes = qtd_nfes - 1,
+            valor_total = valor_total - {valor},
+            qtd_identificadas = qtd_identificadas - {identificada},
+            valor_identificado = valor_identificado - {identificada} * {valor}
+        WHERE chave = {chave} AND ano_mes = substr(date({r}.data_emissao), 1, 7);
+        DELETE FROM modulo2_fornecedores_mensal
+        WHERE chave = {chave} AND ano_mes = substr(date({r}.data_emissao), 1, 7) AND qtd_nfes <= 0;
+    """
+
+
+GATILHOS_FORNECEDORES = {
+    "trg_fornecedores_insert": f"AFTER INSERT ON modulo2_nfe BEGIN {_sql_somar_fornecedor('NEW', '+')} END",
+    "trg_fornecedores_delete": f"AFTER DELETE ON modulo2_nfe BEGIN {_sql_somar_fornecedor('OLD', '-')} END",
+    # Identificação (status) e correções de emitente/valor/data; outros UPDATEs não mexem nos contadores
+    "trg_fornecedores_update": f"""
+        AFTER UPDATE OF cnpj_emitente, nome_emitente, valor_total, status, data_emissao ON modulo2_nfe
+        WHEN OLD.cnpj_emitente IS NOT NEW.cnpj_emitente
+          OR OLD.nome_emitente IS NOT NEW.nome_emitente
+          OR OLD.valor_total IS NOT NEW.valor_total
+          OR COALESCE(OLD.status = 'identificado', 0) != COALESCE(NEW.status = 'identificado', 0)
+          OR OLD.data_emissao IS NOT NEW.data_emissao
+        BEGIN {_sql_somar_fornecedor('OLD', '-')} {_sql_somar_fornecedor('NEW', '+')} END
+    """,
+}
+
+
+def _criar_gatilhos_fornecedores(cur) -> bool:
+    """Cria os gatilhos que faltam. Retorna True se criou algum (contadores precisam de carga)."""
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_fornecedores_%'")
+    existentes = {row[0] for row in cur.fetchall()}
+    for nome, corpo in GATILHOS_FORNECEDORES.items():
+        if nome not in existentes:
+            cur.execute(f"CREATE TRIGGER {nome} {corpo}")
+    return set(GATILHOS_FORNECEDORES) != existentes
+
+
+def reconstruir_fornecedores(cur=None) -> int:
+    """
+    Recalcula os contadores dos fornecedores a partir de modulo2_nfe (carga inicial da
+    migração ou correção manual). Com cursor, roda na transação do chamador.
+    Retorna o número de fornecedores.
+    """
+    conn = None
+    try:
+        if cur is None:
+            conn = get_conn()
+            cursor = conn.cursor()
+        else:
+            cursor = cur
+        chave = _sql_chave_fornecedor("n")
+        cursor.execute("DELETE FROM modulo2_fornecedores")
+        cursor.execute("DELETE FROM modulo2_fornecedores_mensal")
+        cursor.execute(f"""
+            INSERT INTO modulo2_fornecedores (chave, cnpj, nome, qtd_nfes, valor_total, qtd_identificadas,
+                                              valor_identificado, primeira_emissao, ultima_emissao)
+            SELECT {chave}, MAX(NULLIF(TRIM(n.cnpj_emitente), '')), MAX(n.nome_emitente), COUNT(*),
+                   COALESCE(SUM(n.valor_total), 0),
+                   SUM(CASE WHEN n.status = 'identificado' THEN 1 ELSE 0 END),
+                   COALESCE(SUM(CASE WHEN n.status = 'identificado' THEN n.valor_total END), 0),
+                   MIN(date(n.data_emissao)), MAX(date(n.data_emissao))
+            FROM modulo2_nfe n
+            GROUP BY 1
+        """)
+        fornecedores = cursor.rowcount
+        cursor.execute(f"""
+            INSERT INTO modulo2_fornecedores_mensal (chave, ano_mes, qtd_nfes, valor_total,
+                                                     qtd_identificadas, valor_identificado)
+            SELECT {chave}, substr(date(n.data_emissao), 1, 7), COUNT(*),
+                   COALESCE(SUM(n.valor_total), 0),
+                   SUM(CASE WHEN n.status = 'identificado' THEN 1 ELSE 0 END),
+                   COALESCE(SUM(CASE WHEN n.status = 'identificado' THEN n.valor_total END), 0)
+            FROM modulo2_nfe n
+            WHERE date(n.data_emissao) IS NOT NULL
+            GROUP BY 1, 2
+        """)
+        if conn:
+            conn.commit()
+        print(f"[DB] Fornecedores reconstruídos: {fornecedores} fornecedores")
+        return fornecedores
+    finally:
+        if conn:
+            conn.close()
+
+
+# Ordenações do ranking: expressão ORDER BY sobre as colunas agregadas
+ORDENS_RANKING_FORNECEDORES = {
+    "valor": "valor_total DESC",
+    "nfes": "qtd_nfes DESC, valor_total DESC",
+    "pendentes": "(qtd_nfes - qtd_identificadas) DESC, valor_total DESC",
+    # Pior taxa de identificação primeiro
+    "identificacao": "(qtd_identificadas * 1.0 / qtd_nfes) ASC, qtd_nfes DESC",
+}
+
+
+def _fornecedor_para_dict(r) -> dict:
+    qtd = r["qtd_nfes"] or 0
+    identificadas = r["qtd_identificadas"] or 0
+    valor = float(r["valor_total"] or 0)
+    return {
+        "chave": r["chave"],
+        "cnpj": r["cnpj"],
+        "nome": r["nome"],
+        "qtd_nfes": qtd,
+        "valor_total": round(valor, 2),
+        "qtd_identificadas": identificadas,
+        "qtd_pendentes": qtd - identificadas,
+        "valor_identificado": round(float(r["valor_identificado"] or 0), 2),
+        "percentual_identificacao": round(identificadas / qtd * 100, 1) if qtd > 0 else 0,
+        "ticket_medio": round(valor / qtd, 2) if qtd > 0 else 0,
+    }
+
+
+def _filtro_meses_fornecedor(mes_ini: str = None, mes_fim: str = None) -> Tuple[str, list]:
+    """Condição sobre ano_mes ("YYYY-MM") de modulo2_fornecedores_mensal, limites inclusivos"""
+    condicoes, params = [], []
+    if mes_ini:
+        condicoes.append("ano_mes >= ?")
+        params.append(mes_ini)
+    if mes_fim:
+        condicoes.append("ano_mes <= ?")
+        params.append(mes_fim)
+    return " AND ".join(condicoes) or "1=1", params
+
+
+def consultar_ranking_fornecedores(cur, ordem: str = "valor", limit: int = 50,
+                                   mes_ini: str = None, mes_fim: str = None) -> List[dict]:
+    """
+    Ranking de fornecedores pelos contadores. Com mes_ini/mes_fim ("YYYY-MM"), soma só
+    esses meses de modulo2_fornecedores_mensal; sem, usa os totais.
+    """
+    ordem_sql = ORDENS_RANKING_FORNECEDORES[ordem]
+    por_mes = bool(mes_ini or mes_fim)
+    if por_mes:
+        filtro, params = _filtro_meses_fornecedor(mes_ini, mes_fim)
+        cur.execute(f"""
+            SELECT a.*,
+                   (SELECT f.cnpj FROM modulo2_fornecedores f WHERE f.chave = a.chave) AS cnpj,
+                   (SELECT f.nome FROM modulo2_fornecedores f WHERE f.chave = a.chave) AS nome
+            FROM (
+                SELECT chave,
+                       SUM(qtd_nfes) AS qtd_nfes,
+                       SUM(valor_total) AS valor_total,
+                       SUM(qtd_identificadas) AS qtd_identificadas,
+                       SUM(valor_identificado) AS valor_identificado
+                FROM modulo2_fornecedores_mensal
+                WHERE {filtro}
+                GROUP BY chave
+                ORDER BY {ordem_sql}
+                LIMIT ?
+            ) a
+            ORDER BY {ordem_sql}
+        """, params + [limit])
+    else:
+        cur.execute(f"""
+            SELECT * FROM modulo2_fornecedores
+            WHERE qtd_nfes > 0
+            ORDER BY {ordem_sql}
+            LIMIT ?
+        """, (limit,))
+    
+    result = []
+    for row in cur.fetchall():
+        item = _fornecedor_para_dict(row)
+        if not por_mes:
+            item["primeira_emissao"] = row["primeira_emissao"]
+            item["ultima_emissao"] = row["ultima_emissao"]
+        result.append(item)
+    return result
+
+
+def consultar_fornecedor(cur, chave: str, mes_ini: str = None, mes_fim: str = None) -> Optional[dict]:
+    """Totais do fornecedor + contadores por mês (todos ou só de mes_ini a mes_fim). None se não existe."""
+    cur.execute("SELECT * FROM modulo2_fornecedores WHERE chave = ?", (chave,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    fornecedor = _fornecedor_para_dict(row)
+    fornecedor["primeira_emissao"] = row["primeira_emissao"]
+    fornecedor["ultima_emissao"] = row["ultima_emissao"]
+    
+    filtro, params = _filtro_meses_fornecedor(mes_ini, mes_fim)
+    cur.execute(f"SELECT * FROM modulo2_fornecedores_mensal WHERE chave = ? AND {filtro} ORDER BY ano_mes",
+                [chave] + params)
+    
+    mensal = []
+    for r in cur.fetchall():
+        qtd = r["qtd_nfes"] or 0
+        mensal.append({
+            "ano_mes": r["ano_mes"],
+            "qtd_nfes": qtd,
+            "valor_total": round(float(r["valor_total"] or 0), 2),
+            "qtd_identificadas": r["qtd_identificadas"] or 0,
+            "valor_identificado": round(float(r["valor_identificado"] or 0), 2),
+            "percentual_identificacao": round((r["qtd_identificadas"] or 0) / qtd * 100, 1) if qtd > 0 else 0,
+        })
+    fornecedor["mensal"] = mensal
+    return fornecedor
+
+
+def listar_ranking_fornecedores(ordem: str = "valor", limit: int = 50, mes_ini: str = None,
+                                mes_fim: str = None) -> List[dict]:
+    """Ranking de fornecedores (ver consultar_ranking_fornecedores)"""
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        result = consultar_ranking_fornecedores(cur, ordem, limit, mes_ini, mes_fim)
+        cur.close()
+        return result
+    except Exception as e:
+        print(f"[DB] ERRO ao listar ranking de fornecedores: {e}")
+        return []
+    finally:
+        if conn:
+            conn.close()
+
+
+def obter_fornecedor(chave: str, mes_ini: str = None, mes_fim: str = None) -> Optional[dict]:
+    """Detalhe do fornecedor (ver consultar_fornecedor)"""
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        result = consultar_fornecedor(cur, chave, mes_ini, mes_fim)
+        cur.close()
+        return result
+    finally:
+        if conn:
+            conn.close()
+
+
+# ================================
+# VERSÕES (INVALIDAÇÃO DE CACHES)
+# ================================
+# Cada chave (ex: "postos") tem um contador incrementado a cada escrita.
+# Caches em memória comparam a versão para saber quando reconstruir,
+# inclusive entre processos diferentes (workers).
+
+_versoes_escritas_processo = 0
+
+
+def incrementar_versao(cur, chave: str):
+    """Incrementa a versão de uma chave usando o cursor (e a transação) do chamador"""
+    global _versoes_escritas_processo
+    cur.execute("""
+        INSERT INTO modulo2_versoes (chave, versao, atualizado_em)
+        VALUES (?, 1, datetime('now'))
+        ON CONFLICT(chave) DO UPDATE SET
+            versao = modulo2_versoes.versao + 1,
+            atualizado_em = datetime('now')
+    """, (chave,))
+    _versoes_escritas_processo += 1
+
+
+# Tabelas cujas escritas mudam o que o dashboard mostra: gatilhos incrementam a versão
+# "dados" em qualquer INSERT/UPDATE/DELETE, venha de db.py, service.py, scripts ou
+# outro processo (ver cache_respostas.py)
+TABELAS_VERSAO_DADOS = [
+    "modulo2_nfe",
+    "modulo2_nfe_itens",
+    "modulo2_pendencias",
+    "modulo2_pendencias_sugestoes",
+    "modulo2_postos_trabalho",
+    "modulo2_orcado_posto",
+    "modulo2_nsu_checkpoint",
+    "modulo2_importacoes_log",
+]
+
+
+def _criar_gatilhos_versao(cur, chave: str, tabelas: List[str]) -> int:
+    """Cria (se não existem) gatilhos que incrementam a versão `chave` a cada escrita nas tabelas"""
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    existentes = {row[0] for row in cur.fetchall()}
+    
+    criados = 0
+    for tabela in tabelas:
+        if tabela not in existentes:
+            continue
+        for operacao in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_versao_{chave}_{tabela}_{operacao.lower()}
+                AFTER {operacao} ON {tabela}
+                BEGIN
+                    INSERT INTO modulo2_versoes (chave, versao, atualizado_em)
+                    VALUES ('{chave}', 1, datetime('now'))
+                    ON CONFLICT(chave) DO UPDATE SET
+                        versao = modulo2_versoes.versao + 1,
+                        atualizado_em = datetime('now');
+                END
+            """)
+            criados += 1
+    return criados
+
+
+def versoes_escritas_processo() -> int:
+    """Quantas vezes este processo incrementou versões (detecção barata de escrita local)"""
+    return _versoes_escritas_processo
+
+
+def obter_versao(chave: str) -> int:
+    """Retorna a versão atual de uma chave (0 se nunca foi alterada)"""
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("SELECT versao FROM modulo2_versoes WHERE chave = ?", (chave,))
+        row = cur.fetchone()
+        cur.close()
+        return row[0] if row else 0
+    except Exception as e:
+        print(f"[DB] ERRO ao consultar versão '{chave}': {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
+# ================================
+# MEMÓRIA DE IDENTIFICAÇÕES
+# ================================
+
+def obter_memos_identificacao(chaves: List[str], cur=None) -> Dict[str, dict]:
+    """
+    Busca resultados memorizados por chave (ver matcher.chave_memo_identificacao).
+    Com cursor, usa a conexão do chamador.
+    """
+    if not chaves:
+        return {}
+    
+    conn = None
+    try:
+        if cur is None:
+            conn = get_conn()
+            cursor = conn.cursor()
+        else:
+            cursor = cur
+        resultado = {}
+        # Limite de parâmetros do SQLite: consultar em blocos
+        for i in range(0, len(chaves), 500):
+            bloco = chaves[i:i + 500]
+            cursor.execute(f"""
+                SELECT chave, posto_id, regra, versao_postos, manual
+                FROM modulo2_memo_identificacao
+                WHERE chave IN ({",".join("?" * len(bloco))})
+            """, bloco)
+            for row in cursor.fetchall():
+                r = _row_to_dict(row)
+                resultado[r["chave"]] = r
+        return resultado
+    except Exception as e:
+        print(f"[DB] ERRO ao consultar memória de identificações: {e}")
+        return {}
+    finally:
+        if conn:
+            conn.close()
+
+
+def _gravar_memos_identificacao(cur, memos: List[Tuple]):
+    """
+    Grava (chave, posto_id, regra, versao_postos, manual) usando o cursor do chamador.
+    Resultado automático não sobrescreve resolução manual.
+    """
+    cur.executemany("""
+        INSERT INTO modulo2_memo_identificacao (chave, posto_id, regra, versao_postos, manual, atualizado_em)
+        VALUES (?, ?, ?, ?, ?, datetime('now'))
+        ON CONFLICT(chave) DO UPDATE SET
+            posto_id = excluded.posto_id,
+            regra = excluded.regra,
+            versao_postos = excluded.versao_postos,
+            manual = excluded.manual,
+            atualizado_em = datetime('now')
+        WHERE modulo2_memo_identificacao.manual = 0 OR excluded.manual = 1
+    """, memos)
+
+
+def salvar_memos_identificacao(memos: List[Tuple], cur=None):
+    """
+    Grava resultados de identificação na memória (uma transação).
+    Com cursor, grava na transação do chamador (o commit fica com ele).
+    """
+    if not memos:
+        return
+    if cur is not None:
+        _gravar_memos_identificacao(cur, memos)
+        return
+    
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        _gravar_memos_identificacao(cur, memos)
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print(f"[DB] ERRO ao gravar memória de identificações: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+
+def limpar_memos_obsoletos(versao_postos: int) -> int:
+    """Remove resultados automáticos memorizados com outra versão dos postos (manuais ficam)"""
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM modulo2_memo_identificacao
+            WHERE manual = 0 AND versao_postos != ?
+        """, (versao_postos,))
+        removidos = cur.rowcount
+        conn.commit()
+        cur.close()
+        return removidos
+    except Exception as e:
+        print(f"[DB] ERRO ao limpar memória de identificações: {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
@@ -3,108 +3,363 @@ Módulo de Enriquecimento Automático de CEPs
 Consulta APIs e atualiza base de postos durante importação de XMLs
 """
 import requests
+import os
 import re
 import time
-from typing import Optional, Dict, Tuple
-from .db import get_conn
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, List, Tuple
+from .db import get_conn, incrementar_versao, colunas_busca_cep, buscar_postos_por_cep, COLUNAS_BUSCA_POSTO
+from .normalizacao import limpar_posto
+from .ceps_referencia import consultar_cep_referencia, consultar_ceps_referencia_lote
 from .utils import normalizar_forte
 
 
 # ============================================
 # CONSULTA DE CEP VIA API
 # ============================================
+# Na frente do ViaCEP: um LRU em memória (por processo), a base de referência local
+# (ceps_referencia.py, se carregada) e a tabela modulo2_cache_ceps. CEPs inexistentes
+# ficam em cache por CEP_TTL_INVALIDO segundos e depois são consultados de novo.
+# Falhas de rede não são cacheadas.
 
-def consultar_viacep(cep: str, usar_cache: bool = True) -> Optional[Dict]:
+# URL do serviço de CEP ({cep} = 8 dígitos). Pode apontar para um serviço local em testes.
+VIACEP_URL = os.getenv("MODULO2_VIACEP_URL", "https://viacep.com.br/ws/{cep}/json/")
+VIACEP_TIMEOUT = float(os.getenv("MODULO2_VIACEP_TIMEOUT", "5"))
+
+# Consultas simultâneas ao ViaCEP no prefetch (a taxa é limitada pelo token bucket do rate_limiter)
+VIACEP_WORKERS = int(os.getenv("MODULO2_VIACEP_WORKERS", "8"))
+
+CEP_CACHE_MEMORIA = int(os.getenv("MODULO2_CEP_CACHE_MEMORIA", "4096"))
+CEP_TTL_INVALIDO = float(os.getenv("MODULO2_CEP_TTL_INVALIDO", str(7 * 24 * 3600)))
+
+_CAMPOS_CEP = ('logradouro', 'complemento', 'bairro', 'localidade', 'uf', 'ddd', 'ibge')
+
+
+class CacheCepsMemoria:
+    """
+    LRU thread-safe de CEPs consultados: cep -> (dados ou None se inexistente, expira_em).
+    Entradas válidas não expiram (expira_em None), como na tabela.
     """
-    Consulta CEP na API ViaCEP com cache
     
-    Args:
-        cep: CEP a consultar (com ou sem formatação)
-        usar_cache: Se deve usar cache local
+    def __init__(self, tamanho: int = CEP_CACHE_MEMORIA):
+        self._tamanho = tamanho
+        self._itens: "OrderedDict[str, Tuple[Optional[Dict], Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.metricas = {
+            'hits_memoria': 0,
+            'hits_referencia': 0,
+            'hits_banco': 0,
+            'consultas_api': 0,
+            'erros_api': 0
+        }
     
-    Returns:
-        Dict com dados do CEP ou None se não encontrado
-    """
-    # Limpar CEP
-    cep_limpo = re.sub(r'\D', '', cep)
+    def get(self, cep: str) -> Tuple[bool, Optional[Dict]]:
+        """(encontrado, dados). dados None = CEP inexistente ainda dentro do TTL"""
+        with self._lock:
+            item = self._itens.get(cep)
+            if item is None:
+                return False, None
+            dados, expira_em = item
+            if expira_em is not None and expira_em <= time.time():
+                del self._itens[cep]
+                return False, None
+            self._itens.move_to_end(cep)
+            return True, dados
     
-    if len(cep_limpo) != 8:
-        return None
+    def set(self, cep: str, dados: Optional[Dict], expira_em: Optional[float] = None):
+        with self._lock:
+            self._itens[cep] = (dados, expira_em)
+            self._itens.move_to_end(cep)
+            while len(self._itens) > self._tamanho:
+                self._itens.popitem(last=False)
     
-    # Verificar cache primeiro
-    if usar_cache:
+    def contar(self, metrica: str, quantidade: int = 1):
+        with self._lock:
+            self.metricas[metrica] += quantidade
+    
+    def clear(self):
+        with self._lock:
+            self._itens.clear()
+            for metrica in self.metricas:
+                self.metricas[metrica] = 0
+    
+    def __len__(self):
+        return len(self._itens)
+
+
+# Instância global do cache
+_cache_ceps = CacheCepsMemoria()
+
+
+def get_cache_ceps() -> CacheCepsMemoria:
+    """Retorna instância global do cache de CEPs em memória"""
+    return _cache_ceps
+
+
+def estatisticas_cache_ceps() -> Dict:
+    """Contadores do cache de CEPs desde o início do processo"""
+    metricas = dict(_cache_ceps.metricas)
+    consultas = metricas['hits_memoria'] + metricas['hits_referencia'] + metricas['hits_banco'] + metricas['consultas_api']
+    metricas['em_memoria'] = len(_cache_ceps)
+    metricas['taxa_hit'] = round((consultas - metricas['consultas_api']) / consultas, 4) if consultas else 0.0
+    return metricas
+
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """Session HTTP compartilhada (conexões keep-alive reaproveitadas entre consultas e threads)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, VIACEP_WORKERS))
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def _limpar_cep(cep) -> Optional[str]:
+    """CEP só com dígitos, ou None se não tiver 8 dígitos"""
+    cep_limpo = re.sub(r'\D', '', str(cep or ''))
+    return cep_limpo if len(cep_limpo) == 8 else None
+
+
+def _dados_cacheados(dados: Optional[Dict]) -> Optional[Dict]:
+    return dict(dados, cached=True) if dados else None
+
+
+def _buscar_ceps_banco(ceps: List[str]) -> Dict[str, Tuple[Optional[Dict], Optional[float]]]:
+    """
+    Lê do modulo2_cache_ceps os CEPs informados (em blocos).
+    Retorna {cep: (dados ou None se inexistente, expira_em)}; inválidos com TTL vencido ficam de fora.
+    """
+    encontrados = {}
+    if not ceps:
+        return encontrados
+    
+    conn = None
+    try:
         conn = get_conn()
         cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT logradouro, complemento, bairro, localidade, uf, ddd, ibge, valido
-            FROM modulo2_cache_ceps
-            WHERE cep = ?
-        """, (cep_limpo,))
-        
-        resultado = cursor.fetchone()
+        agora = time.time()
+        for i in range(0, len(ceps), 500):
+            bloco = ceps[i:i + 500]
+            cursor.execute(f"""
+                SELECT cep, logradouro, complemento, bairro, localidade, uf, ddd, ibge, valido,
+                       (julianday('now') - julianday(consultado_em)) * 86400 AS idade
+                FROM modulo2_cache_ceps
+                WHERE cep IN ({','.join('?' * len(bloco))})
+            """, bloco)
+            for row in cursor.fetchall():
+                cep, valido, idade = row[0], row[8], row[9] or 0
+                if valido:
+                    dados = {'cep': cep}
+                    dados.update(zip(_CAMPOS_CEP, row[1:8]))
+                    encontrados[cep] = (dados, None)
+                elif idade < CEP_TTL_INVALIDO:
+                    encontrados[cep] = (None, agora + CEP_TTL_INVALIDO - idade)
         cursor.close()
-        conn.close()
-        
-        if resultado:
-            logr, compl, bairro, cidade, uf, ddd, ibge, valido = resultado
-            
-            # Se estava marcado como inválido, retornar None
-            if not valido:
-                return None
-            
-            return {
-                'cep': cep_limpo,
-                'logradouro': logr,
-                'complemento': compl,
-                'bairro': bairro,
-                'localidade': cidade,
-                'uf': uf,
-                'ddd': ddd,
-                'ibge': ibge,
-                'cached': True
-            }
+    except Exception as e:
+        print(f"[ENRIQUECIMENTO] Erro ao ler cache de CEPs: {e}")
+    finally:
+        if conn:
+            conn.close()
+    return encontrados
+
+
+def _consultar_api_cep(cep: str, limiter=None) -> Tuple[str, Optional[Dict]]:
+    """
+    Consulta um CEP (8 dígitos) no serviço de CEP, respeitando o token bucket.
+    Retorna ('ok', dados), ('invalido', None) ou ('erro', None) em falha de rede/serviço.
+    """
+    from .rate_limiter import get_viacep_limiter
     
-    # Consultar API
+    (limiter or get_viacep_limiter()).adquirir()
+    _cache_ceps.contar('consultas_api')
     try:
-        print(f"[ENRIQUECIMENTO] Consultando ViaCEP: {cep_limpo}")
-        url = f"https://viacep.com.br/ws/{cep_limpo}/json/"
+        print(f"[ENRIQUECIMENTO] Consultando ViaCEP: {cep}")
+        url = VIACEP_URL.format(cep=cep)
         
-        response = requests.get(url, timeout=5)
+        response = _get_session().get(url, timeout=VIACEP_TIMEOUT)
         response.raise_for_status()
         
         dados = response.json()
         
         # Verificar se CEP existe
         if 'erro' in dados and dados['erro']:
-            # Cachear como inválido
-            _cachear_cep_invalido(cep_limpo)
-            return None
-        
-        # Cachear resultado válido
-        _cachear_cep(cep_limpo, dados)
-        
-        dados['cached'] = False
-        return dados
+            return 'invalido', None
+        return 'ok', dados
         
     except requests.exceptions.Timeout:
-        print(f"[ENRIQUECIMENTO] ⚠️  Timeout ao consultar CEP {cep_limpo}")
-        return None
+        print(f"[ENRIQUECIMENTO] ⚠️  Timeout ao consultar CEP {cep}")
     except requests.exceptions.RequestException as e:
-        print(f"[ENRIQUECIMENTO] ⚠️  Erro ao consultar CEP {cep_limpo}: {e}")
-        return None
+        print(f"[ENRIQUECIMENTO] ⚠️  Erro ao consultar CEP {cep}: {e}")
     except Exception as e:
-        print(f"[ENRIQUECIMENTO] ⚠️  Erro inesperado ao consultar CEP {cep_limpo}: {e}")
+        print(f"[ENRIQUECIMENTO] ⚠️  Erro inesperado ao consultar CEP {cep}: {e}")
+    _cache_ceps.contar('erros_api')
+    return 'erro', None
+
+
+def consultar_viacep(cep: str, usar_cache: bool = True) -> Optional[Dict]:
+    """
+    Consulta CEP na API ViaCEP com cache
+    
+    Args:
+        cep: CEP a consultar (com ou sem formatação)
+        usar_cache: Se deve usar cache local (memória e banco)
+    
+    Returns:
+        Dict com dados do CEP ou None se não encontrado
+    """
+    cep_limpo = _limpar_cep(cep)
+    if not cep_limpo:
+        return None
+    
+    # Verificar cache primeiro (memória, base de referência, depois banco)
+    if usar_cache:
+        encontrado, dados = _cache_ceps.get(cep_limpo)
+        if encontrado:
+            _cache_ceps.contar('hits_memoria')
+            return _dados_cacheados(dados)
+        
+        dados = consultar_cep_referencia(cep_limpo)
+        if dados:
+            _cache_ceps.contar('hits_referencia')
+            _cache_ceps.set(cep_limpo, dados)
+            return _dados_cacheados(dados)
+        
+        do_banco = _buscar_ceps_banco([cep_limpo]).get(cep_limpo)
+        if do_banco:
+            _cache_ceps.contar('hits_banco')
+            _cache_ceps.set(cep_limpo, *do_banco)
+            return _dados_cacheados(do_banco[0])
+    
+    # Consultar API
+    status, dados = _consultar_api_cep(cep_limpo)
+    if status == 'erro':
+        return None
+    
+    _gravar_ceps_cache([(cep_limpo, dados)])
+    if not dados:
         return None
+    
+    dados['cached'] = False
+    return dados
 
 
-def _cachear_cep(cep: str, dados: Dict):
-    """Armazena CEP válido no cache"""
+def prefetch_ceps(ceps: List[str], workers: int = None, limiter=None) -> Dict:
+    """
+    Resolve de uma vez todos os CEPs distintos de um lote (ex: das NF-es a enriquecer):
+    memória -> base de referência -> uma leitura em blocos do modulo2_cache_ceps ->
+    API só para o que faltar, em paralelo (Session compartilhada + token bucket) e
+    com uma única transação de escrita no cache. Depois disso consultar_viacep() desses CEPs sai da memória.
+    
+    Args:
+        ceps: CEPs (com ou sem formatação, repetidos ou não)
+        workers: consultas simultâneas à API (padrão: MODULO2_VIACEP_WORKERS)
+        limiter: TokenBucket a usar (padrão: limite global do ViaCEP)
+    
+    Returns:
+        Dict com métricas do lote (hits de memória/banco, consultas à API, taxa de hit)
+    """
+    inicio = time.time()
+    distintos = list(dict.fromkeys(c for c in (_limpar_cep(cep) for cep in ceps) if c))
+    
+    metricas = {
+        'total': len(ceps),
+        'distintos': len(distintos),
+        'formato_invalido': sum(1 for cep in ceps if not _limpar_cep(cep)),
+        'hits_memoria': 0,
+        'hits_referencia': 0,
+        'hits_banco': 0,
+        'consultas_api': 0,
+        'encontrados_api': 0,
+        'inexistentes_api': 0,
+        'erros_api': 0,
+        'ceps_com_erro': []
+    }
+    
+    faltando = []
+    for cep in distintos:
+        if _cache_ceps.get(cep)[0]:
+            metricas['hits_memoria'] += 1
+        else:
+            faltando.append(cep)
+    
+    da_referencia = consultar_ceps_referencia_lote(faltando)
+    for cep, dados in da_referencia.items():
+        _cache_ceps.set(cep, dados)
+    metricas['hits_referencia'] = len(da_referencia)
+    faltando = [cep for cep in faltando if cep not in da_referencia]
+    
+    do_banco = _buscar_ceps_banco(faltando)
+    for cep, (dados, expira_em) in do_banco.items():
+        _cache_ceps.set(cep, dados, expira_em)
+    metricas['hits_banco'] = len(do_banco)
+    faltando = [cep for cep in faltando if cep not in do_banco]
+    
+    # Só os CEPs que faltam vão para a API (sem espera nenhuma nos hits)
+    if faltando:
+        workers = max(1, min(workers or VIACEP_WORKERS, len(faltando)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="viacep") as pool:
+            respostas = list(pool.map(lambda cep: _consultar_api_cep(cep, limiter), faltando))
+    else:
+        respostas = []
+    
+    novos = []
+    for cep, (status, dados) in zip(faltando, respostas):
+        metricas['consultas_api'] += 1
+        if status == 'ok':
+            metricas['encontrados_api'] += 1
+        elif status == 'invalido':
+            metricas['inexistentes_api'] += 1
+        else:
+            metricas['erros_api'] += 1
+            metricas['ceps_com_erro'].append(cep)
+            continue
+        novos.append((cep, dados))
+    _gravar_ceps_cache(novos)
+    
+    _cache_ceps.contar('hits_memoria', metricas['hits_memoria'])
+    _cache_ceps.contar('hits_referencia', metricas['hits_referencia'])
+    _cache_ceps.contar('hits_banco', metricas['hits_banco'])
+    
+    metricas['taxa_hit'] = round((len(distintos) - metricas['consultas_api']) / len(distintos), 4) if distintos else 0.0
+    metricas['tempo_segundos'] = round(time.time() - inicio, 3)
+    print(f"[ENRIQUECIMENTO] Prefetch de CEPs: {metricas['distintos']} distintos, "
+          f"{metricas['hits_memoria']} memória, {metricas['hits_referencia']} referência, {metricas['hits_banco']} banco, "
+          f"{metricas['consultas_api']} API ({metricas['tempo_segundos']}s)")
+    return metricas
+
+
+def _gravar_ceps_cache(resultados: List[Tuple[str, Optional[Dict]]]):
+    """
+    Grava no modulo2_cache_ceps (uma transação) e no cache em memória os resultados
+    da API: (cep, dados) para CEP válido ou (cep, None) para CEP inexistente.
+    """
+    if not resultados:
+        return
+    
+    validos = [(cep, *(dados.get(campo) for campo in _CAMPOS_CEP)) for cep, dados in resultados if dados]
+    invalidos = [(cep,) for cep, dados in resultados if not dados]
+    
+    for cep, dados in resultados:
+        if dados:
+            _cache_ceps.set(cep, {'cep': cep, **{campo: dados.get(campo) for campo in _CAMPOS_CEP}})
+        else:
+            _cache_ceps.set(cep, None, time.time() + CEP_TTL_INVALIDO)
+    
+    conn = None
     try:
         conn = get_conn()
         cursor = conn.cursor()
         
-        cursor.execute("""
+        cursor.executemany("""
             INSERT INTO modulo2_cache_ceps 
             (cep, logradouro, complemento, bairro, localidade, uf, ddd, ibge, valido)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)
@@ -118,45 +373,25 @@ def _cachear_cep(cep: str, dados: Dict):
                 ibge = excluded.ibge,
                 valido = 1,
                 consultado_em = datetime('now')
-        """, (
-            cep,
-            dados.get('logradouro'),
-            dados.get('complemento'),
-            dados.get('bairro'),
-            dados.get('localidade'),
-            dados.get('uf'),
-            dados.get('ddd'),
-            dados.get('ibge')
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        """, validos)
         
-    except Exception as e:
-        print(f"[ENRIQUECIMENTO] Erro ao cachear CEP: {e}")
-
-
-def _cachear_cep_invalido(cep: str):
-    """Marca CEP como inválido no cache para não consultar novamente"""
-    try:
-        conn = get_conn()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
+        # Inválidos: marca para não consultar de novo até vencer o TTL
+        cursor.executemany("""
             INSERT INTO modulo2_cache_ceps (cep, valido)
             VALUES (?, 0)
             ON CONFLICT(cep) DO UPDATE SET
                 valido = 0,
                 consultado_em = datetime('now')
-        """, (cep,))
+        """, invalidos)
         
         conn.commit()
         cursor.close()
-        conn.close()
         
     except Exception as e:
-        print(f"[ENRIQUECIMENTO] Erro ao cachear CEP inválido: {e}")
+        print(f"[ENRIQUECIMENTO] Erro ao cachear CEPs: {e}")
+    finally:
+        if conn:
+            conn.close()
 
 
 # ============================================
@@ -178,41 +413,64 @@ def buscar_posto_similar(nome: str = None, endereco: str = None, cidade: str = N
     Returns:
         Dict com dados do posto mais similar ou None
     """
-    conn = get_conn()
-    cursor = conn.cursor()
+    cep_limpo = re.sub(r'\D', '', cep) if cep else None
     
-    cursor.execute("""
-        SELECT id, codigo, nomecli, nomepos, end, bairro, cep, nomecid, estado
-        FROM modulo2_postos_trabalho
-    """)
+    nome_norm = normalizar_forte(nome) if nome else ""
+    end_norm = normalizar_forte(endereco) if endereco else ""
+    cidade_norm = normalizar_forte(cidade) if cidade else ""
     
-    postos = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    # Sem CEP igual o score máximo é 60 (nome 35 + endereço 15 + cidade 10):
+    # acima disso só os postos do mesmo CEP podem atingir o threshold, que saem
+    # do índice de cep_digitos já com as colunas normalizadas (sem montar o índice
+    # em memória nem ler a tabela inteira)
+    if threshold > 60:
+        from .matcher import trigramas
+        
+        candidatos = buscar_postos_por_cep(cep_limpo) if cep else []
+        campos_por_id = {
+            p["id"]: {"nomepos": p["nomepos_norm"], "end": p["end_norm"], "nomecid": p["nomecid_norm"]}
+            for p in candidatos
+        }
+        
+        # Mesma similaridade de PostoMatcher.similaridade_por_posto, só para os candidatos
+        similaridade_nome = {}
+        consulta = trigramas(limpar_posto(nome)) if nome else set()
+        for p in candidatos if consulta else []:
+            trgm_posto = trigramas(limpar_posto(p["nomepos"]))
+            comuns = len(consulta & trgm_posto)
+            if comuns:
+                similaridade_nome[p["id"]] = comuns / (len(consulta) + len(trgm_posto) - comuns)
+        
+        colunas_busca = {nome_coluna for nome_coluna, _ in COLUNAS_BUSCA_POSTO}
+        candidatos = [{k: v for k, v in p.items() if k not in colunas_busca} for p in candidatos]
+    else:
+        # Índice de postos em memória (sem ler a tabela inteira a cada chamada)
+        from .matcher import get_posto_matcher
+        matcher = get_posto_matcher()
+        
+        candidatos = sorted(matcher.postos, key=lambda p: p["id"])
+        campos_por_id = {p["id"]: matcher.campos(p) for p in candidatos}
+        similaridade_nome = matcher.similaridade_por_posto(nome) if nome else {}
     
-    if not postos:
+    if not candidatos:
         return None
     
     melhor_match = None
     melhor_score = 0
     
-    for posto in postos:
-        posto_id, codigo, nomecli, nomepos, end_posto, bairro_posto, cep_posto, cidade_posto, uf = posto
+    for posto in candidatos:
+        campos = campos_por_id[posto["id"]]
         
         score = 0
         
         # Match por CEP (peso alto - 40 pontos)
-        if cep and cep_posto:
-            cep_limpo = re.sub(r'\D', '', cep)
-            cep_posto_limpo = re.sub(r'\D', '', cep_posto)
-            
-            if cep_limpo == cep_posto_limpo:
+        if cep and posto.get("cep"):
+            if cep_limpo == re.sub(r'\D', '', str(posto["cep"])):
                 score += 40
         
         # Match por nome do posto (peso médio-alto - 35 pontos)
-        if nome and nomepos:
-            nome_norm = normalizar_forte(nome)
-            nomepos_norm = normalizar_forte(nomepos)
+        if nome and posto.get("nomepos"):
+            nomepos_norm = campos["nomepos"]
             
             if nome_norm and nomepos_norm:
                 # Match exato
@@ -221,47 +479,27 @@ def buscar_posto_similar(nome: str = None, endereco: str = None, cidade: str = N
                 # Substring
                 elif nome_norm in nomepos_norm or nomepos_norm in nome_norm:
                     score += 25
-                # Palavras em comum
+                # Nome parecido (trigramas: erros de digitação, abreviações, palavras fora de ordem)
                 else:
-                    palavras_nome = set(nome_norm.split())
-                    palavras_posto = set(nomepos_norm.split())
-                    if palavras_nome and palavras_posto:
-                        palavras_comuns = palavras_nome & palavras_posto
-                        if palavras_comuns:
-                            score += int(len(palavras_comuns) / max(len(palavras_nome), len(palavras_posto)) * 20)
+                    score += int(similaridade_nome.get(posto["id"], 0) * 20)
         
         # Match por endereço (peso médio - 15 pontos)
-        if endereco and end_posto:
-            end_norm = normalizar_forte(endereco)
-            end_posto_norm = normalizar_forte(end_posto)
+        if endereco and posto.get("end"):
+            end_posto_norm = campos["end"]
             
             if end_norm and end_posto_norm:
                 if end_norm in end_posto_norm or end_posto_norm in end_norm:
                     score += 15
         
         # Match por cidade (peso baixo - 10 pontos)
-        if cidade and cidade_posto:
-            cidade_norm = normalizar_forte(cidade)
-            cidade_posto_norm = normalizar_forte(cidade_posto)
-            
-            if cidade_norm == cidade_posto_norm:
+        if cidade and posto.get("nomecid"):
+            if cidade_norm == campos["nomecid"]:
                 score += 10
         
         # Atualizar melhor match
         if score > melhor_score and score >= threshold:
             melhor_score = score
-            melhor_match = {
-                'id': posto_id,
-                'codigo': codigo,
-                'nomecli': nomecli,
-                'nomepos': nomepos,
-                'end': end_posto,
-                'bairro': bairro_posto,
-                'cep': cep_posto,
-                'nomecid': cidade_posto,
-                'estado': uf,
-                'score': score
-            }
+            melhor_match = dict(posto, score=score)
     
     return melhor_match
 
@@ -303,12 +541,13 @@ def atualizar_cep_posto(posto_id: int, cep_novo: str, nfe_id: int = None) -> boo
             conn.close()
             return False
         
-        # Atualizar CEP
+        # Atualizar CEP (e as colunas de busca derivadas dele)
+        busca_cep = colunas_busca_cep(cep_novo)
         cursor.execute("""
             UPDATE modulo2_postos_trabalho
-            SET cep = ?, updated_at = datetime('now')
+            SET cep = ?, cep_digitos = ?, cep_num = ?, cep5 = ?, updated_at = datetime('now')
             WHERE id = ?
-        """, (cep_novo, posto_id))
+        """, (cep_novo, busca_cep["cep_digitos"], busca_cep["cep_num"], busca_cep["cep5"], posto_id))
         
         # Registrar log de enriquecimento
         cursor.execute("""
@@ -317,12 +556,18 @@ def atualizar_cep_posto(posto_id: int, cep_novo: str, nfe_id: int = None) -> boo
             VALUES (?, 'cep', ?, ?, 'xml+api', ?)
         """, (posto_id, cep_antigo, cep_novo, nfe_id))
         
+        # Invalida o índice de postos em memória (matcher)
+        incrementar_versao(cursor, "postos")
+        
         conn.commit()
         cursor.close()
         conn.close()
         
         print(f"[ENRIQUECIMENTO] [OK] CEP atualizado - Posto {posto_id}: {cep_antigo or '(vazio)'} -> {cep_novo}")
         
+        # Pendências no alcance do CEP antigo ou do novo podem mudar de resultado
+        _agendar_reidentificacao([cep_antigo, cep_novo])
+        
         return True
         
     except Exception as e:
@@ -371,6 +616,138 @@ def criar_posto_sugerido(nome: str = None, logradouro: str = None, numero: str =
         return False
 
 
+def aplicar_enriquecimento_lote(acoes: List[Tuple]) -> Dict:
+    """
+    Aplica em uma transação as escritas planejadas por processar_enriquecimento_xml(aplicar=False):
+    ('cep', posto_id, cep, nfe_id) e ('sugerido', dados de criar_posto_sugerido).
+    
+    Escritas repetidas no lote são descartadas: um CEP por posto (a primeira NF-e vence)
+    e uma sugestão por nome + CEP, ignorando também as que já estão pendentes no banco.
+    
+    Returns:
+        Dict com ceps_atualizados, postos_sugeridos e sugestoes_repetidas
+    """
+    resultado = {'ceps_atualizados': 0, 'postos_sugeridos': 0, 'sugestoes_repetidas': 0}
+    ceps_alterados = []
+    
+    ceps_por_posto = {}
+    for acao in acoes:
+        if acao[0] == 'cep':
+            ceps_por_posto.setdefault(acao[1], (acao[2], acao[3]))
+    
+    sugestoes = {}
+    for acao in acoes:
+        if acao[0] == 'sugerido':
+            dados = acao[1]
+            chave = (normalizar_forte(dados.get('nome') or dados.get('logradouro') or ''), dados.get('cep'))
+            if chave in sugestoes:
+                resultado['sugestoes_repetidas'] += 1
+            else:
+                sugestoes[chave] = dados
+    
+    if not ceps_por_posto and not sugestoes:
+        return resultado
+    
+    conn = None
+    try:
+        conn = get_conn()
+        cursor = conn.cursor()
+        
+        # CEPs dos postos: só os que mudam, com log e uma única invalidação do índice de postos
+        if ceps_por_posto:
+            ids = list(ceps_por_posto)
+            cursor.execute(f"""
+                SELECT id, cep FROM modulo2_postos_trabalho WHERE id IN ({','.join('?' * len(ids))})
+            """, ids)
+            atuais = {row[0]: row[1] for row in cursor.fetchall()}
+            mudancas = [
+                (posto_id, atuais[posto_id], cep, nfe_id)
+                for posto_id, (cep, nfe_id) in ceps_por_posto.items()
+                if posto_id in atuais and atuais[posto_id] != cep
+            ]
+            
+            if mudancas:
+                atualizacoes = []
+                for posto_id, _, cep, _ in mudancas:
+                    busca_cep = colunas_busca_cep(cep)
+                    atualizacoes.append((cep, busca_cep["cep_digitos"], busca_cep["cep_num"], busca_cep["cep5"], posto_id))
+                cursor.executemany("""
+                    UPDATE modulo2_postos_trabalho
+                    SET cep = ?, cep_digitos = ?, cep_num = ?, cep5 = ?, updated_at = datetime('now')
+                    WHERE id = ?
+                """, atualizacoes)
+                cursor.executemany("""
+                    INSERT INTO modulo2_log_enriquecimento
+                    (posto_id, campo_atualizado, valor_antigo, valor_novo, fonte, nfe_id)
+                    VALUES (?, 'cep', ?, ?, 'xml+api', ?)
+                """, mudancas)
+                incrementar_versao(cursor, "postos")
+                resultado['ceps_atualizados'] = len(mudancas)
+                ceps_alterados = [cep for _, antigo, novo, _ in mudancas for cep in (antigo, novo) if cep]
+        
+        # Postos sugeridos: ignora os que já estão pendentes com o mesmo nome + CEP
+        if sugestoes:
+            ceps = list({cep for _, cep in sugestoes if cep})
+            pendentes = set()
+            for i in range(0, len(ceps), 500):
+                bloco = ceps[i:i + 500]
+                cursor.execute(f"""
+                    SELECT nome_sugerido, logradouro, cep FROM modulo2_postos_sugeridos
+                    WHERE status = 'pendente' AND cep IN ({','.join('?' * len(bloco))})
+                """, bloco)
+                for nome, logradouro, cep in cursor.fetchall():
+                    pendentes.add((normalizar_forte(nome or logradouro or ''), cep))
+            
+            novas = []
+            for chave, dados in sugestoes.items():
+                if chave in pendentes:
+                    resultado['sugestoes_repetidas'] += 1
+                    continue
+                novas.append((
+                    dados.get('nome'), dados.get('logradouro'), dados.get('numero'), dados.get('complemento'),
+                    dados.get('bairro'), dados.get('cidade'), dados.get('uf'), dados.get('cep'),
+                    dados.get('chave_nfe'), dados.get('nfe_id')
+                ))
+            cursor.executemany("""
+                INSERT INTO modulo2_postos_sugeridos
+                (nome_sugerido, logradouro, numero, complemento, bairro, cidade, uf, cep, 
+                 fonte_xml, nfe_id, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pendente')
+            """, novas)
+            resultado['postos_sugeridos'] = len(novas)
+        
+        conn.commit()
+        cursor.close()
+        
+        print(f"[ENRIQUECIMENTO] Lote aplicado: {resultado['ceps_atualizados']} CEPs de postos, "
+              f"{resultado['postos_sugeridos']} postos sugeridos ({resultado['sugestoes_repetidas']} repetidos)")
+        
+        # Pendências no alcance dos CEPs antigos ou novos podem mudar de resultado
+        _agendar_reidentificacao(ceps_alterados)
+        
+    except Exception as e:
+        print(f"[ENRIQUECIMENTO] Erro ao aplicar lote de enriquecimento: {e}")
+        if conn:
+            conn.rollback()
+        resultado['ceps_atualizados'] = resultado['postos_sugeridos'] = 0
+    finally:
+        if conn:
+            conn.close()
+    
+    return resultado
+
+
+def _agendar_reidentificacao(ceps_alterados: List[str]):
+    """Reidentificação das pendências em segundo plano (reidentificacao.py) após CEPs de postos mudarem"""
+    if not ceps_alterados:
+        return
+    try:
+        from .reidentificacao import agendar_reidentificacao
+        agendar_reidentificacao(ceps_alterados)
+    except Exception as e:
+        print(f"[ENRIQUECIMENTO] Erro ao agendar reidentificação das pendências: {e}")
+
+
 # ============================================
 # ESTATÍSTICAS E RELATÓRIOS
 # ============================================
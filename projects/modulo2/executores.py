@@ -0,0 +1,182 @@
+# projects/modulo2/executores.py
+"""
+Pools de threads por classe de carga.
+
+Endpoints `def` rodam no threadpool padrão do Starlette (compartilhado por toda a
+aplicação, inclusive login): poucas importações/exportações longas ao mesmo tempo
+ocupavam o pool e travavam a interface. Aqui cada classe tem seu pool:
+
+- "pesado": importação SEFAZ, previews, jobs de exportação, reidentificação, módulo 1,
+  ficha de presença. Poucos workers e fila curta; acima disso PoolSaturado
+  (429 com Retry-After nos endpoints).
+- "interativo": leituras do dashboard. Mais workers, fila longa.
+
+Uso:
+    @router.get("/rota")
+    @em_pool("interativo")
+    def rota(...): ...
+
+    resultado = await get_pool("pesado").executar(funcao, *args)
+
+Métricas de utilização em estatisticas_pools() (GET /api/modulo2/executores/estatisticas).
+"""
+
+import os
+import time
+import asyncio
+import threading
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+
+from fastapi import HTTPException
+
+
+POOL_PESADO_WORKERS = int(os.getenv("MODULO2_POOL_PESADO_WORKERS", "2"))
+POOL_PESADO_FILA = int(os.getenv("MODULO2_POOL_PESADO_FILA", "2"))
+POOL_INTERATIVO_WORKERS = int(os.getenv("MODULO2_POOL_INTERATIVO_WORKERS", "16"))
+POOL_INTERATIVO_FILA = int(os.getenv("MODULO2_POOL_INTERATIVO_FILA", "200"))
+
+# Segundos sugeridos ao cliente no Retry-After quando o pool está saturado
+RETRY_AFTER_SEGUNDOS = int(os.getenv("MODULO2_POOL_RETRY_AFTER", "10"))
+
+
+class PoolSaturado(Exception):
+    """Pool com todos os workers ocupados e a fila cheia"""
+
+    def __init__(self, nome: str):
+        super().__init__(f"Pool '{nome}' saturado: tente novamente em instantes")
+        self.nome = nome
+
+
+class PoolTrabalho:
+    """ThreadPoolExecutor com fila limitada e métricas de utilização"""
+
+    def __init__(self, nome: str, workers: int, max_fila: int):
+        """
+        Args:
+            nome: Nome da classe de carga (aparece nas métricas e nos nomes das threads)
+            workers: Threads do pool
+            max_fila: Tarefas aguardando além das que estão rodando
+        """
+        self.nome = nome
+        self.workers = workers
+        self.max_fila = max_fila
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"pool-{nome}")
+        self._lock = threading.Lock()
+        self._ativos = 0
+        self._pendentes = 0  # rodando + na fila
+        self._metricas = {
+            "executados": 0,
+            "rejeitados": 0,
+            "erros": 0,
+            "pico_ativos": 0,
+            "pico_fila": 0,
+            "tempo_total": 0.0,
+            "espera_total": 0.0
+        }
+
+    def submeter(self, funcao: Callable, *args, **kwargs) -> Future:
+        """Agenda funcao(*args, **kwargs). Levanta PoolSaturado se a fila estiver cheia."""
+        with self._lock:
+            if self._pendentes >= self.workers + self.max_fila:
+                self._metricas["rejeitados"] += 1
+                raise PoolSaturado(self.nome)
+            self._pendentes += 1
+            self._metricas["pico_fila"] = max(self._metricas["pico_fila"], self._pendentes - self.workers)
+        enfileirado_em = time.perf_counter()
+
+        def tarefa():
+            inicio = time.perf_counter()
+            with self._lock:
+                self._ativos += 1
+                self._metricas["pico_ativos"] = max(self._metricas["pico_ativos"], self._ativos)
+                self._metricas["espera_total"] += inicio - enfileirado_em
+            try:
+                return funcao(*args, **kwargs)
+            except BaseException:
+                with self._lock:
+                    self._metricas["erros"] += 1
+                raise
+            finally:
+                with self._lock:
+                    self._ativos -= 1
+                    self._pendentes -= 1
+                    self._metricas["executados"] += 1
+                    self._metricas["tempo_total"] += time.perf_counter() - inicio
+
+        try:
+            return self._executor.submit(tarefa)
+        except BaseException:
+            with self._lock:
+                self._pendentes -= 1
+            raise
+
+    async def executar(self, funcao: Callable, *args, **kwargs):
+        """Roda funcao no pool e espera o resultado sem bloquear o event loop"""
+        return await asyncio.wrap_future(self.submeter(funcao, *args, **kwargs))
+
+    def estatisticas(self) -> Dict:
+        with self._lock:
+            m = dict(self._metricas)
+            ativos, na_fila = self._ativos, self._pendentes - self._ativos
+        executados = m.pop("executados")
+        tempo_total = m.pop("tempo_total")
+        espera_total = m.pop("espera_total")
+        return {
+            "workers": self.workers,
+            "max_fila": self.max_fila,
+            "ativos": ativos,
+            "na_fila": na_fila,
+            "utilizacao": round(ativos / self.workers, 2) if self.workers else 0,
+            "executados": executados,
+            "tempo_medio_ms": round(tempo_total / executados * 1000, 1) if executados else 0,
+            "espera_media_ms": round(espera_total / executados * 1000, 1) if executados else 0,
+            **m
+        }
+
+
+# Instâncias globais (criadas sob demanda)
+_pools: Dict[str, PoolTrabalho] = {}
+_pools_lock = threading.Lock()
+
+_CONFIG_POOLS = {
+    "pesado": (POOL_PESADO_WORKERS, POOL_PESADO_FILA),
+    "interativo": (POOL_INTERATIVO_WORKERS, POOL_INTERATIVO_FILA),
+}
+
+
+def get_pool(nome: str) -> PoolTrabalho:
+    """Retorna o pool da classe de carga ("pesado" ou "interativo")"""
+    with _pools_lock:
+        pool = _pools.get(nome)
+        if pool is None:
+            workers, max_fila = _CONFIG_POOLS[nome]
+            pool = _pools[nome] = PoolTrabalho(nome, workers, max_fila)
+        return pool
+
+
+def estatisticas_pools() -> Dict[str, Dict]:
+    """Métricas de todos os pools configurados"""
+    return {nome: get_pool(nome).estatisticas() for nome in _CONFIG_POOLS}
+
+
+def em_pool(nome: str) -> Callable:
+    """
+    Decorator para endpoints `def`: roda o endpoint no pool da classe de carga em vez
+    do threadpool padrão. Pool saturado vira HTTP 429 com Retry-After.
+    (functools.wraps preserva a assinatura que o FastAPI usa para os parâmetros.)
+    """
+    def decorator(funcao: Callable) -> Callable:
+        @functools.wraps(funcao)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await get_pool(nome).executar(funcao, *args, **kwargs)
+            except PoolSaturado as e:
+                raise HTTPException(
+                    status_code=429,
+                    detail=str(e),
+                    headers={"Retry-After": str(RETRY_AFTER_SEGUNDOS)}
+                )
+        return wrapper
+    return decorator
@@ -0,0 +1,370 @@
+# projects/modulo2/exportacao.py
+"""
+Exportação de NFes com memória limitada (XLSX, CSV e Parquet).
+
+A exportação antiga carregava todas as linhas (com a coluna xml inteira) com
+fetchall(), montava uma lista de dicts e um DataFrame, gravava com pandas e depois
+reabria o arquivo com load_workbook só para formatar o cabeçalho. Memória e tempo
+cresciam com o período exportado.
+
+Aqui as linhas saem do cursor uma a uma (iterar_linhas_exportacao) e vão direto
+para o arquivo:
+- XLSX: openpyxl em modo write-only (linhas gravadas em disco conforme chegam),
+  cabeçalho já formatado na escrita.
+- CSV: gerador de blocos de bytes.
+- Parquet: um row group a cada LINHAS_POR_BLOCO linhas (requer pyarrow, opcional).
+
+A memória fica limitada a um bloco de linhas, qualquer que seja o tamanho da exportação.
+Os arquivos são gravados pelos jobs de jobs_exportacao.py (pool "pesado") e servidos do
+disco: o gerador de linhas segura uma conexão SQLite e por isso precisa ser consumido
+inteiro na mesma thread (não direto por StreamingResponse, que retoma o iterador em
+threads diferentes do threadpool).
+"""
+
+import io
+import csv
+import json
+import xml.etree.ElementTree as ET
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from .db import get_conn
+
+
+# Linhas por bloco de saída (CSV e row group do Parquet)
+LINHAS_POR_BLOCO = 2000
+
+OUTPUT_DIR = Path(__file__).parent / "output"
+
+# (cabeçalho, tipo) na ordem das colunas; tipo "numero" vira float no Parquet
+COLUNAS: List[Tuple[str, str]] = [
+    ("Chave NFe", "texto"),
+    ("Número NFe", "texto"),
+    ("NSU", "texto"),
+    ("Data Emissão", "texto"),
+    ("Fornecedor", "texto"),
+    ("CNPJ Fornecedor", "texto"),
+    ("Valor Total", "numero"),
+    ("ICMS", "numero"),
+    ("IPI", "numero"),
+    ("PIS", "numero"),
+    ("COFINS", "numero"),
+    ("Total Impostos", "numero"),
+    ("Destinatário Nome", "texto"),
+    ("Destinatário CNPJ", "texto"),
+    ("Destinatário Endereço", "texto"),
+    ("Destinatário Cidade", "texto"),
+    ("Destinatário UF", "texto"),
+    ("Destinatário CEP", "texto"),
+    ("Informações Complementares", "texto"),
+    ("Status", "texto"),
+    ("Cliente Identificado", "texto"),
+    ("Posto Identificado", "texto"),
+    ("Motivo Pendência", "texto"),
+]
+
+# Larguras ajustadas no XLSX (mesmas da exportação antiga)
+LARGURAS_XLSX = {"A": 50, "E": 40, "S": 60}
+
+TIPOS_MIDIA = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+# ================================
+# LEITURA
+# ================================
+
+def _consulta_exportacao(data_inicio: date, data_fim: date, apenas_pendentes: bool) -> Tuple[str, list]:
+    query = """
+        SELECT
+            n.chave_acesso,
+            n.nsu,
+            n.data_emissao,
+            n.valor_total,
+            n.nome_emitente as fornecedor,
+            n.cnpj_emitente,
+            n.cnpj_destinatario,
+            n.nome_destinatario,
+            n.endereco_entrega,
+            n.info_adicional,
+            n.status,
+            n.xml,
+            p.motivo as motivo_pendencia,
+            pt.nomecli as cliente_identificado,
+            pt.nomepos as posto_identificado
+        FROM modulo2_nfe n
+        LEFT JOIN modulo2_pendencias p ON p.chave_nfe = n.chave_acesso AND p.status = 'pendente'
+        LEFT JOIN modulo2_postos_trabalho pt ON pt.id = n.posto_id
+        WHERE 1=1
+    """
+    params = []
+
+    if data_inicio:
+        query += " AND (n.data_emissao >= ? OR n.data_emissao IS NULL)"
+        params.append(str(data_inicio))
+
+    if data_fim:
+        query += " AND (n.data_emissao <= ? OR n.data_emissao IS NULL)"
+        params.append(str(data_fim))
+
+    if apenas_pendentes:
+        query += " AND n.status = 'pendente'"
+
+    query += " ORDER BY n.data_emissao, n.nsu"
+    return query, params
+
+
+def _dados_xml(xml_str: str) -> Tuple[str, dict]:
+    """Número da NF e impostos (ICMS, IPI, PIS, COFINS) do XML"""
+    numero_nf = ""
+    impostos = {"icms": 0, "ipi": 0, "pis": 0, "cofins": 0}
+
+    if not xml_str:
+        return numero_nf, impostos
+
+    tags_impostos = {"vICMS": "icms", "vIPI": "ipi", "vPIS": "pis", "vCOFINS": "cofins"}
+    try:
+        root = ET.fromstring(xml_str)
+        for elem in root.iter():
+            tag = elem.tag.split("}")[-1] if "}" in elem.tag else elem.tag
+            if tag == "nNF":
+                numero_nf = elem.text or ""
+            elif tag in tags_impostos:
+                try:
+                    impostos[tags_impostos[tag]] = float(elem.text or 0)
+                except ValueError:
+                    pass
+    except ET.ParseError:
+        pass
+
+    return numero_nf, impostos
+
+
+def _linha_exportacao(row) -> tuple:
+    """Linha do banco -> valores na ordem de COLUNAS"""
+    numero_nf, impostos = _dados_xml(row["xml"])
+
+    # Parse endereço JSON
+    endereco = {}
+    if row["endereco_entrega"]:
+        try:
+            endereco = json.loads(row["endereco_entrega"])
+        except (ValueError, TypeError):
+            endereco = {"endereco_raw": row["endereco_entrega"]}
+        if not isinstance(endereco, dict):
+            endereco = {"endereco_raw": row["endereco_entrega"]}
+
+    # Status e motivo
+    if row["status"] == "identificado":
+        status_texto = "Identificada"
+        motivo = ""
+    else:
+        status_texto = "Pendente"
+        motivo = row["motivo_pendencia"] or "Não identificado automaticamente"
+
+    return (
+        row["chave_acesso"] or "",
+        numero_nf,
+        str(row["nsu"]) if row["nsu"] is not None else "",
+        row["data_emissao"] or "",
+        row["fornecedor"] or "",
+        row["cnpj_emitente"] or "",
+        row["valor_total"] or 0,
+        impostos["icms"],
+        impostos["ipi"],
+        impostos["pis"],
+        impostos["cofins"],
+        sum(impostos.values()),
+        row["nome_destinatario"] or endereco.get("nome", ""),
+        row["cnpj_destinatario"] or endereco.get("cnpj", ""),
+        endereco.get("endereco", ""),
+        endereco.get("cidade", ""),
+        endereco.get("uf", ""),
+        endereco.get("cep", ""),
+        (row["info_adicional"] or "")[:500],
+        status_texto,
+        row["cliente_identificado"] or "",
+        row["posto_identificado"] or "",
+        motivo
+    )
+
+
+def iterar_linhas_exportacao(
+    data_inicio: date = None,
+    data_fim: date = None,
+    apenas_pendentes: bool = False
+) -> Iterator[tuple]:
+    """
+    Linhas da exportação (na ordem de COLUNAS) lidas do cursor sob demanda.
+    A conexão fica aberta enquanto o gerador é consumido (WAL: não bloqueia escritas)
+    e só pode ser usada pela thread que a abriu: consumir o gerador inteiro em uma thread.
+    """
+    query, params = _consulta_exportacao(data_inicio, data_fim, apenas_pendentes)
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        cur.arraysize = LINHAS_POR_BLOCO
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany()
+            if not rows:
+                break
+            for row in rows:
+                yield _linha_exportacao(row)
+        cur.close()
+    finally:
+        if conn:
+            conn.close()
+
+
+def periodo_padrao(data_inicio: Optional[date], data_fim: Optional[date]) -> Tuple[date, date]:
+    """Período padrão da exportação: 01/01/2026 até hoje"""
+    return data_inicio or date(2026, 1, 1), data_fim or date.today()
+
+
+# ================================
+# ESCRITA
+# ================================
+
+def escrever_xlsx(caminho: Path, linhas: Iterator[tuple]) -> int:
+    """Grava as linhas em um XLSX write-only com cabeçalho formatado. Retorna o total de linhas."""
+    try:
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import PatternFill, Font, Alignment
+    except ImportError:
+        raise RuntimeError("openpyxl é necessário. Instale com: pip install openpyxl")
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("NFes")
+
+    # Em write-only, larguras e painel congelado precisam ser definidos antes da primeira linha
+    for coluna, largura in LARGURAS_XLSX.items():
+        ws.column_dimensions[coluna].width = largura
+    ws.freeze_panes = "A2"
+
+    header_fill = PatternFill("solid", fgColor="1a365d")
+    header_font = Font(color="FFFFFF", bold=True)
+    header_alignment = Alignment(horizontal="center")
+    cabecalho = []
+    for nome, _ in COLUNAS:
+        cell = WriteOnlyCell(ws, value=nome)
+        cell.fill = header_fill
+        cell.font = header_font
+        cell.alignment = header_alignment
+        cabecalho.append(cell)
+    ws.append(cabecalho)
+
+    total = 0
+    for linha in linhas:
+        ws.append(linha)
+        total += 1
+
+    wb.save(str(caminho))
+    return total
+
+
+def stream_csv(linhas: Iterator[tuple]) -> Iterator[bytes]:
+    """
+    CSV em blocos de LINHAS_POR_BLOCO linhas. Separador ";" e BOM UTF-8 para o Excel
+    em português abrir com acentos e colunas certas.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=";", lineterminator="\r\n")
+    writer.writerow([nome for nome, _ in COLUNAS])
+    yield b"\xef\xbb\xbf" + buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate()
+
+    pendentes = 0
+    for linha in linhas:
+        writer.writerow(linha)
+        pendentes += 1
+        if pendentes >= LINHAS_POR_BLOCO:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pendentes = 0
+
+    if pendentes:
+        yield buffer.getvalue().encode("utf-8")
+
+
+class _SaidaEmBlocos(io.RawIOBase):
+    """Arquivo só de escrita cujo conteúdo é retirado em blocos (destino do ParquetWriter)"""
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+        self._posicao = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, dados) -> int:
+        dados = bytes(dados)
+        self._partes.append(dados)
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self) -> int:
+        return self._posicao
+
+    def retirar(self) -> bytes:
+        dados = b"".join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def parquet_disponivel() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def stream_parquet(linhas: Iterator[tuple]) -> Iterator[bytes]:
+    """Parquet com um row group a cada LINHAS_POR_BLOCO linhas, devolvido em blocos conforme gravado"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("pyarrow é necessário para Parquet. Instale com: pip install pyarrow")
+
+    schema = pa.schema([
+        (nome, pa.float64() if tipo == "numero" else pa.string())
+        for nome, tipo in COLUNAS
+    ])
+    saida = _SaidaEmBlocos()
+    writer = pq.ParquetWriter(saida, schema, compression="snappy")
+
+    def gravar(bloco: List[tuple]):
+        colunas = [
+            pa.array([float(v or 0) for v in valores] if tipo == "numero" else [str(v) for v in valores],
+                     type=schema.field(i).type)
+            for i, ((_, tipo), valores) in enumerate(zip(COLUNAS, zip(*bloco)))
+        ]
+        writer.write_table(pa.Table.from_arrays(colunas, schema=schema))
+
+    bloco: List[tuple] = []
+    for linha in linhas:
+        bloco.append(linha)
+        if len(bloco) >= LINHAS_POR_BLOCO:
+            gravar(bloco)
+            bloco = []
+            yield saida.retirar()
+
+    if bloco:
+        gravar(bloco)
+    writer.close()
+    yield saida.retirar()
+
+
+def nome_arquivo_exportacao(formato: str) -> str:
+    return f"nfes_exportacao_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{formato}"
@@ -0,0 +1,141 @@
+# projects/modulo2/fila_enriquecimento.py
+"""
+Fila de enriquecimento de CEPs em segundo plano.
+
+A importação só enfileira (xml, nfe_id, chave) e segue para a identificação; uma
+thread de fundo junta as NF-es em lotes e chama processar_enriquecimento_lote():
+CEPs distintos consultados uma vez (cache/base de referência/API em paralelo) e
+escritas de CEPs de postos, log e postos sugeridos em uma transação por lote.
+Assim a vazão da importação não depende da latência da API de CEP.
+"""
+
+import os
+import time
+import queue
+import threading
+from typing import Dict, Optional
+
+
+# NF-es por lote e tempo máximo esperando o lote encher (segundos)
+ENRIQUECIMENTO_LOTE = int(os.getenv("MODULO2_ENRIQUECIMENTO_LOTE", "200"))
+ENRIQUECIMENTO_JANELA = float(os.getenv("MODULO2_ENRIQUECIMENTO_JANELA", "2"))
+# Limite da fila: acima disso novas NF-es são descartadas (a importação nunca espera)
+ENRIQUECIMENTO_MAX_FILA = int(os.getenv("MODULO2_ENRIQUECIMENTO_MAX_FILA", "10000"))
+
+
+class FilaEnriquecimento:
+    """Fila thread-safe com um worker de fundo que processa as NF-es em lotes"""
+
+    def __init__(self, tamanho_lote: int = ENRIQUECIMENTO_LOTE, janela: float = ENRIQUECIMENTO_JANELA,
+                 max_fila: int = ENRIQUECIMENTO_MAX_FILA):
+        """
+        Args:
+            tamanho_lote: Máximo de NF-es por lote
+            janela: Segundos esperando mais NF-es depois da primeira do lote
+            max_fila: Tamanho máximo da fila
+        """
+        self.tamanho_lote = tamanho_lote
+        self.janela = janela
+        self._fila: "queue.Queue[tuple]" = queue.Queue(maxsize=max_fila)
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        self._stats = {
+            'enfileiradas': 0,
+            'descartadas': 0,
+            'processadas': 0,
+            'lotes': 0,
+            'ceps_atualizados': 0,
+            'postos_sugeridos': 0,
+            'consultas_api': 0,
+            'erros': 0,
+            'ultimo_lote_segundos': None
+        }
+
+    def enfileirar(self, xml_string: str, nfe_id: int = None, chave_nfe: str = None) -> bool:
+        """Adiciona uma NF-e à fila sem bloquear. Retorna False se a fila estiver cheia."""
+        self._iniciar_worker()
+        try:
+            self._fila.put_nowait((xml_string, nfe_id, chave_nfe))
+        except queue.Full:
+            with self._lock:
+                self._stats['descartadas'] += 1
+            return False
+        with self._lock:
+            self._stats['enfileiradas'] += 1
+        return True
+
+    def _iniciar_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._executar, name="enriquecimento-ceps", daemon=True)
+                self._worker.start()
+
+    def _proximo_lote(self) -> list:
+        """Espera a primeira NF-e e junta as seguintes até encher o lote ou passar a janela"""
+        lote = [self._fila.get()]
+        limite = time.monotonic() + self.janela
+        while len(lote) < self.tamanho_lote:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self._fila.get(timeout=restante) if restante > 0 else self._fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _executar(self):
+        from .processar_enriquecimento import processar_enriquecimento_lote
+
+        while True:
+            lote = self._proximo_lote()
+            inicio = time.time()
+            try:
+                stats = processar_enriquecimento_lote(lote)
+                with self._lock:
+                    self._stats['processadas'] += stats['processados']
+                    self._stats['ceps_atualizados'] += stats['ceps_atualizados']
+                    self._stats['postos_sugeridos'] += stats['postos_sugeridos']
+                    self._stats['consultas_api'] += stats['cache_ceps']['consultas_api']
+                    self._stats['erros'] += stats['erros']
+                print(f"[ENRIQUECIMENTO] Lote de {len(lote)} NF-es: {stats['ceps_atualizados']} CEPs atualizados, "
+                      f"{stats['postos_sugeridos']} postos sugeridos ({time.time() - inicio:.2f}s)")
+            except Exception as e:
+                # Falha no lote não derruba o worker
+                print(f"[ENRIQUECIMENTO] ⚠️  Erro no lote de {len(lote)} NF-es: {e}")
+                with self._lock:
+                    self._stats['erros'] += len(lote)
+            finally:
+                with self._lock:
+                    self._stats['lotes'] += 1
+                    self._stats['ultimo_lote_segundos'] = round(time.time() - inicio, 3)
+                for _ in lote:
+                    self._fila.task_done()
+
+    def aguardar(self, timeout: float = None) -> bool:
+        """Espera a fila esvaziar (tudo processado). Retorna False se o timeout acabar antes."""
+        limite = time.monotonic() + timeout if timeout is not None else None
+        while self._fila.unfinished_tasks:
+            if limite is not None and time.monotonic() >= limite:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def estatisticas(self) -> Dict:
+        """Contadores da fila desde o início do processo"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['na_fila'] = self._fila.unfinished_tasks
+        return stats
+
+
+# Instância global da fila
+_fila_enriquecimento: Optional[FilaEnriquecimento] = None
+_fila_lock = threading.Lock()
+
+
+def get_fila_enriquecimento() -> FilaEnriquecimento:
+    """Retorna instância global da fila de enriquecimento (singleton)"""
+    global _fila_enriquecimento
+    with _fila_lock:
+        if _fila_enriquecimento is None:
+            _fila_enriquecimento = FilaEnriquecimento()
+        return _fila_enriquecimento
@@ -5,6 +5,7 @@ Processa produtos, agrupa por chave de NF, cria NFes e itens, e identifica pend
 """
 
 import json
+import re
 import sys
 from pathlib import Path
 from datetime import datetime
@@ -15,7 +16,42 @@ from collections import defaultdict
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 
-from projects.modulo2.db import get_conn, init_db
+from projects.modulo2.db import get_conn, init_db, inserir_sugestoes_pendencia, resolver_produto_id
+from projects.modulo2.progresso_importacao import get_progresso_importacao
+
+# NFes por evento de progresso (/api/modulo2/importacao/eventos, quando roda no servidor)
+LOTE_PROGRESSO = 100
+
+
+def converter_sugestoes_json(sugestoes_texto: str, end_cliente: str, matcher) -> List[dict]:
+    """
+    Converte as sugestões do JSON ("OPÇÕES: CLIENTE/POSTO (score) | ...") em postos cadastrados.
+    Nomes podem conter "/", então tenta cada divisão cliente/posto até achar o par no cadastro.
+    Sem nenhum posto reconhecido, calcula as sugestões pelo endereço do cliente (sugerir_postos).
+    """
+    from projects.modulo2.service import sugerir_postos
+    from projects.modulo2.matcher import SUGESTOES_POR_PENDENCIA
+
+    resultado = []
+    vistos = set()
+    texto = re.sub(r"^\s*[^:|]*:\s*", "", sugestoes_texto or "")
+    for opcao in texto.split("|"):
+        m = re.match(r"\s*(.+?)\s*\(([\d.]+)\)\s*$", opcao)
+        if not m:
+            continue
+        nome, score = m.group(1), float(m.group(2))
+        partes = nome.split("/")
+        for i in range(1, len(partes)):
+            posto = matcher.posto_por_nomes("/".join(partes[:i]), "/".join(partes[i:]))
+            if posto:
+                if posto["id"] not in vistos:
+                    vistos.add(posto["id"])
+                    resultado.append({"posto_id": posto["id"], "score": score, "motivo": "sugestão do arquivo JSON"})
+                break
+
+    if not resultado and end_cliente:
+        resultado = sugerir_postos(end_cliente, None, matcher=matcher)
+    return resultado[:SUGESTOES_POR_PENDENCIA]
 
 
 def carregar_json_produtos(caminho_json: Path) -> Dict:
@@ -71,6 +107,7 @@ def processar_e_salvar_produtos(dados_json: Dict, limpar_antes: bool = False):
             cur.execute("DELETE FROM modulo2_pendencias WHERE motivo LIKE '%JSON%' OR motivo IS NULL")
             cur.execute("DELETE FROM modulo2_nfe_itens WHERE nfe_id IN (SELECT id FROM modulo2_nfe WHERE chave_acesso LIKE 'JSON%')")
             cur.execute("DELETE FROM modulo2_nfe WHERE chave_acesso LIKE 'JSON%'")
+            cur.execute("DELETE FROM modulo2_pendencias_sugestoes WHERE pendencia_id NOT IN (SELECT id FROM modulo2_pendencias)")
             conn.commit()
             print("[IMPORT] Dados anteriores removidos.")
         
@@ -88,12 +125,32 @@ def processar_e_salvar_produtos(dados_json: Dict, limpar_antes: bool = False):
         
         print(f"[IMPORT] Encontradas {len(nfes_por_chave)} NFes únicas.")
         
+        # Índice de postos para converter as sugestões do JSON (montado uma vez)
+        from projects.modulo2.matcher import get_posto_matcher
+        matcher = get_posto_matcher()
+        
         # Processar cada NFe
         nfes_processadas = 0
+        nfes_identificadas = 0
         produtos_processados = 0
+        cache_produtos = {}  # chave do produto -> produto_id (dimensão de produtos)
         pendencias_criadas = 0
         
-        for chave_nf, produtos_nf in nfes_por_chave.items():
+        progresso = get_progresso_importacao()
+        progresso.iniciar("json", total=len(nfes_por_chave))
+        # Contadores já publicados (cada evento leva só o que é novo no lote)
+        publicado = {"lidas": 0, "salvas": 0, "identificadas": 0}
+        
+        def publicar_progresso(lidas: int):
+            progresso.lote(
+                buscados=lidas - publicado["lidas"],
+                salvos=nfes_processadas - publicado["salvas"],
+                identificados=nfes_identificadas - publicado["identificadas"],
+                mensagem=f"{lidas}/{len(nfes_por_chave)} NFes lidas do JSON"
+            )
+            publicado.update(lidas=lidas, salvas=nfes_processadas, identificadas=nfes_identificadas)
+        
+        for lidas, (chave_nf, produtos_nf) in enumerate(nfes_por_chave.items(), start=1):
             # Pegar o primeiro produto para dados da NFe
             primeiro_produto = produtos_nf[0]
             
@@ -165,14 +222,16 @@ def processar_e_salvar_produtos(dados_json: Dict, limpar_antes: bool = False):
                 
                 nfe_id = cur.lastrowid
                 nfes_processadas += 1
+                if status_nfe == "identificado":
+                    nfes_identificadas += 1
                 
                 # Inserir itens da NFe
                 for idx, produto in enumerate(produtos_nf, start=1):
                     cur.execute("""
                         INSERT INTO modulo2_nfe_itens (
                             nfe_id, numero_item, descricao_produto, ncm,
-                            quantidade, valor_unitario, valor_total
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                            quantidade, valor_unitario, valor_total, produto_id
+                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                     """, (
                         nfe_id,
                         idx,
@@ -180,7 +239,9 @@ def processar_e_salvar_produtos(dados_json: Dict, limpar_antes: bool = False):
                         produto.get("ncm", ""),
                         produto.get("quantidade", 0),
                         produto.get("valor_unitario", 0),
-                        produto.get("valor_total_produto", 0)
+                        produto.get("valor_total_produto", 0),
+                        resolver_produto_id(cur, produto.get("produto", ""), produto.get("ncm", ""),
+                                            cache=cache_produtos)
                     ))
                     produtos_processados += 1
                 
@@ -189,6 +250,9 @@ def processar_e_salvar_produtos(dados_json: Dict, limpar_antes: bool = False):
                     # Agrupar produtos pendentes da mesma NFe
                     produtos_pendentes = [p for p in produtos_nf if p.get("_status") == "PENDENTE"]
                     
+                    # Postos sugeridos: mesmo texto na NFe inteira, convertido uma vez por texto
+                    sugestoes_convertidas = {}
+                    
                     # Criar uma pendência por produto pendente (ou agrupar?)
                     for produto_pendente in produtos_pendentes:
                         motivo = produto_pendente.get("motivo_nao_identificado", "Não identificado")
@@ -214,15 +278,27 @@ def processar_e_salvar_produtos(dados_json: Dict, limpar_antes: bool = False):
                             motivo_completo,
                             "pendente"
                         ))
+                        pendencia_id = cur.lastrowid
+                        
+                        if sugestoes not in sugestoes_convertidas:
+                            sugestoes_convertidas[sugestoes] = converter_sugestoes_json(sugestoes, end_cliente, matcher)
+                        inserir_sugestoes_pendencia(cur, pendencia_id, sugestoes_convertidas[sugestoes])
                         pendencias_criadas += 1
             
             # Commit a cada 100 NFes para evitar transações muito longas
             if nfes_processadas % 100 == 0:
                 conn.commit()
                 print(f"[IMPORT] Processadas {nfes_processadas} NFes...")
+            
+            if lidas % LOTE_PROGRESSO == 0:
+                # O progresso é gravado por outra conexão: não pode esperar o lock desta transação
+                conn.commit()
+                publicar_progresso(lidas)
         
         # Commit final
         conn.commit()
+        publicar_progresso(len(nfes_por_chave))
+        progresso.concluir(f"{nfes_processadas} NFes importadas do JSON ({pendencias_criadas} pendências)")
         
         print(f"\n[IMPORT] Importação concluída!")
         print(f"  - NFes processadas: {nfes_processadas}")
@@ -238,6 +314,7 @@ def processar_e_salvar_produtos(dados_json: Dict, limpar_antes: bool = False):
     except Exception as e:
         conn.rollback()
         print(f"[IMPORT] ERRO: {e}")
+        get_progresso_importacao().concluir(f"Erro na importação do JSON: {e}", erro=True)
         import traceback
         traceback.print_exc()
         raise
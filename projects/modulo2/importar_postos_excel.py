@@ -423,13 +423,25 @@ def importar_postos_excel(caminho_excel: str, sheet_name: str = 0, skip_rows: in
     print(f"  [ERRO] Erros: {erros}")
     print()
     
+    # Reavaliar pendências com o cadastro novo (NF-es que agora têm posto correspondente)
+    reidentificacao = None
+    if importados or atualizados:
+        try:
+            from projects.modulo2.reidentificacao import reidentificar_pendentes
+            reidentificacao = reidentificar_pendentes(aplicar=True, salvar_relatorio=True)
+            print(f"  [OK] Pendencias resolvidas apos importacao: {reidentificacao['total_resolvidas']}")
+            print()
+        except Exception as e:
+            print(f"  [ERRO] Falha ao reidentificar pendencias: {e}")
+    
     return {
         "success": True,
         "total": len(df),
         "importados": importados,
         "atualizados": atualizados,
         "linhas_invalidas": linhas_invalidas,
-        "erros": erros
+        "erros": erros,
+        "pendencias_resolvidas": reidentificacao["total_resolvidas"] if reidentificacao else 0
     }
 
 
@@ -0,0 +1,345 @@
+# projects/modulo2/jobs_exportacao.py
+"""
+Jobs de exportação em segundo plano com reaproveitamento do arquivo gerado.
+
+Antes cada chamada de /exportar/excel gerava na hora um arquivo novo com timestamp,
+mesmo com os mesmos filtros, e a pasta output só crescia. Agora:
+
+- O id do job é um hash de formato + filtros + versão "dados" (cache_respostas).
+  O arquivo fica em output/nfes_<id>.<formato>: enquanto os dados não mudam, o
+  mesmo pedido devolve o arquivo pronto na hora (inclusive depois de reiniciar).
+- Sem arquivo válido, o job roda no pool "pesado" e a resposta traz o id para
+  acompanhar (/exportar/jobs/{id}) e baixar (/exportar/jobs/{id}/download).
+  Pedidos iguais enquanto o job roda recebem o mesmo job.
+- Depois de cada job a pasta output é limitada a EXPORTACAO_MAX_MB, removendo os
+  arquivos usados há mais tempo (reaproveitar um arquivo atualiza o mtime).
+
+Com vários workers do uvicorn cada processo tem seu JobsExportacao. O job em
+andamento é marcado em disco (output/nfes_<id>.job, criado com O_EXCL): só um
+processo gera cada arquivo, e o status é consultável de qualquer worker.
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from .exportacao import (
+    OUTPUT_DIR,
+    TIPOS_MIDIA,
+    escrever_xlsx,
+    iterar_linhas_exportacao,
+    periodo_padrao,
+    stream_csv,
+    stream_parquet
+)
+
+
+EXPORTACAO_MAX_MB = float(os.getenv("MODULO2_EXPORTACAO_MAX_MB", "500"))
+# Jobs mantidos em memória para consulta de status (os arquivos ficam na pasta output)
+JOBS_EM_MEMORIA = 200
+# Marca de job em andamento mais antiga que isso: processo morreu no meio da geração
+EXPORTACAO_JOB_EXPIRA = int(os.getenv("MODULO2_EXPORTACAO_JOB_EXPIRA", "3600"))
+
+EXTENSOES_EXPORTACAO = tuple(TIPOS_MIDIA)
+
+
+def _versao_dados():
+    try:
+        from .cache_respostas import versao_dados
+        return versao_dados()
+    except Exception:
+        return None
+
+
+def id_job_exportacao(formato: str, data_inicio: date, data_fim: date, apenas_pendentes: bool) -> str:
+    """Hash dos parâmetros + versão dos dados"""
+    texto = f"{formato}|{data_inicio}|{data_fim}|{int(bool(apenas_pendentes))}|{_versao_dados()}"
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()[:20]
+
+
+def _caminho_arquivo(job_id: str, formato: str) -> Path:
+    return OUTPUT_DIR / f"nfes_{job_id}.{formato}"
+
+
+# ================================
+# MARCA DO JOB EM DISCO (ENTRE WORKERS)
+# ================================
+
+def _caminho_marca(job_id: str) -> Path:
+    return OUTPUT_DIR / f"nfes_{job_id}.job"
+
+
+def _ler_marca(job_id: str) -> Optional[Dict]:
+    """Status gravado na marca do job; em andamento expirado vira erro"""
+    marca = _caminho_marca(job_id)
+    try:
+        idade = time.time() - marca.stat().st_mtime
+        texto = marca.read_text(encoding="utf-8")
+    except OSError:
+        return None
+    try:
+        job = json.loads(texto)
+    except ValueError:
+        # Marca recém-criada por outro processo, ainda sem conteúdo
+        job = {"id": job_id, "status": "em_andamento"}
+    if job.get("status") == "em_andamento" and idade > EXPORTACAO_JOB_EXPIRA:
+        job.update(status="erro", erro="Job interrompido (sem conclusão registrada)")
+    return job
+
+
+def _reservar_marca(job: Dict) -> bool:
+    """
+    Cria a marca do job (O_EXCL: só um processo consegue). Marca de job com erro
+    ou expirado é substituída. Retorna False se outro processo já está gerando.
+    """
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    marca = _caminho_marca(job["id"])
+    for _ in range(2):
+        try:
+            fd = os.open(marca, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            atual = _ler_marca(job["id"])
+            if atual is not None and atual.get("status") == "em_andamento":
+                return False
+            try:
+                marca.unlink()
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False)
+        return True
+    return False
+
+
+def _gravar_marca(job: Dict):
+    marca = _caminho_marca(job["id"])
+    temporario = marca.with_name(f"{marca.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+    temporario.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+    os.replace(temporario, marca)
+
+
+def gerar_arquivo_exportacao(caminho: Path, formato: str, data_inicio: date, data_fim: date,
+                             apenas_pendentes: bool) -> int:
+    """
+    Grava a exportação em `caminho` (via arquivo temporário + rename, para nunca
+    servir um arquivo pela metade). O temporário tem nome único por processo e
+    chamada: duas gerações do mesmo arquivo não escrevem uma no arquivo da outra.
+    Retorna o número de linhas.
+    """
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    temporario = caminho.with_name(f"{caminho.name}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp")
+    linhas = iterar_linhas_exportacao(data_inicio, data_fim, apenas_pendentes)
+    total = 0
+
+    def contar(iterador):
+        nonlocal total
+        for linha in iterador:
+            total += 1
+            yield linha
+
+    try:
+        if formato == "xlsx":
+            escrever_xlsx(temporario, contar(linhas))
+        else:
+            blocos = stream_csv(contar(linhas)) if formato == "csv" else stream_parquet(contar(linhas))
+            with open(temporario, "wb") as f:
+                for bloco in blocos:
+                    f.write(bloco)
+        os.replace(temporario, caminho)
+    finally:
+        if temporario.exists():
+            temporario.unlink()
+    return total
+
+
+def limitar_pasta_output(max_mb: float = EXPORTACAO_MAX_MB, manter: Optional[Path] = None) -> int:
+    """
+    Remove exportações usadas há mais tempo até a pasta caber em max_mb.
+    Não toca em temporários (.tmp) nem em `manter`. Retorna quantos arquivos removeu.
+    """
+    if not OUTPUT_DIR.exists():
+        return 0
+
+    arquivos = []
+    for f in OUTPUT_DIR.iterdir():
+        if f.is_file() and f.suffix.lstrip(".") in EXTENSOES_EXPORTACAO:
+            stat = f.stat()
+            arquivos.append((stat.st_mtime, stat.st_size, f))
+
+    limite = max_mb * 1024 * 1024
+    total = sum(tamanho for _, tamanho, _ in arquivos)
+    removidos = 0
+    for _, tamanho, f in sorted(arquivos, key=lambda a: a[0]):
+        if total <= limite:
+            break
+        if manter is not None and f == manter:
+            continue
+        try:
+            f.unlink()
+            total -= tamanho
+            removidos += 1
+        except OSError as e:
+            print(f"[EXPORTACAO] AVISO: não foi possível remover {f.name}: {e}")
+
+    if removidos:
+        print(f"[EXPORTACAO] {removidos} exportação(ões) antiga(s) removida(s) (limite {max_mb:g} MB)")
+    return removidos
+
+
+class JobsExportacao:
+    """Registro dos jobs de exportação (status em memória, resultado em disco)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def _job_pronto(self, job_id: str, formato: str, filtros: Dict, caminho: Path) -> Dict:
+        stat = caminho.stat()
+        return {
+            "id": job_id,
+            "status": "ok",
+            "formato": formato,
+            "filtros": filtros,
+            "arquivo": str(caminho),
+            "tamanho_bytes": stat.st_size,
+            "concluido_em": datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds")
+        }
+
+    def _registrar(self, job: Dict):
+        """Chamar com o lock"""
+        self._jobs[job["id"]] = job
+        self._jobs.move_to_end(job["id"])
+        while len(self._jobs) > JOBS_EM_MEMORIA:
+            self._jobs.popitem(last=False)
+
+    def solicitar(
+        self,
+        formato: str,
+        data_inicio: date = None,
+        data_fim: date = None,
+        apenas_pendentes: bool = False
+    ) -> Dict:
+        """
+        Devolve o job da exportação: pronto (arquivo válido já existe) ou em andamento
+        (agendado agora ou já rodando). Levanta PoolSaturado se o pool pesado estiver cheio.
+        """
+        from .executores import get_pool
+
+        data_inicio, data_fim = periodo_padrao(data_inicio, data_fim)
+        job_id = id_job_exportacao(formato, data_inicio, data_fim, apenas_pendentes)
+        caminho = _caminho_arquivo(job_id, formato)
+        filtros = {"data_inicio": str(data_inicio), "data_fim": str(data_fim), "apenas_pendentes": apenas_pendentes}
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job and job["status"] == "em_andamento":
+                return dict(job)
+
+            if caminho.exists():
+                # Reaproveitado: conta como uso recente para a política de remoção
+                os.utime(caminho)
+                job = self._job_pronto(job_id, formato, filtros, caminho)
+                job["reaproveitado"] = True
+                self._registrar(job)
+                return dict(job)
+
+            job = {
+                "id": job_id,
+                "status": "em_andamento",
+                "formato": formato,
+                "filtros": filtros,
+                "criado_em": datetime.now().isoformat(timespec="seconds")
+            }
+            if not _reservar_marca(job):
+                # Outro worker já está gerando este arquivo
+                return _ler_marca(job_id) or job
+            self._registrar(job)
+
+        try:
+            get_pool("pesado").submeter(self._executar, job_id, caminho, formato, data_inicio, data_fim, apenas_pendentes)
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job_id, None)
+            _caminho_marca(job_id).unlink(missing_ok=True)
+            raise
+        print(f"[EXPORTACAO] Job {job_id} agendado ({formato}, {data_inicio} a {data_fim})")
+        return dict(job)
+
+    def _executar(self, job_id: str, caminho: Path, formato: str, data_inicio: date, data_fim: date,
+                  apenas_pendentes: bool):
+        inicio = time.perf_counter()
+        try:
+            linhas = gerar_arquivo_exportacao(caminho, formato, data_inicio, data_fim, apenas_pendentes)
+            atualizacao = {
+                "status": "ok",
+                "arquivo": str(caminho),
+                "linhas": linhas,
+                "tamanho_bytes": caminho.stat().st_size,
+                "tempo_segundos": round(time.perf_counter() - inicio, 1),
+                "concluido_em": datetime.now().isoformat(timespec="seconds")
+            }
+            print(f"[EXPORTACAO] Job {job_id} concluído: {linhas} linhas em {atualizacao['tempo_segundos']}s")
+        except Exception as e:
+            print(f"[EXPORTACAO] ERRO no job {job_id}: {e}")
+            atualizacao = {"status": "erro", "erro": str(e)}
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(atualizacao)
+            final = dict(job or {"id": job_id}, **atualizacao)
+
+        # Sucesso: o próprio arquivo indica o status; erro fica na marca para os outros workers
+        try:
+            if atualizacao["status"] == "ok":
+                _caminho_marca(job_id).unlink(missing_ok=True)
+            else:
+                _gravar_marca(final)
+        except OSError as e:
+            print(f"[EXPORTACAO] AVISO: marca do job {job_id} não atualizada: {e}")
+
+        try:
+            limitar_pasta_output(manter=caminho)
+        except Exception as e:
+            print(f"[EXPORTACAO] AVISO: erro ao limitar pasta output: {e}")
+
+    def obter(self, job_id: str) -> Optional[Dict]:
+        """
+        Status do job: registro deste processo; senão o arquivo pronto pelo id
+        (depois de reiniciar) ou a marca em disco (job de outro worker).
+        """
+        if not re.fullmatch(r"[0-9a-f]{20}", job_id or ""):
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            job = dict(job) if job else None
+        if job and job["status"] == "em_andamento":
+            return job
+        for formato in EXTENSOES_EXPORTACAO:
+            caminho = _caminho_arquivo(job_id, formato)
+            if caminho.exists():
+                return dict(job or {}, **self._job_pronto(job_id, formato, (job or {}).get("filtros", {}), caminho))
+        # Erro daqui pode ter sido refeito por outro worker: a marca é mais recente
+        return _ler_marca(job_id) or job
+
+    def listar(self) -> list:
+        with self._lock:
+            return [dict(j) for j in reversed(self._jobs.values())]
+
+
+# Instância global
+_jobs_exportacao = JobsExportacao()
+
+
+def get_jobs_exportacao() -> JobsExportacao:
+    """Retorna instância global dos jobs de exportação"""
+    return _jobs_exportacao
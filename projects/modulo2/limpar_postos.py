@@ -11,7 +11,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent.parent
 if str(BASE_DIR) not in sys.path:
     sys.path.insert(0, str(BASE_DIR))
 
-from projects.modulo2.db import get_conn
+from projects.modulo2.db import get_conn, init_db, incrementar_versao
 
 
 def limpar_postos(confirmar=False):
@@ -25,6 +25,8 @@ def limpar_postos(confirmar=False):
     
     conn = None
     try:
+        # Garante tabelas de migração (modulo2_versoes)
+        init_db()
         conn = get_conn()
         cur = conn.cursor()
         
@@ -63,6 +65,7 @@ def limpar_postos(confirmar=False):
         cur.execute("DELETE FROM modulo2_postos_trabalho")
         postos_removidos = cur.rowcount
         
+        incrementar_versao(cur, "postos")
         conn.commit()
         cur.close()
         conn.close()
@@ -0,0 +1,470 @@
+"""
+Índice em memória dos postos de trabalho para identificação de NF-es.
+
+Antes, cada chamada de identificar_posto() lia todos os postos do banco e
+re-normalizava todos os nomes. O PostoMatcher mantém esses índices prontos
+e só é reconstruído quando a versão "postos" (modulo2_versoes) muda.
+"""
+import os
+import re
+import heapq
+import hashlib
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from itertools import chain
+from typing import Iterable, List, Dict, Optional, Set, Tuple
+
+from .db import listar_postos_db, obter_versao, versoes_escritas_processo
+from .normalizacao import normalizar_forte, limpar_posto
+
+
+# Intervalo mínimo entre consultas da versão no banco (escritas de outros workers)
+MATCHER_VERSAO_TTL = float(os.getenv("MODULO2_MATCHER_VERSAO_TTL", "5"))
+
+# Busca aproximada por nome (trigramas): similaridade mínima e margem sobre o 2º colocado
+SIMILARIDADE_MINIMA_POSTO = float(os.getenv("MODULO2_SIMILARIDADE_MINIMA_POSTO", "0.6"))
+MARGEM_SIMILARIDADE_POSTO = float(os.getenv("MODULO2_MARGEM_SIMILARIDADE_POSTO", "0.1"))
+
+# Pesos das referências a um posto dentro do infCpl: (campo, peso, tamanho mínimo)
+PESOS_INFCPL = (
+    ("nomepos", 100, 5),  # Match forte por nome do posto
+    ("nomecli", 50, 5),   # Match médio por nome do cliente
+    ("end", 70, 10),      # Match forte por endereço
+    ("bairro", 30, 5),    # Match fraco por bairro
+)
+PESOS_INFCPL_NOMES = PESOS_INFCPL[:2]
+
+# Sugestões de postos gravadas com cada pendência (top-k)
+SUGESTOES_POR_PENDENCIA = int(os.getenv("MODULO2_SUGESTOES_POR_PENDENCIA", "5"))
+
+# Diferença máxima da estratégia "CEP próximo" da cascata de identificação
+DIFERENCA_CEP_PROXIMO = 50
+
+
+def trigramas(texto: str) -> Set[str]:
+    """
+    Trigramas de um nome já normalizado (maiúsculas, sem acentos), palavra a palavra,
+    com dois espaços no início e um no fim de cada palavra (como no pg_trgm).
+    """
+    resultado = set()
+    for palavra in re.sub(r"[^A-Z0-9]+", " ", texto).split():
+        palavra = f"  {palavra} "
+        for i in range(len(palavra) - 2):
+            resultado.add(palavra[i:i + 3])
+    return resultado
+
+
+def cep_destino(enderDest: dict) -> str:
+    """
+    CEP do enderDest; se vier sem CEP, tenta a base de referência local pelo
+    logradouro + município (sem rede, só quando o logradouro tem um único CEP).
+    """
+    if not enderDest:
+        return ""
+    cep = enderDest.get("CEP", "")
+    if cep or not enderDest.get("xLgr") or not enderDest.get("xMun"):
+        return cep
+    
+    from .ceps_referencia import cep_por_endereco
+    cep = cep_por_endereco(enderDest["xLgr"], enderDest["xMun"], enderDest.get("UF")) or ""
+    if cep:
+        print(f"[IDENTIFICACAO] CEP {cep} obtido da base de referência pelo endereço de destino")
+    return cep
+
+
+def chave_memo_identificacao(infcpl: str, enderDest: dict) -> str:
+    """
+    Chave da memória de identificações: tudo o que a cascata de identificar_posto_com_regra
+    lê da NF-e, na forma em que lê. infCpl sem normalizar (as regras LOCAL DE ENTREGA
+    e SME usam regex sobre o texto original), CEP já resolvido por cep_destino() (cobre
+    o município/UF usados quando falta CEP) e logradouro, número e bairro em maiúsculas,
+    como nas comparações por endereço.
+    Ao mudar as regras, revisar esta chave junto.
+    """
+    ender = enderDest or {}
+    cep = cep_destino(ender)
+    partes = [
+        infcpl or "",
+        cep.zfill(8) if cep else "",
+        (ender.get("xLgr") or "").upper(),
+        (ender.get("nro") or "").upper(),
+        (ender.get("xBairro") or "").upper()
+    ]
+    return hashlib.sha1("\x1f".join(partes).encode("utf-8")).hexdigest()
+
+
+class AutomatoPadroes:
+    """
+    Autômato de Aho-Corasick: encontra, numa única passada pelo texto, todos os
+    padrões (strings normalizadas) contidos nele. O custo da busca depende do
+    tamanho do texto e do número de padrões encontrados, não do total de padrões.
+    """
+
+    def __init__(self, padroes: Iterable[str]):
+        self.padroes: List[str] = []
+        self._trans: List[Dict[str, int]] = [{}]
+        self._falha: List[int] = [0]
+        self._saida: List[int] = [-1]   # padrão que termina no nó (-1 se nenhum)
+        self._proxima_saida: List[int] = [0]  # próximo nó com saída na cadeia de falhas (0 = nenhum)
+
+        for padrao in padroes:
+            if not padrao:
+                continue
+            no = 0
+            for c in padrao:
+                prox = self._trans[no].get(c)
+                if prox is None:
+                    prox = len(self._trans)
+                    self._trans[no][c] = prox
+                    self._trans.append({})
+                    self._falha.append(0)
+                    self._saida.append(-1)
+                    self._proxima_saida.append(0)
+                no = prox
+            if self._saida[no] == -1:
+                self._saida[no] = len(self.padroes)
+                self.padroes.append(padrao)
+
+        # Links de falha em largura (BFS)
+        fila = deque(self._trans[0].values())
+        while fila:
+            no = fila.popleft()
+            for c, filho in self._trans[no].items():
+                fila.append(filho)
+                f = self._falha[no]
+                while f and c not in self._trans[f]:
+                    f = self._falha[f]
+                destino = self._trans[f].get(c, 0)
+                self._falha[filho] = destino if destino != filho else 0
+                alvo = self._falha[filho]
+                self._proxima_saida[filho] = alvo if self._saida[alvo] != -1 else self._proxima_saida[alvo]
+
+    def encontrar(self, texto: str) -> Set[str]:
+        """Conjunto dos padrões que aparecem como substring de texto"""
+        trans, falha, saida, proxima = self._trans, self._falha, self._saida, self._proxima_saida
+        achados = set()
+        vistos = set()
+        no = 0
+        for c in texto:
+            while no and c not in trans[no]:
+                no = falha[no]
+            no = trans[no].get(c, 0)
+            n = no
+            while n and n not in vistos:
+                vistos.add(n)
+                if saida[n] != -1:
+                    achados.add(self.padroes[saida[n]])
+                n = proxima[n]
+        return achados
+
+
+class PostoMatcher:
+    """Índices pré-calculados dos postos (nome normalizado, CEP e campos de desempate)"""
+
+    def __init__(self, postos: List[dict], versao: int = 0):
+        self.postos = postos
+        self.versao = versao
+        self.criado_em = time.time()
+
+        # nome do posto normalizado -> posto (último vence, como no código original)
+        self.idx_postos: Dict[str, dict] = {}
+        # CEP (8 dígitos) -> lista de postos
+        self.idx_cep: Dict[str, List[dict]] = {}
+        # id do posto -> campos normalizados usados nos desempates
+        self._campos: Dict[int, dict] = {}
+
+        for p in postos:
+            nome_limpo = limpar_posto(p.get("nomepos", ""))
+            self.idx_postos[normalizar_forte(nome_limpo)] = p
+
+            cep = str(p.get("cep", "")).zfill(8) if p.get("cep") else ""
+            if cep and cep != "00000000":
+                self.idx_cep.setdefault(cep, []).append(p)
+
+            self._campos[p["id"]] = {
+                "nomepos": normalizar_forte(p.get("nomepos", "")),
+                "nomecli": normalizar_forte(p.get("nomecli", "")),
+                "end": normalizar_forte(p.get("end", "")),
+                "bairro": normalizar_forte(p.get("bairro", "")),
+                "nomecid": normalizar_forte(p.get("nomecid", "")),
+                "end_upper": (p.get("end") or "").upper(),
+                "bairro_upper": (p.get("bairro") or "").upper(),
+            }
+
+        self._por_id = {p["id"]: p for p in postos}
+
+        # (cliente, posto) normalizados -> posto (primeiro em ordem de id vence)
+        self._idx_nomes: Dict[Tuple[str, str], dict] = {}
+        for p in sorted(postos, key=lambda x: x["id"]):
+            campos = self._campos[p["id"]]
+            self._idx_nomes.setdefault((campos["nomecli"], campos["nomepos"]), p)
+
+        # CEP só com dígitos (sem zfill) -> postos em ordem de id, como no cadastro
+        self.idx_cep_digitos: Dict[str, List[dict]] = {}
+        for p in sorted(postos, key=lambda x: x["id"]):
+            if p.get("cep"):
+                self.idx_cep_digitos.setdefault(re.sub(r"\D", "", str(p["cep"])), []).append(p)
+
+        self._montar_indice_cep_numerico()
+        self._montar_automato()
+        self._montar_indice_trigramas()
+
+    def _montar_indice_trigramas(self):
+        """Índice invertido trigrama -> nomes de posto (limpar_posto), para busca aproximada"""
+        self._nomes_trgm: List[str] = []           # nome limpo (único)
+        self._nomes_postos: List[List[dict]] = []  # postos com esse nome
+        self._nomes_qtd_trgm: List[int] = []
+        self._idx_trgm: Dict[str, List[int]] = {}
+
+        posicao = {}
+        for p in self.postos:
+            nome = limpar_posto(p.get("nomepos", ""))
+            if not nome:
+                continue
+            if nome in posicao:
+                self._nomes_postos[posicao[nome]].append(p)
+                continue
+            tris = trigramas(nome)
+            if not tris:
+                continue
+            posicao[nome] = len(self._nomes_trgm)
+            self._nomes_trgm.append(nome)
+            self._nomes_postos.append([p])
+            self._nomes_qtd_trgm.append(len(tris))
+            for t in tris:
+                self._idx_trgm.setdefault(t, []).append(posicao[nome])
+
+    def _similaridades(self, texto: str) -> Dict[int, float]:
+        """Similaridade (trigramas em comum / trigramas distintos) por índice de nome"""
+        consulta = trigramas(limpar_posto(texto))
+        if not consulta:
+            return {}
+
+        # Contagem de trigramas em comum por nome (Counter conta em C)
+        comuns = Counter(chain.from_iterable(self._idx_trgm.get(t, ()) for t in consulta))
+
+        qtd = len(consulta)
+        return {i: n / (qtd + self._nomes_qtd_trgm[i] - n) for i, n in comuns.items()}
+
+    def buscar_similares(self, texto: str, limite: int = 5, minimo: float = 0.0) -> List[Tuple[dict, float]]:
+        """
+        Postos com nome parecido com texto (erros de digitação, abreviações, palavras
+        fora de ordem). Similaridade de 0 a 1 sobre os trigramas dos nomes (limpar_posto).
+        Retorna até `limite` pares (posto, similaridade), do mais parecido para o menos.
+        """
+        pontuados = [(sim, -i) for i, sim in self._similaridades(texto).items() if sim >= minimo]
+
+        resultado = []
+        for similaridade, i in heapq.nlargest(limite, pontuados):
+            for posto in self._nomes_postos[-i]:
+                resultado.append((posto, round(similaridade, 4)))
+        return resultado[:limite]
+
+    def similaridade_por_posto(self, texto: str) -> Dict[int, float]:
+        """Similaridade de nome (0 a 1) por id de posto; postos sem trigrama em comum ficam de fora"""
+        resultado = {}
+        for i, similaridade in self._similaridades(texto).items():
+            for posto in self._nomes_postos[i]:
+                resultado[posto["id"]] = similaridade
+        return resultado
+
+    def _montar_automato(self):
+        """
+        Autômato com todos os textos normalizados que podem aparecer no infCpl:
+        chaves de idx_postos e nomepos/nomecli/end/bairro (respeitando os tamanhos mínimos).
+        """
+        # Chaves do índice por nome (>= 5 caracteres) na ordem do dicionário
+        self._chaves_nome = [k for k in self.idx_postos if len(k) >= 5]
+        self._ordem_chave = {k: i for i, k in enumerate(self._chaves_nome)}
+        # Texto único com separador: busca "texto contido na chave" via str.find
+        self._chaves_concat = "\x00".join(self._chaves_nome)
+        self._chaves_inicio = []
+        pos = 0
+        for k in self._chaves_nome:
+            self._chaves_inicio.append(pos)
+            pos += len(k) + 1
+
+        # padrão -> [(id do posto, campo)]
+        self._referencias: Dict[str, List[Tuple[int, str]]] = {}
+        for p in self.postos:
+            campos = self._campos[p["id"]]
+            for campo, _, minimo in PESOS_INFCPL:
+                valor = campos[campo]
+                if valor and len(valor) >= minimo:
+                    self._referencias.setdefault(valor, []).append((p["id"], campo))
+
+        padroes = dict.fromkeys(self._chaves_nome)
+        padroes.update(dict.fromkeys(self._referencias))
+        self.automato = AutomatoPadroes(padroes)
+
+    def encontrar(self, texto_forte: str) -> Set[str]:
+        """Textos de postos (nomes, clientes, endereços, bairros) contidos no texto normalizado"""
+        if not texto_forte:
+            return set()
+        return self.automato.encontrar(texto_forte)
+
+    def melhor_chave_por_substring(self, texto_forte: str) -> Optional[dict]:
+        """
+        Busca parcial da regra LOCAL DE ENTREGA: chave de idx_postos contida no texto
+        ou que contém o texto (ambos >= 5 caracteres). Vence o maior trecho em comum;
+        empate fica com a primeira chave na ordem de idx_postos.
+        """
+        if len(texto_forte) < 5:
+            return None
+
+        # Chaves que contêm o texto: trecho em comum = texto inteiro (maior possível)
+        pos = self._chaves_concat.find(texto_forte)
+        if pos != -1:
+            chave = self._chaves_nome[bisect_right(self._chaves_inicio, pos) - 1]
+            return self.idx_postos[chave]
+
+        # Chaves contidas no texto: vence a mais longa
+        melhor = None
+        for chave in self.encontrar(texto_forte):
+            ordem = self._ordem_chave.get(chave)
+            if ordem is None:
+                continue
+            if melhor is None or (len(chave), -ordem) > (len(melhor), -self._ordem_chave[melhor]):
+                melhor = chave
+        return self.idx_postos[melhor] if melhor else None
+
+    def pontuar_infcpl(self, encontrados: Set[str], pesos=PESOS_INFCPL) -> Dict[int, int]:
+        """Pontuação por id de posto para os textos encontrados no infCpl"""
+        campos_validos = {campo: (peso, minimo) for campo, peso, minimo in pesos}
+        scores: Dict[int, int] = {}
+        for texto in encontrados:
+            for posto_id, campo in self._referencias.get(texto, ()):
+                if campo in campos_validos:
+                    scores[posto_id] = scores.get(posto_id, 0) + campos_validos[campo][0]
+        return scores
+
+    def referencias_por_posto(self, encontrados: Set[str], pesos=PESOS_INFCPL) -> Dict[int, List[str]]:
+        """Campos de cada posto (nomepos, nomecli, end, bairro) encontrados no infCpl"""
+        campos_validos = {campo for campo, _, _ in pesos}
+        resultado: Dict[int, List[str]] = {}
+        for texto in encontrados:
+            for posto_id, campo in self._referencias.get(texto, ()):
+                if campo in campos_validos:
+                    resultado.setdefault(posto_id, []).append(campo)
+        return resultado
+
+    def score_posto(self, posto: dict, encontrados: Set[str], pesos=PESOS_INFCPL) -> int:
+        """Pontuação de um posto candidato para os textos encontrados no infCpl"""
+        campos = self._campos[posto["id"]]
+        score = 0
+        for campo, peso, minimo in pesos:
+            valor = campos[campo]
+            if valor and len(valor) >= minimo and valor in encontrados:
+                score += peso
+        return score
+
+    def _montar_indice_cep_numerico(self):
+        """
+        Índice ordenado dos CEPs de 8 dígitos como inteiros (busca por faixa com bisect).
+        A posição de cada CEP em idx_cep (ordem de inserção) é guardada para que os
+        candidatos saiam na mesma ordem dos laços originais sobre idx_cep. CEPs que
+        não têm exatamente 8 dígitos ficam fora da busca por proximidade (mesmo
+        critério de cep_num em colunas_busca_cep) e só entram na busca por prefixo.
+        """
+        self._cep_chaves = list(self.idx_cep.keys())
+
+        numericos = []             # (valor, ordem) dos CEPs regulares
+        self._cep_irregulares = [] # ordem dos CEPs que não têm exatamente 8 dígitos
+        for ordem, chave in enumerate(self._cep_chaves):
+            if len(chave) != 8 or chave.strip("0123456789"):
+                self._cep_irregulares.append(ordem)
+            else:
+                numericos.append((int(chave), ordem))
+
+        numericos.sort()
+        self._cep_valores = array("q", [v for v, _ in numericos])
+        self._cep_ordens = array("l", [o for _, o in numericos])
+
+    def candidatos_cep_proximo(self, cep_num: int, raio: int = 50) -> Tuple[Optional[int], List[dict]]:
+        """
+        Postos cujo CEP está a no máximo `raio` de cep_num.
+        Retorna (menor diferença, postos com essa diferença) ou (None, []) se não houver.
+        """
+        ini = bisect_left(self._cep_valores, cep_num - raio)
+        fim = bisect_right(self._cep_valores, cep_num + raio)
+        if ini == fim:
+            return None, []
+
+        achados = [(abs(cep_num - self._cep_valores[i]), self._cep_ordens[i]) for i in range(ini, fim)]
+        menor_diferenca = min(d for d, _ in achados)
+        ordens = sorted(o for d, o in achados if d == menor_diferenca)
+        postos = []
+        for ordem in ordens:
+            postos.extend(self.idx_cep[self._cep_chaves[ordem]])
+        return menor_diferenca, postos
+
+    def candidatos_prefixo_cep(self, cep5: str) -> List[dict]:
+        """Postos cujo CEP começa com cep5 (na ordem de idx_cep)"""
+        if len(cep5) == 5 and not cep5.strip("0123456789"):
+            base = int(cep5) * 1000
+            ini = bisect_left(self._cep_valores, base)
+            fim = bisect_right(self._cep_valores, base + 999)
+            # O índice numérico só tem CEPs de 8 dígitos; os irregulares são conferidos pelo texto
+            ordens = {self._cep_ordens[i] for i in range(ini, fim)}
+            ordens.update(o for o in self._cep_irregulares if self._cep_chaves[o].startswith(cep5))
+        else:
+            ordens = {o for o, c in enumerate(self._cep_chaves) if c.startswith(cep5)}
+
+        postos = []
+        for ordem in sorted(ordens):
+            postos.extend(self.idx_cep[self._cep_chaves[ordem]])
+        return postos
+
+    def posto_por_id(self, posto_id: int) -> Optional[dict]:
+        """Posto do índice pelo id (None se não existe mais)"""
+        return self._por_id.get(posto_id)
+
+    def posto_por_nomes(self, nomecli: str, nomepos: str) -> Optional[dict]:
+        """Posto pelo par cliente/posto (comparação normalizada), None se não existir"""
+        return self._idx_nomes.get((normalizar_forte(nomecli), normalizar_forte(nomepos)))
+
+    def campos(self, posto: dict) -> dict:
+        """Campos normalizados de um posto do índice"""
+        return self._campos[posto["id"]]
+
+    def __len__(self):
+        return len(self.postos)
+
+
+_matcher: Optional[PostoMatcher] = None
+_matcher_lock = threading.Lock()
+_ultima_checagem = 0.0
+_escritas_vistas = -1
+
+
+def get_posto_matcher(forcar: bool = False) -> PostoMatcher:
+    """
+    Retorna o matcher global, reconstruindo se a versão dos postos mudou.
+    Escritas deste processo são detectadas na hora; de outros processos, em até MATCHER_VERSAO_TTL.
+    """
+    global _matcher, _ultima_checagem, _escritas_vistas
+
+    escritas = versoes_escritas_processo()
+    if (not forcar and _matcher is not None and escritas == _escritas_vistas
+            and time.time() - _ultima_checagem < MATCHER_VERSAO_TTL):
+        return _matcher
+
+    with _matcher_lock:
+        versao = obter_versao("postos")
+        if forcar or _matcher is None or _matcher.versao != versao:
+            inicio = time.time()
+            _matcher = PostoMatcher(listar_postos_db(), versao)
+            print(f"[MATCHER] Índice de postos construído: {len(_matcher)} postos, versão {versao} ({time.time() - inicio:.3f}s)")
+        _ultima_checagem = time.time()
+        _escritas_vistas = escritas
+        return _matcher
+
+
+def invalidar_posto_matcher():
+    """Descarta o matcher global (próxima chamada reconstrói)"""
+    global _matcher
+    with _matcher_lock:
+        _matcher = None
@@ -0,0 +1,173 @@
+# projects/modulo2/normalizacao.py
+
+"""
+Normalização de textos (nomes de postos, clientes, endereços, infCpl).
+
+Antes havia cópias de normalizar_leve/normalizar_forte em service.py e utils.py,
+cada chamada fazendo NFKD + gerador em Python + regex. Aqui o resultado por
+caractere é pré-calculado em tabelas de str.translate (mesmo resultado do NFKD
+sem marcas combinantes) e valores repetidos saem de um cache LRU limitado.
+
+Para colunas do pandas use as variantes *_serie: normalizam só os valores
+distintos e reaproveitam o resultado nas linhas repetidas.
+"""
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+
+STOPWORDS_POSTO = {
+    "DIRET", "DIRETOR", "DIRETORIA", "DIR",
+    "ADMIN", "ADMINISTRACAO", "ADM", "UNIDADE"
+}
+
+# Tamanho do cache LRU por função e maior texto que vale a pena guardar
+NORMALIZACAO_CACHE_TAMANHO = int(os.getenv("MODULO2_NORMALIZACAO_CACHE", "16384"))
+NORMALIZACAO_CACHE_MAX_CARACTERES = 256
+
+_RE_NAO_ALFANUM = re.compile(r"[^A-Z0-9]")
+
+
+# ================================
+# TABELAS DE TRADUÇÃO
+# ================================
+
+def _sem_acentos(c: str) -> str:
+    """NFKD de um caractere sem as marcas combinantes (acentos, cedilha, til)"""
+    return "".join(x for x in unicodedata.normalize("NFKD", c) if not unicodedata.combining(x))
+
+
+class _TabelaTraducao(dict):
+    """
+    Tabela de str.translate (código -> texto) calculada sob demanda: caracteres fora
+    da faixa pré-calculada são resolvidos na primeira ocorrência e ficam guardados.
+    """
+
+    def __init__(self, funcao, ate: int):
+        super().__init__()
+        self._funcao = funcao
+        for codigo in range(ate):
+            self[codigo] = funcao(chr(codigo))
+
+    def __missing__(self, codigo: int) -> str:
+        valor = self._funcao(chr(codigo))
+        self[codigo] = valor
+        return valor
+
+
+# Leve: só remove acentos (maiúsculas e strip são aplicados no texto todo, como antes)
+_TABELA_LEVE = _TabelaTraducao(_sem_acentos, 0x0250)
+# Forte: remove acentos, passa para maiúsculas e descarta o que não é A-Z/0-9.
+# str.upper() não depende de contexto, então pode ser feito caractere a caractere.
+_TABELA_FORTE = _TabelaTraducao(lambda c: _RE_NAO_ALFANUM.sub("", _sem_acentos(c).upper()), 0x0250)
+
+
+# ================================
+# FUNÇÕES
+# ================================
+
+def _leve(txt: str) -> str:
+    # Texto só ASCII não tem acentos: NFKD não muda nada
+    if txt.isascii():
+        return txt.upper().strip()
+    return txt.translate(_TABELA_LEVE).upper().strip()
+
+
+@lru_cache(maxsize=NORMALIZACAO_CACHE_TAMANHO)
+def _leve_cache(txt: str) -> str:
+    return _leve(txt)
+
+
+@lru_cache(maxsize=NORMALIZACAO_CACHE_TAMANHO)
+def _forte_cache(txt: str) -> str:
+    return txt.translate(_TABELA_FORTE)
+
+
+@lru_cache(maxsize=NORMALIZACAO_CACHE_TAMANHO)
+def _limpar_posto_cache(txt: str) -> str:
+    palavras = normalizar_leve(txt).split()
+    return " ".join(p for p in palavras if p not in STOPWORDS_POSTO)
+
+
+def normalizar_leve(txt) -> str:
+    """
+    Normalização leve: remove acentos e converte para maiúsculas.
+    Mantém espaços e pontuação.
+    """
+    if txt is None:
+        return ""
+    txt = str(txt)
+    if len(txt) > NORMALIZACAO_CACHE_MAX_CARACTERES:
+        return _leve(txt)
+    return _leve_cache(txt)
+
+
+def normalizar_forte(txt) -> str:
+    """
+    Normalização forte: remove acentos, converte para maiúsculas
+    e remove toda pontuação e espaços.
+    """
+    if txt is None:
+        return ""
+    txt = str(txt)
+    if len(txt) > NORMALIZACAO_CACHE_MAX_CARACTERES:
+        return txt.translate(_TABELA_FORTE)
+    return _forte_cache(txt)
+
+
+def limpar_posto(txt: str) -> str:
+    """normalizar_leve sem as palavras genéricas de nome de posto (STOPWORDS_POSTO)"""
+    if txt is None:
+        return ""
+    txt = str(txt)
+    if len(txt) > NORMALIZACAO_CACHE_MAX_CARACTERES:
+        return " ".join(p for p in normalizar_leve(txt).split() if p not in STOPWORDS_POSTO)
+    return _limpar_posto_cache(txt)
+
+
+def limpar_cache_normalizacao():
+    """Esvazia os caches LRU (ex: entre medições do benchmark)"""
+    _leve_cache.cache_clear()
+    _forte_cache.cache_clear()
+    _limpar_posto_cache.cache_clear()
+
+
+# ================================
+# PANDAS
+# ================================
+
+def normalizar_serie(serie, funcao=normalizar_leve):
+    """
+    Aplica `funcao` a uma Series do pandas normalizando cada valor distinto uma vez
+    (mesmo resultado de serie.apply(funcao), inclusive para NaN).
+    """
+    import numpy as np
+    import pandas as pd
+
+    # Ausentes (None, NaN, pd.NA) ficam com código -1 e são tratados um a um,
+    # porque o factorize junta todos e a função dá resultados diferentes para cada um
+    codigos, unicos = pd.factorize(serie)
+    valores = np.array([funcao(v) for v in unicos] + [None], dtype=object)
+    resultado = valores[codigos]
+    ausentes = np.flatnonzero(codigos == -1)
+    if len(ausentes):
+        originais = serie.to_numpy(dtype=object)
+        for i in ausentes:
+            resultado[i] = funcao(originais[i])
+    return pd.Series(resultado, index=serie.index, name=serie.name, dtype=object)
+
+
+def normalizar_leve_serie(serie):
+    """normalizar_leve() vetorizado para Series"""
+    return normalizar_serie(serie, normalizar_leve)
+
+
+def normalizar_forte_serie(serie):
+    """normalizar_forte() vetorizado para Series"""
+    return normalizar_serie(serie, normalizar_forte)
+
+
+def limpar_posto_serie(serie):
+    """limpar_posto() vetorizado para Series"""
+    return normalizar_serie(serie, limpar_posto)
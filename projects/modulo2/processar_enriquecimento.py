@@ -7,13 +7,16 @@ import re
 from typing import Optional, Dict, Tuple
 from .enriquecimento_ceps import (
     consultar_viacep,
+    prefetch_ceps,
     buscar_posto_similar,
     atualizar_cep_posto,
-    criar_posto_sugerido
+    criar_posto_sugerido,
+    aplicar_enriquecimento_lote
 )
 
 
-def processar_enriquecimento_xml(xml_string: str, nfe_id: int = None, chave_nfe: str = None) -> Dict:
+def processar_enriquecimento_xml(xml_string: str, nfe_id: int = None, chave_nfe: str = None,
+                                 aplicar: bool = True) -> Dict:
     """
     Processa um XML de NFe para enriquecer base de postos com CEPs
     
@@ -24,6 +27,8 @@ def processar_enriquecimento_xml(xml_string: str, nfe_id: int = None, chave_nfe:
         xml_string: String com XML da NFe
         nfe_id: ID da NFe no banco (opcional)
         chave_nfe: Chave da NFe (opcional)
+        aplicar: False = não grava; a escrita planejada vai em resultado['acao']
+                 para ser aplicada em lote (aplicar_enriquecimento_lote)
     
     Returns:
         Dict com resultado do processamento:
@@ -32,7 +37,8 @@ def processar_enriquecimento_xml(xml_string: str, nfe_id: int = None, chave_nfe:
             'cep_atualizado': bool,
             'posto_sugerido': bool,
             'posto_id': int (se encontrou),
-            'mensagem': str
+            'mensagem': str,
+            'acao': ('cep', posto_id, cep, nfe_id) ou ('sugerido', dados) (se aplicar=False)
         }
     """
     resultado = {
@@ -104,7 +110,11 @@ def processar_enriquecimento_xml(xml_string: str, nfe_id: int = None, chave_nfe:
             
             if not cep_atual or cep_atual == '' or cep_atual == '00000000':
                 # Posto não tem CEP - ATUALIZAR
-                if atualizar_cep_posto(posto_similar['id'], cep_limpo, nfe_id):
+                if not aplicar:
+                    resultado['acao'] = ('cep', posto_similar['id'], cep_limpo, nfe_id)
+                    resultado['cep_atualizado'] = True
+                    resultado['mensagem'] = f"CEP a atualizar no posto: {posto_similar['nomepos']}"
+                elif atualizar_cep_posto(posto_similar['id'], cep_limpo, nfe_id):
                     resultado['cep_atualizado'] = True
                     resultado['mensagem'] = f"CEP atualizado no posto: {posto_similar['nomepos']}"
                 else:
@@ -114,18 +124,21 @@ def processar_enriquecimento_xml(xml_string: str, nfe_id: int = None, chave_nfe:
         
         else:
             # Posto NÃO encontrado - criar sugestão
-            if criar_posto_sugerido(
-                nome=nome_posto,
-                logradouro=dados_endereco.get('logradouro'),
-                numero=dados_endereco.get('numero'),
-                complemento=dados_endereco.get('complemento'),
-                bairro=dados_endereco.get('bairro'),
-                cidade=dados_endereco.get('cidade'),
-                uf=dados_endereco.get('uf'),
-                cep=cep_limpo,
-                nfe_id=nfe_id,
-                chave_nfe=chave_nfe
-            ):
+            sugestao = {
+                'nome': nome_posto,
+                'logradouro': dados_endereco.get('logradouro'),
+                'numero': dados_endereco.get('numero'),
+                'complemento': dados_endereco.get('complemento'),
+                'bairro': dados_endereco.get('bairro'),
+                'cidade': dados_endereco.get('cidade'),
+                'uf': dados_endereco.get('uf'),
+                'cep': cep_limpo,
+                'nfe_id': nfe_id,
+                'chave_nfe': chave_nfe
+            }
+            if not aplicar or criar_posto_sugerido(**sugestao):
+                if not aplicar:
+                    resultado['acao'] = ('sugerido', sugestao)
                 resultado['posto_sugerido'] = True
                 resultado['success'] = True
                 resultado['mensagem'] = f"Novo posto sugerido: {nome_posto or dados_endereco.get('cidade')}"
@@ -249,42 +262,69 @@ def _extrair_nome_posto_de_infcpl(infcpl: str) -> Optional[str]:
 # FUNÇÃO PARA PROCESSAR EM LOTE
 # ============================================
 
-def processar_enriquecimento_lote(nfes: list, delay: float = 0.5) -> Dict:
+def extrair_ceps_nfes(nfes: list) -> list:
+    """CEPs do endereço de entrega (enderDest) de cada XML, na ordem das NF-es"""
+    ns = {'nfe': 'http://www.portalfiscal.inf.br/nfe'}
+    ceps = []
+    for xml, _, _ in nfes:
+        try:
+            cep = ET.fromstring(xml).find('.//nfe:dest/nfe:enderDest/nfe:CEP', ns)
+            if cep is not None and cep.text:
+                ceps.append(cep.text.strip())
+        except Exception:
+            continue
+    return ceps
+
+
+def processar_enriquecimento_lote(nfes: list, delay: float = None, workers: int = None) -> Dict:
     """
     Processa enriquecimento para múltiplas NFes em lote
     
+    Os CEPs distintos do lote são resolvidos antes (prefetch_ceps): cache em
+    memória, uma leitura do cache no banco e consultas paralelas à API só para
+    os que faltarem. Depois cada NF-e é avaliada sem chamadas de rede e as
+    escritas (CEPs de postos, log e postos sugeridos) são aplicadas juntas, em
+    uma transação, sem repetições.
+    
     Args:
         nfes: Lista de tuplas (xml, nfe_id, chave)
-        delay: Delay entre requisições à API (segundos)
+        delay: Intervalo mínimo entre requisições à API (segundos);
+               padrão: limite global do ViaCEP (MODULO2_VIACEP_TAXA)
+        workers: Consultas simultâneas à API (padrão: MODULO2_VIACEP_WORKERS)
     
     Returns:
-        Dict com estatísticas do processamento
+        Dict com estatísticas do processamento (inclui métricas do cache de CEPs)
     """
-    import time
+    from .rate_limiter import TokenBucket
     
     stats = {
         'total': len(nfes),
         'processados': 0,
         'ceps_atualizados': 0,
         'postos_sugeridos': 0,
+        'sugestoes_repetidas': 0,
         'erros': 0
     }
     
+    # Uma consulta por CEP distinto; a espera só acontece nas chamadas reais à API
+    limiter = TokenBucket(taxa=1.0 / delay, capacidade=1) if delay else None
+    stats['cache_ceps'] = prefetch_ceps(extrair_ceps_nfes(nfes), workers=workers, limiter=limiter)
+    
+    acoes = []
     for xml, nfe_id, chave in nfes:
-        resultado = processar_enriquecimento_xml(xml, nfe_id, chave)
+        resultado = processar_enriquecimento_xml(xml, nfe_id, chave, aplicar=False)
         
         stats['processados'] += 1
         
         if resultado['success']:
-            if resultado['cep_atualizado']:
-                stats['ceps_atualizados'] += 1
-            if resultado['posto_sugerido']:
-                stats['postos_sugeridos'] += 1
+            if resultado.get('acao'):
+                acoes.append(resultado['acao'])
         else:
             stats['erros'] += 1
-        
-        # Delay para não sobrecarregar API
-        if delay > 0:
-            time.sleep(delay)
+    
+    aplicado = aplicar_enriquecimento_lote(acoes)
+    stats['ceps_atualizados'] = aplicado['ceps_atualizados']
+    stats['postos_sugeridos'] = aplicado['postos_sugeridos']
+    stats['sugestoes_repetidas'] = aplicado['sugestoes_repetidas']
     
     return stats
@@ -0,0 +1,256 @@
+# projects/modulo2/progresso_importacao.py
+"""
+Progresso da importação em tempo real.
+
+O dashboard consultava /importacao/progresso a cada 2 segundos, mas o dicionário
+devolvido nunca era atualizado por ninguém. Aqui o pipeline de importação publica
+um evento por lote (NSU, documentos buscados, salvos e identificados, vazão e ETA)
+e os navegadores recebem os eventos por Server-Sent Events em uma única conexão
+(GET /api/modulo2/importacao/eventos).
+
+O pipeline roda em threads (pool pesado, scheduler); cada assinante SSE é uma
+asyncio.Queue do event loop e recebe os eventos via call_soon_threadsafe.
+
+Com vários workers do uvicorn a importação roda em um processo e os assinantes podem
+estar em outro. Cada evento publicado também é gravado em modulo2_progresso_importacao
+(db.py); os outros processos olham o PRAGMA data_version da sua conexão a cada
+PROGRESSO_POLL_SEGUNDOS e, quando a linha traz um evento novo, repassam aos seus
+assinantes. Vale também para importações rodadas pela linha de comando.
+"""
+
+import os
+import json
+import time
+import asyncio
+import threading
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+
+# Tamanho da fila de cada assinante; assinante lento perde eventos antigos, não trava o pipeline
+FILA_ASSINANTE = 100
+
+# Intervalo em que o stream SSE procura eventos publicados por outros processos
+PROGRESSO_POLL_SEGUNDOS = float(os.getenv("MODULO2_PROGRESSO_POLL", "1"))
+
+# Importação "em andamento" sem evento novo há mais que isso: processo morreu no meio
+PROGRESSO_EXPIRA_SEGUNDOS = int(os.getenv("MODULO2_PROGRESSO_EXPIRA", "900"))
+
+
+class ProgressoImportacao:
+    """Estado da importação em andamento + publicação de eventos para os assinantes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assinantes: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        self._seq = 0
+        self._inicio = None
+        self._estado = self._estado_inicial()
+        # Sincronização com o banco: seq do último evento já entregue e conexão por thread
+        self._lock_banco = threading.Lock()
+        self._seq_banco = 0
+        self._atualizado_banco = None
+        self._local = threading.local()
+
+    @staticmethod
+    def _estado_inicial() -> Dict:
+        return {
+            "em_andamento": False,
+            "tipo": None,
+            "processados": 0,
+            "total": 0,
+            "mensagem": "",
+            "nsu": None,
+            "buscados": 0,
+            "salvos": 0,
+            "identificados": 0,
+            "lotes": 0,
+            "docs_por_segundo": 0,
+            "eta_segundos": None,
+            "iniciado_em": None,
+            "atualizado_em": None
+        }
+
+    # ================================
+    # PUBLICAÇÃO (pipeline de importação)
+    # ================================
+
+    def iniciar(self, tipo: str, total: int = 0, mensagem: str = ""):
+        """Nova importação: zera os contadores"""
+        with self._lock:
+            self._inicio = time.perf_counter()
+            self._estado = self._estado_inicial()
+            self._estado.update({
+                "em_andamento": True,
+                "tipo": tipo,
+                "total": total or 0,
+                "mensagem": mensagem or f"Importação {tipo} iniciada",
+                "iniciado_em": datetime.now().isoformat(timespec="seconds")
+            })
+            evento = self._evento("inicio")
+        self._publicar(evento)
+
+    def lote(
+        self,
+        buscados: int = 0,
+        salvos: int = 0,
+        identificados: int = 0,
+        nsu=None,
+        total: int = None,
+        mensagem: str = None
+    ):
+        """Soma os números de um lote concluído e recalcula vazão e ETA"""
+        with self._lock:
+            e = self._estado
+            e["buscados"] += buscados
+            e["salvos"] += salvos
+            e["identificados"] += identificados
+            e["processados"] = e["salvos"]
+            e["lotes"] += 1
+            if nsu is not None:
+                e["nsu"] = str(nsu)
+            if total is not None:
+                e["total"] = total
+            if mensagem:
+                e["mensagem"] = mensagem
+
+            decorrido = time.perf_counter() - self._inicio if self._inicio else 0
+            vazao = e["processados"] / decorrido if decorrido > 0 else 0
+            e["docs_por_segundo"] = round(vazao, 1)
+            restantes = e["total"] - e["processados"]
+            e["eta_segundos"] = int(restantes / vazao) if vazao > 0 and restantes > 0 else (0 if e["total"] else None)
+            evento = self._evento("lote")
+        self._publicar(evento)
+
+    def concluir(self, mensagem: str = "", erro: bool = False):
+        """Fim da importação (com sucesso ou erro)"""
+        with self._lock:
+            self._estado["em_andamento"] = False
+            self._estado["eta_segundos"] = 0 if not erro else None
+            if mensagem:
+                self._estado["mensagem"] = mensagem
+            evento = self._evento("erro" if erro else "fim")
+        self._publicar(evento)
+
+    def _evento(self, tipo: str) -> Dict:
+        """Chamar com o lock: numera o evento e tira uma cópia do estado"""
+        self._seq += 1
+        self._estado["atualizado_em"] = datetime.now().isoformat(timespec="seconds")
+        return {"id": self._seq, "evento": tipo, "dados": dict(self._estado)}
+
+    def _publicar(self, evento: Dict):
+        """Grava o evento no banco (para os outros processos) e entrega aos assinantes daqui"""
+        from . import db
+
+        dados = json.dumps(evento["dados"], ensure_ascii=False)
+        with self._lock_banco:
+            seq = db.gravar_progresso_importacao(evento["evento"], dados, os.getpid())
+            if seq is not None:
+                # Numeração global: o mesmo evento tem o mesmo id em todos os workers
+                evento["id"] = seq
+                self._seq_banco = seq
+                self._atualizado_banco = time.time()
+        self._entregar_local(evento)
+
+    def _entregar_local(self, evento: Dict):
+        with self._lock:
+            assinantes = list(self._assinantes)
+        for loop, fila in assinantes:
+            try:
+                loop.call_soon_threadsafe(_entregar, fila, evento)
+            except RuntimeError:
+                # Event loop já encerrado
+                self.cancelar(fila)
+
+    # ================================
+    # EVENTOS DE OUTROS PROCESSOS
+    # ================================
+
+    def sincronizar(self):
+        """
+        Traz o último evento gravado por outro processo e repassa aos assinantes daqui.
+        Só lê a linha quando o PRAGMA data_version indica escrita de outra conexão.
+        """
+        from . import db
+
+        try:
+            conn = getattr(self._local, "conn", None)
+            if conn is None or getattr(self._local, "db_path", None) != db.DB_PATH:
+                conn = db.get_conn()
+                self._local.conn = conn
+                self._local.db_path = db.DB_PATH
+                self._local.data_version = None
+
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._local.data_version:
+                return
+            self._local.data_version = data_version
+            linha = db.obter_progresso_importacao(conn)
+        except Exception as e:
+            print(f"[PROGRESSO] AVISO: falha ao ler progresso do banco: {e}")
+            return
+
+        if not linha or not linha.get("dados"):
+            return
+        with self._lock_banco:
+            if linha["seq"] <= self._seq_banco:
+                return
+            self._seq_banco = linha["seq"]
+            self._atualizado_banco = linha.get("atualizado_em")
+            dados = json.loads(linha["dados"])
+            with self._lock:
+                self._estado = dados
+                self._inicio = None
+            evento = {"id": linha["seq"], "evento": linha["evento"], "dados": dict(dados)}
+        self._entregar_local(evento)
+
+    # ================================
+    # CONSULTA / ASSINATURA (endpoints)
+    # ================================
+
+    def estado(self) -> Dict:
+        self.sincronizar()
+        with self._lock:
+            estado = dict(self._estado)
+        atualizado = self._atualizado_banco
+        if estado.get("em_andamento") and atualizado and time.time() - atualizado > PROGRESSO_EXPIRA_SEGUNDOS:
+            # Processo da importação encerrou sem publicar o fim
+            estado["em_andamento"] = False
+            estado["eta_segundos"] = None
+            estado["mensagem"] = f"Importação sem atualização há mais de {PROGRESSO_EXPIRA_SEGUNDOS // 60} min"
+        return estado
+
+    def assinar(self) -> Tuple[asyncio.Queue, Dict]:
+        """Chamar de dentro do event loop. Retorna a fila do assinante e o evento com o estado atual."""
+        fila: asyncio.Queue = asyncio.Queue(maxsize=FILA_ASSINANTE)
+        atual = self.estado()
+        with self._lock:
+            self._assinantes.append((asyncio.get_running_loop(), fila))
+        return fila, {"id": self._seq_banco or self._seq, "evento": "estado", "dados": atual}
+
+    def cancelar(self, fila: asyncio.Queue):
+        with self._lock:
+            self._assinantes = [(l, f) for l, f in self._assinantes if f is not fila]
+
+    def total_assinantes(self) -> int:
+        with self._lock:
+            return len(self._assinantes)
+
+
+def _entregar(fila: asyncio.Queue, evento: Dict):
+    """Roda no event loop: fila cheia descarta o evento mais antigo"""
+    if fila.full():
+        try:
+            fila.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    fila.put_nowait(evento)
+
+
+# Instância global
+_progresso = ProgressoImportacao()
+
+
+def get_progresso_importacao() -> ProgressoImportacao:
+    """Retorna instância global do progresso da importação"""
+    return _progresso
@@ -5,8 +5,11 @@ Rate Limiter para controlar requisições ao SEFAZ e evitar penalizações.
 Limites recomendados pela SEFAZ:
 - Máximo 10 requisições por minuto por CNPJ
 - Máximo 100 requisições por hora por CNPJ
+
+Também tem um token bucket genérico (TokenBucket) usado nas consultas ao ViaCEP.
 """
 
+import os
 import time
 from collections import defaultdict
 from datetime import datetime, timedelta
@@ -224,3 +227,69 @@ def wait_before_sefaz_request(cnpj: str) -> float:
     """
     limiter = get_rate_limiter()
     return limiter.wait_if_needed(cnpj)
+
+
+# ================================
+# TOKEN BUCKET (APIs externas, ex: ViaCEP)
+# ================================
+
+class TokenBucket:
+    """
+    Limita a taxa de chamadas (tokens por segundo) permitindo rajadas de até
+    `capacidade` chamadas. Thread-safe: cada chamada reserva seu token dentro do
+    lock e dorme fora dele, então várias threads esperam em paralelo, na ordem.
+    """
+    
+    def __init__(self, taxa: float, capacidade: float = None):
+        """
+        Args:
+            taxa: Tokens por segundo (0 ou negativo = sem limite)
+            capacidade: Máximo acumulado para rajadas (padrão: max(1, taxa))
+        """
+        self.taxa = taxa
+        self.capacidade = capacidade if capacidade is not None else max(1.0, taxa)
+        self._tokens = self.capacidade
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+        self.total_esperado = 0.0
+    
+    def adquirir(self, tokens: float = 1.0) -> float:
+        """
+        Consome `tokens`, aguardando se necessário.
+        
+        Returns:
+            Tempo de espera em segundos (0 se havia token disponível)
+        """
+        if self.taxa <= 0:
+            return 0.0
+        
+        with self._lock:
+            agora = time.monotonic()
+            self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+            self._ultimo = agora
+            self._tokens -= tokens
+            espera = -self._tokens / self.taxa if self._tokens < 0 else 0.0
+            self.total_esperado += espera
+        
+        if espera > 0:
+            time.sleep(espera)
+        return espera
+
+
+_viacep_limiter: Optional[TokenBucket] = None
+
+
+def get_viacep_limiter() -> TokenBucket:
+    """
+    Token bucket global das consultas ao ViaCEP (compartilhado por todas as threads).
+    MODULO2_VIACEP_TAXA = requisições por segundo, MODULO2_VIACEP_RAJADA = rajada máxima.
+    """
+    global _viacep_limiter
+    
+    if _viacep_limiter is None:
+        _viacep_limiter = TokenBucket(
+            taxa=float(os.getenv("MODULO2_VIACEP_TAXA", "5")),
+            capacidade=float(os.getenv("MODULO2_VIACEP_RAJADA", "5"))
+        )
+    
+    return _viacep_limiter
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# projects/modulo2/reidentificacao.py
+
+"""
+Reidentificação em lote das NF-es pendentes.
+
+Quando postos são importados (importar_postos_excel) ou enriquecidos com CEP, as
+pendências antigas não eram reavaliadas. Este módulo percorre as NF-es pendentes,
+aplica identificar_posto() com o índice de postos atual e resolve o que passou a ser
+identificado, em transações por lote. O resultado é um relatório do que mudou.
+
+Depois de um enriquecimento que muda CEPs de postos (enriquecimento_ceps.py), a
+reidentificação é agendada em segundo plano (agendar_reidentificacao) e só roda a
+cascata nas NF-es cujo CEP de destino alcança um CEP alterado pelas regras de CEP.
+
+Uso:
+    python -m projects.modulo2.reidentificacao            # aplica e salva relatório
+    python -m projects.modulo2.reidentificacao --simular  # só mostra o que mudaria
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Dict, Optional, Set, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+from projects.modulo2.db import (
+    colunas_busca_cep,
+    iterar_nfes_pendentes,
+    resolver_nfes_em_lote,
+    obter_memos_identificacao,
+    salvar_memos_identificacao,
+    limpar_memos_obsoletos
+)
+from projects.modulo2.matcher import (
+    PostoMatcher,
+    get_posto_matcher,
+    chave_memo_identificacao,
+    cep_destino,
+    DIFERENCA_CEP_PROXIMO
+)
+
+
+# Abaixo disso não compensa abrir processos (custo de iniciar e montar o índice em cada um)
+MIN_NFES_PARALELO = 200
+TAMANHO_LOTE = 500
+
+
+def _identificar_lote(nfes: List[dict], matcher: PostoMatcher) -> List[Tuple[int, str, Optional[int], Optional[str]]]:
+    """Identifica um lote de NF-es. Retorna [(nfe_id, chave da memória, posto_id ou None, regra)]"""
+    from projects.modulo2.service import dados_identificacao_nfe, identificar_posto_com_regra
+
+    resultado = []
+    for nfe in nfes:
+        try:
+            infcpl, ender_dest = dados_identificacao_nfe(nfe.get("xml"), nfe.get("endereco_entrega"))
+            posto, regra = identificar_posto_com_regra(infcpl, ender_dest, matcher=matcher)
+            resultado.append((
+                nfe["id"], chave_memo_identificacao(infcpl, ender_dest),
+                posto["id"] if posto else None, regra
+            ))
+        except Exception as e:
+            print(f"[REIDENTIFICACAO] ERRO na NF-e {nfe.get('chave_acesso')}: {e}")
+            resultado.append((nfe["id"], None, None, None))
+    return resultado
+
+
+def _chaves_divergentes(resultados: List[Tuple[int, str, Optional[int], Optional[str]]]) -> set:
+    """Chaves da memória que, no mesmo lote, levaram a resultados diferentes da cascata"""
+    por_chave: Dict[str, Tuple[Optional[int], Optional[str]]] = {}
+    divergentes = set()
+    for nfe_id, chave_memo, posto_id, regra in resultados:
+        if not chave_memo:
+            continue
+        anterior = por_chave.setdefault(chave_memo, (posto_id, regra))
+        if anterior != (posto_id, regra) and chave_memo not in divergentes:
+            divergentes.add(chave_memo)
+            print(f"[REIDENTIFICACAO] ERRO: chave da memória {chave_memo[:12]} com resultados diferentes "
+                  f"({anterior} x {(posto_id, regra)} na NF-e {nfe_id}); não memorizada")
+    return divergentes
+
+
+def _ceps_busca(ceps: Iterable[str]) -> Set[int]:
+    """CEPs como número (mesma chave do idx_cep), ignorando vazios e inválidos"""
+    numeros = set()
+    for cep in ceps or ():
+        cep_num = colunas_busca_cep(cep)["cep_num"]
+        if cep_num is not None:
+            numeros.add(cep_num)
+    return numeros
+
+
+def _nfes_alcancadas(nfes: List[dict], ceps_alterados: Set[int]) -> List[dict]:
+    """
+    NF-es cujo CEP de destino pode mudar de resultado com os CEPs alterados: mesmo
+    prefixo de 5 dígitos ou diferença até DIFERENCA_CEP_PROXIMO (regras de CEP da
+    cascata). Sem CEP de destino nenhuma regra de CEP roda e a NF-e fica de fora.
+    """
+    from projects.modulo2.service import dados_identificacao_nfe
+
+    prefixos = {str(c).zfill(8)[:5] for c in ceps_alterados}
+    alcancadas = []
+    for nfe in nfes:
+        try:
+            _, ender_dest = dados_identificacao_nfe(nfe.get("xml"), nfe.get("endereco_entrega"))
+        except Exception:
+            # XML ilegível: _identificar_lote registra o erro
+            alcancadas.append(nfe)
+            continue
+        cep = cep_destino(ender_dest).zfill(8) if ender_dest else ""
+        if not cep.isdigit() or cep == "00000000":
+            continue
+        cep_num = int(cep)
+        if cep[:5] in prefixos or any(abs(cep_num - c) <= DIFERENCA_CEP_PROXIMO for c in ceps_alterados):
+            alcancadas.append(nfe)
+    return alcancadas
+
+
+# Índice de cada processo do pool (montado uma vez, a partir da mesma lista de postos)
+_matcher_worker: Optional[PostoMatcher] = None
+
+
+def _inicializar_worker(postos: List[dict], versao: int):
+    global _matcher_worker
+    _matcher_worker = PostoMatcher(postos, versao)
+
+
+def _identificar_lote_worker(nfes: List[dict]) -> List[Tuple[int, str, Optional[int], Optional[str]]]:
+    return _identificar_lote(nfes, _matcher_worker)
+
+
+def reidentificar_pendentes(
+    aplicar: bool = True,
+    ceps_alterados: Iterable[str] = None,
+    workers: int = None,
+    tamanho_lote: int = TAMANHO_LOTE,
+    salvar_relatorio: bool = False
+) -> Dict:
+    """
+    Reavalia todas as NF-es pendentes contra o cadastro de postos atual.
+
+    Args:
+        aplicar: grava as identificações (False = apenas relatório do que mudaria)
+        ceps_alterados: CEPs antigos e novos dos postos alterados; se informado, só
+            passam pela cascata as NF-es alcançadas por eles (_nfes_alcancadas)
+        workers: processos em paralelo (padrão: núcleos da máquina, até 4)
+        tamanho_lote: NF-es por lote (leitura e transação de escrita)
+        salvar_relatorio: grava o relatório em JSON na pasta output
+
+    Returns:
+        Dict com totais e a lista de alterações (NF-e -> posto)
+    """
+    inicio = time.time()
+    matcher = get_posto_matcher(forcar=True)
+    filtro_ceps = _ceps_busca(ceps_alterados) if ceps_alterados is not None else None
+    postos_por_id = {p["id"]: p for p in matcher.postos}
+
+    if workers is None:
+        workers = min(4, os.cpu_count() or 1)
+
+    # Resultados automáticos de versões anteriores dos postos não servem mais
+    if aplicar:
+        limpar_memos_obsoletos(matcher.versao)
+
+    print(f"[REIDENTIFICACAO] Iniciando ({len(matcher)} postos, versão {matcher.versao}, "
+          f"{'aplicando' if aplicar else 'simulação'})")
+
+    total_lidas = 0
+    total_analisadas = 0
+    total_resolvidas = 0
+    alteracoes = []
+    pool = None
+
+    try:
+        for lote in iterar_nfes_pendentes(tamanho_lote):
+            total_lidas += len(lote)
+            if filtro_ceps is not None:
+                lote = _nfes_alcancadas(lote, filtro_ceps)
+                if not lote:
+                    continue
+            total_analisadas += len(lote)
+
+            # Paraleliza a partir do primeiro lote cheio (pendências suficientes para compensar)
+            if pool is None and workers > 1 and len(lote) >= MIN_NFES_PARALELO:
+                # spawn: esta função também roda no servidor (APScheduler, threads do anyio,
+                # conexões SQLite abertas); fork de processo com threads pode herdar locks
+                # travados e deixar o filho parado
+                pool = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_inicializar_worker,
+                    initargs=(matcher.postos, matcher.versao)
+                )
+
+            if pool is not None:
+                fatia = max(1, len(lote) // workers)
+                partes = [lote[i:i + fatia] for i in range(0, len(lote), fatia)]
+                resultados = [r for parte in pool.map(_identificar_lote_worker, partes) for r in parte]
+            else:
+                resultados = _identificar_lote(lote, matcher)
+
+            # Mesma chave da memória tem que dar o mesmo resultado da cascata; se não der,
+            # a chave está incompleta e essa entrada não é memorizada
+            divergentes = _chaves_divergentes(resultados)
+
+            # Resoluções manuais memorizadas valem para NF-es que as regras não identificam
+            manuais = obter_memos_identificacao([c for _, c, posto_id, _ in resultados if c and posto_id is None])
+            chaves = {nfe["id"]: nfe.get("chave_acesso") for nfe in lote}
+            identificacoes = []
+            memos = []
+            for nfe_id, chave_memo, posto_id, regra in resultados:
+                if chave_memo in divergentes:
+                    chave_memo = None
+                if chave_memo and posto_id is None:
+                    memo = manuais.get(chave_memo)
+                    if memo and memo["manual"] and matcher.posto_por_id(memo["posto_id"]):
+                        posto_id, regra = memo["posto_id"], "memo:manual"
+                    else:
+                        memos.append((chave_memo, None, "nao_identificado", matcher.versao, 0))
+                elif chave_memo:
+                    memos.append((chave_memo, posto_id, regra, matcher.versao, 0))
+                if posto_id is None:
+                    continue
+                posto = postos_por_id[posto_id]
+                identificacoes.append((nfe_id, posto))
+                alteracoes.append({
+                    "nfe_id": nfe_id,
+                    "chave_nfe": chaves.get(nfe_id),
+                    "posto_id": posto_id,
+                    "codigo": posto.get("codigo"),
+                    "nomecli": posto.get("nomecli"),
+                    "nomepos": posto.get("nomepos"),
+                    "regra": regra
+                })
+
+            # Uma transação por lote
+            if aplicar and identificacoes:
+                total_resolvidas += resolver_nfes_em_lote(identificacoes)
+            if aplicar:
+                salvar_memos_identificacao(memos)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    resultado = {
+        "success": True,
+        "aplicado": aplicar,
+        "versao_postos": matcher.versao,
+        "total_lidas": total_lidas,
+        "total_analisadas": total_analisadas,
+        "total_identificadas": len(alteracoes),
+        "total_resolvidas": total_resolvidas,
+        "continuam_pendentes": total_lidas - (total_resolvidas if aplicar else len(alteracoes)),
+        "tempo_segundos": round(time.time() - inicio, 2),
+        "alteracoes": alteracoes
+    }
+
+    if salvar_relatorio and alteracoes:
+        output_dir = Path(__file__).parent / "output"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        caminho = output_dir / f"reidentificacao_{timestamp}.json"
+        with open(caminho, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        resultado["relatorio"] = str(caminho)
+
+    print(f"[REIDENTIFICACAO] Concluído: {total_lidas} pendentes lidas, {total_analisadas} analisadas, {len(alteracoes)} identificadas, "
+          f"{total_resolvidas} resolvidas ({resultado['tempo_segundos']}s)")
+    return resultado
+
+
+# ================================
+# REIDENTIFICAÇÃO APÓS ENRIQUECIMENTO
+# ================================
+# CEPs alterados enquanto uma reidentificação roda se juntam na próxima execução.
+
+_agendados_lock = threading.Lock()
+_ceps_agendados: Set[str] = set()
+_thread_agendada: Optional[threading.Thread] = None
+
+
+def agendar_reidentificacao(ceps_alterados: Iterable[str]):
+    """Agenda em segundo plano a reidentificação das NF-es alcançadas pelos CEPs alterados"""
+    global _thread_agendada
+
+    ceps = {str(c) for c in ceps_alterados or () if c}
+    if not ceps:
+        return
+    with _agendados_lock:
+        _ceps_agendados.update(ceps)
+        if _thread_agendada is not None:
+            return
+        _thread_agendada = threading.Thread(target=_executar_agendadas, name="reidentificacao", daemon=True)
+        _thread_agendada.start()
+
+
+def _executar_agendadas():
+    global _thread_agendada
+
+    while True:
+        with _agendados_lock:
+            if not _ceps_agendados:
+                _thread_agendada = None
+                return
+            ceps = set(_ceps_agendados)
+            _ceps_agendados.clear()
+        try:
+            print(f"[REIDENTIFICACAO] Agendada após enriquecimento ({len(ceps)} CEPs alterados)")
+            reidentificar_pendentes(aplicar=True, ceps_alterados=ceps)
+        except Exception as e:
+            print(f"[REIDENTIFICACAO] ERRO na reidentificação agendada: {e}")
+
+
+def main():
+    """Função principal para execução via linha de comando"""
+    from projects.modulo2.db import init_db
+
+    simular = "--simular" in sys.argv
+    init_db()
+
+    resultado = reidentificar_pendentes(aplicar=not simular, salvar_relatorio=True)
+
+    print()
+    print("=" * 70)
+    print("REIDENTIFICAÇÃO DE PENDÊNCIAS" + (" (SIMULAÇÃO)" if simular else ""))
+    print("=" * 70)
+    print(f"  NF-es pendentes analisadas: {resultado['total_analisadas']}")
+    print(f"  Identificadas agora: {resultado['total_identificadas']}")
+    print(f"  Resolvidas no banco: {resultado['total_resolvidas']}")
+    print(f"  Continuam pendentes: {resultado['continuam_pendentes']}")
+    if resultado.get("relatorio"):
+        print(f"  Relatório: {resultado['relatorio']}")
+    print()
+
+
+if __name__ == "__main__":
+    main()
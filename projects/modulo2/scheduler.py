@@ -1,11 +1,32 @@
 # projects/modulo2/scheduler.py
 
+import os
+import socket
 import schedule
 import time
 import threading
+import uuid
 from datetime import datetime
 
 from .service import importar_xmls_diario_automatico
+from .db import (
+    adquirir_lease_scheduler,
+    liberar_lease_scheduler,
+    atualizar_estado_scheduler,
+    obter_lease_scheduler
+)
+
+
+# ================================
+# ELEIÇÃO DE LÍDER (MULTI-WORKER)
+# ================================
+# Com uvicorn/gunicorn em N workers, cada processo cria seu próprio SEFAZScheduler.
+# Apenas o processo dono do lease (linha em modulo2_scheduler_lease) executa os jobs.
+# O líder renova o lease a cada LEASE_RENOVACAO_SEGUNDOS; se morrer, outro worker
+# assume quando o lease expirar (LEASE_TTL_SEGUNDOS).
+LEASE_NOME = "sefaz_scheduler"
+LEASE_TTL_SEGUNDOS = float(os.getenv("MODULO2_SCHEDULER_LEASE_TTL", "90"))
+LEASE_RENOVACAO_SEGUNDOS = float(os.getenv("MODULO2_SCHEDULER_LEASE_RENOVACAO", "20"))
 
 
 class SEFAZScheduler:
@@ -16,7 +37,12 @@ class SEFAZScheduler:
         self.thread = None
         self.xmls_disponiveis = 0
         self.ultima_verificacao = None
-        
+        self.eh_lider = False
+        # Identificador único deste processo no lease
+        self.dono_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        # Agenda própria (não usa o scheduler global da lib schedule)
+        self._agenda = schedule.Scheduler()
+    
     def job_diario(self):
         """Job executado diariamente às 00:00 - APENAS VERIFICA, NÃO IMPORTA"""
         print(f"[SCHEDULER] Verificando XMLs disponíveis - {datetime.now()}")
@@ -40,6 +66,51 @@ class SEFAZScheduler:
             import traceback
             traceback.print_exc()
             self.xmls_disponiveis = 0
+        
+        # Publicar resultado no banco para que todos os workers vejam o mesmo status
+        atualizar_estado_scheduler(
+            LEASE_NOME,
+            self.xmls_disponiveis,
+            self.ultima_verificacao.isoformat() if self.ultima_verificacao else None
+        )
+    
+    def _registrar_jobs(self):
+        """Agenda os jobs (apenas no processo líder)"""
+        self._agenda.clear()
+        # Agendar job diário às 00:00
+        self._agenda.every().day.at("00:00").do(self.job_diario)
+        print("[SCHEDULER] Job agendado: Verificação diária de novos XMLs às 00:00")
+    
+    def _renovar_lideranca(self):
+        """Adquire/renova o lease e agenda ou desagenda os jobs conforme a liderança"""
+        proxima = self.get_next_run() if self.eh_lider else None
+        eh_lider = adquirir_lease_scheduler(
+            LEASE_NOME,
+            self.dono_id,
+            LEASE_TTL_SEGUNDOS,
+            hostname=socket.gethostname(),
+            pid=os.getpid(),
+            proxima_execucao=proxima.isoformat() if proxima else None
+        )
+        
+        if eh_lider and not self.eh_lider:
+            print(f"[SCHEDULER] Este processo assumiu a liderança ({self.dono_id})")
+            self._registrar_jobs()
+            # Publicar a próxima execução já no primeiro ciclo como líder
+            proxima = self.get_next_run()
+            adquirir_lease_scheduler(
+                LEASE_NOME,
+                self.dono_id,
+                LEASE_TTL_SEGUNDOS,
+                hostname=socket.gethostname(),
+                pid=os.getpid(),
+                proxima_execucao=proxima.isoformat() if proxima else None
+            )
+        elif not eh_lider and self.eh_lider:
+            print(f"[SCHEDULER] AVISO: Liderança perdida ({self.dono_id}) - jobs desagendados")
+            self._agenda.clear()
+        
+        self.eh_lider = eh_lider
     
     def start(self):
         """Inicia o agendador em thread separada"""
@@ -48,11 +119,7 @@ class SEFAZScheduler:
             return
         
         print("[SCHEDULER] Iniciando agendador de verificação automática...")
-        
-        # Agendar job diário às 00:00
-        schedule.every().day.at("00:00").do(self.job_diario)
-        
-        print("[SCHEDULER] Job agendado: Verificação diária de novos XMLs às 00:00")
+        print(f"[SCHEDULER] Processo {self.dono_id} disputando liderança (lease {LEASE_TTL_SEGUNDOS:.0f}s)")
         
         self.running = True
         
@@ -60,8 +127,10 @@ class SEFAZScheduler:
         def run_scheduler():
             try:
                 while self.running:
-                    schedule.run_pending()
-                    time.sleep(60)  # Verificar a cada 1 minuto
+                    self._renovar_lideranca()
+                    if self.eh_lider:
+                        self._agenda.run_pending()
+                    time.sleep(LEASE_RENOVACAO_SEGUNDOS)
             except Exception as e:
                 print(f"[SCHEDULER] ERRO CRÍTICO na thread do scheduler: {e}")
                 import traceback
@@ -83,20 +152,29 @@ class SEFAZScheduler:
         """Para o agendador"""
         print("[SCHEDULER] Parando agendador...")
         self.running = False
-        schedule.clear()
+        self._agenda.clear()
         if self.thread:
             self.thread.join(timeout=5)
+        # Liberar o lease para que outro worker assuma sem esperar a expiração
+        if self.eh_lider:
+            liberar_lease_scheduler(LEASE_NOME, self.dono_id)
+            self.eh_lider = False
         print("[SCHEDULER] Agendador parado")
     
     def get_next_run(self):
-        """Retorna próxima execução agendada"""
-        jobs = schedule.jobs
+        """Retorna próxima execução agendada (neste processo)"""
+        jobs = self._agenda.jobs
         if jobs:
             return jobs[0].next_run
         return None
     
+    def resetar_xmls_disponiveis(self):
+        """Zera o contador de XMLs disponíveis (local e compartilhado)"""
+        self.xmls_disponiveis = 0
+        atualizar_estado_scheduler(LEASE_NOME, 0)
+    
     def get_status(self):
-        """Retorna status do agendador"""
+        """Retorna status do agendador (visão compartilhada entre todos os workers)"""
         # Verificar se a thread está realmente viva
         thread_alive = self.thread is not None and self.thread.is_alive()
         
@@ -106,13 +184,33 @@ class SEFAZScheduler:
             print("[SCHEDULER] AVISO: Thread do scheduler morreu! Status: running=False")
             self.running = False
         
+        lease = obter_lease_scheduler(LEASE_NOME)
+        lease_valido = bool(lease) and (lease.get("expira_em") or 0) >= time.time()
+        
+        if self.eh_lider:
+            next_run = self.get_next_run()
+            next_run = next_run.isoformat() if next_run else None
+        else:
+            next_run = lease.get("proxima_execucao") if lease_valido else None
+        
         return {
             "running": self.running and thread_alive,
             "thread_alive": thread_alive,
-            "next_run": self.get_next_run().isoformat() if self.get_next_run() else None,
-            "xmls_disponiveis": self.xmls_disponiveis,
-            "ultima_verificacao": self.ultima_verificacao.isoformat() if self.ultima_verificacao else None,
-            "jobs_count": len(schedule.jobs)
+            "next_run": next_run,
+            "xmls_disponiveis": lease.get("xmls_disponiveis", self.xmls_disponiveis) or 0,
+            "ultima_verificacao": lease.get("ultima_verificacao") or (
+                self.ultima_verificacao.isoformat() if self.ultima_verificacao else None
+            ),
+            "jobs_count": len(self._agenda.jobs),
+            "eh_lider": self.eh_lider,
+            "processo": self.dono_id,
+            "lider": {
+                "processo": lease.get("dono"),
+                "hostname": lease.get("hostname"),
+                "pid": lease.get("pid"),
+                "ativo": lease_valido,
+                "lease_expira_em": datetime.fromtimestamp(lease["expira_em"]).isoformat() if lease_valido else None
+            } if lease else None
         }
 
 
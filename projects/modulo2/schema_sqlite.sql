@@ -44,13 +44,28 @@ CREATE TABLE IF NOT EXISTS modulo2_postos_trabalho (
   estado TEXT,
   valor_orcado REAL DEFAULT 0,  -- Valor orçado mensal para o posto
   created_at TEXT DEFAULT (datetime('now')),
-  updated_at TEXT DEFAULT (datetime('now'))
+  updated_at TEXT DEFAULT (datetime('now')),
+  
+  -- Colunas de busca (mantidas por salvar_posto / atualizar_cep_posto, ver db.COLUNAS_BUSCA_POSTO)
+  cep_digitos TEXT,       -- só os dígitos do CEP
+  cep_num INTEGER,        -- CEP com 8 dígitos como número (busca por faixa)
+  cep5 TEXT,              -- prefixo de 5 dígitos do CEP
+  nomepos_chave TEXT,     -- normalizar_forte(limpar_posto(nomepos))
+  nomepos_norm TEXT,      -- normalizar_forte(nomepos)
+  nomecli_norm TEXT,
+  end_norm TEXT,
+  bairro_norm TEXT,
+  nomecid_norm TEXT
 );
 
 CREATE INDEX IF NOT EXISTS idx_mod2_postos_codigo ON modulo2_postos_trabalho(codigo);
 CREATE INDEX IF NOT EXISTS idx_mod2_postos_nomecli ON modulo2_postos_trabalho(nomecli);
 CREATE INDEX IF NOT EXISTS idx_mod2_postos_nomepos ON modulo2_postos_trabalho(nomepos);
 CREATE INDEX IF NOT EXISTS idx_mod2_postos_cep ON modulo2_postos_trabalho(cep);
+CREATE INDEX IF NOT EXISTS idx_mod2_postos_cep_digitos ON modulo2_postos_trabalho(cep_digitos);
+CREATE INDEX IF NOT EXISTS idx_mod2_postos_cep_num ON modulo2_postos_trabalho(cep_num);
+CREATE INDEX IF NOT EXISTS idx_mod2_postos_cep5 ON modulo2_postos_trabalho(cep5);
+CREATE INDEX IF NOT EXISTS idx_mod2_postos_nomepos_chave ON modulo2_postos_trabalho(nomepos_chave);
 
 -- ============================================================
 -- NF-e (Notas Fiscais Eletrônicas)
@@ -144,12 +159,30 @@ CREATE TABLE IF NOT EXISTS modulo2_nfe_itens (
   ipi_valor REAL DEFAULT 0,
   pis_valor REAL DEFAULT 0,
   cofins_valor REAL DEFAULT 0,
+  produto_id INTEGER REFERENCES modulo2_produtos(id),
   created_at TEXT DEFAULT (datetime('now')),
   FOREIGN KEY (nfe_id) REFERENCES modulo2_nfe(id) ON DELETE CASCADE
 );
 
 CREATE INDEX IF NOT EXISTS idx_mod2_nfe_itens_nfe ON modulo2_nfe_itens(nfe_id);
 CREATE INDEX IF NOT EXISTS idx_mod2_nfe_itens_ncm ON modulo2_nfe_itens(ncm);
+CREATE INDEX IF NOT EXISTS idx_mod2_nfe_itens_produto ON modulo2_nfe_itens(produto_id, nfe_id);
+
+-- ============================================================
+-- PRODUTOS (dimensão: descrição normalizada + NCM, referenciada pelos itens via produto_id)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS modulo2_produtos (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  chave TEXT NOT NULL UNIQUE,
+  descricao TEXT NOT NULL,
+  descricao_norm TEXT NOT NULL,
+  ncm TEXT,
+  codigo_produto TEXT,
+  unidade TEXT,
+  criado_em TEXT DEFAULT (datetime('now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_mod2_produtos_ncm ON modulo2_produtos(ncm);
 
 -- ============================================================
 -- ORÇADO POR POSTO (Valores orçados por posto de trabalho)
@@ -190,3 +223,107 @@ CREATE TABLE IF NOT EXISTS modulo2_importacoes_log (
 CREATE INDEX IF NOT EXISTS idx_mod2_importacoes_tipo ON modulo2_importacoes_log(tipo);
 CREATE INDEX IF NOT EXISTS idx_mod2_importacoes_status ON modulo2_importacoes_log(status);
 CREATE INDEX IF NOT EXISTS idx_mod2_importacoes_data ON modulo2_importacoes_log(data_inicio);
+
+-- ============================================================
+-- LEASE DO SCHEDULER (Eleição de líder entre workers)
+-- Tabela modulo2_scheduler_lease: definida só em db.py (SQL_TABELA_SCHEDULER_LEASE),
+-- criada pela migração do init_db
+-- ============================================================
+
+-- ============================================================
+-- VERSÕES DOS DADOS (Invalidação de caches em memória)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS modulo2_versoes (
+  chave TEXT PRIMARY KEY,      -- ex: 'postos'
+  versao INTEGER NOT NULL DEFAULT 0,
+  atualizado_em TEXT DEFAULT (datetime('now'))
+);
+
+-- ============================================================
+-- MEMÓRIA DE IDENTIFICAÇÕES (infCpl + destino -> posto)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS modulo2_memo_identificacao (
+  chave TEXT PRIMARY KEY,      -- sha1(infCpl normalizado | CEP | logradouro | número)
+  posto_id INTEGER,            -- NULL = não identificado nessa versão dos postos
+  regra TEXT,                  -- regra que identificou ('cep_exato', 'local_entrega', 'manual', ...)
+  versao_postos INTEGER NOT NULL DEFAULT 0,
+  manual INTEGER NOT NULL DEFAULT 0,  -- 1 = resolução manual (vale para qualquer versão)
+  atualizado_em TEXT DEFAULT (datetime('now'))
+);
+
+-- ============================================================
+-- SUGESTÕES DE POSTOS POR PENDÊNCIA (top-k calculado na criação)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS modulo2_pendencias_sugestoes (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  pendencia_id INTEGER NOT NULL,
+  posto_id INTEGER NOT NULL,
+  ordem INTEGER NOT NULL,      -- 1 = mais provável
+  score REAL,
+  motivo TEXT,                 -- evidências (ex: 'nome do posto no infCpl, mesmo CEP (01001000)')
+  FOREIGN KEY (pendencia_id) REFERENCES modulo2_pendencias(id),
+  FOREIGN KEY (posto_id) REFERENCES modulo2_postos_trabalho(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_mod2_pend_sugestoes_pendencia ON modulo2_pendencias_sugestoes(pendencia_id, ordem);
+
+-- ============================================================
+-- BASE DE REFERÊNCIA DE CEPs (carregada de CSV por ceps_referencia.py)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS modulo2_ceps_referencia (
+  cep TEXT PRIMARY KEY,        -- 8 dígitos
+  logradouro TEXT,
+  complemento TEXT,
+  bairro TEXT,
+  localidade TEXT,
+  uf TEXT,
+  ddd TEXT,
+  ibge TEXT,
+  logradouro_norm TEXT,        -- normalizar_forte(logradouro)
+  localidade_norm TEXT         -- normalizar_forte(localidade)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_mod2_ceps_ref_endereco ON modulo2_ceps_referencia(localidade_norm, logradouro_norm);
+
+-- ============================================================
+-- GASTOS DIÁRIOS (agregados por dia e posto, mantidos por gatilhos em modulo2_nfe)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS modulo2_gastos_diarios (
+  dia TEXT NOT NULL,           -- date(data_emissao)
+  posto_id INTEGER NOT NULL,   -- 0 = NFe sem posto identificado
+  valor REAL NOT NULL DEFAULT 0,
+  qtd_nfes INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (dia, posto_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_mod2_gastos_diarios_posto ON modulo2_gastos_diarios(posto_id, dia);
+
+-- ============================================================
+-- FORNECEDORES (emitentes com contadores totais e por mês, mantidos por gatilhos em modulo2_nfe)
+-- ============================================================
+CREATE TABLE IF NOT EXISTS modulo2_fornecedores (
+  chave TEXT PRIMARY KEY,      -- CNPJ do emitente, ou NOME:<nome> para NFes sem CNPJ
+  cnpj TEXT,
+  nome TEXT,
+  qtd_nfes INTEGER NOT NULL DEFAULT 0,
+  valor_total REAL NOT NULL DEFAULT 0,
+  qtd_identificadas INTEGER NOT NULL DEFAULT 0,
+  valor_identificado REAL NOT NULL DEFAULT 0,
+  primeira_emissao TEXT,
+  ultima_emissao TEXT
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_mod2_fornecedores_valor ON modulo2_fornecedores(valor_total);
+CREATE INDEX IF NOT EXISTS idx_mod2_fornecedores_qtd ON modulo2_fornecedores(qtd_nfes);
+
+CREATE TABLE IF NOT EXISTS modulo2_fornecedores_mensal (
+  chave TEXT NOT NULL,
+  ano_mes TEXT NOT NULL,       -- YYYY-MM de data_emissao
+  qtd_nfes INTEGER NOT NULL DEFAULT 0,
+  valor_total REAL NOT NULL DEFAULT 0,
+  qtd_identificadas INTEGER NOT NULL DEFAULT 0,
+  valor_identificado REAL NOT NULL DEFAULT 0,
+  PRIMARY KEY (chave, ano_mes)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_mod2_fornecedores_mensal_mes ON modulo2_fornecedores_mensal(ano_mes);
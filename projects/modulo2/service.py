@@ -3,8 +3,8 @@
 from datetime import date, datetime, timedelta
 from typing import Tuple, List, Dict
 import xml.etree.ElementTree as ET
+import os
 import re
-import unicodedata
 import random
 
 from .config import DEV_MODE
@@ -21,6 +21,8 @@ from .db import (
     atualizar_pendencia_com_posto,
     consultar_nfes_por_data,
     salvar_posto,
+    obter_memos_identificacao,
+    salvar_memos_identificacao,
     get_conn
 )
 
@@ -31,13 +33,32 @@ except ImportError:
     SEFAZ_ENDPOINT = None
 
 from .rate_limiter import get_rate_limiter, wait_before_sefaz_request
+from .progresso_importacao import get_progresso_importacao
+
+# XMLs por evento de progresso da importação (/importacao/eventos)
+LOTE_PROGRESSO = int(os.getenv("MODULO2_LOTE_PROGRESSO", "100"))
+from .matcher import (
+    get_posto_matcher,
+    cep_destino,
+    chave_memo_identificacao,
+    PESOS_INFCPL,
+    PESOS_INFCPL_NOMES,
+    SIMILARIDADE_MINIMA_POSTO,
+    MARGEM_SIMILARIDADE_POSTO,
+    SUGESTOES_POR_PENDENCIA,
+    DIFERENCA_CEP_PROXIMO
+)
 
 # Importar enriquecimento de CEPs
 try:
-    from .processar_enriquecimento import processar_enriquecimento_xml
-    # DESABILITADO TEMPORARIAMENTE - estava travando importação
-    ENRIQUECIMENTO_HABILITADO = False
-    print("[SERVICE] Enriquecimento automatico DESABILITADO (pode ser executado manualmente)")
+    from .fila_enriquecimento import get_fila_enriquecimento
+    # Roda em segundo plano (fila em lotes), fora do caminho da importação.
+    # Desabilitado por padrão: MODULO2_ENRIQUECIMENTO_AUTOMATICO=true para ligar
+    ENRIQUECIMENTO_HABILITADO = os.getenv("MODULO2_ENRIQUECIMENTO_AUTOMATICO", "false").lower() in ("true", "1", "yes")
+    if ENRIQUECIMENTO_HABILITADO:
+        print("[SERVICE] Enriquecimento automatico HABILITADO (fila em segundo plano)")
+    else:
+        print("[SERVICE] Enriquecimento automatico DESABILITADO (pode ser executado manualmente)")
 except ImportError:
     ENRIQUECIMENTO_HABILITADO = False
     print("[SERVICE] Modulo de enriquecimento nao disponivel")
@@ -46,37 +67,9 @@ except ImportError:
 # ================================
 # NORMALIZAÇÕES (do tratamento)
 # ================================
-
-STOPWORDS_POSTO = {
-    "DIRET", "DIRETOR", "DIRETORIA", "DIR",
-    "ADMIN", "ADMINISTRACAO", "ADM", "UNIDADE"
-}
-
-
-def normalizar_leve(txt) -> str:
-    if txt is None:
-        return ""
-    txt = str(txt)
-    txt = unicodedata.normalize("NFKD", txt)
-    txt = "".join(c for c in txt if not unicodedata.combining(c))
-    return txt.upper().strip()
-
-
-def normalizar_forte(txt) -> str:
-    if txt is None:
-        return ""
-    txt = str(txt)
-    txt = unicodedata.normalize("NFKD", txt)
-    txt = "".join(c for c in txt if not unicodedata.combining(c))
-    txt = re.sub(r"[^A-Z0-9]", "", txt.upper())
-    return txt
-
-
-def limpar_posto(txt: str) -> str:
-    txt = normalizar_leve(txt)
-    palavras = txt.split()
-    palavras = [p for p in palavras if p not in STOPWORDS_POSTO]
-    return " ".join(palavras)
+# Implementação única em normalizacao.py
+from .normalizacao import normalizar_leve, normalizar_forte, limpar_posto
+from .single_flight import coalescer
 
 
 # ================================
@@ -415,12 +408,14 @@ def _gerar_xml_mock(cnpj: str, nsu: int, data_emissao: date = None) -> str:
 
 def importar_xmls_sefaz(
     data_ini: date,
-    data_fim: date
+    data_fim: date,
+    tipo: str = "manual"
 ) -> dict:
     """
     Importa XMLs do SEFAZ para o banco de dados.
     Em DEV_MODE, gera XMLs mockados. Em produção, consulta SEFAZ real.
     Usa NSU incremental para evitar duplicatas.
+    Publica o progresso por lote em progresso_importacao (tipo: manual, inicial, diaria).
     """
     
     print(f"[SERVICE] IMPORTAR XMLs SEFAZ - Data: {data_ini} a {data_fim}")
@@ -452,6 +447,9 @@ def importar_xmls_sefaz(
         xmls_por_empresa_cache = None
         nsu_por_empresa_cache = None
     
+    progresso = get_progresso_importacao()
+    progresso.iniciar(tipo, mensagem=f"Importação {tipo}: consultando SEFAZ...")
+    
     try:
         # Buscar empresas do banco
         empresas = get_empresas()
@@ -465,6 +463,7 @@ def importar_xmls_sefaz(
             empresas = get_empresas()
         
         if not empresas:
+            progresso.concluir("Nenhuma empresa configurada", erro=True)
             return {
                 "success": False,
                 "error": "Nenhuma empresa configurada. Verifique se certificados/empresas.json existe e tem empresas válidas. Reinicie o servidor se necessário."
@@ -539,6 +538,12 @@ def importar_xmls_sefaz(
                     total_encontrado += xmls_encontrados
                     
                     print(f"[SERVICE]   - [OK] XMLs ENCONTRADOS no SEFAZ: {xmls_encontrados} (NSU até {maior_nsu})")
+                    progresso.lote(
+                        buscados=xmls_encontrados,
+                        nsu=maior_nsu,
+                        total=total_encontrado,
+                        mensagem=f"Empresa {idx}/{len(empresas)}: {xmls_encontrados} XMLs encontrados"
+                    )
                     
                     if xmls:
                         # Validar XMLs antes de salvar (prevenir dados mock)
@@ -580,12 +585,22 @@ def importar_xmls_sefaz(
                         
                         # Processar XMLs importados (tratamento)
                         print(f"[SERVICE]   - Processando XMLs (identificação e pendencias)...")
-                        for x in xmls:
-                            try:
-                                processar_xml_e_criar_pendencias(x["xml"])
-                            except Exception as e:
-                                print(f"[SERVICE]   - [AVISO] ERRO ao processar XML NSU {x['nsu']}: {e}")
-                                erros.append(f"Erro ao processar XML NSU {x['nsu']}: {str(e)}")
+                        for inicio_lote in range(0, len(xmls), LOTE_PROGRESSO):
+                            lote = xmls[inicio_lote:inicio_lote + LOTE_PROGRESSO]
+                            identificados_lote = 0
+                            for x in lote:
+                                try:
+                                    if processar_xml_e_criar_pendencias(x["xml"]):
+                                        identificados_lote += 1
+                                except Exception as e:
+                                    print(f"[SERVICE]   - [AVISO] ERRO ao processar XML NSU {x['nsu']}: {e}")
+                                    erros.append(f"Erro ao processar XML NSU {x['nsu']}: {str(e)}")
+                            progresso.lote(
+                                salvos=len(lote),
+                                identificados=identificados_lote,
+                                nsu=lote[-1]["nsu"],
+                                mensagem=f"Empresa {idx}/{len(empresas)}: processando XMLs"
+                            )
                         
                         xmls_importados = len(xmls)
                         total_importado += xmls_importados
@@ -631,6 +646,7 @@ def importar_xmls_sefaz(
         print(f"[SERVICE] {'='*60}\n")
         
         if erros and total_importado == 0:
+            progresso.concluir(f"Erros durante importação: {erros[0]}", erro=True)
             return {
                 "success": False,
                 "error": f"Erros durante importação: {'; '.join(erros[:3])}",
@@ -640,6 +656,7 @@ def importar_xmls_sefaz(
         mensagem = f"{total_importado} XMLs importados com sucesso (de {total_encontrado} encontrados no SEFAZ)"
         if erros:
             mensagem += f" ({len(erros)} aviso(s))"
+        progresso.concluir(mensagem)
         
         # Limpar cache após importação bem-sucedida
         if total_importado > 0:
@@ -658,6 +675,7 @@ def importar_xmls_sefaz(
         print(f"[SERVICE] ERRO CRÍTICO na importação: {e}")
         import traceback
         traceback.print_exc()
+        progresso.concluir(f"Erro crítico: {e}", erro=True)
         return {
             "success": False,
             "error": f"Erro crítico: {str(e)}",
@@ -703,7 +721,7 @@ def importar_xmls_inicial() -> dict:
     
     try:
         # Importar usando a função normal (ela usa NSU incremental automaticamente)
-        result = importar_xmls_sefaz(data_ini, data_fim)
+        result = importar_xmls_sefaz(data_ini, data_fim, tipo="inicial")
         
         # Atualizar log
         if conn and log_id:
@@ -813,7 +831,7 @@ def importar_xmls_diario_automatico() -> dict:
     
     try:
         # Importar usando NSU incremental (apenas XMLs novos)
-        result = importar_xmls_sefaz(data_ini, data_fim)
+        result = importar_xmls_sefaz(data_ini, data_fim, tipo="diaria")
         
         # Log adicional após importação
         total_encontrado = result.get("total_encontrado", result.get("total", 0))
@@ -925,6 +943,7 @@ def processar_xml_e_criar_pendencias(xml_string: str):
     """
     Processa um XML e tenta identificar o posto de trabalho.
     Se não conseguir, cria uma pendência.
+    Retorna True quando o posto foi identificado.
     """
     try:
         root = ET.fromstring(xml_string)
@@ -954,34 +973,25 @@ def processar_xml_e_criar_pendencias(xml_string: str):
                 return  # NFe não encontrada no banco
             
             nfe_id = nfe_row[0]
-            cur.close()
             
             # ============================================
             # ENRIQUECIMENTO DE CEPs (se habilitado)
+            # Só enfileira: a fila processa em lotes, em segundo plano
             # ============================================
             if ENRIQUECIMENTO_HABILITADO:
                 try:
-                    resultado_enriq = processar_enriquecimento_xml(
-                        xml_string=xml_string,
-                        nfe_id=nfe_id,
-                        chave_nfe=chave
-                    )
-                    
-                    if resultado_enriq.get('cep_atualizado'):
-                        print(f"[ENRIQUECIMENTO] ✅ {resultado_enriq['mensagem']}")
-                    elif resultado_enriq.get('posto_sugerido'):
-                        print(f"[ENRIQUECIMENTO] 📝 {resultado_enriq['mensagem']}")
-                        
+                    if not get_fila_enriquecimento().enfileirar(xml_string, nfe_id, chave):
+                        print(f"[ENRIQUECIMENTO] ⚠️  Fila cheia, NF-e {chave} não será enriquecida")
                 except Exception as e:
                     # Não deixar falha de enriquecimento quebrar o fluxo principal
                     print(f"[ENRIQUECIMENTO] ⚠️  Erro (não crítico): {e}")
             
-            # Tentar identificar posto
-            posto = identificar_posto(infcpl, enderDest)
+            # Tentar identificar posto (memória de identificações antes das regras).
+            # Memória, posto e pendência vão na mesma transação: um commit por documento
+            posto, regra = identificar_posto_memorizado(infcpl, enderDest, cur=cur)
             
             if posto:
                 # Atualizar NFe com posto_id
-                cur = conn.cursor()
                 cur.execute("""
                     UPDATE modulo2_nfe 
                     SET posto_id = ?, status = 'identificado', updated_at = datetime('now')
@@ -990,18 +1000,25 @@ def processar_xml_e_criar_pendencias(xml_string: str):
                 conn.commit()
                 cur.close()
                 
-                print(f"[TRATAMENTO] NFe {chave} identificada com posto {posto.get('nomepos', posto.get('nome'))}")
+                print(f"[TRATAMENTO] NFe {chave} identificada com posto {posto.get('nomepos', posto.get('nome'))} ({regra})")
+                return True
             else:
-                # Criar pendência
+                # Criar pendência (com os postos mais prováveis para a identificação manual)
                 motivo = "Não foi possível identificar posto de trabalho automaticamente"
+                sugestoes = sugerir_postos(infcpl, enderDest)
                 criar_pendencia(
                     nfe_id=nfe_id,
                     chave_nfe=chave,
                     valor=valor_total or 0,
                     fornecedor=fornecedor or "DESCONHECIDO",
-                    motivo=motivo
+                    motivo=motivo,
+                    sugestoes=sugestoes,
+                    cur=cur
                 )
-                print(f"[TRATAMENTO] Pendência criada para NFe {chave}")
+                conn.commit()
+                cur.close()
+                print(f"[TRATAMENTO] Pendência criada para NFe {chave} ({len(sugestoes)} sugestões)")
+                return False
             
         finally:
             if conn:
@@ -1011,35 +1028,96 @@ def processar_xml_e_criar_pendencias(xml_string: str):
         print(f"[TRATAMENTO] ERRO ao processar XML: {e}")
 
 
-def identificar_posto(infcpl: str, enderDest: dict) -> dict:
+def _desempatar_por_infcpl(candidatos: List[dict], encontrados: set, matcher, pesos) -> Tuple[dict, int]:
+    """
+    Desempate entre postos candidatos pelas referências encontradas no infCpl.
+    Retorna (melhor posto, score); em empate de score fica o primeiro candidato.
+    """
+    melhor_match = None
+    melhor_score = 0
+    for posto in candidatos:
+        score = matcher.score_posto(posto, encontrados, pesos)
+        if score > melhor_score:
+            melhor_score = score
+            melhor_match = posto
+    return melhor_match, melhor_score
+
+
+def identificar_posto(infcpl: str, enderDest: dict, matcher=None) -> dict:
     """
     Tenta identificar o posto de trabalho usando as regras do tratamento.
     Retorna dict com informações do posto ou None se não encontrar.
     
     VERSÃO MELHORADA: Agora tenta identificar por enderDest mesmo se infCpl vazio!
+    
+    Os índices de postos vêm do PostoMatcher (memória, reconstruído só quando os postos mudam).
+    Em lotes, passe o mesmo matcher para todas as chamadas.
+    """
+    posto, _ = identificar_posto_com_regra(infcpl, enderDest, matcher)
+    return posto
+
+
+def identificar_posto_memorizado(infcpl: str, enderDest: dict, matcher=None, cur=None) -> Tuple[dict, str]:
+    """
+    identificar_posto_com_regra() com memória persistente (modulo2_memo_identificacao).
+    A chave (chave_memo_identificacao) reúne o que a cascata lê da NF-e; a reidentificação
+    em lote confere que NF-es com a mesma chave tiveram o mesmo resultado.
+    Resultados automáticos valem só para a versão atual dos postos; resoluções manuais valem sempre.
+    Com cursor, lê e grava a memória na conexão do chamador, dentro da transação dele
+    (sem commit próprio). Sem cursor, abre conexões próprias.
+    Retorna (posto ou None, regra); em acerto da memória a regra vem como "memo:<regra>".
+    """
+    if matcher is None:
+        matcher = get_posto_matcher()
+    
+    chave = chave_memo_identificacao(infcpl, enderDest)
+    memo = obter_memos_identificacao([chave], cur=cur).get(chave)
+    if memo and (memo["manual"] or memo["versao_postos"] == matcher.versao):
+        if memo["posto_id"] is None:
+            return None, f"memo:{memo['regra']}"
+        posto = matcher.posto_por_id(memo["posto_id"])
+        if posto:
+            return posto, f"memo:{memo['regra']}"
+    
+    posto, regra = identificar_posto_com_regra(infcpl, enderDest, matcher)
+    salvar_memos_identificacao(
+        [(chave, posto["id"] if posto else None, regra or "nao_identificado", matcher.versao, 0)],
+        cur=cur
+    )
+    return posto, regra
+
+
+def identificar_posto_com_regra(infcpl: str, enderDest: dict, matcher=None) -> Tuple[dict, str]:
+    """
+    Cascata de regras de identificar_posto(). Retorna (posto, regra que identificou)
+    ou (None, None) se nenhuma regra identificou.
     """
     # ✅ NÃO retornar None se infCpl vazio - tentar por enderDest também
     
-    # Carregar postos do banco
-    postos = listar_postos_db()
+    # Índices pré-calculados dos postos
+    if matcher is None:
+        matcher = get_posto_matcher()
+    
+    postos = matcher.postos
     if not postos:
-        return None
+        return None, None
     
-    # Criar índices (similar ao código original)
-    idx_postos = {}
-    idx_cep = {}
+    idx_postos = matcher.idx_postos
+    idx_cep = matcher.idx_cep
     
-    for p in postos:
-        nome_limpo = limpar_posto(p.get("nomepos", ""))
-        idx_postos[normalizar_forte(nome_limpo)] = p
-        
-        cep = str(p.get("cep", "")).zfill(8) if p.get("cep") else ""
-        if cep and cep != "00000000":
-            idx_cep.setdefault(cep, []).append(p)
+    # Textos de postos contidos no infCpl: uma passada do autômato, calculada só se precisar
+    _refs = []
+    def referencias_infcpl():
+        if not _refs:
+            _refs.append(matcher.encontrar(normalizar_forte(infcpl)))
+        return _refs[0]
     
     # ============================================
     # FASE 1: TENTAR IDENTIFICAR POR infCpl
     # ============================================
+    # Nomes de posto extraídos do infCpl (usados na busca aproximada da FASE 3)
+    textos_posto = []
+    
     if infcpl:
         # REGRA 1: LOCAL DE ENTREGA
         # Normalizar infCpl para busca (mas manter original para regex)
@@ -1050,13 +1128,14 @@ def identificar_posto(infcpl: str, enderDest: dict) -> dict:
             m = re.search(r"LOCAL\s+DE\s+ENTREGA\s*:\s*([^;]+)", infcpl, re.IGNORECASE)
             if m:
                 posto_texto = m.group(1).strip()
+                textos_posto.append(posto_texto)
                 
                 # Tentar encontrar exatamente no índice
                 posto_limpo = limpar_posto(posto_texto)
                 chave_norm = normalizar_forte(posto_limpo)
                 posto = idx_postos.get(chave_norm)
                 if posto:
-                    return posto
+                    return posto, "local_entrega"
                 
                 # Se não encontrou exato, tentar buscar por parte do texto (caso tenha "nomecli - nomepos")
                 # Extrair última parte após "-" ou último token
@@ -1066,48 +1145,38 @@ def identificar_posto(infcpl: str, enderDest: dict) -> dict:
                     if len(partes) > 1:
                         # Pegar última parte (geralmente é o nomepos)
                         ultima_parte = partes[-1].strip()
+                        textos_posto.append(ultima_parte)
                         posto_limpo = limpar_posto(ultima_parte)
                         chave_norm = normalizar_forte(posto_limpo)
                         posto = idx_postos.get(chave_norm)
                         if posto:
-                            return posto
+                            return posto, "local_entrega_parte"
                 
                 # Tentar buscar parcialmente nos índices (buscar por substring)
+                # (nome do posto contido no texto extraído ou vice-versa, maior trecho vence)
                 posto_texto_norm = normalizar_forte(posto_limpo)
-                melhor_match = None
-                melhor_score = 0
-                for chave_idx, posto_ref in idx_postos.items():
-                    # Verificar se o nome do posto está contido no texto extraído ou vice-versa
-                    if chave_idx and posto_texto_norm:
-                        # Verificar substring (texto do XML contém nome do posto ou vice-versa)
-                        if len(chave_idx) >= 5 and len(posto_texto_norm) >= 5:
-                            # Calcular similaridade simples
-                            if chave_idx in posto_texto_norm or posto_texto_norm in chave_idx:
-                                # Usar o maior match
-                                score = min(len(chave_idx), len(posto_texto_norm))
-                                if score > melhor_score:
-                                    melhor_score = score
-                                    melhor_match = posto_ref
+                melhor_match = matcher.melhor_chave_por_substring(posto_texto_norm)
                 
                 if melhor_match:
-                    return melhor_match
+                    return melhor_match, "local_entrega_parcial"
         
         # REGRA 2: SME
         if infcpl.startswith("SME"):
             m = re.search(r"POSTO\s*\d+\s*-\s*([^;]+)", infcpl)
             if m:
+                textos_posto.append(m.group(1))
                 posto_limpo = limpar_posto(m.group(1))
                 chave_norm = normalizar_forte(posto_limpo)
                 posto = idx_postos.get(chave_norm)
                 if posto:
-                    return posto
+                    return posto, "sme"
     
     # ============================================
     # FASE 2: TENTAR IDENTIFICAR POR enderDest
     # ✅ Sempre tentar, mesmo se infCpl vazio!
     # ============================================
     if enderDest:
-        cep = enderDest.get("CEP", "")
+        cep = cep_destino(enderDest)
         if cep:
             cep_limpo = cep.zfill(8)
             
@@ -1119,51 +1188,22 @@ def identificar_posto(infcpl: str, enderDest: dict) -> dict:
                 # Se houver apenas 1 posto, usar ele
                 if len(postos_no_cep) == 1:
                     print(f"[IDENTIFICACAO] ✅ Posto único identificado por CEP exato: {cep_limpo}")
-                    return postos_no_cep[0]
+                    return postos_no_cep[0], "cep_exato"
                 
                 # ✅ MÚLTIPLOS POSTOS NO MESMO CEP - Tentar desempatar por infCpl
                 print(f"[IDENTIFICACAO] ⚠️  {len(postos_no_cep)} postos com mesmo CEP {cep_limpo} - tentando desempatar...")
                 
                 # Tentar desempatar usando infCpl (buscar nome do posto ou endereço específico)
                 if infcpl:
-                    melhor_match = None
-                    melhor_score = 0
-                    
-                    for posto in postos_no_cep:
-                        score = 0
-                        
-                        # Match por nome do posto
-                        nome_posto_norm = normalizar_forte(posto.get("nomepos", ""))
-                        if nome_posto_norm and len(nome_posto_norm) >= 5:
-                            if nome_posto_norm in normalizar_forte(infcpl):
-                                score += 100  # Match forte por nome do posto
-                        
-                        # Match por nome do cliente
-                        nome_cliente_norm = normalizar_forte(posto.get("nomecli", ""))
-                        if nome_cliente_norm and len(nome_cliente_norm) >= 5:
-                            if nome_cliente_norm in normalizar_forte(infcpl):
-                                score += 50  # Match médio por nome do cliente
-                        
-                        # Match por endereço no infCpl
-                        end_posto_norm = normalizar_forte(posto.get("end", ""))
-                        if end_posto_norm and len(end_posto_norm) >= 10:
-                            if end_posto_norm in normalizar_forte(infcpl):
-                                score += 70  # Match forte por endereço
-                        
-                        # Match por bairro
-                        bairro_posto_norm = normalizar_forte(posto.get("bairro", ""))
-                        if bairro_posto_norm and len(bairro_posto_norm) >= 5:
-                            if bairro_posto_norm in normalizar_forte(infcpl):
-                                score += 30  # Match fraco por bairro
-                        
-                        if score > melhor_score:
-                            melhor_score = score
-                            melhor_match = posto
+                    # Nome do posto (100), cliente (50), endereço (70) e bairro (30) no infCpl
+                    melhor_match, melhor_score = _desempatar_por_infcpl(
+                        postos_no_cep, referencias_infcpl(), matcher, PESOS_INFCPL
+                    )
                     
                     # Se conseguiu um match com score significativo, usar
                     if melhor_match and melhor_score >= 50:
                         print(f"[IDENTIFICACAO] ✅ Posto desempatado por infCpl (score: {melhor_score}) - {melhor_match.get('nomepos')}")
-                        return melhor_match
+                        return melhor_match, "cep_exato_infcpl"
                 
                 # Se não conseguiu desempatar por infCpl, tentar por endereço completo
                 logradouro = enderDest.get("xLgr", "").upper()
@@ -1174,7 +1214,7 @@ def identificar_posto(infcpl: str, enderDest: dict) -> dict:
                     melhor_score = 0
                     
                     for posto in postos_no_cep:
-                        end_posto = (posto.get("end") or "").upper()
+                        end_posto = matcher.campos(posto)["end_upper"]
                         score = 0
                         
                         # Match por logradouro
@@ -1191,7 +1231,7 @@ def identificar_posto(infcpl: str, enderDest: dict) -> dict:
                     
                     if melhor_match and melhor_score >= 50:
                         print(f"[IDENTIFICACAO] ✅ Posto desempatado por endereço (score: {melhor_score}) - {melhor_match.get('nomepos')}")
-                        return melhor_match
+                        return melhor_match, "cep_exato_endereco"
                 
                 # ⚠️ Não conseguiu desempatar - NÃO identificar (avançar para próxima estratégia)
                 print(f"[IDENTIFICACAO] ⚠️  Não foi possível desempatar {len(postos_no_cep)} postos - avançando para próxima estratégia")
@@ -1201,111 +1241,59 @@ def identificar_posto(infcpl: str, enderDest: dict) -> dict:
             # Também aplica regra de desempate se houver múltiplos CEPs próximos
             try:
                 cep_num = int(cep_limpo)
-                candidatos = []  # Lista de (posto, diferenca)
                 
-                for cep_cadastrado, postos_lista in idx_cep.items():
-                    try:
-                        cep_cad_num = int(cep_cadastrado)
-                        diferenca = abs(cep_num - cep_cad_num)
-                        
-                        if diferenca <= 50:
-                            # Adicionar todos os postos deste CEP como candidatos
-                            for posto in postos_lista:
-                                candidatos.append((posto, diferenca))
-                    except:
-                        pass
+                # Busca por faixa no índice ordenado de CEPs (bisect) - já retorna
+                # apenas os postos com a menor diferença, na ordem de idx_cep
+                menor_diferenca, melhores_candidatos = matcher.candidatos_cep_proximo(cep_num, DIFERENCA_CEP_PROXIMO)
                 
-                if candidatos:
-                    # Ordenar por diferença (menor primeiro)
-                    candidatos.sort(key=lambda x: x[1])
-                    menor_diferenca = candidatos[0][1]
-                    
-                    # Pegar apenas candidatos com a menor diferença
-                    melhores_candidatos = [p for p, d in candidatos if d == menor_diferenca]
-                    
+                if melhores_candidatos:
                     # Se houver apenas 1 candidato com menor diferença, usar
                     if len(melhores_candidatos) == 1:
                         print(f"[IDENTIFICACAO] ✅ Posto identificado por CEP próximo (diferença: {menor_diferenca})")
-                        return melhores_candidatos[0]
+                        return melhores_candidatos[0], "cep_proximo"
                     
                     # Se houver múltiplos candidatos, tentar desempatar por infCpl
                     if len(melhores_candidatos) > 1 and infcpl:
-                        melhor_match = None
-                        melhor_score = 0
-                        
-                        for posto in melhores_candidatos:
-                            score = 0
-                            
-                            nome_posto_norm = normalizar_forte(posto.get("nomepos", ""))
-                            if nome_posto_norm and len(nome_posto_norm) >= 5:
-                                if nome_posto_norm in normalizar_forte(infcpl):
-                                    score += 100
-                            
-                            nome_cliente_norm = normalizar_forte(posto.get("nomecli", ""))
-                            if nome_cliente_norm and len(nome_cliente_norm) >= 5:
-                                if nome_cliente_norm in normalizar_forte(infcpl):
-                                    score += 50
-                            
-                            if score > melhor_score:
-                                melhor_score = score
-                                melhor_match = posto
+                        melhor_match, melhor_score = _desempatar_por_infcpl(
+                            melhores_candidatos, referencias_infcpl(), matcher, PESOS_INFCPL_NOMES
+                        )
                         
                         if melhor_match and melhor_score >= 50:
                             print(f"[IDENTIFICACAO] ✅ Posto desempatado por infCpl em CEP próximo (dif: {menor_diferenca}, score: {melhor_score})")
-                            return melhor_match
+                            return melhor_match, "cep_proximo_infcpl"
                     
                     # Se não conseguiu desempatar mas só há candidatos com diferença mínima, usar o primeiro
                     if len(melhores_candidatos) > 1:
                         print(f"[IDENTIFICACAO] ⚠️  {len(melhores_candidatos)} postos com CEP próximo (dif: {menor_diferenca}) - usando primeiro")
                     
-                    return melhores_candidatos[0]
+                    return melhores_candidatos[0], "cep_proximo"
             except:
                 pass
             
             # Estratégia 3: Prefixo CEP (5 primeiros dígitos)
             # Também aplica regra de desempate
             cep5 = cep_limpo[:5]
-            candidatos_prefixo = []
-            
-            for c, lst in idx_cep.items():
-                if c.startswith(cep5):
-                    candidatos_prefixo.extend(lst)
+            candidatos_prefixo = matcher.candidatos_prefixo_cep(cep5)
             
             if candidatos_prefixo:
                 # Se houver apenas 1, usar
                 if len(candidatos_prefixo) == 1:
                     print(f"[IDENTIFICACAO] ✅ Posto identificado por prefixo CEP: {cep5}")
-                    return candidatos_prefixo[0]
+                    return candidatos_prefixo[0], "cep_prefixo"
                 
                 # Se houver múltiplos, tentar desempatar por infCpl
                 if len(candidatos_prefixo) > 1 and infcpl:
-                    melhor_match = None
-                    melhor_score = 0
-                    
-                    for posto in candidatos_prefixo:
-                        score = 0
-                        
-                        nome_posto_norm = normalizar_forte(posto.get("nomepos", ""))
-                        if nome_posto_norm and len(nome_posto_norm) >= 5:
-                            if nome_posto_norm in normalizar_forte(infcpl):
-                                score += 100
-                        
-                        nome_cliente_norm = normalizar_forte(posto.get("nomecli", ""))
-                        if nome_cliente_norm and len(nome_cliente_norm) >= 5:
-                            if nome_cliente_norm in normalizar_forte(infcpl):
-                                score += 50
-                        
-                        if score > melhor_score:
-                            melhor_score = score
-                            melhor_match = posto
+                    melhor_match, melhor_score = _desempatar_por_infcpl(
+                        candidatos_prefixo, referencias_infcpl(), matcher, PESOS_INFCPL_NOMES
+                    )
                     
                     if melhor_match and melhor_score >= 50:
                         print(f"[IDENTIFICACAO] ✅ Posto desempatado por infCpl em prefixo CEP (score: {melhor_score})")
-                        return melhor_match
+                        return melhor_match, "cep_prefixo_infcpl"
                 
                 # Se não conseguiu desempatar, usar o primeiro
                 print(f"[IDENTIFICACAO] ⚠️  {len(candidatos_prefixo)} postos com prefixo CEP {cep5} - usando primeiro")
-                return candidatos_prefixo[0]
+                return candidatos_prefixo[0], "cep_prefixo"
         
         # ✅ MELHORIA: Estratégia 4: Matching por endereço completo (fuzzy)
         logradouro = enderDest.get("xLgr", "").upper()
@@ -1317,8 +1305,8 @@ def identificar_posto(infcpl: str, enderDest: dict) -> dict:
             melhor_score = 0
             
             for posto in postos:
-                end_posto = (posto.get("end") or "").upper()
-                bairro_posto = (posto.get("bairro") or "").upper()
+                end_posto = matcher.campos(posto)["end_upper"]
+                bairro_posto = matcher.campos(posto)["bairro_upper"]
                 
                 score = 0
                 
@@ -1340,9 +1328,133 @@ def identificar_posto(infcpl: str, enderDest: dict) -> dict:
             
             if melhor_match:
                 print(f"[IDENTIFICACAO] ✅ Posto identificado por endereço (score: {melhor_score})")
-                return melhor_match
+                return melhor_match, "endereco"
     
-    return None
+    # ============================================
+    # FASE 3: NOME PARECIDO (trigramas)
+    # Erros de digitação, abreviações e palavras fora de ordem no nome do posto.
+    # Só aceita um vencedor claro (similaridade mínima e margem sobre o segundo).
+    # ============================================
+    for texto in textos_posto:
+        similares = matcher.buscar_similares(texto, limite=2)
+        if not similares or similares[0][1] < SIMILARIDADE_MINIMA_POSTO:
+            continue
+        if len(similares) > 1 and similares[0][1] - similares[1][1] < MARGEM_SIMILARIDADE_POSTO:
+            continue
+        posto, similaridade = similares[0]
+        print(f"[IDENTIFICACAO] ✅ Posto identificado por nome parecido (similaridade: {similaridade:.2f}) - {posto.get('nomepos')}")
+        return posto, "nome_parecido"
+    
+    return None, None
+
+
+# ================================
+# SUGESTÕES PARA PENDÊNCIAS
+# ================================
+
+# Pontos por evidência nas sugestões (referências no infCpl usam PESOS_INFCPL)
+PONTOS_SUGESTAO_CEP_EXATO = 80
+PONTOS_SUGESTAO_CEP_PROXIMO = 50
+PONTOS_SUGESTAO_CEP_PREFIXO = 20
+SIMILARIDADE_MINIMA_SUGESTAO = 0.3
+# Prefixos de CEP com mais postos que isso não diferenciam nada
+MAX_POSTOS_PREFIXO_SUGESTAO = 30
+
+MOTIVOS_INFCPL = {
+    "nomepos": "nome do posto no infCpl",
+    "nomecli": "cliente no infCpl",
+    "end": "endereço no infCpl",
+    "bairro": "bairro no infCpl",
+}
+
+
+def _textos_posto_infcpl(infcpl: str) -> List[str]:
+    """Nomes de posto citados no infCpl (LOCAL DE ENTREGA e SME), como nas regras 1 e 2"""
+    textos = []
+    if not infcpl:
+        return textos
+    
+    m = re.search(r"LOCAL\s+DE\s+ENTREGA\s*:\s*([^;]+)", infcpl, re.IGNORECASE)
+    if m:
+        posto_texto = m.group(1).strip()
+        textos.append(posto_texto)
+        partes = re.split(r'\s*-\s*', posto_texto)
+        if len(partes) > 1:
+            textos.append(partes[-1].strip())
+    
+    if infcpl.startswith("SME"):
+        m = re.search(r"POSTO\s*\d+\s*-\s*([^;]+)", infcpl)
+        if m:
+            textos.append(m.group(1))
+    return textos
+
+
+def sugerir_postos(infcpl: str, enderDest: dict, matcher=None, limite: int = SUGESTOES_POR_PENDENCIA) -> List[dict]:
+    """
+    Postos mais prováveis para uma NF-e que as regras não identificaram.
+    Soma as evidências (referências no infCpl, proximidade de CEP e nome parecido)
+    e retorna até `limite` itens {"posto_id", "score", "motivo"}, do maior score para o menor.
+    
+    Calculado uma vez, na criação da pendência: a tela de identificação usa o que foi
+    gravado em modulo2_pendencias_sugestoes, sem rodar o matching de novo.
+    """
+    if matcher is None:
+        matcher = get_posto_matcher()
+    if not matcher.postos or limite <= 0:
+        return []
+    
+    scores: Dict[int, float] = {}
+    motivos: Dict[int, List[str]] = {}
+    
+    def somar(posto_id: int, pontos: float, motivo: str):
+        scores[posto_id] = scores.get(posto_id, 0) + pontos
+        motivos.setdefault(posto_id, []).append(motivo)
+    
+    # Referências a postos no infCpl (nome, cliente, endereço, bairro)
+    if infcpl:
+        pesos = {campo: peso for campo, peso, _ in PESOS_INFCPL}
+        referencias = matcher.referencias_por_posto(matcher.encontrar(normalizar_forte(infcpl)))
+        for posto_id, campos in referencias.items():
+            for campo in campos:
+                somar(posto_id, pesos[campo], MOTIVOS_INFCPL[campo])
+    
+    # Proximidade do CEP de destino
+    cep = cep_destino(enderDest)
+    if cep:
+        cep_limpo = cep.zfill(8)
+        no_cep = {p["id"] for p in matcher.idx_cep.get(cep_limpo, [])}
+        for posto_id in no_cep:
+            somar(posto_id, PONTOS_SUGESTAO_CEP_EXATO, f"mesmo CEP ({cep_limpo})")
+        
+        try:
+            diferenca, proximos = matcher.candidatos_cep_proximo(int(cep_limpo), 50)
+        except ValueError:
+            diferenca, proximos = None, []
+        for posto in proximos:
+            if posto["id"] not in no_cep:
+                somar(posto["id"], PONTOS_SUGESTAO_CEP_PROXIMO, f"CEP próximo (diferença {diferenca})")
+        
+        regiao = matcher.candidatos_prefixo_cep(cep_limpo[:5])
+        if len(regiao) <= MAX_POSTOS_PREFIXO_SUGESTAO:
+            for posto in regiao:
+                if posto["id"] not in no_cep:
+                    somar(posto["id"], PONTOS_SUGESTAO_CEP_PREFIXO, f"mesma região de CEP ({cep_limpo[:5]})")
+    
+    # Nome parecido com o local de entrega citado no infCpl (melhor similaridade entre os textos)
+    similaridades: Dict[int, float] = {}
+    for texto in _textos_posto_infcpl(infcpl):
+        for posto_id, similaridade in matcher.similaridade_por_posto(texto).items():
+            if similaridade > similaridades.get(posto_id, 0):
+                similaridades[posto_id] = similaridade
+    for posto_id, similaridade in similaridades.items():
+        if similaridade >= SIMILARIDADE_MINIMA_SUGESTAO:
+            somar(posto_id, round(similaridade * 100, 1), f"nome parecido ({similaridade:.2f})")
+    
+    melhores = sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:limite]
+    return [
+        {"posto_id": posto_id, "score": round(score, 2), "motivo": "; ".join(motivos[posto_id])}
+        for posto_id, score in melhores
+    ]
 
 
 # ================================
@@ -1389,6 +1501,17 @@ def extrair_infCpl(root) -> str:
     return ""
 
 
+def dados_identificacao_nfe(xml: str, endereco_entrega: str = None) -> Tuple[str, dict]:
+    """(infCpl, enderDest) de uma NF-e gravada no banco"""
+    xml = xml or ""
+    # NF-es importadas do JSON não têm XML real: o texto de entrega fica em endereco_entrega
+    if "<origem>JSON</origem>" in xml:
+        return endereco_entrega or "", None
+    
+    root = ET.fromstring(xml)
+    return extrair_infCpl(root), extrair_enderDest(root)
+
+
 def extrair_enderDest(root) -> dict:
     """Extrai endereço do destinatário"""
     for elem in root.iter():
@@ -1415,8 +1538,13 @@ def extrair_enderDest(root) -> dict:
 # PENDÊNCIAS
 # ================================
 
+@coalescer
 def listar_pendencias(limit: int = 500, data_ini: date = None, data_fim: date = None) -> List[dict]:
-    """Lista pendências de identificação com filtro opcional por data de emissão"""
+    """
+    Lista pendências de identificação com filtro opcional por data de emissão.
+    GET /pendencias não passa por resposta_com_cache (a lista tem que refletir cada
+    identificação), então o coalescer é o single-flight desse endpoint.
+    """
     print(f"[SERVICE] listar_pendencias - limit: {limit}, data_ini: {data_ini}, data_fim: {data_fim}")
     return listar_pendencias_db(limit, data_ini, data_fim)
 
@@ -1479,122 +1607,7 @@ def listar_gastos_por_posto(data_ini: date = None, data_fim: date = None, client
     try:
         conn = get_conn()
         cur = conn.cursor()
-        from .db import _row_to_dict
-        
-        # ============================================
-        # 1. BUSCAR ORÇADO POR CLIENTE
-        # Soma de valor_orcado de todos os postos do cliente
-        # ============================================
-        orcado_query = """
-            SELECT 
-                nomecli,
-                COALESCE(SUM(valor_orcado), 0) as total_orcado,
-                COUNT(*) as total_postos_cliente
-            FROM modulo2_postos_trabalho
-            WHERE nomecli IS NOT NULL AND nomecli != ''
-        """
-        
-        if cliente_filtro:
-            orcado_query += " AND nomecli = ?"
-            cur.execute(orcado_query + " GROUP BY nomecli", (cliente_filtro,))
-        else:
-            cur.execute(orcado_query + " GROUP BY nomecli")
-        
-        orcado_rows = cur.fetchall()
-        orcado_map = {}
-        for row in orcado_rows:
-            row_dict = _row_to_dict(row)
-            nomecli = row_dict.get("nomecli", "")
-            if nomecli:
-                orcado_map[nomecli] = {
-                    "orcado": float(row_dict.get("total_orcado", 0) or 0),
-                    "total_postos_cliente": row_dict.get("total_postos_cliente", 0)
-                }
-        
-        # ============================================
-        # 2. BUSCAR REALIZADO POR CLIENTE
-        # Soma de valor_total das NFes agrupado por cliente
-        # ============================================
-        data_conditions = []
-        params = []
-        
-        if data_ini:
-            data_conditions.append("n.data_emissao >= ?")
-            params.append(str(data_ini))
-        
-        if data_fim:
-            data_conditions.append("n.data_emissao <= ?")
-            params.append(str(data_fim))
-        
-        data_where = " AND " + " AND ".join(data_conditions) if data_conditions else ""
-        
-        cliente_filter_clause = ""
-        if cliente_filtro:
-            cliente_filter_clause = " AND pt.nomecli = ?"
-            params.append(cliente_filtro)
-        
-        query = f"""
-            SELECT 
-                COALESCE(pt.nomecli, 'Não identificado') as nomecli,
-                COALESCE(SUM(n.valor_total), 0) as total_realizado,
-                COUNT(DISTINCT n.id) as total_nfes,
-                COUNT(DISTINCT CASE WHEN pt.id IS NOT NULL THEN pt.id END) as total_postos_nfe
-            FROM modulo2_nfe n
-            LEFT JOIN modulo2_postos_trabalho pt ON n.posto_id = pt.id
-            WHERE 1=1 {data_where} {cliente_filter_clause}
-            GROUP BY COALESCE(pt.nomecli, 'Não identificado')
-            ORDER BY total_realizado DESC
-        """
-        
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        
-        # ============================================
-        # 3. COMBINAR ORÇADO + REALIZADO
-        # ============================================
-        result = []
-        clientes_processados = set()
-        
-        for row in rows:
-            row_dict = _row_to_dict(row)
-            nomecli = row_dict.get("nomecli", "") or "Não identificado"
-            clientes_processados.add(nomecli)
-            
-            orcado_info = orcado_map.get(nomecli, {"orcado": 0.0, "total_postos_cliente": 0})
-            orcado = orcado_info["orcado"]
-            realizado = float(row_dict.get("total_realizado", 0) or 0)
-            status = orcado - realizado  # Positivo = dentro do orçado, Negativo = acima
-            
-            result.append({
-                "nomecli": nomecli,
-                "nome": nomecli,
-                "orcado": orcado,
-                "realizado": realizado,
-                "valor": realizado,
-                "status": status,
-                "total_nfes": row_dict.get("total_nfes", 0),
-                "total_postos": row_dict.get("total_postos_nfe", 0),
-                "total_postos_cliente": orcado_info["total_postos_cliente"]
-            })
-        
-        # ============================================
-        # 4. INCLUIR CLIENTES COM ORÇADO MAS SEM NFE
-        # ============================================
-        if not cliente_filtro:
-            for nomecli, orcado_info in orcado_map.items():
-                if nomecli not in clientes_processados and orcado_info["orcado"] > 0:
-                    result.append({
-                        "nomecli": nomecli,
-                        "nome": nomecli,
-                        "orcado": orcado_info["orcado"],
-                        "realizado": 0.0,
-                        "valor": 0.0,
-                        "status": orcado_info["orcado"],
-                        "total_nfes": 0,
-                        "total_postos": 0,
-                        "total_postos_cliente": orcado_info["total_postos_cliente"]
-                    })
-        
+        result = calcular_gastos_por_cliente(cur, data_ini, data_fim, cliente_filtro)
         cur.close()
         return result
         
@@ -1608,6 +1621,221 @@ def listar_gastos_por_posto(data_ini: date = None, data_fim: date = None, client
             conn.close()
 
 
+def _meses_do_periodo(data_ini: date, data_fim: date) -> List[str]:
+    """ano_mes ("YYYY-MM") de cada mês entre as datas, inclusive"""
+    meses = []
+    ano, mes = data_ini.year, data_ini.month
+    while (ano, mes) <= (data_fim.year, data_fim.month):
+        meses.append(f"{ano:04d}-{mes:02d}")
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return meses
+
+
+def _periodos_serie(granularidade: str, data_ini: date, data_fim: date) -> List[str]:
+    """Todos os períodos do intervalo (mesmo formato de db.PERIODOS_SERIE), para preencher lacunas"""
+    if granularidade == "mes":
+        return _meses_do_periodo(data_ini, data_fim)
+    if granularidade == "semana":
+        inicio, passo = data_ini - timedelta(days=data_ini.weekday()), timedelta(days=7)
+    else:
+        inicio, passo = data_ini, timedelta(days=1)
+    periodos = []
+    while inicio <= data_fim:
+        periodos.append(inicio.isoformat())
+        inicio += passo
+    return periodos
+
+
+def serie_gastos(
+    granularidade: str = "mes",
+    data_ini: date = None,
+    data_fim: date = None,
+    cliente: str = None,
+    posto: str = None,
+    agrupar_por: str = None
+) -> dict:
+    """
+    Série temporal do realizado (dia, semana ou mês) com o orçado por ano_mes.
+    Lê os baldes de modulo2_gastos_diarios (mantidos por gatilhos na importação).
+    
+    Args:
+        granularidade: "dia", "semana" (começa na segunda) ou "mes"
+        data_ini, data_fim: período (padrão: últimos 12 meses, do dia 1 até hoje)
+        cliente / posto: filtros por nomecli / nomepos
+        agrupar_por: None, "cliente" ou "posto" (série por grupo)
+    
+    Returns:
+        Dict com serie [{periodo, grupo?, realizado, qtd_nfes}], orcado [{ano_mes, grupo?, orcado}]
+        e totais. Sem agrupamento a série tem todos os períodos (zero onde não há NFe) e,
+        em "mes", cada ponto já traz o orçado do mês.
+    """
+    from .db import consultar_serie_gastos, consultar_orcado_mensal
+    
+    if not data_fim:
+        data_fim = date.today()
+    if not data_ini:
+        ano, mes = (data_fim.year - 1, data_fim.month + 1) if data_fim.month < 12 else (data_fim.year, 1)
+        data_ini = date(ano, mes, 1)
+    
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        serie = consultar_serie_gastos(cur, granularidade, data_ini, data_fim, cliente, posto, agrupar_por)
+        orcado = consultar_orcado_mensal(cur, _meses_do_periodo(data_ini, data_fim), cliente, posto, agrupar_por)
+        cur.close()
+    finally:
+        if conn:
+            conn.close()
+    
+    if not agrupar_por:
+        por_periodo = {p["periodo"]: p for p in serie}
+        serie = [
+            por_periodo.get(periodo) or {"periodo": periodo, "realizado": 0.0, "qtd_nfes": 0}
+            for periodo in _periodos_serie(granularidade, data_ini, data_fim)
+        ]
+        if granularidade == "mes":
+            orcado_por_mes = {o["ano_mes"]: o["orcado"] for o in orcado}
+            for ponto in serie:
+                ponto["orcado"] = orcado_por_mes.get(ponto["periodo"], 0.0)
+    
+    return {
+        "granularidade": granularidade,
+        "data_ini": str(data_ini),
+        "data_fim": str(data_fim),
+        "agrupar_por": agrupar_por,
+        "serie": serie,
+        "orcado": orcado,
+        "total_realizado": round(sum(p["realizado"] for p in serie), 2),
+        "total_orcado": round(sum(o["orcado"] for o in orcado), 2)
+    }
+
+
+def calcular_gastos_por_cliente(cur, data_ini: date = None, data_fim: date = None,
+                                cliente_filtro: str = None) -> List[dict]:
+    """
+    Orçado + realizado por cliente (nomecli) usando o cursor informado.
+    Usado por listar_gastos_por_posto() e pelo bundle do dashboard (mesma transação).
+    """
+    from .db import _row_to_dict
+    
+    # ============================================
+    # 1. BUSCAR ORÇADO POR CLIENTE
+    # Soma de valor_orcado de todos os postos do cliente
+    # ============================================
+    orcado_query = """
+        SELECT 
+            nomecli,
+            COALESCE(SUM(valor_orcado), 0) as total_orcado,
+            COUNT(*) as total_postos_cliente
+        FROM modulo2_postos_trabalho
+        WHERE nomecli IS NOT NULL AND nomecli != ''
+    """
+    
+    if cliente_filtro:
+        orcado_query += " AND nomecli = ?"
+        cur.execute(orcado_query + " GROUP BY nomecli", (cliente_filtro,))
+    else:
+        cur.execute(orcado_query + " GROUP BY nomecli")
+    
+    orcado_rows = cur.fetchall()
+    orcado_map = {}
+    for row in orcado_rows:
+        row_dict = _row_to_dict(row)
+        nomecli = row_dict.get("nomecli", "")
+        if nomecli:
+            orcado_map[nomecli] = {
+                "orcado": float(row_dict.get("total_orcado", 0) or 0),
+                "total_postos_cliente": row_dict.get("total_postos_cliente", 0)
+            }
+    
+    # ============================================
+    # 2. BUSCAR REALIZADO POR CLIENTE
+    # Soma de valor_total das NFes agrupado por cliente
+    # ============================================
+    data_conditions = []
+    params = []
+    
+    if data_ini:
+        data_conditions.append("n.data_emissao >= ?")
+        params.append(str(data_ini))
+    
+    if data_fim:
+        data_conditions.append("n.data_emissao <= ?")
+        params.append(str(data_fim))
+    
+    data_where = " AND " + " AND ".join(data_conditions) if data_conditions else ""
+    
+    cliente_filter_clause = ""
+    if cliente_filtro:
+        cliente_filter_clause = " AND pt.nomecli = ?"
+        params.append(cliente_filtro)
+    
+    query = f"""
+        SELECT 
+            COALESCE(pt.nomecli, 'Não identificado') as nomecli,
+            COALESCE(SUM(n.valor_total), 0) as total_realizado,
+            COUNT(DISTINCT n.id) as total_nfes,
+            COUNT(DISTINCT CASE WHEN pt.id IS NOT NULL THEN pt.id END) as total_postos_nfe
+        FROM modulo2_nfe n
+        LEFT JOIN modulo2_postos_trabalho pt ON n.posto_id = pt.id
+        WHERE 1=1 {data_where} {cliente_filter_clause}
+        GROUP BY COALESCE(pt.nomecli, 'Não identificado')
+        ORDER BY total_realizado DESC
+    """
+    
+    cur.execute(query, params)
+    rows = cur.fetchall()
+    
+    # ============================================
+    # 3. COMBINAR ORÇADO + REALIZADO
+    # ============================================
+    result = []
+    clientes_processados = set()
+    
+    for row in rows:
+        row_dict = _row_to_dict(row)
+        nomecli = row_dict.get("nomecli", "") or "Não identificado"
+        clientes_processados.add(nomecli)
+        
+        orcado_info = orcado_map.get(nomecli, {"orcado": 0.0, "total_postos_cliente": 0})
+        orcado = orcado_info["orcado"]
+        realizado = float(row_dict.get("total_realizado", 0) or 0)
+        status = orcado - realizado  # Positivo = dentro do orçado, Negativo = acima
+        
+        result.append({
+            "nomecli": nomecli,
+            "nome": nomecli,
+            "orcado": orcado,
+            "realizado": realizado,
+            "valor": realizado,
+            "status": status,
+            "total_nfes": row_dict.get("total_nfes", 0),
+            "total_postos": row_dict.get("total_postos_nfe", 0),
+            "total_postos_cliente": orcado_info["total_postos_cliente"]
+        })
+    
+    # ============================================
+    # 4. INCLUIR CLIENTES COM ORÇADO MAS SEM NFE
+    # ============================================
+    if not cliente_filtro:
+        for nomecli, orcado_info in orcado_map.items():
+            if nomecli not in clientes_processados and orcado_info["orcado"] > 0:
+                result.append({
+                    "nomecli": nomecli,
+                    "nome": nomecli,
+                    "orcado": orcado_info["orcado"],
+                    "realizado": 0.0,
+                    "valor": 0.0,
+                    "status": orcado_info["orcado"],
+                    "total_nfes": 0,
+                    "total_postos": 0,
+                    "total_postos_cliente": orcado_info["total_postos_cliente"]
+                })
+    
+    return result
+
+
 def listar_clientes() -> List[dict]:
     """Lista clientes únicos (agrupados por nomecli)"""
     postos = listar_postos_db()
@@ -1657,207 +1885,26 @@ def exportar_nfes_excel(
     Returns:
         Caminho do arquivo Excel gerado
     """
-    import json
-    from pathlib import Path
-    from datetime import datetime as dt
-    
-    try:
-        import pandas as pd
-        from openpyxl import load_workbook
-        from openpyxl.styles import PatternFill, Font, Alignment
-    except ImportError:
-        raise RuntimeError("pandas e openpyxl são necessários. Instale com: pip install pandas openpyxl")
+    from .exportacao import (
+        OUTPUT_DIR,
+        escrever_xlsx,
+        iterar_linhas_exportacao,
+        nome_arquivo_exportacao,
+        periodo_padrao
+    )
     
     # Definir período padrão
-    if not data_inicio:
-        data_inicio = date(2026, 1, 1)
-    if not data_fim:
-        data_fim = date.today()
+    data_inicio, data_fim = periodo_padrao(data_inicio, data_fim)
     
     print(f"[EXPORTACAO] Exportando NFes de {data_inicio} a {data_fim}")
     
-    # Buscar NFes do banco
-    conn = get_conn()
-    cur = conn.cursor()
-    
-    query = """
-        SELECT 
-            n.chave_acesso,
-            n.nsu,
-            n.data_emissao,
-            n.valor_total,
-            n.nome_emitente as fornecedor,
-            n.cnpj_emitente,
-            n.cnpj_destinatario,
-            n.nome_destinatario,
-            n.endereco_entrega,
-            n.info_adicional,
-            n.status,
-            n.xml,
-            p.motivo as motivo_pendencia,
-            pt.nomecli as cliente_identificado,
-            pt.nomepos as posto_identificado
-        FROM modulo2_nfe n
-        LEFT JOIN modulo2_pendencias p ON p.chave_nfe = n.chave_acesso AND p.status = 'pendente'
-        LEFT JOIN modulo2_postos_trabalho pt ON pt.id = n.posto_id
-        WHERE 1=1
-    """
-    
-    params = []
-    
-    if data_inicio:
-        query += " AND (n.data_emissao >= ? OR n.data_emissao IS NULL)"
-        params.append(str(data_inicio))
-    
-    if data_fim:
-        query += " AND (n.data_emissao <= ? OR n.data_emissao IS NULL)"
-        params.append(str(data_fim))
-    
-    if apenas_pendentes:
-        query += " AND n.status = 'pendente'"
-    
-    query += " ORDER BY n.data_emissao, n.nsu"
-    
-    cur.execute(query, params)
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
-    
-    print(f"[EXPORTACAO] {len(rows)} NFes encontradas")
-    
-    # Função para extrair número da NF e impostos do XML
-    def extrair_dados_xml(xml_str):
-        numero_nf = ""
-        impostos = {"icms": 0, "ipi": 0, "pis": 0, "cofins": 0}
-        
-        if not xml_str:
-            return numero_nf, impostos
-        
-        try:
-            root = ET.fromstring(xml_str)
-            
-            for elem in root.iter():
-                tag = elem.tag.split("}")[-1] if "}" in elem.tag else elem.tag
-                
-                if tag == "nNF":
-                    numero_nf = elem.text or ""
-                elif tag == "vICMS":
-                    try:
-                        impostos["icms"] = float(elem.text or 0)
-                    except:
-                        pass
-                elif tag == "vIPI":
-                    try:
-                        impostos["ipi"] = float(elem.text or 0)
-                    except:
-                        pass
-                elif tag == "vPIS":
-                    try:
-                        impostos["pis"] = float(elem.text or 0)
-                    except:
-                        pass
-                elif tag == "vCOFINS":
-                    try:
-                        impostos["cofins"] = float(elem.text or 0)
-                    except:
-                        pass
-        except:
-            pass
-        
-        return numero_nf, impostos
-    
-    # Processar dados
-    dados = []
-    for row in rows:
-        row_dict = {k: row[k] for k in row.keys()}
-        
-        # Extrair dados do XML
-        xml_str = row_dict.get("xml", "")
-        numero_nf, impostos = extrair_dados_xml(xml_str)
-        
-        # Parse endereço JSON
-        endereco_str = row_dict.get("endereco_entrega", "")
-        endereco = {}
-        if endereco_str:
-            try:
-                endereco = json.loads(endereco_str)
-            except:
-                endereco = {"endereco_raw": endereco_str}
-        
-        # Status e motivo
-        status = row_dict.get("status", "pendente")
-        if status == "identificado":
-            status_texto = "Identificada"
-            motivo = ""
-        else:
-            status_texto = "Pendente"
-            motivo = row_dict.get("motivo_pendencia") or "Não identificado automaticamente"
-        
-        dados.append({
-            "Chave NFe": row_dict.get("chave_acesso", ""),
-            "Número NFe": numero_nf,
-            "NSU": row_dict.get("nsu", ""),
-            "Data Emissão": row_dict.get("data_emissao", ""),
-            "Fornecedor": row_dict.get("fornecedor", ""),
-            "CNPJ Fornecedor": row_dict.get("cnpj_emitente", ""),
-            "Valor Total": row_dict.get("valor_total", 0),
-            "ICMS": impostos.get("icms", 0),
-            "IPI": impostos.get("ipi", 0),
-            "PIS": impostos.get("pis", 0),
-            "COFINS": impostos.get("cofins", 0),
-            "Total Impostos": sum(impostos.values()),
-            "Destinatário Nome": row_dict.get("nome_destinatario") or endereco.get("nome", ""),
-            "Destinatário CNPJ": row_dict.get("cnpj_destinatario") or endereco.get("cnpj", ""),
-            "Destinatário Endereço": endereco.get("endereco", ""),
-            "Destinatário Cidade": endereco.get("cidade", ""),
-            "Destinatário UF": endereco.get("uf", ""),
-            "Destinatário CEP": endereco.get("cep", ""),
-            "Informações Complementares": (row_dict.get("info_adicional", "") or "")[:500],
-            "Status": status_texto,
-            "Cliente Identificado": row_dict.get("cliente_identificado", ""),
-            "Posto Identificado": row_dict.get("posto_identificado", ""),
-            "Motivo Pendência": motivo
-        })
-    
-    # Criar DataFrame
-    df = pd.DataFrame(dados)
-    
-    # Gerar caminho do arquivo
-    output_dir = Path(__file__).parent / "output"
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
-    timestamp = dt.now().strftime("%Y%m%d_%H%M%S")
-    output_path = output_dir / f"nfes_exportacao_{timestamp}.xlsx"
-    
-    # Exportar para Excel
-    with pd.ExcelWriter(str(output_path), engine="openpyxl") as writer:
-        df.to_excel(writer, sheet_name="NFes", index=False)
-    
-    # Formatar Excel
-    wb = load_workbook(str(output_path))
-    ws = wb.active
-    
-    # Formatar cabeçalho
-    header_fill = PatternFill("solid", fgColor="1a365d")
-    header_font = Font(color="FFFFFF", bold=True)
-    
-    for col in range(1, ws.max_column + 1):
-        cell = ws.cell(row=1, column=col)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-    
-    # Ajustar largura de algumas colunas
-    ws.column_dimensions["A"].width = 50  # Chave
-    ws.column_dimensions["E"].width = 40  # Fornecedor
-    ws.column_dimensions["S"].width = 60  # Info Complementares
-    
-    # Congelar primeira linha
-    ws.freeze_panes = "A2"
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    output_path = OUTPUT_DIR / nome_arquivo_exportacao("xlsx")
     
-    wb.save(str(output_path))
+    # Linhas vão do cursor direto para o XLSX (write-only), sem carregar tudo em memória
+    total = escrever_xlsx(output_path, iterar_linhas_exportacao(data_inicio, data_fim, apenas_pendentes))
     
     print(f"[EXPORTACAO] Arquivo gerado: {output_path}")
-    print(f"[EXPORTACAO] Total de linhas: {len(dados)}")
+    print(f"[EXPORTACAO] Total de linhas: {total}")
     
     return str(output_path)
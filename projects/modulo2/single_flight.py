@@ -0,0 +1,119 @@
+# projects/modulo2/single_flight.py
+"""
+Coalescência de chamadas idênticas (single-flight).
+
+Depois da importação da manhã vários usuários abrem o dashboard ao mesmo tempo e as
+mesmas agregações pesadas rodam em paralelo no threadpool do FastAPI, disputando o
+SQLite. Com SingleFlight, chamadas concorrentes com a mesma chave esperam a execução
+que já está em andamento e recebem o mesmo resultado (ou a mesma exceção).
+
+Não há cache: assim que a execução termina a chave sai da tabela e a próxima chamada
+calcula de novo. A chave de coalescer() inclui a versão "dados" (cache_respostas),
+então uma chamada que começa depois de uma escrita não pega carona em uma execução
+iniciada antes dela.
+
+O resultado é o mesmo objeto para todas as chamadas coalescidas: não alterar.
+"""
+
+import os
+import threading
+import functools
+from typing import Callable, Dict, Hashable
+
+
+SINGLE_FLIGHT_HABILITADO = os.getenv("MODULO2_SINGLE_FLIGHT_HABILITADO", "true").lower() in ("true", "1", "yes")
+
+
+class _Voo:
+    """Execução em andamento de uma chave"""
+    __slots__ = ("evento", "resultado", "erro", "seguidores")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.erro = None
+        self.seguidores = 0
+
+
+class SingleFlight:
+    """Uma execução por chave em andamento; chamadas concorrentes esperam e compartilham o resultado"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._voos: Dict[Hashable, _Voo] = {}
+        self.metricas = {"chamadas": 0, "execucoes": 0, "coalescidas": 0, "erros": 0, "max_seguidores": 0}
+
+    def executar(self, chave: Hashable, funcao: Callable[[], object]):
+        """Executa funcao() ou espera a execução em andamento com a mesma chave"""
+        with self._lock:
+            self.metricas["chamadas"] += 1
+            voo = self._voos.get(chave)
+            lider = voo is None
+            if lider:
+                voo = _Voo()
+                self._voos[chave] = voo
+                self.metricas["execucoes"] += 1
+            else:
+                voo.seguidores += 1
+                self.metricas["coalescidas"] += 1
+                self.metricas["max_seguidores"] = max(self.metricas["max_seguidores"], voo.seguidores)
+
+        if not lider:
+            voo.evento.wait()
+            if voo.erro is not None:
+                raise voo.erro
+            return voo.resultado
+
+        try:
+            voo.resultado = funcao()
+            return voo.resultado
+        except BaseException as e:
+            voo.erro = e
+            with self._lock:
+                self.metricas["erros"] += 1
+            raise
+        finally:
+            # Sai da tabela antes de liberar os seguidores: chamadas novas calculam de novo
+            with self._lock:
+                self._voos.pop(chave, None)
+            voo.evento.set()
+
+    def estatisticas(self) -> Dict:
+        with self._lock:
+            return dict(self.metricas, em_andamento=len(self._voos))
+
+
+# Instância global
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """Retorna instância global do single-flight"""
+    return _single_flight
+
+
+def _versao_dados():
+    try:
+        from .cache_respostas import versao_dados
+        return versao_dados()
+    except Exception:
+        return None
+
+
+def coalescer(funcao: Callable) -> Callable:
+    """
+    Decorator: chamadas concorrentes da função com os mesmos argumentos (e a mesma
+    versão dos dados) compartilham uma execução. Argumentos não hashable: chamada direta.
+    """
+    @functools.wraps(funcao)
+    def wrapper(*args, **kwargs):
+        if not SINGLE_FLIGHT_HABILITADO:
+            return funcao(*args, **kwargs)
+        chave = (funcao.__module__, funcao.__qualname__, _versao_dados(), args, tuple(sorted(kwargs.items())))
+        try:
+            hash(chave)
+        except TypeError:
+            return funcao(*args, **kwargs)
+        return _single_flight.executar(chave, lambda: funcao(*args, **kwargs))
+
+    return wrapper
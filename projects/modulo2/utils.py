@@ -2,8 +2,18 @@
 
 from datetime import date, datetime, timedelta
 from typing import Tuple
-import unicodedata
-import re
+
+# Normalizações: implementação única em normalizacao.py (reexportadas aqui)
+from .normalizacao import normalizar_leve, normalizar_forte
+
+__all__ = [
+    "obter_periodo_mes_atual",
+    "obter_periodo_ano_atual",
+    "obter_periodo_dia_anterior",
+    "normalizar_leve",
+    "normalizar_forte",
+]
+
 
 def obter_periodo_mes_atual() -> Tuple[date, date]:
     """
@@ -39,30 +49,3 @@ def obter_periodo_dia_anterior() -> Tuple[date, date]:
     """
     ontem = date.today() - timedelta(days=1)
     return ontem, ontem
-
-
-def normalizar_leve(txt) -> str:
-    """
-    Normalização leve: remove acentos e converte para maiúsculas.
-    Mantém espaços e pontuação.
-    """
-    if txt is None:
-        return ""
-    txt = str(txt)
-    txt = unicodedata.normalize("NFKD", txt)
-    txt = "".join(c for c in txt if not unicodedata.combining(c))
-    return txt.upper().strip()
-
-
-def normalizar_forte(txt) -> str:
-    """
-    Normalização forte: remove acentos, converte para maiúsculas
-    e remove toda pontuação e espaços.
-    """
-    if txt is None:
-        return ""
-    txt = str(txt)
-    txt = unicodedata.normalize("NFKD", txt)
-    txt = "".join(c for c in txt if not unicodedata.combining(c))
-    txt = re.sub(r"[^A-Z0-9]", "", txt.upper())
-    return txt
@@ -0,0 +1,226 @@
+"""
+Teste dos agregados mantidos por gatilhos em modulo2_nfe.
+
+Roda contra um banco temporário (não toca em data/rentus.db): aplica rodadas de
+inserções, atualizações e exclusões aleatórias de NFes e, depois de cada rodada,
+confere que o que os gatilhos acumularam é igual ao recálculo completo
+(reconstruir_*), na mesma transação.
+
+  - modulo2_gastos_diarios (GATILHOS_GASTOS_DIARIOS x reconstruir_gastos_diarios)
+  - modulo2_fornecedores e modulo2_fornecedores_mensal
+    (GATILHOS_FORNECEDORES x reconstruir_fornecedores)
+
+Em modulo2_fornecedores o nome e primeira/ultima_emissao não são comparados
+(divergência documentada em db.py: o nome é o último gravado e as datas só se
+estendem); confere-se só que o intervalo dos gatilhos contém o do recálculo.
+
+Uso:
+    python testar_gatilhos_agregados.py [rodadas]
+"""
+
+import sys
+import random
+import tempfile
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+TOTAL_POSTOS = 30
+NFES_POR_RODADA = 400
+
+falhas = []
+
+
+def verificar(condicao: bool, descricao: str):
+    print(f"  {'✅' if condicao else '❌'} {descricao}")
+    if not condicao:
+        falhas.append(descricao)
+
+
+# ================================
+# MASSA DE DADOS
+# ================================
+
+def data_aleatoria():
+    """Datas com e sem hora, vazias e nulas (date() ignora as inválidas)"""
+    sorteio = random.random()
+    if sorteio < 0.05:
+        return None
+    if sorteio < 0.08:
+        return ""
+    dia = f"2025-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}"
+    return dia if sorteio < 0.5 else f"{dia}T{random.randint(0, 23):02d}:10:00"
+
+
+def valor_aleatorio():
+    return None if random.random() < 0.05 else round(random.random() * 1000, 2)
+
+
+def posto_aleatorio():
+    return None if random.random() < 0.3 else random.randint(1, TOTAL_POSTOS)
+
+
+def emitente_aleatorio():
+    """(cnpj, nome): com CNPJ, ou sem (JSON) com variações de caixa/espaços do mesmo nome"""
+    if random.random() < 0.6:
+        k = random.randint(1, 15)
+        cnpj = f"{k:014d}" if random.random() < 0.9 else f" {k:014d} "
+        return cnpj, random.choice([f"AUTO POSTO {k}", f"Auto Posto {k}", ""])
+    k = random.randint(1, 8)
+    return random.choice([None, "", "  "]), random.choice([f"POSTO SEM CNPJ {k}", f" posto sem cnpj {k} ", "", None])
+
+
+def inserir_nfes(cur, rodada: int):
+    linhas = []
+    for n in range(NFES_POR_RODADA):
+        linhas.append((
+            f"TESTE{rodada:03d}{n:05d}", rodada * NFES_POR_RODADA + n, data_aleatoria(), valor_aleatorio(),
+            posto_aleatorio(), random.choice(["pendente", "identificado", "processado", None]),
+            *emitente_aleatorio()
+        ))
+    cur.executemany("""
+        INSERT INTO modulo2_nfe (empresa_id, chave_acesso, nsu, data_emissao, valor_total, posto_id, status, xml,
+                                 cnpj_emitente, nome_emitente)
+        VALUES (1, ?, ?, ?, ?, ?, ?, '<x/>', ?, ?)
+    """, linhas)
+
+
+def atualizar_nfes(cur):
+    ids = [row[0] for row in cur.execute("SELECT id FROM modulo2_nfe").fetchall()]
+    for nfe_id in random.sample(ids, min(len(ids), NFES_POR_RODADA // 2)):
+        campo = random.choice(["posto_id", "valor_total", "data_emissao", "status", "emitente", "xml", "varios"])
+        if campo == "posto_id":
+            cur.execute("UPDATE modulo2_nfe SET posto_id = ? WHERE id = ?", (posto_aleatorio(), nfe_id))
+        elif campo == "valor_total":
+            cur.execute("UPDATE modulo2_nfe SET valor_total = ? WHERE id = ?", (valor_aleatorio(), nfe_id))
+        elif campo == "data_emissao":
+            cur.execute("UPDATE modulo2_nfe SET data_emissao = ? WHERE id = ?", (data_aleatoria(), nfe_id))
+        elif campo == "status":
+            cur.execute("UPDATE modulo2_nfe SET status = ? WHERE id = ?",
+                        (random.choice(["pendente", "identificado", None]), nfe_id))
+        elif campo == "emitente":
+            cur.execute("UPDATE modulo2_nfe SET cnpj_emitente = ?, nome_emitente = ? WHERE id = ?",
+                        (*emitente_aleatorio(), nfe_id))
+        elif campo == "xml":
+            # UPDATE que não mexe em nenhuma coluna agregada
+            cur.execute("UPDATE modulo2_nfe SET xml = '<y/>' WHERE id = ?", (nfe_id,))
+        else:
+            # Identificação: posto e status juntos
+            cur.execute("UPDATE modulo2_nfe SET posto_id = ?, status = 'identificado', valor_total = ? WHERE id = ?",
+                        (posto_aleatorio(), valor_aleatorio(), nfe_id))
+
+
+def excluir_nfes(cur):
+    ids = [row[0] for row in cur.execute("SELECT id FROM modulo2_nfe").fetchall()]
+    alvo = random.sample(ids, min(len(ids), NFES_POR_RODADA // 4))
+    cur.executemany("DELETE FROM modulo2_nfe WHERE id = ?", [(i,) for i in alvo])
+
+
+# ================================
+# COMPARAÇÃO
+# ================================
+
+def _arredondar(linha):
+    return tuple(round(v, 6) if isinstance(v, float) else v for v in linha)
+
+
+def foto(cur, sql: str) -> dict:
+    """Linhas da consulta indexadas pela primeira coluna (chave) com floats arredondados"""
+    return {linha[0]: _arredondar(linha[1:]) for linha in cur.execute(sql).fetchall()}
+
+
+def comparar(nome: str, incremental: dict, reconstruido: dict):
+    diferentes = [k for k in set(incremental) | set(reconstruido) if incremental.get(k) != reconstruido.get(k)]
+    verificar(not diferentes, f"{nome}: {len(reconstruido)} linhas iguais ao recálculo"
+              + (f" (diferentes: {sorted(diferentes, key=str)[:5]})" if diferentes else ""))
+
+
+def conferir_gastos_diarios(cur):
+    import projects.modulo2.db as db
+
+    sql = "SELECT dia || '|' || posto_id, valor, qtd_nfes FROM modulo2_gastos_diarios"
+    incremental = foto(cur, sql)
+    db.reconstruir_gastos_diarios(cur)
+    comparar("gastos diários", incremental, foto(cur, sql))
+
+
+def conferir_fornecedores(cur):
+    import projects.modulo2.db as db
+
+    sql_totais = """
+        SELECT chave, cnpj, qtd_nfes, valor_total, qtd_identificadas, valor_identificado
+        FROM modulo2_fornecedores
+    """
+    sql_mensal = """
+        SELECT chave || '|' || ano_mes, qtd_nfes, valor_total, qtd_identificadas, valor_identificado
+        FROM modulo2_fornecedores_mensal
+    """
+    sql_datas = "SELECT chave, primeira_emissao, ultima_emissao FROM modulo2_fornecedores"
+    incremental = foto(cur, sql_totais)
+    incremental_mensal = foto(cur, sql_mensal)
+    datas_incremental = foto(cur, sql_datas)
+
+    db.reconstruir_fornecedores(cur)
+    comparar("fornecedores", incremental, foto(cur, sql_totais))
+    comparar("fornecedores por mês", incremental_mensal, foto(cur, sql_mensal))
+
+    # Datas: as dos gatilhos podem ser mais largas (exclusões não recuam), nunca mais estreitas
+    fora = []
+    for chave, (primeira, ultima) in foto(cur, sql_datas).items():
+        primeira_inc, ultima_inc = datas_incremental.get(chave, (None, None))
+        if primeira is not None and (primeira_inc is None or primeira_inc > primeira):
+            fora.append(chave)
+        elif ultima is not None and (ultima_inc is None or ultima_inc < ultima):
+            fora.append(chave)
+    verificar(not fora, "fornecedores: intervalo de emissão dos gatilhos contém o do recálculo"
+              + (f" (fora: {fora[:5]})" if fora else ""))
+
+
+def main():
+    import projects.modulo2.db as db
+
+    rodadas = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    random.seed(48)
+
+    db.DB_PATH = Path(tempfile.mkdtemp()) / "teste_gatilhos.db"
+    db.init_db()
+
+    conn = db.get_conn()
+    cur = conn.cursor()
+    for k in range(TOTAL_POSTOS):
+        cur.execute("INSERT INTO modulo2_postos_trabalho (codigo, nomecli, nomepos) VALUES (?, ?, ?)",
+                    (f"T{k}", f"CLIENTE {k % 5}", f"POSTO {k}"))
+    conn.commit()
+
+    print("=" * 70)
+    print(f"TESTE: agregados por gatilhos x recálculo ({rodadas} rodadas, banco {db.DB_PATH})")
+    print("=" * 70)
+
+    for rodada in range(1, rodadas + 1):
+        print(f"\nRodada {rodada}: inserções, atualizações e exclusões")
+        inserir_nfes(cur, rodada)
+        atualizar_nfes(cur)
+        excluir_nfes(cur)
+        conn.commit()
+
+        conferir_gastos_diarios(cur)
+        conferir_fornecedores(cur)
+        # O recálculo roda na transação: desfaz para a próxima rodada seguir só com os gatilhos
+        conn.rollback()
+
+    conn.close()
+
+    print()
+    print("=" * 70)
+    if falhas:
+        print(f"❌ {len(falhas)} verificação(ões) falharam")
+        for descricao in falhas:
+            print(f"   - {descricao}")
+        sys.exit(1)
+    print("✅ Todas as verificações passaram")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Teste da eleição de líder do scheduler (lease em modulo2_scheduler_lease).
+
+Roda contra um banco temporário (não toca em data/rentus.db) e confere:
+  1. dois processos disputando o lease ao mesmo tempo: só um vence
+  2. o não líder enxerga o líder em get_status()
+  3. sem renovação, o outro assume depois do TTL e o antigo líder desagenda os jobs
+  4. stop() libera o lease e o outro assume sem esperar o TTL
+
+Uso:
+    python testar_lease_scheduler.py
+"""
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+# TTL curto para o teste não esperar 90s (lido no import do scheduler)
+os.environ["MODULO2_SCHEDULER_LEASE_TTL"] = "2"
+
+BASE_DIR = Path(__file__).resolve().parent
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+
+falhas = []
+
+
+def verificar(condicao: bool, descricao: str):
+    print(f"  {'✅' if condicao else '❌'} {descricao}")
+    if not condicao:
+        falhas.append(descricao)
+
+
+def disputar_lease(db_path: str, dono: str, inicio: float) -> bool:
+    """Roda em outro processo: espera o instante combinado e tenta adquirir o lease"""
+    import projects.modulo2.db as db
+    db.DB_PATH = Path(db_path)
+    while time.time() < inicio:
+        time.sleep(0.001)
+    return db.adquirir_lease_scheduler("teste_disputa", dono, 30, pid=os.getpid())
+
+
+def main():
+    import projects.modulo2.db as db
+
+    db.DB_PATH = Path(tempfile.mkdtemp()) / "teste_lease.db"
+    db.init_db()
+
+    from projects.modulo2.scheduler import SEFAZScheduler, LEASE_TTL_SEGUNDOS
+
+    print("=" * 70)
+    print(f"TESTE: lease do scheduler (banco {db.DB_PATH}, TTL {LEASE_TTL_SEGUNDOS:g}s)")
+    print("=" * 70)
+
+    # 1. Disputa simultânea entre processos
+    print("\n1. Dois processos disputando o lease ao mesmo tempo")
+    contexto = multiprocessing.get_context("spawn")
+    with contexto.Pool(2) as pool:
+        inicio = time.time() + 3  # tempo para os dois processos subirem
+        resultados = pool.starmap(
+            disputar_lease,
+            [(str(db.DB_PATH), "processo-a", inicio), (str(db.DB_PATH), "processo-b", inicio)]
+        )
+    lease = db.obter_lease_scheduler("teste_disputa")
+    verificar(sorted(resultados) == [False, True], f"só um venceu (resultados: {resultados})")
+    vencedor = "processo-a" if resultados[0] else "processo-b"
+    verificar(lease.get("dono") == vencedor, f"dono gravado é o vencedor ({lease.get('dono')})")
+
+    # 2. Líder e não líder
+    print("\n2. Líder e não líder")
+    a = SEFAZScheduler()
+    b = SEFAZScheduler()
+    a._renovar_lideranca()
+    b._renovar_lideranca()
+    verificar(a.eh_lider and not b.eh_lider, "A assumiu e B ficou como não líder")
+    verificar(len(a._agenda.jobs) == 1 and len(b._agenda.jobs) == 0, "jobs agendados só no líder")
+
+    a._renovar_lideranca()
+    b._renovar_lideranca()
+    verificar(a.eh_lider and not b.eh_lider, "renovação mantém A como líder")
+
+    status_b = b.get_status()
+    lider = status_b.get("lider") or {}
+    verificar(not status_b["eh_lider"], "get_status() de B: eh_lider = False")
+    verificar(lider.get("processo") == a.dono_id, "get_status() de B informa A como líder")
+    verificar(bool(lider.get("ativo")), "get_status() de B: lease ativo")
+    verificar(status_b["next_run"] is not None, "get_status() de B mostra a próxima execução do líder")
+
+    # 3. Failover por expiração do TTL
+    print(f"\n3. A para de renovar: B assume depois de {LEASE_TTL_SEGUNDOS:g}s")
+    b._renovar_lideranca()
+    verificar(not b.eh_lider, "antes do TTL B não assume")
+    time.sleep(LEASE_TTL_SEGUNDOS + 0.5)
+    verificar(not b.get_status()["lider"]["ativo"], "lease expirado aparece como inativo")
+    b._renovar_lideranca()
+    verificar(b.eh_lider, "B assumiu após o TTL")
+    a._renovar_lideranca()
+    verificar(not a.eh_lider and len(a._agenda.jobs) == 0, "A perdeu a liderança e desagendou os jobs")
+    verificar(a.get_status()["lider"]["processo"] == b.dono_id, "get_status() de A informa B como líder")
+
+    # 4. Liberação no stop()
+    print("\n4. B para (stop): A assume sem esperar o TTL")
+    b.stop()
+    a._renovar_lideranca()
+    verificar(a.eh_lider, "A assumiu logo após B liberar o lease")
+
+    print()
+    print("=" * 70)
+    if falhas:
+        print(f"❌ {len(falhas)} verificação(ões) falharam")
+        for descricao in falhas:
+            print(f"   - {descricao}")
+        sys.exit(1)
+    print("✅ Todas as verificações passaram")
+
+
+if __name__ == "__main__":
+    main()